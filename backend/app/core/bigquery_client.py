@@ -0,0 +1,393 @@
+"""
+Cliente BigQuery compartido para toda la aplicación.
+
+Antes cada endpoint construía su propio ``bigquery.Client()``, repitiendo la
+carga de credenciales y la creación de la sesión HTTP en cada request. Este
+módulo mantiene un único ejecutor por proceso, creado en el ``lifespan`` de
+FastAPI, que reutiliza la sesión autenticada (pool de conexiones) y lleva
+contadores por consulta: tiempo, bytes procesados y aciertos de caché.
+
+Uso en routers::
+
+    from app.core.bigquery_client import get_bigquery_client
+
+    @router.get("/algo")
+    def endpoint(client: bigquery.Client = Depends(get_bigquery_client)):
+        client.query(sql).result()
+
+Los handlers ``async def`` no deben llamar ``client.query(...).result()``
+directamente porque bloquean el event loop. Para ellos existe la API
+asíncrona, que ejecuta la consulta en un pool de hilos acotado::
+
+    filas = await client.query_async(sql, job_config=job_config)
+    info = await client.ejecutar_async(funcion_bloqueante, arg1, client)
+
+Para pruebas locales se puede enchufar ``FakeBigQueryBackend`` con
+``iniciar_bigquery(backend=FakeBigQueryBackend())``.
+"""
+
+import asyncio
+import functools
+import logging
+import re
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+from app.core.config import (
+    BIGQUERY_MAX_WORKERS,
+    BIGQUERY_POOL_SIZE,
+    BIGQUERY_PROJECT_ID,
+    GOOGLE_CREDENTIALS_PATH,
+)
+
+logger = logging.getLogger(__name__)
+
+SCOPES_BIGQUERY = ["https://www.googleapis.com/auth/cloud-platform"]
+MAX_CONSULTAS_RECIENTES = 100
+
+
+def crear_cliente_bigquery(project: str = BIGQUERY_PROJECT_ID, pool_size: int = BIGQUERY_POOL_SIZE):
+    """
+    Crea un ``bigquery.Client`` con credenciales cargadas una sola vez y una
+    sesión HTTP autenticada con pool de conexiones reutilizables.
+    """
+    import os
+
+    import google.auth
+    from google.auth.transport.requests import AuthorizedSession
+    from google.cloud import bigquery
+    from google.oauth2 import service_account
+    from requests.adapters import HTTPAdapter
+
+    if GOOGLE_CREDENTIALS_PATH and os.path.exists(GOOGLE_CREDENTIALS_PATH):
+        credenciales = service_account.Credentials.from_service_account_file(
+            GOOGLE_CREDENTIALS_PATH, scopes=SCOPES_BIGQUERY
+        )
+    else:
+        credenciales, _ = google.auth.default(scopes=SCOPES_BIGQUERY)
+
+    sesion = AuthorizedSession(credenciales)
+    adaptador = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    sesion.mount("https://", adaptador)
+
+    cliente = bigquery.Client(project=project, credentials=credenciales, _http=sesion)
+    logger.info(f"✅ Cliente BigQuery compartido creado para proyecto {project} (pool={pool_size})")
+    return cliente
+
+
+class _TrabajoInstrumentado:
+    """
+    Envoltura de un ``QueryJob`` que registra métricas al obtener el resultado.
+    Delegar el resto de atributos mantiene compatible el código existente
+    (``num_dml_affected_rows``, ``job_id``, etc.).
+    """
+
+    def __init__(self, job, executor: "BigQueryExecutor", sql: str, inicio: float):
+        self._job = job
+        self._executor = executor
+        self._sql = sql
+        self._inicio = inicio
+        self._registrado = False
+
+    def result(self, *args, **kwargs):
+        try:
+            filas = self._job.result(*args, **kwargs)
+        except Exception:
+            if not self._registrado:
+                self._registrado = True
+                self._executor._registrar(self._sql, time.perf_counter() - self._inicio, None, False, error=True)
+            raise
+        if not self._registrado:
+            self._registrado = True
+            self._executor._registrar(
+                self._sql,
+                time.perf_counter() - self._inicio,
+                getattr(self._job, "total_bytes_processed", None),
+                bool(getattr(self._job, "cache_hit", False)),
+            )
+        return filas
+
+    def __iter__(self):
+        return iter(self.result())
+
+    def __getattr__(self, nombre):
+        return getattr(self._job, nombre)
+
+
+class BigQueryExecutor:
+    """
+    Ejecutor compartido. Se comporta como un ``bigquery.Client`` (delega todo
+    lo que no sea ``query``) pero instrumenta cada consulta.
+
+    El backend real se crea de forma perezosa en el primer uso, así importar
+    un router no exige credenciales.
+    """
+
+    def __init__(self, backend: Any = None, fabrica: Callable[[], Any] = crear_cliente_bigquery,
+                 max_workers: int = BIGQUERY_MAX_WORKERS):
+        self._backend = backend
+        self._fabrica = fabrica
+        self._max_workers = max_workers
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._reiniciar_contadores()
+
+    # ------------------------------------------------------------------
+    # Backend
+    # ------------------------------------------------------------------
+    @property
+    def backend(self):
+        if self._backend is None:
+            with self._lock:
+                if self._backend is None:
+                    self._backend = self._fabrica()
+        return self._backend
+
+    def usar_backend(self, backend: Any) -> None:
+        """Reemplaza el backend (por ejemplo con ``FakeBigQueryBackend``)."""
+        with self._lock:
+            anterior, self._backend = self._backend, backend
+        self._cerrar_backend(anterior)
+        self.reiniciar_estadisticas()
+
+    def close(self) -> None:
+        with self._lock:
+            anterior, self._backend = self._backend, None
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+        self._cerrar_backend(anterior)
+
+    @staticmethod
+    def _cerrar_backend(backend) -> None:
+        if backend is not None and hasattr(backend, "close"):
+            try:
+                backend.close()
+            except Exception as e:
+                logger.warning(f"⚠️ Error cerrando cliente BigQuery: {e}")
+
+    # ------------------------------------------------------------------
+    # Consultas
+    # ------------------------------------------------------------------
+    def query(self, sql: str, job_config=None, **kwargs):
+        inicio = time.perf_counter()
+        try:
+            job = self.backend.query(sql, job_config=job_config, **kwargs)
+        except Exception:
+            self._registrar(sql, time.perf_counter() - inicio, None, False, error=True)
+            raise
+        return _TrabajoInstrumentado(job, self, sql, inicio)
+
+    # ------------------------------------------------------------------
+    # API asíncrona
+    # ------------------------------------------------------------------
+    @property
+    def pool(self) -> ThreadPoolExecutor:
+        if self._pool is None:
+            with self._lock:
+                if self._pool is None:
+                    self._pool = ThreadPoolExecutor(
+                        max_workers=self._max_workers, thread_name_prefix="bigquery"
+                    )
+        return self._pool
+
+    def _consultar_filas(self, sql: str, job_config, timeout: Optional[float],
+                         kwargs: Dict[str, Any]) -> List[Any]:
+        # Se materializan las filas en el hilo: iterar un RowIterator
+        # puede pedir más páginas por red
+        return list(self.query(sql, job_config=job_config, **kwargs).result(timeout=timeout))
+
+    async def query_async(self, sql: str, job_config=None, timeout: Optional[float] = None,
+                          **kwargs) -> List[Any]:
+        """
+        Ejecuta la consulta sin bloquear el event loop y devuelve la lista de
+        filas. ``timeout`` se pasa a ``result()``. La concurrencia queda
+        limitada por ``BIGQUERY_MAX_WORKERS``.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self.pool, functools.partial(self._consultar_filas, sql, job_config, timeout, kwargs)
+        )
+
+    async def ejecutar_async(self, funcion: Callable[..., Any], *args, **kwargs) -> Any:
+        """Ejecuta en el pool un helper síncrono que hace varias consultas"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.pool, functools.partial(funcion, *args, **kwargs))
+
+    @property
+    def credenciales(self):
+        """Credenciales del cliente real (para clientes auxiliares como la Storage Read API)"""
+        return getattr(self.backend, "_credentials", None)
+
+    def __getattr__(self, nombre):
+        # Solo se llama para atributos que no existen en el ejecutor
+        if nombre.startswith("_"):
+            raise AttributeError(nombre)
+        return getattr(self.backend, nombre)
+
+    # ------------------------------------------------------------------
+    # Métricas
+    # ------------------------------------------------------------------
+    def _reiniciar_contadores(self) -> None:
+        self._total_consultas = 0
+        self._total_errores = 0
+        self._total_segundos = 0.0
+        self._max_segundos = 0.0
+        self._bytes_procesados = 0
+        self._aciertos_cache = 0
+        self._recientes: Deque[Dict[str, Any]] = deque(maxlen=MAX_CONSULTAS_RECIENTES)
+
+    def reiniciar_estadisticas(self) -> None:
+        with self._lock:
+            self._reiniciar_contadores()
+
+    def _registrar(self, sql: str, segundos: float, bytes_procesados: Optional[int],
+                   cache_hit: bool, error: bool = False) -> None:
+        with self._lock:
+            self._total_consultas += 1
+            self._total_segundos += segundos
+            self._max_segundos = max(self._max_segundos, segundos)
+            if error:
+                self._total_errores += 1
+            if bytes_procesados:
+                self._bytes_procesados += int(bytes_procesados)
+            if cache_hit:
+                self._aciertos_cache += 1
+            self._recientes.append({
+                "consulta": _resumir_sql(sql),
+                "ms": round(segundos * 1000, 1),
+                "bytes_procesados": int(bytes_procesados or 0),
+                "cache_hit": cache_hit,
+                "error": error,
+            })
+
+    def estadisticas(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self._total_consultas
+            return {
+                "total_consultas": total,
+                "total_errores": self._total_errores,
+                "tiempo_total_ms": round(self._total_segundos * 1000, 1),
+                "tiempo_promedio_ms": round(self._total_segundos * 1000 / total, 1) if total else 0.0,
+                "tiempo_max_ms": round(self._max_segundos * 1000, 1),
+                "bytes_procesados": self._bytes_procesados,
+                "aciertos_cache": self._aciertos_cache,
+                "tasa_cache": round(self._aciertos_cache / total, 4) if total else 0.0,
+                "consultas_recientes": list(self._recientes),
+            }
+
+
+def _resumir_sql(sql: str, largo: int = 160) -> str:
+    """Colapsa espacios y recorta el SQL para las métricas"""
+    compacto = re.sub(r"\s+", " ", sql or "").strip()
+    return compacto if len(compacto) <= largo else compacto[:largo] + "..."
+
+
+# ======================================================================
+# Backend falso para pruebas locales
+# ======================================================================
+class _ResultadoFalso(list):
+    """Lista de filas con los atributos mínimos de un ``RowIterator``"""
+
+    @property
+    def total_rows(self) -> int:
+        return len(self)
+
+
+class _TrabajoFalso:
+    def __init__(self, filas: List[Any], dml_afectadas: Optional[int] = None):
+        self._filas = filas
+        self.num_dml_affected_rows = dml_afectadas
+        self.total_bytes_processed = 0
+        self.cache_hit = False
+        self.job_id = f"fake_{id(self)}"
+
+    def result(self, *args, **kwargs):
+        return _ResultadoFalso(self._filas)
+
+    def __iter__(self):
+        return iter(self.result())
+
+
+class FakeBigQueryBackend:
+    """
+    Backend en memoria que imita la parte de ``bigquery.Client`` usada por
+    los routers. Las respuestas se registran por expresión regular sobre el
+    SQL; las consultas y filas insertadas quedan guardadas para inspección.
+    """
+
+    def __init__(self):
+        self._respuestas: List[Tuple[re.Pattern, Any]] = []
+        self.consultas: List[Tuple[str, Any]] = []
+        self.filas_insertadas: Dict[str, List[Dict[str, Any]]] = {}
+
+    def registrar_respuesta(self, patron: str, filas, dml_afectadas: Optional[int] = None) -> None:
+        """
+        ``filas`` puede ser una lista de dicts o una función
+        ``(sql, job_config) -> lista de dicts``.
+        """
+        self._respuestas.append((re.compile(patron, re.IGNORECASE | re.DOTALL), (filas, dml_afectadas)))
+
+    def query(self, sql: str, job_config=None, **kwargs):
+        self.consultas.append((sql, job_config))
+        for patron, (filas, dml_afectadas) in self._respuestas:
+            if patron.search(sql):
+                datos = filas(sql, job_config) if callable(filas) else filas
+                return _TrabajoFalso([_fila(d) for d in datos], dml_afectadas)
+        return _TrabajoFalso([])
+
+    def insert_rows_json(self, tabla, filas, **kwargs):
+        self.filas_insertadas.setdefault(str(tabla), []).extend(filas)
+        return []
+
+    def load_table_from_file(self, archivo, tabla, job_config=None, **kwargs):
+        import json
+
+        filas = [json.loads(linea) for linea in archivo.read().decode("utf-8").splitlines() if linea]
+        self.filas_insertadas.setdefault(str(tabla), []).extend(filas)
+        return _TrabajoFalso([])
+
+    def close(self) -> None:
+        pass
+
+
+def _fila(datos):
+    from google.cloud.bigquery import Row
+
+    if isinstance(datos, Row):
+        return datos
+    return Row(tuple(datos.values()), {campo: i for i, campo in enumerate(datos)})
+
+
+# ======================================================================
+# Instancia por proceso
+# ======================================================================
+_executor: Optional[BigQueryExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def iniciar_bigquery(backend: Any = None) -> BigQueryExecutor:
+    """Crea (o reutiliza) el ejecutor global. Se llama desde el lifespan."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = BigQueryExecutor(backend=backend)
+        elif backend is not None:
+            _executor.usar_backend(backend)
+    return _executor
+
+
+def cerrar_bigquery() -> None:
+    """Cierra la sesión HTTP del cliente compartido al apagar la app"""
+    if _executor is not None:
+        _executor.close()
+
+
+def get_bigquery_client() -> BigQueryExecutor:
+    """Dependencia FastAPI: devuelve el cliente compartido"""
+    if _executor is None:
+        return iniciar_bigquery()
+    return _executor
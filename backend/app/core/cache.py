@@ -0,0 +1,358 @@
+"""
+Caché de agregados para dashboards.
+
+Los dashboards (master, entregas, cruces, contabilidad) recorren tablas
+completas en cada carga, pero los datos solo cambian cuando se registran
+pagos, se cargan extractos bancarios o se aprueban/rechazan pagos. Este
+módulo guarda el resultado de cada dashboard por parámetros con un TTL y
+permite invalidarlo explícitamente según la tabla que cambió::
+
+    @router.get("/resumen")
+    @cacheado("contabilidad_resumen", tablas=("pagosconductor", "COD_pendientes_v1"))
+    async def obtener_resumen(...): ...
+
+    @router.post("/aprobar-pago")
+    @invalida("pagosconductor")
+    def aprobar_pago(...): ...
+
+Opcionalmente se pueden registrar tablas resumen en BigQuery
+(``registrar_tabla_resumen``) que se refrescan con un ``MERGE`` incremental
+sobre los últimos días cuando cambia una de sus tablas origen. Los writers
+que tocan fechas más antiguas las informan para que también se recalculen::
+
+    invalidar_tablas("pagosconductor", fechas=[r["fecha_pago"] for r in filas])
+
+    @invalida("pagosconductor")
+    def marcar_conciliado(...):
+        registrar_fechas_modificadas(fecha)
+"""
+
+import asyncio
+import contextvars
+import functools
+import inspect
+import json
+import logging
+import threading
+import time
+from datetime import date, datetime, timedelta
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+from app.core.config import (
+    DASHBOARD_CACHE_TTL,
+    DASHBOARD_RESUMEN_DIAS_REFRESCO,
+    DASHBOARD_RESUMENES_HABILITADOS,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class CacheAgregados:
+    """
+    Caché en memoria por proceso, con TTL por dashboard e invalidación por
+    dashboard o por tabla origen. Un contador de generación evita guardar un
+    resultado calculado antes de una invalidación que ocurrió mientras tanto.
+    """
+
+    def __init__(self, ttl_por_defecto: float = DASHBOARD_CACHE_TTL):
+        self._ttl_por_defecto = ttl_por_defecto
+        self._datos: Dict[Tuple[str, str], Tuple[float, Any]] = {}
+        self._generacion: Dict[str, int] = {}
+        self._tablas: Dict[str, set] = {}
+        self._lock = threading.Lock()
+        self._aciertos = 0
+        self._fallos = 0
+
+    @staticmethod
+    def clave(params: Optional[Dict[str, Any]]) -> str:
+        return json.dumps(params or {}, sort_keys=True, default=str)
+
+    def registrar(self, dashboard: str, tablas: Iterable[str] = ()) -> None:
+        with self._lock:
+            self._tablas[dashboard] = set(tablas)
+            self._generacion.setdefault(dashboard, 0)
+
+    def obtener(self, dashboard: str, params: Optional[Dict[str, Any]] = None) -> Tuple[bool, Any]:
+        llave = (dashboard, self.clave(params))
+        with self._lock:
+            entrada = self._datos.get(llave)
+            if entrada and entrada[0] > time.monotonic():
+                self._aciertos += 1
+                return True, entrada[1]
+            if entrada:
+                del self._datos[llave]
+            self._fallos += 1
+            return False, None
+
+    def generacion(self, dashboard: str) -> int:
+        with self._lock:
+            return self._generacion.get(dashboard, 0)
+
+    def guardar(self, dashboard: str, params: Optional[Dict[str, Any]], valor: Any,
+                ttl: Optional[float] = None, generacion: Optional[int] = None) -> None:
+        with self._lock:
+            if generacion is not None and generacion != self._generacion.get(dashboard, 0):
+                return  # Se invalidó mientras se calculaba
+            expira = time.monotonic() + (ttl if ttl is not None else self._ttl_por_defecto)
+            self._datos[(dashboard, self.clave(params))] = (expira, valor)
+
+    def invalidar(self, *dashboards: str) -> int:
+        """Invalida los dashboards indicados (todos si no se indica ninguno)"""
+        with self._lock:
+            objetivo = set(dashboards) if dashboards else set(self._generacion) | {d for d, _ in self._datos}
+            for dashboard in objetivo:
+                self._generacion[dashboard] = self._generacion.get(dashboard, 0) + 1
+            llaves = [llave for llave in self._datos if llave[0] in objetivo]
+            for llave in llaves:
+                del self._datos[llave]
+        if llaves:
+            logger.info(f"🧹 Caché de dashboards invalidada: {sorted(objetivo)} ({len(llaves)} entradas)")
+        return len(llaves)
+
+    def invalidar_tablas(self, *tablas: str) -> int:
+        """Invalida los dashboards que leen alguna de las tablas indicadas"""
+        cambiadas = set(tablas)
+        with self._lock:
+            dashboards = [d for d, origen in self._tablas.items() if origen & cambiadas]
+        return self.invalidar(*dashboards) if dashboards else 0
+
+    def estadisticas(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self._aciertos + self._fallos
+            return {
+                "entradas": len(self._datos),
+                "aciertos": self._aciertos,
+                "fallos": self._fallos,
+                "tasa_aciertos": round(self._aciertos / total, 4) if total else 0.0,
+                "dashboards": {d: sorted(t) for d, t in self._tablas.items()},
+            }
+
+
+cache_agregados = CacheAgregados()
+
+
+def _params_llamada(firma: inspect.Signature, excluir: Sequence[str], args, kwargs) -> Dict[str, Any]:
+    ligados = firma.bind_partial(*args, **kwargs)
+    ligados.apply_defaults()
+    return {k: v for k, v in ligados.arguments.items() if k not in excluir}
+
+
+def cacheado(dashboard: str, tablas: Iterable[str] = (), ttl: Optional[float] = None,
+             excluir: Sequence[str] = ("current_user", "request", "client")):
+    """
+    Decorador para endpoints de dashboard (sync o async). La clave son los
+    argumentos de la llamada menos los de ``excluir``. Conserva la firma para
+    que FastAPI siga resolviendo parámetros y dependencias.
+    """
+    cache_agregados.registrar(dashboard, tablas)
+
+    def decorador(funcion: Callable):
+        firma = inspect.signature(funcion)
+
+        if asyncio.iscoroutinefunction(funcion):
+            @functools.wraps(funcion)
+            async def envoltura_async(*args, **kwargs):
+                params = _params_llamada(firma, excluir, args, kwargs)
+                encontrado, valor = cache_agregados.obtener(dashboard, params)
+                if encontrado:
+                    return valor
+                generacion = cache_agregados.generacion(dashboard)
+                valor = await funcion(*args, **kwargs)
+                cache_agregados.guardar(dashboard, params, valor, ttl, generacion)
+                return valor
+            return envoltura_async
+
+        @functools.wraps(funcion)
+        def envoltura(*args, **kwargs):
+            params = _params_llamada(firma, excluir, args, kwargs)
+            encontrado, valor = cache_agregados.obtener(dashboard, params)
+            if encontrado:
+                return valor
+            generacion = cache_agregados.generacion(dashboard)
+            valor = funcion(*args, **kwargs)
+            cache_agregados.guardar(dashboard, params, valor, ttl, generacion)
+            return valor
+        return envoltura
+
+    return decorador
+
+
+def _como_fecha(valor: Any) -> Optional[date]:
+    if valor is None or valor == "":
+        return None
+    if isinstance(valor, datetime):
+        return valor.date()
+    if isinstance(valor, date):
+        return valor
+    try:
+        return date.fromisoformat(str(valor)[:10])
+    except ValueError:
+        return None
+
+
+def invalidar_tablas(*tablas: str, fechas: Iterable[Any] = ()) -> None:
+    """
+    Invalida la caché y programa el refresco de las tablas resumen afectadas.
+    ``fechas`` son las fechas de negocio que tocó el writer (``date``,
+    ``datetime`` o ``"YYYY-MM-DD"``); se recalculan aunque estén fuera de la
+    ventana de ``DASHBOARD_RESUMEN_DIAS_REFRESCO`` días.
+    """
+    cache_agregados.invalidar_tablas(*tablas)
+    if DASHBOARD_RESUMENES_HABILITADOS:
+        programar_refresco_resumenes(tablas, fechas)
+
+
+# Fechas informadas por el endpoint en curso (las recoge ``invalida``)
+_fechas_modificadas: contextvars.ContextVar[Optional[Set[Any]]] = contextvars.ContextVar(
+    "fechas_modificadas", default=None
+)
+
+
+def registrar_fechas_modificadas(*fechas: Any) -> None:
+    """Dentro de un endpoint con ``@invalida``: fechas que se deben recalcular en los resúmenes"""
+    pendientes = _fechas_modificadas.get()
+    if pendientes is not None:
+        pendientes.update(fechas)
+
+
+def invalida(*tablas: str):
+    """
+    Decorador para endpoints que modifican datos: al terminar sin excepción
+    invalida los dashboards que leen ``tablas`` (con las fechas informadas
+    por ``registrar_fechas_modificadas``).
+    """
+    def decorador(funcion: Callable):
+        if asyncio.iscoroutinefunction(funcion):
+            @functools.wraps(funcion)
+            async def envoltura_async(*args, **kwargs):
+                fechas: Set[Any] = set()
+                token = _fechas_modificadas.set(fechas)
+                try:
+                    resultado = await funcion(*args, **kwargs)
+                finally:
+                    _fechas_modificadas.reset(token)
+                invalidar_tablas(*tablas, fechas=fechas)
+                return resultado
+            return envoltura_async
+
+        @functools.wraps(funcion)
+        def envoltura(*args, **kwargs):
+            fechas: Set[Any] = set()
+            token = _fechas_modificadas.set(fechas)
+            try:
+                resultado = funcion(*args, **kwargs)
+            finally:
+                _fechas_modificadas.reset(token)
+            invalidar_tablas(*tablas, fechas=fechas)
+            return resultado
+        return envoltura
+
+    return decorador
+
+
+# ======================================================================
+# Tablas resumen precalculadas (opcionales)
+# ======================================================================
+class TablaResumen:
+    """
+    Tabla de agregados en BigQuery mantenida con ``MERGE`` incremental.
+
+    ``sql_merge`` recibe ``@desde`` (DATE) y ``@fechas`` (ARRAY<DATE>) y
+    debe recalcular solo las fechas ``>= @desde`` o ``IN UNNEST(@fechas)``
+    (las que tocó un writer fuera de la ventana); ``sql_crear`` es un
+    ``CREATE TABLE IF NOT EXISTS`` que se ejecuta una vez por proceso.
+    """
+
+    def __init__(self, nombre: str, tablas_origen: Iterable[str], sql_crear: str, sql_merge: str):
+        self.nombre = nombre
+        self.tablas_origen = set(tablas_origen)
+        self.sql_crear = sql_crear
+        self.sql_merge = sql_merge
+        self.creada = False
+        self.ultimo_refresco: Optional[float] = None
+
+    def refrescar(self, client, desde: date, fechas: Iterable[date] = ()) -> None:
+        from google.cloud import bigquery
+
+        if not self.creada:
+            client.query(self.sql_crear).result()
+            self.creada = True
+        # Las de la ventana ya se recalculan con @desde
+        fechas = sorted(f for f in set(fechas) if f < desde)
+        job_config = bigquery.QueryJobConfig(
+            query_parameters=[
+                bigquery.ScalarQueryParameter("desde", "DATE", desde),
+                bigquery.ArrayQueryParameter("fechas", "DATE", fechas),
+            ]
+        )
+        inicio = time.perf_counter()
+        job = client.query(self.sql_merge, job_config=job_config)
+        job.result()
+        self.ultimo_refresco = time.time()
+        logger.info(
+            f"🔄 Tabla resumen {self.nombre} refrescada desde {desde} "
+            f"{f'y {len(fechas)} fechas anteriores ' if fechas else ''}"
+            f"({getattr(job, 'num_dml_affected_rows', None)} filas, {time.perf_counter() - inicio:.2f}s)"
+        )
+
+
+_tablas_resumen: Dict[str, TablaResumen] = {}
+
+
+def registrar_tabla_resumen(tabla: TablaResumen) -> TablaResumen:
+    _tablas_resumen[tabla.nombre] = tabla
+    return tabla
+
+
+def obtener_tabla_resumen(nombre: str) -> Optional[TablaResumen]:
+    """Devuelve la tabla resumen si está habilitada y ya fue poblada"""
+    if not DASHBOARD_RESUMENES_HABILITADOS:
+        return None
+    tabla = _tablas_resumen.get(nombre)
+    return tabla if tabla is not None and tabla.ultimo_refresco is not None else None
+
+
+def refrescar_resumenes(tablas_modificadas: Optional[Iterable[str]] = None,
+                        desde: Optional[date] = None, fechas: Iterable[Any] = ()) -> List[str]:
+    """
+    Refresca (síncrono) las tablas resumen cuyo origen cambió; sin
+    ``tablas_modificadas`` refresca todas. Además de la ventana desde
+    ``desde`` se recalculan ``fechas``. Devuelve los nombres refrescados.
+    """
+    from app.core.bigquery_client import get_bigquery_client
+
+    client = get_bigquery_client()
+    desde = desde or (date.today() - timedelta(days=DASHBOARD_RESUMEN_DIAS_REFRESCO))
+    modificadas = set(tablas_modificadas) if tablas_modificadas is not None else None
+    fechas = {f for f in map(_como_fecha, fechas) if f is not None}
+    refrescadas = []
+    for tabla in list(_tablas_resumen.values()):
+        if modificadas is not None and not (tabla.tablas_origen & modificadas):
+            continue
+        try:
+            # La primera vez se puebla la ventana completa del dashboard
+            tabla.refrescar(client, desde if tabla.ultimo_refresco else date(2000, 1, 1), fechas)
+            refrescadas.append(tabla.nombre)
+            # Los dashboards que leen la tabla resumen pudieron cachear datos
+            # previos al refresco
+            cache_agregados.invalidar_tablas(tabla.nombre)
+        except Exception as e:
+            logger.error(f"❌ Error refrescando tabla resumen {tabla.nombre}: {e}")
+    return refrescadas
+
+
+def programar_refresco_resumenes(tablas_modificadas: Iterable[str], fechas: Iterable[Any] = ()) -> None:
+    """Lanza el refresco en el pool de BigQuery sin bloquear la respuesta"""
+    from app.core.bigquery_client import get_bigquery_client
+
+    tablas = tuple(tablas_modificadas)
+    if any(t.tablas_origen & set(tablas) for t in _tablas_resumen.values()):
+        get_bigquery_client().pool.submit(refrescar_resumenes, tablas, None, tuple(fechas))
+
+
+def iniciar_resumenes() -> None:
+    """Pobla las tablas resumen al arrancar (si están habilitadas)"""
+    from app.core.bigquery_client import get_bigquery_client
+
+    if DASHBOARD_RESUMENES_HABILITADOS and _tablas_resumen:
+        get_bigquery_client().pool.submit(refrescar_resumenes)
@@ -0,0 +1,190 @@
+"""
+Escritura masiva en BigQuery con load jobs.
+
+``insert_rows_json`` (streaming) cobra por fila y deja las filas en el
+streaming buffer, donde no se pueden actualizar con ``UPDATE``/``MERGE``
+durante un rato; la conciliación necesita actualizarlas enseguida. Los load
+jobs no tienen ese problema y son gratuitos::
+
+    errores = cargador_masivo.cargar("proyecto.dataset.tabla", filas)
+
+``cargar`` devuelve una lista de errores con la misma forma de uso que
+``insert_rows_json`` (vacía si todo salió bien) y bloquea hasta que el job
+termina, así que el endpoint puede fallar si la escritura no quedó hecha.
+
+Con ``pyarrow`` instalado las filas viajan como Parquet en memoria,
+tipadas con el esquema de la tabla destino (se consulta una vez por
+tabla). Si falta ``pyarrow``, el esquema no se puede leer o algún valor no
+convierte al tipo de su columna, se usa NDJSON. ``BIGQUERY_CARGA_FORMATO``
+permite forzar ``ndjson``.
+
+BigQuery limita los load jobs por tabla al día, así que ``cargar`` es para
+lotes (cargas de archivos) y para filas sueltas que se actualizan después
+(``conductor_bonos``). Las filas sueltas de tablas de solo inserción, como
+``bono_movimientos``, van con ``insert_rows_json``: nunca se actualizan y
+no consumen la cuota.
+"""
+
+import io
+import json
+import logging
+import threading
+import time
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Any, Dict, Iterable, List, Optional
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+from app.core.config import BIGQUERY_CARGA_FORMATO
+
+logger = logging.getLogger(__name__)
+
+
+def _valor_json(valor: Any) -> Any:
+    if isinstance(valor, (datetime, date)):
+        return valor.isoformat()
+    if isinstance(valor, Decimal):
+        return float(valor)
+    return str(valor)
+
+
+def filas_a_ndjson(filas: Iterable[Dict[str, Any]]) -> bytes:
+    return "".join(json.dumps(fila, default=_valor_json, ensure_ascii=False) + "\n" for fila in filas).encode("utf-8")
+
+
+def _tipo_arrow(campo) -> Optional[Any]:
+    """Tipo Arrow de una columna BigQuery (``None`` si no se carga por Parquet)"""
+    if campo.mode == "REPEATED":
+        return None
+    return {
+        "STRING": pa.string(),
+        "INTEGER": pa.int64(),
+        "INT64": pa.int64(),
+        "FLOAT": pa.float64(),
+        "FLOAT64": pa.float64(),
+        "NUMERIC": pa.decimal128(38, 9),
+        "BOOLEAN": pa.bool_(),
+        "BOOL": pa.bool_(),
+        "DATE": pa.date32(),
+        "DATETIME": pa.timestamp("us"),
+        "TIMESTAMP": pa.timestamp("us", tz="UTC"),
+    }.get(campo.field_type)
+
+
+def _columna_arrow(valores: List[Any], tipo) -> Any:
+    if pa.types.is_string(tipo):
+        return pa.array([None if v is None else v if isinstance(v, str) else _valor_json(v) for v in valores], tipo)
+    columna = pa.array(valores)
+    if columna.type == tipo:
+        return columna
+    if pa.types.is_timestamp(tipo) and tipo.tz and pa.types.is_string(columna.type):
+        # Texto ISO sin zona: BigQuery lo interpreta como UTC, igual que en NDJSON
+        try:
+            return columna.cast(tipo)
+        except pa.ArrowInvalid:
+            return columna.cast(pa.timestamp("us")).cast(tipo)
+    return columna.cast(tipo)
+
+
+def filas_a_parquet(filas: List[Dict[str, Any]], esquema) -> bytes:
+    """Parquet con las columnas de ``filas`` en los tipos de ``esquema`` (lanza si no convierten)"""
+    campos = {campo.name: campo for campo in esquema}
+    nombres = list(dict.fromkeys(nombre for fila in filas for nombre in fila))
+    columnas, tipos = [], []
+    for nombre in nombres:
+        tipo = _tipo_arrow(campos[nombre]) if nombre in campos else None
+        if tipo is None:
+            raise ValueError(f"columna {nombre} sin tipo Parquet")
+        columnas.append(_columna_arrow([fila.get(nombre) for fila in filas], tipo))
+        tipos.append(pa.field(nombre, tipo))
+    salida = io.BytesIO()
+    pq.write_table(pa.Table.from_arrays(columnas, schema=pa.schema(tipos)), salida)
+    return salida.getvalue()
+
+
+class CargadorMasivo:
+    """Load jobs síncronos (Parquet o NDJSON) con métricas; seguro entre hilos"""
+
+    def __init__(self, client=None, formato: str = BIGQUERY_CARGA_FORMATO):
+        self.formato = formato
+        self._client = client
+        self._esquemas: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+        self._jobs = 0
+        self._jobs_parquet = 0
+        self._filas_cargadas = 0
+        self._errores = 0
+
+    @property
+    def client(self):
+        if self._client is None:
+            from app.core.bigquery_client import get_bigquery_client
+            return get_bigquery_client()
+        return self._client
+
+    def _esquema(self, tabla: str):
+        with self._lock:
+            esquema = self._esquemas.get(tabla)
+        if esquema is None:
+            esquema = self.client.get_table(tabla).schema
+            with self._lock:
+                self._esquemas[tabla] = esquema
+        return esquema
+
+    def _serializar(self, tabla: str, filas: List[Dict[str, Any]]):
+        """(contenido, SourceFormat): Parquet si se puede, si no NDJSON"""
+        from google.cloud import bigquery
+
+        if pa is not None and self.formato == "parquet":
+            try:
+                return filas_a_parquet(filas, self._esquema(tabla)), bigquery.SourceFormat.PARQUET
+            except Exception as e:
+                logger.warning(f"⚠️ Carga de {tabla} como NDJSON (Parquet no disponible: {e})")
+        return filas_a_ndjson(filas), bigquery.SourceFormat.NEWLINE_DELIMITED_JSON
+
+    def cargar(self, tabla: str, filas: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Un load job (WRITE_APPEND) con todas las filas; bloquea hasta que termina"""
+        if not filas:
+            return []
+        from google.cloud import bigquery
+
+        inicio = time.perf_counter()
+        try:
+            contenido, formato = self._serializar(tabla, filas)
+            job_config = bigquery.LoadJobConfig(
+                source_format=formato,
+                write_disposition=bigquery.WriteDisposition.WRITE_APPEND,
+            )
+            job = self.client.load_table_from_file(io.BytesIO(contenido), tabla, job_config=job_config)
+            job.result()
+        except Exception as e:
+            with self._lock:
+                self._errores += 1
+            logger.error(f"❌ Error en load job hacia {tabla} ({len(filas)} filas): {e}")
+            errores = getattr(e, "errors", None) or [{"message": str(e)}]
+            return list(errores)
+        with self._lock:
+            self._jobs += 1
+            self._jobs_parquet += formato == bigquery.SourceFormat.PARQUET
+            self._filas_cargadas += len(filas)
+        logger.info(f"📦 Load job {tabla} ({formato}): {len(filas)} filas en {time.perf_counter() - inicio:.2f}s")
+        return []
+
+    def estadisticas(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "load_jobs": self._jobs,
+                "load_jobs_parquet": self._jobs_parquet,
+                "filas_cargadas": self._filas_cargadas,
+                "errores": self._errores,
+                "formato": self.formato if pa is not None else "ndjson",
+            }
+
+
+cargador_masivo = CargadorMasivo()
@@ -1,4 +1,5 @@
 import os
+import tempfile
 from dotenv import load_dotenv
 from pathlib import Path
 
@@ -27,6 +28,58 @@ GOOGLE_CREDENTIALS_PATH = os.getenv("GOOGLE_CREDENTIALS_PATH", "app/credentials/
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 FRONTEND_ORIGIN = os.getenv("FRONTEND_ORIGIN", "https://api.x-cargo.co")
 
+# BigQuery: proyecto por defecto y tamaño del pool de conexiones HTTP compartido
+BIGQUERY_PROJECT_ID = os.getenv("BIGQUERY_PROJECT_ID", "datos-clientes-441216")
+BIGQUERY_POOL_SIZE = int(os.getenv("BIGQUERY_POOL_SIZE", "32"))
+# Hilos para las consultas lanzadas desde handlers async (no debe superar el pool HTTP)
+BIGQUERY_MAX_WORKERS = int(os.getenv("BIGQUERY_MAX_WORKERS", "16"))
+
+# Caché de dashboards: TTL en segundos y tablas resumen incrementales (opcionales)
+DASHBOARD_CACHE_TTL = float(os.getenv("DASHBOARD_CACHE_TTL", "300"))
+DASHBOARD_RESUMENES_HABILITADOS = os.getenv("DASHBOARD_RESUMENES_HABILITADOS", "false").lower() in ("1", "true", "si")
+DASHBOARD_RESUMEN_DIAS_REFRESCO = int(os.getenv("DASHBOARD_RESUMEN_DIAS_REFRESCO", "7"))
+
+# Formato de los load jobs: parquet (requiere pyarrow) o ndjson
+BIGQUERY_CARGA_FORMATO = os.getenv("BIGQUERY_CARGA_FORMATO", "parquet").lower()
+
+# IDs de Id_Transaccion reservados por viaje a BigQuery (1 = orden global estricto)
+SECUENCIA_BLOQUE_ID_TRANSACCION = int(os.getenv("SECUENCIA_BLOQUE_ID_TRANSACCION", "1"))
+
+# Caché de identidades (correo -> employee_id, carriers, rol): refresco y olvido de correos no encontrados
+IDENTIDADES_REFRESCO_SEGUNDOS = float(os.getenv("IDENTIDADES_REFRESCO_SEGUNDOS", "900"))
+IDENTIDADES_TTL_NEGATIVO = float(os.getenv("IDENTIDADES_TTL_NEGATIVO", "60"))
+
+# Resultados materializados para paginar con cursor (pendientes de contabilidad)
+PAGINACION_CURSOR_TTL = float(os.getenv("PAGINACION_CURSOR_TTL", "600"))
+
+# Filas por página al leer resultados para exportar (memoria acotada por página)
+EXPORTACION_TAMANO_PAGINA = int(os.getenv("EXPORTACION_TAMANO_PAGINA", "5000"))
+
+# Conjuntos de resultados (NDJSON en disco) que se leen por páginas tras un proceso SSE
+RESULTADOS_CONJUNTO_DIR = os.getenv("RESULTADOS_CONJUNTO_DIR", os.path.join(tempfile.gettempdir(), "xcargo_resultados"))
+RESULTADOS_CONJUNTO_TTL = float(os.getenv("RESULTADOS_CONJUNTO_TTL", "3600"))
+
+# OCR: procesos para los motores de CPU (EasyOCR, Tesseract) y salida temprana
+# cuando un motor devuelve un resultado confiable y completo
+OCR_PROCESOS = int(os.getenv("OCR_PROCESOS", "2"))
+# Hilos de Torch por proceso OCR (0 = núcleos repartidos entre los procesos)
+OCR_HILOS_POR_PROCESO = int(os.getenv("OCR_HILOS_POR_PROCESO", "0"))
+OCR_SALIDA_TEMPRANA = os.getenv("OCR_SALIDA_TEMPRANA", "true").lower() in ("1", "true", "si")
+OCR_CONFIANZA_SALIDA_TEMPRANA = float(os.getenv("OCR_CONFIANZA_SALIDA_TEMPRANA", "90"))
+# Imagen enviada al modelo de visión: formato (jpeg o webp) y calidad de compresión
+OCR_VISION_FORMATO = os.getenv("OCR_VISION_FORMATO", "jpeg").lower()
+OCR_VISION_CALIDAD = int(os.getenv("OCR_VISION_CALIDAD", "85"))
+
+# Caché de resultados OCR por imagen (SQLite): ruta, tamaño LRU y distancia
+# máxima del hash perceptual (bits de 256; 0 = solo imágenes idénticas)
+OCR_CACHE_RUTA = os.getenv("OCR_CACHE_RUTA", os.path.join(tempfile.gettempdir(), "xcargo_ocr_cache.sqlite3"))
+OCR_CACHE_MAX_ENTRADAS = int(os.getenv("OCR_CACHE_MAX_ENTRADAS", "2000"))
+OCR_CACHE_DISTANCIA_MAXIMA = int(os.getenv("OCR_CACHE_DISTANCIA_MAXIMA", "4"))
+
+# Extracción OCR por lote: comprobantes procesados a la vez y máximo de archivos por petición
+OCR_LOTE_CONCURRENCIA = int(os.getenv("OCR_LOTE_CONCURRENCIA", "3"))
+OCR_LOTE_MAX_ARCHIVOS = int(os.getenv("OCR_LOTE_MAX_ARCHIVOS", "20"))
+
 # 🔍 Debug: Verificar qué se cargó
 print(f"🔑 OPENAI_API_KEY: {'✅ Configurada' if OPENAI_API_KEY else '❌ No encontrada'}")
 if OPENAI_API_KEY:
@@ -43,4 +96,17 @@ print(f"🌐 FRONTEND_ORIGIN: {FRONTEND_ORIGIN}")
 print(f"📄 GOOGLE_CREDENTIALS_PATH: {GOOGLE_CREDENTIALS_PATH}")
 
 # También exportar las variables para fácil acceso
-__all__ = ['GOOGLE_CREDENTIALS_PATH', 'OPENAI_API_KEY', 'FRONTEND_ORIGIN']
\ No newline at end of file
+__all__ = [
+    'GOOGLE_CREDENTIALS_PATH', 'OPENAI_API_KEY', 'FRONTEND_ORIGIN',
+    'BIGQUERY_PROJECT_ID', 'BIGQUERY_POOL_SIZE', 'BIGQUERY_MAX_WORKERS',
+    'DASHBOARD_CACHE_TTL', 'DASHBOARD_RESUMENES_HABILITADOS', 'DASHBOARD_RESUMEN_DIAS_REFRESCO',
+    'BIGQUERY_CARGA_FORMATO',
+    'SECUENCIA_BLOQUE_ID_TRANSACCION',
+    'IDENTIDADES_REFRESCO_SEGUNDOS', 'IDENTIDADES_TTL_NEGATIVO',
+    'PAGINACION_CURSOR_TTL', 'EXPORTACION_TAMANO_PAGINA',
+    'RESULTADOS_CONJUNTO_DIR', 'RESULTADOS_CONJUNTO_TTL',
+    'OCR_PROCESOS', 'OCR_HILOS_POR_PROCESO', 'OCR_SALIDA_TEMPRANA', 'OCR_CONFIANZA_SALIDA_TEMPRANA',
+    'OCR_VISION_FORMATO', 'OCR_VISION_CALIDAD',
+    'OCR_CACHE_RUTA', 'OCR_CACHE_MAX_ENTRADAS', 'OCR_CACHE_DISTANCIA_MAXIMA',
+    'OCR_LOTE_CONCURRENCIA', 'OCR_LOTE_MAX_ARCHIVOS',
+]
\ No newline at end of file
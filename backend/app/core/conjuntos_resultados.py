@@ -0,0 +1,120 @@
+"""
+Conjuntos de resultados en disco para procesos largos con progreso SSE.
+
+La conciliación automática acumulaba todos los resultados en una lista y
+los enviaba en el evento final como un solo mensaje de varios megas. Aquí
+cada resultado se escribe a un archivo NDJSON a medida que se produce (y
+se emite como evento pequeño); el evento final solo lleva el resumen y el
+ID del conjunto, que el frontend lee por páginas::
+
+    with conjuntos_resultados.crear("conciliacion") as escritor:
+        for resultado in procesar():
+            escritor.agregar(resultado)
+            yield evento("resultado", resultado)
+    yield evento("completado", {"resumen": resumen, "resultado_id": escritor.id})
+
+    filas, total = conjuntos_resultados.pagina(resultado_id, offset, limit)
+
+En memoria solo se guardan las posiciones (bytes) de cada fila para leer
+una página sin recorrer el archivo. Los conjuntos vencen tras
+``RESULTADOS_CONJUNTO_TTL`` segundos.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.core.config import RESULTADOS_CONJUNTO_DIR, RESULTADOS_CONJUNTO_TTL
+from app.core.serializacion import codificar_json
+
+logger = logging.getLogger(__name__)
+
+
+class EscritorConjunto:
+    """Agrega filas a un conjunto; queda disponible para lectura al cerrarse"""
+
+    def __init__(self, almacen: "ConjuntosResultados", conjunto_id: str, ruta: str):
+        self._almacen = almacen
+        self.id = conjunto_id
+        self.ruta = ruta
+        self._archivo = open(ruta, "wb")
+        self._posiciones: List[int] = []
+
+    def __len__(self) -> int:
+        return len(self._posiciones)
+
+    def __enter__(self) -> "EscritorConjunto":
+        return self
+
+    def __exit__(self, tipo, valor, traza) -> None:
+        self.cerrar(descartar=tipo is not None)
+
+    def agregar(self, fila: Dict[str, Any]) -> None:
+        self._posiciones.append(self._archivo.tell())
+        self._archivo.write(codificar_json(fila) + b"\n")
+
+    def cerrar(self, descartar: bool = False) -> None:
+        if self._archivo.closed:
+            return
+        self._archivo.close()
+        if descartar:
+            os.remove(self.ruta)
+            return
+        self._almacen._publicar(self.id, self.ruta, self._posiciones)
+
+
+class ConjuntosResultados:
+    """Registro en memoria de los conjuntos escritos en disco (por proceso)"""
+
+    def __init__(self, directorio: str = RESULTADOS_CONJUNTO_DIR, ttl: float = RESULTADOS_CONJUNTO_TTL):
+        self._directorio = directorio
+        self._ttl = ttl
+        self._conjuntos: Dict[str, Tuple[float, str, List[int]]] = {}
+        self._lock = threading.Lock()
+
+    def crear(self, prefijo: str) -> EscritorConjunto:
+        self.limpiar_vencidos()
+        os.makedirs(self._directorio, exist_ok=True)
+        conjunto_id = f"{prefijo}_{uuid.uuid4().hex}"
+        return EscritorConjunto(self, conjunto_id, os.path.join(self._directorio, f"{conjunto_id}.ndjson"))
+
+    def _publicar(self, conjunto_id: str, ruta: str, posiciones: List[int]) -> None:
+        with self._lock:
+            self._conjuntos[conjunto_id] = (time.monotonic() + self._ttl, ruta, posiciones)
+        logger.info(f"📦 Conjunto de resultados {conjunto_id}: {len(posiciones)} filas")
+
+    def pagina(self, conjunto_id: str, offset: int, limit: int) -> Optional[Tuple[List[Dict[str, Any]], int]]:
+        """Filas ``[offset, offset + limit)`` y total; None si no existe o ya venció"""
+        with self._lock:
+            registro = self._conjuntos.get(conjunto_id)
+        if registro is None or registro[0] < time.monotonic():
+            return None
+        _, ruta, posiciones = registro
+        total = len(posiciones)
+        if offset >= total:
+            return [], total
+        fin = min(offset + limit, total)
+        with open(ruta, "rb") as archivo:
+            archivo.seek(posiciones[offset])
+            filas = [json.loads(archivo.readline()) for _ in range(fin - offset)]
+        return filas, total
+
+    def limpiar_vencidos(self) -> int:
+        ahora = time.monotonic()
+        with self._lock:
+            vencidos = [(clave, ruta) for clave, (vence, ruta, _) in self._conjuntos.items() if vence < ahora]
+            for clave, _ in vencidos:
+                del self._conjuntos[clave]
+        for _, ruta in vencidos:
+            try:
+                os.remove(ruta)
+            except OSError:
+                pass
+        return len(vencidos)
+
+
+conjuntos_resultados = ConjuntosResultados()
@@ -0,0 +1,120 @@
+"""
+Construcción de consultas con parámetros de BigQuery.
+
+Las listas (trackings, carrier_ids, estados) se enviaban pegadas en el texto
+del SQL (``IN ('a', 'b', ...)``) o como un parámetro escalar por elemento.
+Así cada llamada produce un texto distinto: BigQuery no reutiliza resultados
+cacheados y las listas grandes chocan con el límite de longitud de la
+consulta. Con un ``ArrayQueryParameter`` y ``UNNEST`` el texto es siempre el
+mismo sin importar cuántos valores haya::
+
+    params = ParametrosConsulta()
+    sql = f"SELECT ... WHERE tracking_number IN {params.lista('trackings', trackings)}"
+    filas = await client.query_async(sql, job_config=params.job_config())
+
+Las filas completas (lotes de INSERT/MERGE) se envían como
+``ARRAY<STRUCT>`` con ``arreglo_structs``.
+"""
+
+from datetime import date, datetime, time
+from decimal import Decimal
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from google.cloud import bigquery
+
+# (campo, tipo BigQuery) de cada elemento de un ARRAY<STRUCT>
+Campos = Sequence[Tuple[str, str]]
+
+
+def inferir_tipo(valor: Any) -> str:
+    """Tipo BigQuery para un valor de Python (STRING si no se reconoce)"""
+    if isinstance(valor, bool):
+        return "BOOL"
+    if isinstance(valor, int):
+        return "INT64"
+    if isinstance(valor, float):
+        return "FLOAT64"
+    if isinstance(valor, Decimal):
+        return "NUMERIC"
+    if isinstance(valor, datetime):
+        return "TIMESTAMP"
+    if isinstance(valor, date):
+        return "DATE"
+    if isinstance(valor, time):
+        return "TIME"
+    return "STRING"
+
+
+def _valor_parametro(valor: Any, tipo: str) -> Any:
+    if valor is None:
+        return None
+    if tipo == "NUMERIC":
+        return Decimal(str(valor))
+    if tipo == "FLOAT64":
+        return float(valor)
+    if tipo == "INT64":
+        return int(valor)
+    return valor
+
+
+def parametro_lista(nombre: str, valores: Iterable[Any], tipo: Optional[str] = None) -> bigquery.ArrayQueryParameter:
+    """``ArrayQueryParameter`` sin duplicados; el tipo se infiere del primer valor"""
+    valores = list(dict.fromkeys(v for v in valores if v is not None))
+    tipo = tipo or (inferir_tipo(valores[0]) if valores else "STRING")
+    return bigquery.ArrayQueryParameter(nombre, tipo, [_valor_parametro(v, tipo) for v in valores])
+
+
+def arreglo_structs(nombre: str, campos: Campos, filas: Iterable[Dict[str, Any]]) -> bigquery.ArrayQueryParameter:
+    """``ARRAY<STRUCT>`` con un elemento por fila, listo para ``UNNEST(@nombre)``"""
+    structs = [
+        bigquery.StructQueryParameter(
+            None,
+            *[bigquery.ScalarQueryParameter(campo, tipo, _valor_parametro(fila.get(campo), tipo))
+              for campo, tipo in campos]
+        )
+        for fila in filas
+    ]
+    return bigquery.ArrayQueryParameter(nombre, "STRUCT", structs)
+
+
+class ParametrosConsulta:
+    """
+    Acumula los parámetros mientras se arma el SQL. Cada método registra el
+    parámetro y devuelve el fragmento que se inserta en el texto.
+    """
+
+    def __init__(self):
+        self._parametros: Dict[str, Any] = {}
+
+    def _agregar(self, parametro) -> None:
+        if parametro.name in self._parametros:
+            raise ValueError(f"Parámetro duplicado en la consulta: @{parametro.name}")
+        self._parametros[parametro.name] = parametro
+
+    def escalar(self, nombre: str, valor: Any, tipo: Optional[str] = None) -> str:
+        tipo = tipo or inferir_tipo(valor)
+        self._agregar(bigquery.ScalarQueryParameter(nombre, tipo, _valor_parametro(valor, tipo)))
+        return f"@{nombre}"
+
+    def lista(self, nombre: str, valores: Iterable[Any], tipo: Optional[str] = None) -> str:
+        """Para ``columna IN {params.lista(...)}``"""
+        self._agregar(parametro_lista(nombre, valores, tipo))
+        return f"UNNEST(@{nombre})"
+
+    def structs(self, nombre: str, campos: Campos, filas: Iterable[Dict[str, Any]]) -> str:
+        """Para ``FROM {params.structs(...)}`` / ``USING {params.structs(...)}``"""
+        self._agregar(arreglo_structs(nombre, campos, filas))
+        return f"UNNEST(@{nombre})"
+
+    def agregar(self, *parametros) -> "ParametrosConsulta":
+        """Incorpora parámetros ya construidos (``ScalarQueryParameter``, etc.)"""
+        for parametro in parametros:
+            self._agregar(parametro)
+        return self
+
+    @property
+    def parametros(self) -> List[Any]:
+        return list(self._parametros.values())
+
+    def job_config(self, **kwargs) -> bigquery.QueryJobConfig:
+        return bigquery.QueryJobConfig(query_parameters=self.parametros, **kwargs)
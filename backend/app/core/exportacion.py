@@ -0,0 +1,207 @@
+"""
+Exportación por streaming de resultados de BigQuery a CSV, XLSX o JSON.
+
+Las exportaciones hacían ``list(client.query(...).result())`` y armaban el
+archivo completo en un ``StringIO``: la memoria crecía con el tamaño de la
+tabla. Aquí las filas se leen página por página (``page_size``) y se
+escriben a medida que llegan, así que en memoria solo vive una página::
+
+    resultado = consultar_paginado(client, sql, job_config)
+    return respuesta_streaming(generar_csv(resultado.columnas, resultado.filas()), "csv", "pagos")
+
+    # Tabla completa a disco, sin consulta (lectura directa, no se factura)
+    resultado = leer_tabla_paginada(client, "proyecto.dataset.tabla")
+    total = escribir_archivo(ruta, resultado.columnas, resultado.filas(), "csv")
+
+Las filas pueden ser ``Row`` de BigQuery o diccionarios; los valores se
+toman por nombre de columna.
+"""
+
+import csv
+import io
+import json
+import logging
+import os
+import tempfile
+from datetime import date, datetime, time
+from decimal import Decimal
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Union
+
+from fastapi.responses import StreamingResponse
+from openpyxl import Workbook
+
+from app.core.config import EXPORTACION_TAMANO_PAGINA
+from app.core.serializacion import dumps_json
+
+logger = logging.getLogger(__name__)
+
+# Bytes acumulados antes de entregar un bloque al cliente
+TAMANO_BLOQUE = 64 * 1024
+
+TIPOS_CONTENIDO = {
+    "csv": "text/csv; charset=utf-8",
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    "json": "application/json",
+}
+
+
+class ResultadoPaginado:
+    """Columnas, total y filas de un ``RowIterator`` leído de a una página"""
+
+    def __init__(self, iterador, transformar: Optional[Callable[[Any], Dict[str, Any]]] = None,
+                 columnas: Optional[Sequence[str]] = None):
+        self._iterador = iterador
+        self._transformar = transformar
+        self.columnas: List[str] = list(columnas) if columnas else [campo.name for campo in iterador.schema]
+        self.total: int = iterador.total_rows or 0
+
+    def filas(self) -> Iterator[Any]:
+        for pagina in self._iterador.pages:
+            for fila in pagina:
+                yield self._transformar(fila) if self._transformar else fila
+
+
+def consultar_paginado(client, sql: str, job_config=None, tamano_pagina: int = EXPORTACION_TAMANO_PAGINA,
+                       timeout: Optional[float] = None, **kwargs) -> ResultadoPaginado:
+    """
+    Ejecuta la consulta y espera a que termine (los errores salen aquí, antes
+    de empezar a responder); las filas se descargan al iterar.
+    """
+    iterador = client.query(sql, job_config=job_config).result(page_size=tamano_pagina, timeout=timeout)
+    return ResultadoPaginado(iterador, **kwargs)
+
+
+def leer_tabla_paginada(client, tabla: str, tamano_pagina: int = EXPORTACION_TAMANO_PAGINA,
+                        **kwargs) -> ResultadoPaginado:
+    """Tabla completa con ``list_rows`` (API de lectura de tablas, sin ejecutar consulta)"""
+    return ResultadoPaginado(client.list_rows(tabla, page_size=tamano_pagina), **kwargs)
+
+
+def _valor_texto(valor: Any) -> str:
+    if valor is None:
+        return ""
+    if isinstance(valor, (dict, list)):
+        return json.dumps(valor, ensure_ascii=False, default=str)
+    return str(valor)
+
+
+def _valor_xlsx(valor: Any) -> Any:
+    if valor is None or isinstance(valor, (bool, int, float, str, date, time)):
+        if isinstance(valor, datetime) and valor.tzinfo is not None:
+            return valor.replace(tzinfo=None)  # Excel no maneja zonas horarias
+        return valor
+    if isinstance(valor, Decimal):
+        return float(valor)
+    return _valor_texto(valor)
+
+
+def generar_csv(columnas: Sequence[str], filas: Iterable[Any], bom: bool = True) -> Iterator[bytes]:
+    """CSV en bloques de ~64 KB; el BOM hace que Excel lo abra como UTF-8"""
+    buffer = io.StringIO()
+    escritor = csv.writer(buffer)
+    if bom:
+        buffer.write("\ufeff")
+    escritor.writerow(columnas)
+    for fila in filas:
+        escritor.writerow([_valor_texto(fila.get(columna)) for columna in columnas])
+        if buffer.tell() >= TAMANO_BLOQUE:
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")
+
+
+def generar_xlsx(columnas: Sequence[str], filas: Iterable[Any], hoja: str = "Datos") -> Iterator[bytes]:
+    """
+    XLSX con ``openpyxl`` en modo ``write_only`` (las filas se vuelcan a un
+    temporal a medida que se agregan). El formato exige cerrar el libro
+    antes de enviarlo, así que se arma en un archivo temporal y luego se
+    envía en bloques.
+    """
+    libro = Workbook(write_only=True)
+    hoja_datos = libro.create_sheet(title=hoja[:31])
+    hoja_datos.append(list(columnas))
+    for fila in filas:
+        hoja_datos.append([_valor_xlsx(fila.get(columna)) for columna in columnas])
+
+    with tempfile.NamedTemporaryFile(suffix=".xlsx", delete=False) as temporal:
+        ruta = temporal.name
+    try:
+        libro.save(ruta)
+        with open(ruta, "rb") as archivo:
+            while True:
+                bloque = archivo.read(TAMANO_BLOQUE)
+                if not bloque:
+                    break
+                yield bloque
+    finally:
+        os.remove(ruta)
+
+
+def generar_json(clave: str, filas: Iterable[Dict[str, Any]],
+                 extra: Union[Dict[str, Any], Callable[[], Dict[str, Any]], None] = None) -> Iterator[bytes]:
+    """
+    ``{"<clave>": [fila, ...], **extra}`` escrito fila por fila. ``extra``
+    puede ser una función: se llama al terminar las filas (totales
+    acumulados mientras se recorrían).
+    """
+    yield f'{{"{clave}":['.encode("utf-8")
+    partes: List[str] = []
+    tamano = 0
+    for indice, fila in enumerate(filas):
+        texto = ("," if indice else "") + dumps_json(fila)
+        partes.append(texto)
+        tamano += len(texto)
+        if tamano >= TAMANO_BLOQUE:
+            yield "".join(partes).encode("utf-8")
+            partes, tamano = [], 0
+    if callable(extra):
+        extra = extra()
+    cola = "]"
+    for llave, valor in (extra or {}).items():
+        cola += f",{json.dumps(llave)}:{dumps_json(valor)}"
+    yield ("".join(partes) + cola + "}").encode("utf-8")
+
+
+def generar(formato: str, columnas: Sequence[str], filas: Iterable[Any]) -> Iterator[bytes]:
+    if formato == "xlsx":
+        return generar_xlsx(columnas, filas)
+    if formato == "csv":
+        return generar_csv(columnas, filas)
+    raise ValueError(f"Formato de exportación no soportado: {formato}")
+
+
+def escribir_archivo(ruta: str, columnas: Sequence[str], filas: Iterable[Any], formato: str = "csv") -> int:
+    """
+    Escribe la exportación directo a disco y devuelve cuántas filas tuvo.
+    Se escribe en ``<ruta>.parcial`` y se renombra al terminar, para no dejar
+    archivos a medias si la lectura falla.
+    """
+    contador = {"filas": 0}
+
+    def contar(filas_origen: Iterable[Any]) -> Iterator[Any]:
+        for fila in filas_origen:
+            contador["filas"] += 1
+            yield fila
+
+    parcial = f"{ruta}.parcial"
+    try:
+        with open(parcial, "wb") as archivo:
+            for bloque in generar(formato, columnas, contar(filas)):
+                archivo.write(bloque)
+        os.replace(parcial, ruta)
+    except Exception:
+        if os.path.exists(parcial):
+            os.remove(parcial)
+        raise
+    return contador["filas"]
+
+
+def respuesta_streaming(contenido: Iterator[bytes], formato: str, nombre_archivo: Optional[str] = None,
+                        headers: Optional[Dict[str, str]] = None):
+    """``StreamingResponse`` con el tipo de contenido y, si hay nombre, como descarga"""
+    cabeceras = dict(headers or {})
+    if nombre_archivo:
+        cabeceras["Content-Disposition"] = f'attachment; filename="{nombre_archivo}.{formato}"'
+    return StreamingResponse(contenido, media_type=TIPOS_CONTENIDO[formato], headers=cabeceras)
@@ -0,0 +1,379 @@
+"""
+Caché de identidades: correo → employee_id, carrier_ids y rol.
+
+``obtener_employee_id_usuario`` (guías/pagos) y ``obtener_carrier_id_supervisor``
+(supervisor) hacían hasta tres consultas por request para resolver datos que
+casi nunca cambian. Este módulo carga de una vez ``usuarios_BIG``,
+``guias_liquidacion``, ``usuarios`` y ``credenciales``, la refresca en segundo
+plano cada ``IDENTIDADES_REFRESCO_SEGUNDOS`` y resuelve en memoria::
+
+    employee_id = identidades.employee_id(correo, consultar=lambda: ...)
+    carrier_ids = identidades.carrier_ids(correo, consultar=lambda: ...)
+
+``consultar`` es la búsqueda original por correo; se usa solo si el correo no
+está en la instantánea (usuarios nuevos entre refrescos) y su resultado queda
+guardado. Los correos no encontrados se recuerdan durante
+``IDENTIDADES_TTL_NEGATIVO`` segundos. Los endpoints que crean usuarios o
+cambian roles llaman a ``identidades.invalidar(correo)``.
+
+El login guarda lo resuelto en el JWT (``claims_token``) con una versión: un
+hash del rol y los carriers. ``token_vigente`` rechaza los tokens cuya versión
+ya no coincide con la instantánea o que se emitieron antes de invalidar el
+correo, así un cambio de rol o de carriers obliga a iniciar sesión de nuevo.
+"""
+
+import hashlib
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from app.core.config import (
+    BIGQUERY_PROJECT_ID,
+    IDENTIDADES_REFRESCO_SEGUNDOS,
+    IDENTIDADES_TTL_NEGATIVO,
+)
+
+logger = logging.getLogger(__name__)
+
+DATASET = f"{BIGQUERY_PROJECT_ID}.Conciliaciones"
+
+SQL_CONDUCTORES = f"""
+SELECT
+    LOWER(TRIM(Employee_Mail)) AS correo,
+    ANY_VALUE(Employee_id) AS employee_id,
+    ARRAY_AGG(DISTINCT Carrier_id IGNORE NULLS) AS carrier_ids
+FROM `{DATASET}.usuarios_BIG`
+WHERE Employee_Mail IS NOT NULL AND Employee_id IS NOT NULL
+GROUP BY correo
+"""
+
+SQL_LIQUIDACION = f"""
+SELECT
+    LOWER(TRIM(conductor_email)) AS correo,
+    ANY_VALUE(employee_id) AS employee_id
+FROM `{DATASET}.guias_liquidacion`
+WHERE conductor_email IS NOT NULL AND employee_id IS NOT NULL
+GROUP BY correo
+"""
+
+# Mismas reglas que obtener_carrier_id_supervisor: empresa_carrier con IDs
+# numéricos (se toma el primero) o con el nombre del carrier en COD_pendientes_v1
+SQL_ADMINISTRATIVOS = f"""
+SELECT
+    LOWER(TRIM(u.correo)) AS correo,
+    ARRAY_AGG(DISTINCT IF(
+        REGEXP_CONTAINS(u.empresa_carrier, r'^[0-9,\\s]+$'),
+        SAFE_CAST(SPLIT(u.empresa_carrier, ',')[SAFE_OFFSET(0)] AS INT64),
+        cod.carrier_id
+    ) IGNORE NULLS) AS carrier_ids
+FROM `{DATASET}.usuarios` u
+LEFT JOIN (
+    SELECT DISTINCT Carrier, carrier_id
+    FROM `{DATASET}.COD_pendientes_v1`
+    WHERE carrier_id IS NOT NULL
+) cod
+    ON NOT REGEXP_CONTAINS(u.empresa_carrier, r'^[0-9,\\s]+$')
+    AND UPPER(TRIM(u.empresa_carrier)) = UPPER(TRIM(cod.Carrier))
+WHERE u.correo IS NOT NULL
+AND u.empresa_carrier IS NOT NULL
+AND u.empresa_carrier != ''
+GROUP BY correo
+"""
+
+SQL_ROLES = f"""
+SELECT
+    LOWER(TRIM(correo)) AS correo,
+    ANY_VALUE(rol) AS rol,
+    ANY_VALUE(empresa_carrier) AS empresa_carrier
+FROM `{DATASET}.credenciales`
+WHERE correo IS NOT NULL
+GROUP BY correo
+"""
+
+
+# Se incrementa si cambia el formato de los claims: invalida todos los tokens
+VERSION_CLAIMS = 1
+
+
+def version_identidad(rol: Optional[str], carrier_ids: Iterable[int]) -> str:
+    """Hash corto de lo que decide los permisos: rol y carriers"""
+    carriers = ",".join(str(c) for c in sorted(set(carrier_ids)))
+    base = f"{VERSION_CLAIMS}|{(rol or '').strip().lower()}|{carriers}"
+    return hashlib.sha256(base.encode()).hexdigest()[:16]
+
+
+class Identidad:
+    __slots__ = ("correo", "employee_id", "carrier_ids", "rol", "empresa_carrier")
+
+    def __init__(self, correo: str, employee_id: Optional[int] = None,
+                 carrier_ids: Tuple[int, ...] = (), rol: Optional[str] = None,
+                 empresa_carrier: Optional[str] = None):
+        self.correo = correo
+        self.employee_id = employee_id
+        self.carrier_ids = carrier_ids
+        self.rol = rol
+        self.empresa_carrier = empresa_carrier
+
+    @property
+    def version(self) -> str:
+        return version_identidad(self.rol, self.carrier_ids)
+
+    def a_dict(self) -> Dict[str, Any]:
+        return {
+            "correo": self.correo,
+            "employee_id": self.employee_id,
+            "carrier_ids": list(self.carrier_ids),
+            "rol": self.rol,
+            "empresa_carrier": self.empresa_carrier,
+            "version": self.version,
+        }
+
+
+def _normalizar(correo: Optional[str]) -> str:
+    return (correo or "").strip().lower()
+
+
+class CacheIdentidades:
+    """
+    Instantánea por proceso de las identidades, reemplazada completa en cada
+    refresco. Las búsquedas individuales (``consultar``) se guardan aparte
+    para que un refresco en curso no las pise con datos más viejos.
+    """
+
+    def __init__(self, refresco_segundos: float = IDENTIDADES_REFRESCO_SEGUNDOS,
+                 ttl_negativo: float = IDENTIDADES_TTL_NEGATIVO, client=None):
+        self.refresco_segundos = refresco_segundos
+        self.ttl_negativo = ttl_negativo
+        self._client = client
+        self._instantanea: Dict[str, Identidad] = {}
+        # (campo, correo) -> (expira, valor); expira None = hasta el próximo refresco
+        self._individuales: Dict[Tuple[str, str], Tuple[Optional[float], Any]] = {}
+        self._lock = threading.Lock()
+        self._lock_carga = threading.Lock()
+        self._cargada = False
+        self._temporizador: Optional[threading.Timer] = None
+        self._ultimo_refresco: Optional[float] = None
+        self._ultimo_intento: Optional[float] = None
+        self._invalidados: Dict[str, float] = {}
+        # correo -> epoch de la última invalidación (no se poda: los tokens viven 12 h)
+        self._invalidados_en: Dict[str, float] = {}
+        self._tokens_rechazados = 0
+        self._aciertos = 0
+        self._fallos = 0
+
+    @property
+    def client(self):
+        if self._client is None:
+            from app.core.bigquery_client import get_bigquery_client
+            return get_bigquery_client()
+        return self._client
+
+    # ------------------------------------------------------------------
+    # Carga
+    # ------------------------------------------------------------------
+    def refrescar(self) -> int:
+        """Recarga la instantánea completa (bloqueante). Devuelve cuántos correos hay."""
+        with self._lock_carga:
+            inicio = time.perf_counter()
+            inicio_monotonico = time.monotonic()
+            self._ultimo_intento = inicio_monotonico
+            client = self.client
+            # Los cuatro jobs se lanzan juntos y BigQuery los ejecuta en paralelo
+            jobs = {
+                "conductores": client.query(SQL_CONDUCTORES),
+                "liquidacion": client.query(SQL_LIQUIDACION),
+                "administrativos": client.query(SQL_ADMINISTRATIVOS),
+                "roles": client.query(SQL_ROLES),
+            }
+            filas = {nombre: list(job.result()) for nombre, job in jobs.items()}
+
+            identidades: Dict[str, Identidad] = {}
+
+            def identidad(correo: str) -> Identidad:
+                if correo not in identidades:
+                    identidades[correo] = Identidad(correo)
+                return identidades[correo]
+
+            # Prioridad de employee_id: usuarios_BIG y luego guias_liquidacion
+            for fila in filas["liquidacion"]:
+                identidad(fila["correo"]).employee_id = fila["employee_id"]
+            conductores_carriers: Dict[str, Tuple[int, ...]] = {}
+            for fila in filas["conductores"]:
+                identidad(fila["correo"]).employee_id = fila["employee_id"]
+                conductores_carriers[fila["correo"]] = tuple(fila["carrier_ids"] or ())
+            # Prioridad de carriers: usuarios (administrativos) y luego usuarios_BIG
+            for correo, carriers in conductores_carriers.items():
+                identidad(correo).carrier_ids = carriers
+            for fila in filas["administrativos"]:
+                if fila["carrier_ids"]:
+                    identidad(fila["correo"]).carrier_ids = tuple(fila["carrier_ids"])
+            for fila in filas["roles"]:
+                identidad(fila["correo"]).rol = fila["rol"]
+                identidad(fila["correo"]).empresa_carrier = fila["empresa_carrier"]
+
+            with self._lock:
+                # Lo invalidado mientras se leía puede venir desactualizado
+                for correo, momento in self._invalidados.items():
+                    if momento >= inicio_monotonico:
+                        identidades.pop(correo, None)
+                self._invalidados = {c: m for c, m in self._invalidados.items() if m >= inicio_monotonico}
+                self._instantanea = identidades
+                self._individuales = {
+                    llave: valor for llave, valor in self._individuales.items()
+                    if llave[1] in self._invalidados
+                }
+                self._cargada = True
+                self._ultimo_refresco = time.time()
+            logger.info(f"👥 Identidades cargadas: {len(identidades)} correos en {time.perf_counter() - inicio:.2f}s")
+            return len(identidades)
+
+    def _asegurar_cargada(self) -> None:
+        if self._cargada:
+            return
+        if self._ultimo_intento is not None and time.monotonic() - self._ultimo_intento < self.ttl_negativo:
+            return
+        try:
+            self.refrescar()
+        except Exception as e:
+            # Sin instantánea se resuelve con las consultas individuales
+            logger.error(f"❌ Error cargando identidades: {e}")
+
+    def iniciar(self) -> None:
+        """Carga inicial en segundo plano y refresco periódico"""
+        self.client.pool.submit(self._refrescar_y_programar)
+
+    def _refrescar_y_programar(self) -> None:
+        try:
+            self.refrescar()
+        except Exception as e:
+            logger.error(f"❌ Error refrescando identidades: {e}")
+        with self._lock:
+            self._temporizador = threading.Timer(self.refresco_segundos, self._refrescar_y_programar)
+            self._temporizador.daemon = True
+            self._temporizador.start()
+
+    def cerrar(self) -> None:
+        with self._lock:
+            temporizador, self._temporizador = self._temporizador, None
+        if temporizador is not None:
+            temporizador.cancel()
+
+    # ------------------------------------------------------------------
+    # Resolución
+    # ------------------------------------------------------------------
+    def resolver(self, correo: str) -> Optional[Identidad]:
+        """Identidad de la instantánea (sin consultas individuales)"""
+        self._asegurar_cargada()
+        with self._lock:
+            return self._instantanea.get(_normalizar(correo))
+
+    def _campo(self, campo: str, correo: str, vacio: Callable[[Any], bool],
+               consultar: Optional[Callable[[], Any]]) -> Any:
+        self._asegurar_cargada()
+        clave = _normalizar(correo)
+        with self._lock:
+            identidad = self._instantanea.get(clave)
+            valor = getattr(identidad, campo) if identidad is not None else None
+            if not vacio(valor):
+                self._aciertos += 1
+                return valor
+            individual = self._individuales.get((campo, clave))
+            if individual is not None and (individual[0] is None or individual[0] > time.monotonic()):
+                self._aciertos += 1
+                return individual[1]
+            self._fallos += 1
+        if consultar is None:
+            return valor
+        valor = consultar()
+        expira = time.monotonic() + self.ttl_negativo if vacio(valor) else None
+        with self._lock:
+            self._individuales[(campo, clave)] = (expira, valor)
+        return valor
+
+    def employee_id(self, correo: str, consultar: Optional[Callable[[], Optional[int]]] = None) -> Optional[int]:
+        return self._campo("employee_id", correo, lambda v: v is None, consultar)
+
+    def carrier_ids(self, correo: str, consultar: Optional[Callable[[], List[int]]] = None) -> List[int]:
+        return list(self._campo("carrier_ids", correo, lambda v: not v, consultar) or [])
+
+    def rol(self, correo: str, consultar: Optional[Callable[[], Optional[str]]] = None) -> Optional[str]:
+        return self._campo("rol", correo, lambda v: v is None, consultar)
+
+    # ------------------------------------------------------------------
+    # Invalidación
+    # ------------------------------------------------------------------
+    def invalidar(self, correo: Optional[str] = None) -> None:
+        """
+        Olvida un correo (se vuelve a consultar en el próximo uso y se
+        relee en el próximo refresco); sin correo, recarga todo en segundo plano.
+        """
+        if correo is None:
+            self.client.pool.submit(self.refrescar)
+            return
+        clave = _normalizar(correo)
+        with self._lock:
+            self._instantanea.pop(clave, None)
+            self._invalidados[clave] = time.monotonic()
+            self._invalidados_en[clave] = time.time()
+            for llave in [llave for llave in self._individuales if llave[1] == clave]:
+                del self._individuales[llave]
+        logger.info(f"🧹 Identidad invalidada: {clave}")
+
+    # ------------------------------------------------------------------
+    # Claims del JWT
+    # ------------------------------------------------------------------
+    def claims_token(self, correo: str, rol: str, employee_id: Optional[int],
+                     carrier_ids: List[int], empresa_carrier: Optional[str]) -> Dict[str, Any]:
+        """
+        Claims de identidad para el login. La versión sale de la instantánea
+        si el correo está cargado (es contra lo que se compara después); si
+        no, de los datos que acaba de resolver el login.
+        """
+        identidad = self.resolver(correo)
+        version = identidad.version if identidad is not None else version_identidad(rol, carrier_ids)
+        return {
+            "employee_id": employee_id,
+            "carrier_ids": list(carrier_ids),
+            "empresa_carrier": empresa_carrier,
+            "ver": version,
+        }
+
+    def token_vigente(self, payload: Dict[str, Any]) -> bool:
+        """
+        False si el rol o los carriers del correo cambiaron desde que se
+        emitió el token. Los tokens sin ``ver`` (anteriores a los claims)
+        se aceptan y los routers resuelven la identidad como antes.
+        """
+        version = payload.get("ver")
+        if version is None:
+            return True
+        clave = _normalizar(payload.get("correo") or payload.get("sub"))
+        emitido_en = payload.get("iat")
+        with self._lock:
+            invalidado_en = self._invalidados_en.get(clave)
+        vigente = not (invalidado_en is not None and (emitido_en is None or emitido_en < int(invalidado_en)))
+        if vigente:
+            identidad = self.resolver(clave)
+            vigente = identidad is None or identidad.version == version
+        if not vigente:
+            with self._lock:
+                self._tokens_rechazados += 1
+        return vigente
+
+    def estadisticas(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self._aciertos + self._fallos
+            return {
+                "correos": len(self._instantanea),
+                "consultas_individuales": len(self._individuales),
+                "aciertos": self._aciertos,
+                "fallos": self._fallos,
+                "tasa_aciertos": round(self._aciertos / total, 4) if total else 0.0,
+                "tokens_rechazados": self._tokens_rechazados,
+                "ultimo_refresco": self._ultimo_refresco,
+                "refresco_segundos": self.refresco_segundos,
+            }
+
+
+identidades = CacheIdentidades()
@@ -0,0 +1,76 @@
+"""
+Paginación por cursor (keyset) sobre resultados materializados.
+
+Con ``LIMIT/OFFSET`` cada página vuelve a ejecutar la consulta completa
+(joins y agrupación incluidos) y descarta las filas anteriores. Aquí la
+primera página materializa el resultado filtrado en un ``ConjuntoPaginado``
+guardado en ``cache_agregados`` por filtros, así que se invalida igual que
+los dashboards cuando cambian sus tablas origen. Las páginas siguientes se
+leen del conjunto por la llave de orden de la última fila entregada::
+
+    conjunto = ConjuntoPaginado((llave(fila), fila) for fila in filas)
+    inicio = conjunto.posicion_despues_de(decodificar_cursor(cursor, huella)) if cursor else offset
+    pagina, siguiente = conjunto.pagina(inicio, limit, huella)
+
+El cursor guarda la llave, no la posición: si el conjunto expiró o se
+invalidó, se vuelve a materializar y la página continúa después de la
+última fila vista aunque hayan entrado o salido filas antes.
+"""
+
+import base64
+import bisect
+import hashlib
+import json
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+Llave = Tuple[Any, ...]
+
+
+def huella_filtros(filtros: Dict[str, Any]) -> str:
+    """Identifica los filtros con los que se generó un cursor"""
+    texto = json.dumps(filtros, sort_keys=True, default=str)
+    return hashlib.sha256(texto.encode()).hexdigest()[:12]
+
+
+def codificar_cursor(llave: Sequence[Any], huella: str) -> str:
+    texto = json.dumps({"k": list(llave), "f": huella}, separators=(",", ":"), default=str)
+    return base64.urlsafe_b64encode(texto.encode()).decode().rstrip("=")
+
+
+def decodificar_cursor(cursor: str, huella: str) -> Llave:
+    """Llave de la última fila entregada. ``ValueError`` si el cursor no sirve para estos filtros."""
+    try:
+        relleno = "=" * (-len(cursor) % 4)
+        datos = json.loads(base64.urlsafe_b64decode(cursor + relleno))
+        llave, huella_cursor = datos["k"], datos["f"]
+    except Exception:
+        raise ValueError("Cursor inválido")
+    if huella_cursor != huella:
+        raise ValueError("El cursor no corresponde a los filtros de la consulta")
+    return tuple(llave)
+
+
+class ConjuntoPaginado:
+    """Filas ordenadas por llave descendente (lo más reciente primero)"""
+
+    __slots__ = ("filas", "llaves", "_ascendentes")
+
+    def __init__(self, filas_con_llave: Iterable[Tuple[Llave, Dict[str, Any]]]):
+        ordenadas = sorted(filas_con_llave, key=lambda item: item[0], reverse=True)
+        self.llaves: List[Llave] = [tuple(llave) for llave, _ in ordenadas]
+        self.filas: List[Dict[str, Any]] = [fila for _, fila in ordenadas]
+        self._ascendentes = self.llaves[::-1]
+
+    def __len__(self) -> int:
+        return len(self.filas)
+
+    def posicion_despues_de(self, llave: Llave) -> int:
+        """Índice de la primera fila con llave menor que ``llave``"""
+        return len(self.llaves) - bisect.bisect_left(self._ascendentes, tuple(llave))
+
+    def pagina(self, inicio: int, limite: int, huella: str) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """Filas de la página y cursor de la siguiente (None si es la última)"""
+        fin = min(inicio + limite, len(self.filas))
+        filas = self.filas[inicio:fin]
+        siguiente = codificar_cursor(self.llaves[fin - 1], huella) if filas and fin < len(self.filas) else None
+        return filas, siguiente
@@ -0,0 +1,210 @@
+"""
+Lectura columnar de resultados grandes (Arrow + BigQuery Storage API).
+
+Los reportes grandes recorrían cada ``Row`` y armaban el diccionario campo
+por campo con ``float(...)`` e ``.isoformat()``. Aquí el resultado se
+descarga en lotes Arrow (por la Storage Read API si
+``google-cloud-bigquery-storage`` está instalado, si no por la API REST),
+las conversiones se hacen por columna con ``pyarrow.compute`` y cada lote
+pasa a diccionarios de una sola vez (``to_pylist``)::
+
+    for filas in lotes_dict(client, sql, job_config, conversiones={"valor": "float0"}):
+        ...
+
+    # Lista completa (reportes paginados o medianos)
+    filas = consultar_dicts(client, sql, job_config)
+
+Sin conversión explícita, las fechas/horas salen como texto ISO y los
+NUMERIC como ``float``, listos para serializar. Conversiones disponibles:
+
+- ``float`` / ``float0``: FLOAT64 (``0.0`` en vez de nulo con ``float0``)
+- ``int0``: INT64 con nulos en ``0``
+- ``bool``: BOOL con nulos en ``False``
+- ``iso``: fecha/hora como texto ISO
+- ``texto``: cualquier valor como texto
+
+Si ``pyarrow`` no está instalado se usa el mismo contrato fila por fila,
+con los conversores precalculados por columna.
+"""
+
+import logging
+import threading
+from datetime import date, datetime, time
+from decimal import Decimal
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+except ImportError:
+    pa = None
+    pc = None
+
+try:
+    from google.cloud import bigquery_storage
+except ImportError:
+    bigquery_storage = None
+
+logger = logging.getLogger(__name__)
+
+Conversiones = Dict[str, str]
+
+_storage_client = None
+_storage_lock = threading.Lock()
+
+
+def arrow_disponible() -> bool:
+    return pa is not None
+
+
+def _cliente_storage(client):
+    """Cliente de la Storage Read API compartido (None si no se puede usar)"""
+    global _storage_client
+    if bigquery_storage is None:
+        return None
+    with _storage_lock:
+        if _storage_client is None:
+            # BigQueryExecutor expone las credenciales del cliente real; un Client directo, en _credentials
+            credenciales = getattr(client, "credenciales", None) or getattr(client, "_credentials", None)
+            try:
+                _storage_client = bigquery_storage.BigQueryReadClient(credentials=credenciales)
+            except Exception as e:
+                logger.warning(f"⚠️ No se pudo crear el cliente de la Storage Read API, se usa REST: {e}")
+                return None
+        return _storage_client
+
+
+# ----------------------------------------------------------------------
+# Conversión por columna (Arrow)
+# ----------------------------------------------------------------------
+def _columna_iso(columna):
+    tipo = columna.type
+    if pa.types.is_timestamp(tipo):
+        # BigQuery guarda TIMESTAMP en UTC
+        formato = "%Y-%m-%dT%H:%M:%S+00:00" if tipo.tz else "%Y-%m-%dT%H:%M:%S"
+        return pc.strftime(columna, format=formato)
+    if pa.types.is_date(tipo) or pa.types.is_time(tipo):
+        return pc.cast(columna, pa.string())
+    return columna
+
+
+def _convertir_columna(columna, conversion: Optional[str]):
+    tipo = columna.type
+    if conversion in ("float", "float0"):
+        columna = pc.cast(columna, pa.float64())
+        return pc.fill_null(columna, 0.0) if conversion == "float0" else columna
+    if conversion == "int0":
+        return pc.fill_null(pc.cast(columna, pa.int64()), 0)
+    if conversion == "bool":
+        return pc.fill_null(pc.cast(columna, pa.bool_()), False)
+    if conversion == "texto":
+        return pc.cast(_columna_iso(columna), pa.string())
+    if conversion == "iso" or pa.types.is_temporal(tipo):
+        return _columna_iso(columna)
+    if pa.types.is_decimal(tipo):
+        return pc.cast(columna, pa.float64())
+    return columna
+
+
+def convertir_lote(lote, conversiones: Optional[Conversiones] = None):
+    """``RecordBatch`` con las conversiones aplicadas columna por columna"""
+    conversiones = conversiones or {}
+    columnas = [
+        _convertir_columna(lote.column(i), conversiones.get(nombre))
+        for i, nombre in enumerate(lote.schema.names)
+    ]
+    return pa.RecordBatch.from_arrays(columnas, names=lote.schema.names)
+
+
+# ----------------------------------------------------------------------
+# Conversión fila por fila (sin pyarrow)
+# ----------------------------------------------------------------------
+def _iso(valor: Any) -> Any:
+    return valor.isoformat() if isinstance(valor, (datetime, date, time)) else valor
+
+
+def _automatico(valor: Any) -> Any:
+    if isinstance(valor, Decimal):
+        return float(valor)
+    return _iso(valor)
+
+
+_CONVERSORES: Dict[str, Callable[[Any], Any]] = {
+    "float": lambda v: None if v is None else float(v),
+    "float0": lambda v: 0.0 if v is None else float(v),
+    "int0": lambda v: 0 if v is None else int(v),
+    "bool": lambda v: bool(v) if v is not None else False,
+    "iso": _iso,
+    "texto": lambda v: None if v is None else str(_iso(v)),
+}
+
+
+def _conversor_filas(columnas: List[str], conversiones: Optional[Conversiones]) -> Callable[[Any], Dict[str, Any]]:
+    conversores = [(nombre, _CONVERSORES.get((conversiones or {}).get(nombre), _automatico)) for nombre in columnas]
+
+    def convertir(fila) -> Dict[str, Any]:
+        return {nombre: conversor(valor) for (nombre, conversor), valor in zip(conversores, fila.values())}
+    return convertir
+
+
+# ----------------------------------------------------------------------
+# Lectura
+# ----------------------------------------------------------------------
+def _lotes_arrow(client, iterador) -> Iterator[Any]:
+    """
+    Lotes Arrow por la Storage Read API; si la sesión de lectura no se puede
+    crear (p. ej. falta el permiso readsessions) se leen las páginas REST.
+    """
+    storage = _cliente_storage(client)
+    if storage is not None:
+        lotes = iter(iterador.to_arrow_iterable(bqstorage_client=storage))
+        try:
+            primero = next(lotes, None)
+        except Exception as e:
+            logger.warning(f"⚠️ Storage Read API no disponible, se leen páginas REST: {e}")
+        else:
+            if primero is not None:
+                yield primero
+                yield from lotes
+            return
+    yield from iterador.to_arrow_iterable(bqstorage_client=None)
+
+
+def _lotes(client, iterador, conversiones: Optional[Conversiones]) -> Iterator[List[Dict[str, Any]]]:
+    if pa is not None:
+        for lote in _lotes_arrow(client, iterador):
+            yield convertir_lote(lote, conversiones).to_pylist()
+        return
+    convertir = _conversor_filas([campo.name for campo in iterador.schema], conversiones)
+    for pagina in iterador.pages:
+        yield [convertir(fila) for fila in pagina]
+
+
+def lotes_dict(client, sql: str, job_config=None, conversiones: Optional[Conversiones] = None,
+               timeout: Optional[float] = None) -> Iterator[List[Dict[str, Any]]]:
+    """
+    Ejecuta la consulta, espera a que termine y descarga el primer lote (los
+    errores salen aquí, antes de empezar a responder); el resto de los lotes
+    se descarga al iterar.
+    """
+    iterador = client.query(sql, job_config=job_config).result(timeout=timeout)
+    lotes = _lotes(client, iterador, conversiones)
+    # El primer lote también se descarga aquí: si la lectura falla, falla antes de responder
+    primero = next(lotes, None)
+
+    def todos() -> Iterator[List[Dict[str, Any]]]:
+        if primero is not None:
+            yield primero
+            yield from lotes
+    return todos()
+
+
+def filas_dict(client, sql: str, job_config=None, conversiones: Optional[Conversiones] = None,
+               timeout: Optional[float] = None) -> Iterator[Dict[str, Any]]:
+    lotes = lotes_dict(client, sql, job_config, conversiones, timeout)
+    return (fila for lote in lotes for fila in lote)
+
+
+def consultar_dicts(client, sql: str, job_config=None, conversiones: Optional[Conversiones] = None,
+                    timeout: Optional[float] = None) -> List[Dict[str, Any]]:
+    return list(filas_dict(client, sql, job_config, conversiones, timeout))
@@ -0,0 +1,192 @@
+"""
+Asignación de identificadores secuenciales (por ejemplo ``Id_Transaccion``).
+
+Antes cada registro de pago hacía ``SELECT MAX(Id_Transaccion) + 1`` sobre
+toda ``pagosconductor``: un escaneo completo de la columna por request y una
+carrera entre dos conductores que registran a la vez (mismo ID). Ahora el
+último valor entregado vive en una tabla contador (``secuencias``) y cada
+proceso reserva bloques con una transacción de BigQuery::
+
+    from app.core.secuencias import siguiente_id_transaccion
+
+    nuevo_id = siguiente_id_transaccion()
+
+Con ``bloque=1`` (por defecto) cada ID sale de la tabla y los IDs crecen en
+el orden en que se piden, también entre workers. Con bloques mayores cada
+worker consume su rango en memoria: los IDs siguen siendo únicos y
+crecientes dentro del worker y cada bloque nuevo es mayor que todos los
+entregados antes, a cambio de no respetar el orden global entre workers.
+
+Para pruebas locales ``SecuenciaMemoria`` reemplaza a la tabla.
+"""
+
+import logging
+import random
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+from app.core.config import BIGQUERY_PROJECT_ID, SECUENCIA_BLOQUE_ID_TRANSACCION
+
+logger = logging.getLogger(__name__)
+
+TABLA_SECUENCIAS = f"{BIGQUERY_PROJECT_ID}.Conciliaciones.secuencias"
+MAX_REINTENTOS = 6
+
+
+class SecuenciaMemoria:
+    """Contadores en memoria con la misma interfaz que ``SecuenciaBigQuery``"""
+
+    def __init__(self, iniciales: Optional[Dict[str, int]] = None):
+        self._valores: Dict[str, int] = dict(iniciales or {})
+        self._lock = threading.Lock()
+
+    def reservar(self, nombre: str, cantidad: int) -> Tuple[int, int]:
+        """Reserva ``cantidad`` valores y devuelve el rango ``(primero, ultimo)``"""
+        with self._lock:
+            ultimo = self._valores.get(nombre, 0) + cantidad
+            self._valores[nombre] = ultimo
+        return ultimo - cantidad + 1, ultimo
+
+
+class SecuenciaBigQuery:
+    """
+    Contador persistido en ``secuencias (nombre STRING, ultimo_valor INT64)``.
+    Cada reserva es un script con una transacción: lee, incrementa y escribe
+    el valor sin que otra reserva se intercale. La fila de la secuencia se
+    siembra dentro de la misma transacción, así dos procesos que arrancan a
+    la vez no pueden insertarla dos veces. Si ya hubiera filas duplicadas
+    (tablas sembradas por versiones anteriores) se toma el ``MAX`` y se
+    dejan en una sola. Si BigQuery aborta la transacción por una reserva
+    concurrente, se reintenta con espera aleatoria.
+    """
+
+    SQL_CREAR = f"""
+    CREATE TABLE IF NOT EXISTS `{TABLA_SECUENCIAS}` (
+        nombre STRING NOT NULL,
+        ultimo_valor INT64 NOT NULL,
+        actualizado_en TIMESTAMP
+    )
+    """
+
+    SQL_RESERVAR = f"""
+    DECLARE ultimo INT64;
+    BEGIN TRANSACTION;
+    SET ultimo = (SELECT MAX(ultimo_valor) FROM `{TABLA_SECUENCIAS}` WHERE nombre = @nombre);
+    IF ultimo IS NULL THEN
+        SET ultimo = COALESCE(({{semilla}}), 0);
+    END IF;
+    SET ultimo = ultimo + @cantidad;
+    DELETE FROM `{TABLA_SECUENCIAS}` WHERE nombre = @nombre;
+    INSERT INTO `{TABLA_SECUENCIAS}` (nombre, ultimo_valor, actualizado_en)
+    VALUES (@nombre, ultimo, CURRENT_TIMESTAMP());
+    COMMIT TRANSACTION;
+    SELECT ultimo AS ultimo_valor;
+    """
+
+    def __init__(self, client=None, semillas: Optional[Dict[str, str]] = None):
+        """
+        ``semillas`` asocia cada secuencia con una consulta ``SELECT ... AS
+        valor`` que da el valor inicial la primera vez (por ejemplo el
+        ``MAX`` actual de la tabla que la usa). Solo se ejecuta mientras la
+        secuencia no tiene fila.
+        """
+        self._client = client
+        self._semillas = dict(semillas or {})
+        self._tabla_creada = False
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        if self._client is None:
+            from app.core.bigquery_client import get_bigquery_client
+            return get_bigquery_client()
+        return self._client
+
+    def _asegurar_tabla(self) -> None:
+        """Crea la tabla si no existe (una vez por proceso; ``IF NOT EXISTS`` es idempotente)"""
+        if self._tabla_creada:
+            return
+        with self._lock:
+            if not self._tabla_creada:
+                self.client.query(self.SQL_CREAR).result()
+                self._tabla_creada = True
+
+    def _sql_reservar(self, nombre: str) -> str:
+        semilla = self._semillas.get(nombre, "SELECT 0 AS valor")
+        return self.SQL_RESERVAR.replace("{semilla}", f"SELECT valor FROM ({semilla})")
+
+    def reservar(self, nombre: str, cantidad: int) -> Tuple[int, int]:
+        from google.cloud import bigquery
+
+        self._asegurar_tabla()
+        sql = self._sql_reservar(nombre)
+        job_config = bigquery.QueryJobConfig(
+            query_parameters=[
+                bigquery.ScalarQueryParameter("nombre", "STRING", nombre),
+                bigquery.ScalarQueryParameter("cantidad", "INT64", cantidad),
+            ]
+        )
+        for intento in range(1, MAX_REINTENTOS + 1):
+            try:
+                filas = list(self.client.query(sql, job_config=job_config).result())
+                ultimo = int(filas[0].ultimo_valor)
+                return ultimo - cantidad + 1, ultimo
+            except Exception as e:
+                if intento == MAX_REINTENTOS or not _es_conflicto(e):
+                    raise
+                espera = min(2.0, 0.1 * 2 ** intento) * random.uniform(0.5, 1.5)
+                logger.warning(f"⚠️ Conflicto reservando secuencia {nombre} (intento {intento}), reintento en {espera:.2f}s")
+                time.sleep(espera)
+        raise RuntimeError("No se pudo reservar la secuencia")
+
+
+def _es_conflicto(error: Exception) -> bool:
+    mensaje = str(error).lower()
+    return "concurrent" in mensaje or "aborted" in mensaje or "could not serialize" in mensaje
+
+
+class AsignadorSecuencia:
+    """Entrega IDs de una secuencia reservando bloques en el backend cuando se agotan"""
+
+    def __init__(self, nombre: str, backend, bloque: int = 1):
+        self.nombre = nombre
+        self.backend = backend
+        self.bloque = max(1, bloque)
+        self._siguiente = 0
+        self._limite = -1
+        self._lock = threading.Lock()
+
+    def siguiente(self) -> int:
+        with self._lock:
+            if self._siguiente > self._limite:
+                self._siguiente, self._limite = self.backend.reservar(self.nombre, self.bloque)
+            valor = self._siguiente
+            self._siguiente += 1
+            return valor
+
+
+SECUENCIA_ID_TRANSACCION = "pagosconductor.Id_Transaccion"
+
+_asignador_id_transaccion = AsignadorSecuencia(
+    SECUENCIA_ID_TRANSACCION,
+    SecuenciaBigQuery(semillas={
+        SECUENCIA_ID_TRANSACCION: (
+            f"SELECT MAX(Id_Transaccion) AS valor "
+            f"FROM `{BIGQUERY_PROJECT_ID}.Conciliaciones.pagosconductor`"
+        ),
+    }),
+    bloque=SECUENCIA_BLOQUE_ID_TRANSACCION,
+)
+
+
+def usar_backend_secuencias(backend) -> None:
+    """Reemplaza el backend de las secuencias (por ejemplo con ``SecuenciaMemoria``)"""
+    with _asignador_id_transaccion._lock:
+        _asignador_id_transaccion.backend = backend
+        _asignador_id_transaccion._siguiente, _asignador_id_transaccion._limite = 0, -1
+
+
+def siguiente_id_transaccion() -> int:
+    """Nuevo ``Id_Transaccion`` para un lote de pagos (bloqueante)"""
+    return _asignador_id_transaccion.siguiente()
@@ -0,0 +1,66 @@
+"""
+Codificación JSON compartida para respuestas y eventos SSE.
+
+Antes cada payload pasaba por ``convertir_decimales_a_float`` (una copia
+recursiva de todo el objeto) y luego por ``json.dumps``. Aquí se serializa
+en una sola pasada con ``orjson``: los tipos que no maneja de forma nativa
+(``Decimal``, ``Row`` de BigQuery, conjuntos, modelos Pydantic) se
+resuelven en el hook ``default`` solo cuando aparecen::
+
+    yield f"data: {dumps_json(evento)}\\n\\n"
+
+    # Respuesta grande sin la copia de jsonable_encoder de FastAPI
+    return RespuestaJSON({"resultados": resultados})
+
+``RespuestaJSON`` es la clase de respuesta por defecto de la app (ver
+``main.py``). Las fechas y horas salen en ISO 8601 igual que con
+``.isoformat()``. Si ``orjson`` no está instalado se usa ``json`` con el
+mismo hook.
+"""
+
+import json
+from datetime import date, datetime, time
+from decimal import Decimal
+from typing import Any
+
+from fastapi.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+_OPCIONES = (orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY) if orjson is not None else 0
+
+
+def valor_json(valor: Any) -> Any:
+    """Hook ``default``: convierte un valor que el codificador no conoce"""
+    if isinstance(valor, Decimal):
+        return float(valor)
+    if isinstance(valor, (datetime, date, time)):
+        return valor.isoformat()
+    if isinstance(valor, (set, frozenset)):
+        return list(valor)
+    if hasattr(valor, "model_dump"):
+        return valor.model_dump()
+    if hasattr(valor, "items"):
+        # Row de BigQuery y otros mapeos
+        return dict(valor.items())
+    return str(valor)
+
+
+def codificar_json(valor: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(valor, default=valor_json, option=_OPCIONES)
+    return json.dumps(valor, ensure_ascii=False, separators=(",", ":"), default=valor_json).encode("utf-8")
+
+
+def dumps_json(valor: Any) -> str:
+    return codificar_json(valor).decode("utf-8")
+
+
+class RespuestaJSON(JSONResponse):
+    """``JSONResponse`` que serializa con ``codificar_json``"""
+
+    def render(self, content: Any) -> bytes:
+        return codificar_json(content)
@@ -2,6 +2,7 @@
 from fastapi import Depends, HTTPException, status, Request
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 import jwt
+from app.core.identidades import identidades
 
 SECRET_KEY = "supersecreto"
 ALGORITHM = "HS256"
@@ -11,6 +12,9 @@ def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(securit
     """
     Valida el token JWT y devuelve la información del usuario.
     El token debe contener al menos el correo (en 'correo' o 'sub') y el rol.
+    Los tokens emitidos con claims de identidad traen además employee_id,
+    carrier_ids, empresa_carrier y la versión ('ver'); si el rol o los
+    carriers cambiaron desde el login, el token se rechaza.
     """
     token = credentials.credentials
     try:
@@ -37,13 +41,24 @@ def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(securit
         correo = correo.lower().strip()
         rol = rol.lower().strip()
         
+        if not identidades.token_vigente(payload):
+            raise HTTPException(
+                status_code=401,
+                detail="Token desactualizado: el rol o los carriers cambiaron, inicie sesión de nuevo"
+            )
+        
         # Retornar payload normalizado
         return {
             **payload,
             "correo": correo,
-            "rol": rol
+            "rol": rol,
+            "employee_id": payload.get("employee_id"),
+            "carrier_ids": payload.get("carrier_ids"),
+            "empresa_carrier": payload.get("empresa_carrier")
         }
         
+    except HTTPException:
+        raise
     except jwt.ExpiredSignatureError:
         raise HTTPException(
             status_code=401,
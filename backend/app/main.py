@@ -1,9 +1,18 @@
-from fastapi import FastAPI, Request
+from fastapi import Depends, FastAPI, HTTPException, Request
 from fastapi.responses import Response
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
+from contextlib import asynccontextmanager
 import logging
 
+from app.core.bigquery_client import iniciar_bigquery, cerrar_bigquery, get_bigquery_client
+from app.core.cache import cache_agregados, iniciar_resumenes
+from app.core.carga_masiva import cargador_masivo
+from app.core.identidades import identidades
+from app.core.serializacion import RespuestaJSON
+from app.dependencies import get_current_user
+from app.services.ocr_motores import cerrar_pool_ocr
+
 from app.routers import (
     guias, ocr, pagos, operador, asistente,
     pagoCliente, contabilidad, auth, roles,
@@ -12,7 +21,18 @@ from app.routers import (
 )
 """ from app.comprobantes_drive import router as drive_router """
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Un solo cliente BigQuery por proceso, compartido por todos los routers
+    app.state.bigquery = iniciar_bigquery()
+    iniciar_resumenes()
+    identidades.iniciar()
+    yield
+    identidades.cerrar()
+    cerrar_bigquery()
+    cerrar_pool_ocr()
+
+app = FastAPI(lifespan=lifespan, default_response_class=RespuestaJSON)
 logging.basicConfig(level=logging.DEBUG)
 
 # ==========================
@@ -55,6 +75,31 @@ async def add_cache_control_header(request: Request, call_next):
 def root():
     return {"message": "API XCargo backend funcionando"}
 
+@app.get("/health/bigquery")
+def bigquery_health(current_user: dict = Depends(get_current_user)):
+    """
+    Contadores del cliente BigQuery compartido (tiempos, bytes, caché).
+    Solo admin y master: ``consultas_recientes`` incluye el texto del SQL.
+    """
+    if current_user["rol"] not in ["admin", "master"]:
+        raise HTTPException(status_code=403, detail="No autorizado - Solo admin y master")
+    return get_bigquery_client().estadisticas()
+
+@app.get("/health/cache")
+def cache_health():
+    """Estado de la caché de dashboards"""
+    return cache_agregados.estadisticas()
+
+@app.get("/health/carga-masiva")
+def carga_masiva_health():
+    """Load jobs enviados, formato y errores"""
+    return cargador_masivo.estadisticas()
+
+@app.get("/health/identidades")
+def identidades_health():
+    """Correos cargados en la caché de identidades y tasa de aciertos"""
+    return identidades.estadisticas()
+
 # ==========================
 # Registrar todas las rutas
 # ==========================
@@ -14,6 +14,8 @@ from pydantic import BaseModel
 import bcrypt
 import uuid
 import re
+from app.core.bigquery_client import get_bigquery_client
+from app.core.identidades import identidades
 
 router = APIRouter(prefix="/admin", tags=["Administrador"])
 
@@ -25,13 +27,6 @@ DATASET = "Conciliaciones"
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-try:
-    bq_client = bigquery.Client(project=PROJECT_ID)  # Especificamos explícitamente el proyecto
-    logger.info(f"✅ Cliente BigQuery inicializado para proyecto: {PROJECT_ID}")
-except Exception as e:
-    logger.error(f"❌ Error inicializando BigQuery: {e}")
-    bq_client = None
-
 def verificar_admin(
     request: Request,
     authorization: Optional[str] = Header(None),
@@ -61,7 +56,7 @@ def verificar_admin(
         raise HTTPException(status_code=403, detail="Rol no autorizado")
     raise HTTPException(status_code=403, detail="Credenciales no válidas")
 
-def verificar_bigquery():
+def verificar_bigquery(bq_client: bigquery.Client):
     """
     Verifica la conexión con BigQuery realizando una consulta simple.
     
@@ -79,14 +74,15 @@ def verificar_bigquery():
         return False
 
 @router.get("/entregas")
-async def listar_entregas(
+def listar_entregas(
     request: Request,
     page: int = Query(1, ge=1),
     limit: int = Query(50, ge=1, le=100),
     carrier: Optional[str] = Query(None),
     conductor: Optional[str] = Query(None),
     ciudad: Optional[str] = Query(None),
-    user = Depends(verificar_admin)
+    user = Depends(verificar_admin),
+    bq_client: bigquery.Client = Depends(get_bigquery_client)
 ):
     """
     Lista las entregas con filtros y paginación.
@@ -112,7 +108,7 @@ async def listar_entregas(
     """
     logger.info(f"📦 Listando entregas para: {user['correo']}")
 
-    if not verificar_bigquery():
+    if not verificar_bigquery(bq_client):
         raise HTTPException(status_code=503, detail="BigQuery no disponible")
 
     offset = (page - 1) * limit
@@ -204,16 +200,17 @@ class UsuarioResponse(BaseModel):
     id_usuario: Optional[str] = None
 
 @router.get("/buscar-usuarios", response_model=List[UsuarioBasico])
-async def buscar_usuarios(
+def buscar_usuarios(
     q: str = Query(..., min_length=3),
-    current_user: dict = Depends(verificar_admin)
+    current_user: dict = Depends(verificar_admin),
+    bq_client: bigquery.Client = Depends(get_bigquery_client)
 ):
     """
     Busca usuarios autenticados por correo o nombre para sugerencias.
     Busca en la tabla credenciales ya que estos son los usuarios que pueden iniciar sesión.
     """
     try:
-        if not verificar_bigquery():
+        if not verificar_bigquery(bq_client):
             raise HTTPException(status_code=503, detail="Error de conexión con BigQuery")
 
         query = f"""
@@ -268,13 +265,14 @@ async def buscar_usuarios(
         )
 
 @router.post("/crear-usuario")
-async def crear_usuario(
+def crear_usuario(
     nombre: str = Form(...),
     correo: str = Form(...),
     telefono: str = Form(...),
     rol: str = Form(...),
     empresa_carrier: Optional[str] = Form(None),
-    current_user: dict = Depends(verificar_admin)
+    current_user: dict = Depends(verificar_admin),
+    bq_client: bigquery.Client = Depends(get_bigquery_client)
 ):
     """
     Crea un nuevo usuario en el sistema
@@ -286,7 +284,7 @@ async def crear_usuario(
                 status_code=400,
                 detail="Formato de correo inválido"
             )        # Validar que el rol exista
-        if not validar_rol(rol):
+        if not validar_rol(rol, bq_client):
             raise HTTPException(
                 status_code=400,
                 detail=f"El rol '{rol}' no es válido"
@@ -365,6 +363,7 @@ async def crear_usuario(
         )
 
         bq_client.query(credenciales_query, job_config=job_config).result()
+        identidades.invalidar(correo)
 
         return {
             "mensaje": f"Usuario creado exitosamente. Contraseña temporal: {temp_password}",
@@ -388,7 +387,7 @@ class Rol(BaseModel):
     ruta_defecto: str
 
 @router.get("/roles", response_model=List[Rol])
-async def obtener_roles(current_user: dict = Depends(verificar_admin)):
+def obtener_roles(current_user: dict = Depends(verificar_admin), bq_client: bigquery.Client = Depends(get_bigquery_client)):
     """
     Obtiene la lista de roles disponibles en el sistema desde la tabla roles
     """
@@ -477,12 +476,13 @@ async def obtener_roles(current_user: dict = Depends(verificar_admin)):
             detail=f"Error obteniendo roles: {str(e)}"
         )
 
-def validar_rol(rol: str) -> bool:
+def validar_rol(rol: str, bq_client: bigquery.Client) -> bool:
     """
     Valida si un rol está permitido consultando la tabla de roles.
     
     Args:
         rol (str): Rol a validar
+        bq_client (bigquery.Client): Cliente de BigQuery del request
     
     Returns:
         bool: True si el rol es válido, False si no
@@ -507,9 +507,10 @@ def validar_rol(rol: str) -> bool:
         return False
 
 @router.get("/obtener-usuario/{correo}", response_model=UsuarioResponse)
-async def obtener_usuario(
+def obtener_usuario(
     correo: str,
-    user = Depends(verificar_admin)
+    user = Depends(verificar_admin),
+    bq_client: bigquery.Client = Depends(get_bigquery_client)
 ):
     """
     Obtiene los detalles de un usuario por su correo.
@@ -525,7 +526,7 @@ async def obtener_usuario(
         HTTPException: Si el usuario no existe o hay error en la consulta
     """
     try:
-        if not verificar_bigquery():
+        if not verificar_bigquery(bq_client):
             raise HTTPException(status_code=503, detail="Error de conexión con BigQuery")
 
         query = f"""
@@ -557,9 +558,10 @@ async def obtener_usuario(
         raise HTTPException(status_code=500, detail="Error interno del servidor")
 
 @router.post("/cambiar-rol")
-async def cambiar_rol(
+def cambiar_rol(
     request: CambioRolRequest,
-    user = Depends(verificar_admin)
+    user = Depends(verificar_admin),
+    bq_client: bigquery.Client = Depends(get_bigquery_client)
 ):
     """
     Cambia el rol de un usuario existente.
@@ -575,11 +577,11 @@ async def cambiar_rol(
         HTTPException: Si el usuario no existe, el rol es inválido o hay error en la actualización
     """
     try:
-        if not verificar_bigquery():
+        if not verificar_bigquery(bq_client):
             raise HTTPException(status_code=503, detail="Error de conexión con BigQuery")
 
         # Validar que el nuevo rol esté permitido
-        if not validar_rol(request.nuevo_rol):
+        if not validar_rol(request.nuevo_rol, bq_client):
             raise HTTPException(
                 status_code=400,
                 detail=f"El rol '{request.nuevo_rol}' no es válido"
@@ -622,6 +624,7 @@ async def cambiar_rol(
         
         update_job = bq_client.query(update_query, job_config=job_config)
         update_job.result()
+        identidades.invalidar(request.correo)
         
         logger.info(f"✅ Rol actualizado para usuario {request.correo}: {request.nuevo_rol}")
         return {"message": "Rol actualizado exitosamente"}
@@ -637,8 +640,9 @@ async def cambiar_rol(
         )
 
 @router.get("/roles")
-async def obtener_roles(
-    user = Depends(verificar_admin)
+def obtener_roles(
+    user = Depends(verificar_admin),
+    bq_client: bigquery.Client = Depends(get_bigquery_client)
 ):
     """
     Obtiene la lista de roles disponibles en el sistema.
@@ -653,7 +657,7 @@ async def obtener_roles(
         HTTPException: Si hay error en la consulta
     """
     try:
-        if not verificar_bigquery():
+        if not verificar_bigquery(bq_client):
             raise HTTPException(status_code=503, detail="Error de conexión con BigQuery")
             
         query = f"""
@@ -716,14 +720,15 @@ class ActualizarPermisosRequest(BaseModel):
     permisos: List[str]
 
 @router.get("/roles-con-permisos", response_model=List[RolConPermisos])
-async def obtener_roles_con_permisos(
-    user = Depends(verificar_admin)
+def obtener_roles_con_permisos(
+    user = Depends(verificar_admin),
+    bq_client: bigquery.Client = Depends(get_bigquery_client)
 ):
     """
     Obtiene la lista de roles con sus permisos asignados
     """
     try:
-        if not verificar_bigquery():
+        if not verificar_bigquery(bq_client):
             raise HTTPException(status_code=503, detail="Error de conexión con BigQuery")
 
         query = f"""
@@ -771,14 +776,15 @@ async def obtener_roles_con_permisos(
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/permisos", response_model=List[Permiso])
-async def obtener_permisos(
-    user = Depends(verificar_admin)
+def obtener_permisos(
+    user = Depends(verificar_admin),
+    bq_client: bigquery.Client = Depends(get_bigquery_client)
 ):
     """
     Obtiene la lista de todos los permisos disponibles
     """
     try:
-        if not verificar_bigquery():
+        if not verificar_bigquery(bq_client):
             raise HTTPException(status_code=503, detail="Error de conexión con BigQuery")
 
         query = f"""
@@ -795,15 +801,16 @@ async def obtener_permisos(
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.post("/crear-rol")
-async def crear_rol(
+def crear_rol(
     rol: NuevoRol,
-    user = Depends(verificar_admin)
+    user = Depends(verificar_admin),
+    bq_client: bigquery.Client = Depends(get_bigquery_client)
 ):
     """
     Crea un nuevo rol en el sistema
     """
     try:
-        if not verificar_bigquery():
+        if not verificar_bigquery(bq_client):
             raise HTTPException(status_code=503, detail="Error de conexión con BigQuery")
 
         # Verificar si el rol ya existe
@@ -868,15 +875,16 @@ async def crear_rol(
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.post("/crear-permiso")
-async def crear_permiso(
+def crear_permiso(
     permiso: NuevoPermiso,
-    user = Depends(verificar_admin)
+    user = Depends(verificar_admin),
+    bq_client: bigquery.Client = Depends(get_bigquery_client)
 ):
     """
     Crea un nuevo permiso en el sistema
     """
     try:
-        if not verificar_bigquery():
+        if not verificar_bigquery(bq_client):
             raise HTTPException(status_code=503, detail="Error de conexión con BigQuery")
 
         # Verificar si el permiso ya existe
@@ -925,16 +933,17 @@ async def crear_permiso(
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.post("/rol/{id_rol}/permisos")
-async def actualizar_permisos_rol(
+def actualizar_permisos_rol(
     id_rol: str,
     request: ActualizarPermisosRequest,
-    user = Depends(verificar_admin)
+    user = Depends(verificar_admin),
+    bq_client: bigquery.Client = Depends(get_bigquery_client)
 ):
     """
     Actualiza los permisos asignados a un rol
     """
     try:
-        if not verificar_bigquery():
+        if not verificar_bigquery(bq_client):
             raise HTTPException(status_code=503, detail="Error de conexión con BigQuery")
 
         # Verificar que el rol existe
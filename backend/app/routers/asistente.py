@@ -6,16 +6,14 @@ from google.cloud import bigquery
 from datetime import datetime
 import os
 import json
+import asyncio
 from app.dependencies import get_current_user
+from app.core.bigquery_client import get_bigquery_client
 
 router = APIRouter(prefix="/asistente", tags=["Asistente"])
 
 client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 
-def get_bigquery_client():
-    """Obtiene el cliente de BigQuery"""
-    return bigquery.Client()
-
 class Mensaje(BaseModel):
     pregunta: str
     correo_usuario: str
@@ -371,8 +369,10 @@ async def obtener_estado_usuario(
         print(f"🔍 Usuario {user_correo} ({user_rol}) accediendo a datos de: {correo}")
         
         # Obtener guías y estadísticas
-        guias = obtener_guias_usuario_real(correo, bigquery_client)
-        estadisticas = obtener_estadisticas_usuario(correo, bigquery_client)
+        guias, estadisticas = await asyncio.gather(
+            bigquery_client.ejecutar_async(obtener_guias_usuario_real, correo, bigquery_client),
+            bigquery_client.ejecutar_async(obtener_estadisticas_usuario, correo, bigquery_client),
+        )
         
         print(f"📊 Estado calculado para {correo}: {estadisticas}")
         
@@ -422,8 +422,10 @@ async def procesar_chat(
             )
         
         # Obtener datos actuales del usuario
-        guias = obtener_guias_usuario_real(mensaje_correo, bigquery_client)
-        estadisticas = obtener_estadisticas_usuario(mensaje_correo, bigquery_client)
+        guias, estadisticas = await asyncio.gather(
+            bigquery_client.ejecutar_async(obtener_guias_usuario_real, mensaje_correo, bigquery_client),
+            bigquery_client.ejecutar_async(obtener_estadisticas_usuario, mensaje_correo, bigquery_client),
+        )
         
         # Construir el prompt del sistema con el contexto actual
         prompt_sistema = construir_prompt_sistema(
@@ -433,8 +435,9 @@ async def procesar_chat(
             contexto_pagina=mensaje.contexto_adicional.get("pagina_actual") if mensaje.contexto_adicional else None
         )
         
-        # Enviar mensaje a OpenAI con el contexto
-        completion = client.chat.completions.create(
+        # Enviar mensaje a OpenAI con el contexto (en un hilo: el SDK es síncrono)
+        completion = await asyncio.to_thread(
+            client.chat.completions.create,
             model="gpt-4-0125-preview",  # Usar el modelo más reciente
             messages=[
                 {"role": "system", "content": prompt_sistema},
@@ -1,8 +1,9 @@
 from datetime import datetime, timedelta
-from fastapi import APIRouter, HTTPException, Form, Body, Request
+from fastapi import APIRouter, Depends, HTTPException, Form, Body, Request
 from pydantic import BaseModel
 from typing import Optional
 from google.cloud import bigquery
+from app.core.identidades import identidades
 import bcrypt
 import logging
 import random
@@ -10,6 +11,9 @@ import string
 import json
 import os
 from app.core.email_utils import enviar_codigo_verificacion
+from app.core.bigquery_client import get_bigquery_client
+from app.routers.guias import obtener_employee_id_usuario
+from app.routers.supervisor import obtener_carrier_id_supervisor
 import jwt
 
 # Configurar logging
@@ -144,9 +148,7 @@ def hash_clave(plain_password: str) -> str:
     return bcrypt.hashpw(plain_password.encode(), bcrypt.gensalt()).decode()
 
 @router.post("/login")
-def login(data: LoginRequest):
-    client = bigquery.Client()
-
+def login(data: LoginRequest, client: bigquery.Client = Depends(get_bigquery_client)):
     # 1. Verificar credenciales
     query_cred = """
         SELECT correo, hashed_password, rol, clave_defecto, id_usuario, empresa_carrier
@@ -254,12 +256,29 @@ def login(data: LoginRequest):
     ruta_defecto = (
         ruta_rows[0]["ruta_defecto"] if ruta_rows and ruta_rows[0]["ruta_defecto"]
         else (permisos[0]["ruta"] if permisos else "/")
-    )    # 5. Generar JWT y retornar
+    )
+
+    # 5. Identidad resuelta: viaja firmada en el token para no consultarla en cada request
+    correo_token = datos_usuario["correo"]
+    employee_id = obtener_employee_id_usuario(correo_token, client) if cred["rol"] == "conductor" else None
+    carrier_ids = obtener_carrier_id_supervisor(correo_token, client)
+    claims = identidades.claims_token(
+        correo_token,
+        cred["rol"],
+        employee_id,
+        carrier_ids,
+        datos_usuario.get("empresa_carrier") or cred.get("empresa_carrier"),
+    )
+
+    # 6. Generar JWT y retornar
+    ahora = datetime.utcnow()
     payload = {
-        "sub": datos_usuario["correo"],  # Mantener sub para compatibilidad JWT
-        "correo": datos_usuario["correo"],  # Agregar correo explícitamente
+        "sub": correo_token,  # Mantener sub para compatibilidad JWT
+        "correo": correo_token,  # Agregar correo explícitamente
         "rol": cred["rol"],
-        "exp": datetime.utcnow() + timedelta(hours=12)
+        **claims,
+        "iat": ahora,
+        "exp": ahora + timedelta(hours=12)
     }
     token = jwt.encode(payload, SECRET_KEY, algorithm=ALGORITHM)
 
@@ -281,7 +300,7 @@ def login(data: LoginRequest):
 
 
 @router.post("/cambiar-clave")
-async def cambiar_clave(request: Request):
+async def cambiar_clave(request: Request, client: bigquery.Client = Depends(get_bigquery_client)):
     """Endpoint para cambiar contraseña con código de verificación"""
     try:
         # Intentar obtener datos como JSON primero
@@ -334,8 +353,6 @@ async def cambiar_clave(request: Request):
         # Hash de la nueva contraseña
         hashed_password = bcrypt.hashpw(nueva_clave.encode(), bcrypt.gensalt()).decode()
         
-        # Actualizar en BigQuery
-        client = bigquery.Client()
         query = """
             UPDATE `datos-clientes-441216.Conciliaciones.credenciales`
             SET hashed_password = @password,
@@ -350,7 +367,7 @@ async def cambiar_clave(request: Request):
             ]
         )
         
-        result = client.query(query, job_config=job_config).result()
+        await client.query_async(query, job_config=job_config)
         
         # Eliminar el código después de usarlo
         eliminar_codigo(correo)
@@ -368,9 +385,8 @@ async def cambiar_clave(request: Request):
         )
 
 @router.post("/solicitar-codigo")
-def solicitar_codigo(correo: str = Form(...)):
+def solicitar_codigo(correo: str = Form(...), client: bigquery.Client = Depends(get_bigquery_client)):
     """Endpoint para solicitar código de recuperación de contraseña"""
-    client = bigquery.Client()
     correo = correo.lower().strip()
     
     print(f"📧 Iniciando solicitud de código para: {correo}")
@@ -648,6 +664,7 @@ def crear_usuario_conductor_automatico(correo: str, client: bigquery.Client, ori
             )
             
             client.query(query_insert, job_config=job_config_insert).result()
+            identidades.invalidar(correo)
             
             print(f"✅ Credenciales creadas automáticamente para conductor: {usuario_data['Employee_Name']}")
             return True
@@ -718,6 +735,7 @@ def crear_usuario_conductor_automatico(correo: str, client: bigquery.Client, ori
             
             # Ejecutar la inserción
             client.query(query_insert, job_config=job_config_insert).result()
+            identidades.invalidar(correo)
             
             print(f"✅ Credenciales creadas automáticamente para usuario interno: {usuario_data['nombre']} con rol {rol}")
             return True
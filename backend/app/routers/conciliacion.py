@@ -14,12 +14,11 @@ from collections import defaultdict
 router = APIRouter(prefix="/conciliacion", tags=["Conciliacion"])
 
 @router.post("/actualizar-estado-pagos-1901")
-async def actualizar_estado_pagos_1901():
+def actualizar_estado_pagos_1901(client: bigquery.Client = Depends(get_bigquery_client)):
     """
     Actualiza el campo estado_conciliacion a 'pendiente_conciliacion' para todos los pagos con Id_Transaccion = 1901.
     """
     try:
-        client = get_bigquery_client()
         logger.info("🔄 Actualizando estado_conciliacion a 'pendiente_conciliacion' para pagos con Id_Transaccion = 1901...")
         query_update_estado = f"""
         UPDATE `{PROJECT_ID}.{DATASET_CONCILIACIONES}.pagosconductor`
@@ -29,6 +28,7 @@ async def actualizar_estado_pagos_1901():
         update_job_estado = client.query(query_update_estado)
         update_job_estado.result()
         registros_actualizados = update_job_estado.num_dml_affected_rows
+        invalidar_tablas("pagosconductor")
         logger.info(f"✅ Registros actualizados a pendiente_conciliacion (Id_Transaccion=1901): {registros_actualizados}")
         return {
             "mensaje": f"{registros_actualizados} pagos actualizados a pendiente_conciliacion (Id_Transaccion=1901)",
@@ -45,7 +45,7 @@ async def actualizar_estado_pagos_1901():
 from fastapi import APIRouter, Form, UploadFile, File, HTTPException, Body, Query, Depends,status
 from fastapi.responses import StreamingResponse
 from google.cloud import bigquery
-from typing import List, Dict, Optional, Any, AsyncGenerator
+from typing import List, Dict, Optional, Any, AsyncGenerator, BinaryIO, Tuple
 from pydantic import BaseModel
 from datetime import datetime, date, timedelta
 import logging
@@ -55,42 +55,39 @@ import asyncio
 from decimal import Decimal
 from collections import defaultdict
 import os
+import sys
 import csv
 import io
-
-def get_bigquery_client() -> bigquery.Client:
-    """Obtiene cliente de BigQuery con manejo de errores"""
-    try:
-        return bigquery.Client(project=PROJECT_ID)
-    except Exception as e:
-        
-        raise HTTPException(
-            status_code=500, 
-            detail="Error de configuración de base de datos"
-        )
-
-def convertir_decimales_a_float(obj):
-    """Convierte recursivamente todos los objetos Decimal a float para serialización JSON"""
-    if isinstance(obj, Decimal):
-        return float(obj)
-    elif isinstance(obj, dict):
-        return {k: convertir_decimales_a_float(v) for k, v in obj.items()}
-    elif isinstance(obj, list):
-        return [convertir_decimales_a_float(item) for item in obj]
-    else:
-        return obj
-
-def json_safe_dumps(obj):
-    """Serializa objetos a JSON de forma segura, convirtiendo Decimals a float"""
-    return json.dumps(convertir_decimales_a_float(obj))
+import itertools
+from app.core.bigquery_client import get_bigquery_client
+from app.core.cache import invalida, invalidar_tablas, registrar_fechas_modificadas
+from app.core.consultas import ParametrosConsulta
+from app.core.exportacion import escribir_archivo, leer_tabla_paginada
+from app.core.resultados_arrow import filas_dict
+from app.core.serializacion import RespuestaJSON, dumps_json
+from app.core.carga_masiva import cargador_masivo
+from app.core.conjuntos_resultados import conjuntos_resultados
+from app.services.conciliacion_service import LoteConciliacionAutomatica
 
 from ..utils.conciliacion_utils import (
+    IndiceMovimientosBanco,
     calcular_diferencia_valor,
     calcular_diferencia_fecha,
     determinar_estado_conciliacion,
     actualizar_metadata_conciliacion,
     validar_conciliacion_lista
 )
+from ..utils.banco_csv import (
+    MAX_ERRORES_DETALLADOS,
+    ClaveContenido,
+    LectorBancoCSV,
+    NumeradorHuellas,
+    clave_contenido,
+    detectar_codificacion,
+    es_consignacion,
+    huella_movimiento,
+    huellas_existentes
+)
 
 # Configuración de logging
 logger = logging.getLogger(__name__)
@@ -107,6 +104,13 @@ class EstadoError(Exception):
 router = APIRouter(prefix="/conciliacion", tags=["Conciliacion"])
 
 class MovimientoBanco:
+    # Sin __dict__ por instancia: los extractos grandes generan cientos de miles
+    __slots__ = (
+        "numero_linea", "linea_original", "cuenta", "codigo", "campo_vacio_1",
+        "fecha_raw", "campo_vacio_2", "valor_raw", "cod_transaccion",
+        "descripcion", "flag", "fecha", "valor", "huella", "id",
+    )
+
     def __init__(self, fila_csv: str, numero_linea: int = 0):
         """
         MEJORADO: Parser más robusto con mejor manejo de errores y logging
@@ -155,13 +159,44 @@ class MovimientoBanco:
         # MEJORADO: Procesamiento de valor más robusto
         self.valor = self._procesar_valor(self.valor_raw, numero_linea)
         
-        # Crear ID único con timestamp para evitar duplicados
-        timestamp = int(datetime.utcnow().timestamp() * 1000000)
-        self.id = f"BANCO_{self.fecha_raw}_{int(abs(self.valor))}_{timestamp % 1000000}"
+        # ID determinista por contenido (línea aislada: primera ocurrencia)
+        self._asignar_huella(huella_movimiento(self.clave_contenido(), 1))
         
         # Log del movimiento procesado exitosamente
         print(f"    ✅ Procesado: {self.fecha} | ${self.valor:,.0f} | {self.descripcion[:30]}")
 
+    @classmethod
+    def desde_fila(cls, fila, numerador: NumeradorHuellas) -> "MovimientoBanco":
+        """
+        Construye el movimiento a partir de una fila ya parseada por
+        ``LectorBancoCSV`` (sin volver a detectar separador ni formatos, sin log)
+        """
+        mov = cls.__new__(cls)
+        mov.numero_linea = fila.numero_linea
+        mov.linea_original = fila.linea_original
+        # Los campos cortos se repiten en casi todas las filas: una sola copia por valor
+        mov.cuenta = sys.intern(fila.cuenta)
+        mov.codigo = sys.intern(fila.codigo)
+        mov.campo_vacio_1 = sys.intern(fila.campo_vacio_1)
+        mov.fecha_raw = sys.intern(fila.fecha_raw)
+        mov.campo_vacio_2 = sys.intern(fila.campo_vacio_2)
+        mov.valor_raw = sys.intern(fila.valor_raw)
+        mov.cod_transaccion = sys.intern(fila.cod_transaccion)
+        mov.descripcion = sys.intern(fila.descripcion)
+        mov.flag = sys.intern(fila.flag)
+        mov.fecha = fila.fecha
+        mov.valor = fila.valor
+        mov._asignar_huella(numerador.siguiente(mov.clave_contenido()))
+        return mov
+
+    def clave_contenido(self) -> ClaveContenido:
+        return clave_contenido(self.cuenta, self.codigo, self.fecha, self.valor, self.cod_transaccion, self.descripcion)
+
+    def _asignar_huella(self, huella: int) -> None:
+        # Mismo contenido y ocurrencia => mismo ID, así una recarga del extracto se deduplica por llave
+        self.huella = huella
+        self.id = f"BANCO_{self.fecha_raw}_{int(abs(self.valor))}_{huella}"
+
     def _procesar_fecha(self, fecha_raw: str, numero_linea: int) -> datetime.date:
         """Procesa fecha con múltiples formatos posibles"""
         if not fecha_raw:
@@ -249,69 +284,66 @@ class MovimientoBanco:
 
 # ========== FUNCIONES DE VALIDACIÓN MEJORADAS ==========
 
-def analizar_archivo_detallado(decoded: str, filename: str) -> Dict:
-    """Analiza el archivo línea por línea para diagnosticar problemas"""
-    
-    lineas = decoded.strip().split('\n')
+def analizar_archivo_detallado(archivo: BinaryIO, filename: str, codificacion: str) -> Dict:
+    """
+    Analiza el archivo por bloques de líneas (ver ``LectorBancoCSV``): el
+    separador y el formato de fecha se detectan una vez y fechas/valores se
+    convierten por columna. Solo se guardan los primeros errores en detalle
+    y, de las filas válidas, solo las de tipo reconocido (las que se cargan);
+    del resto se lleva la cuenta.
+    """
+    lector = LectorBancoCSV(archivo, codificacion)
     analisis = {
-        "total_lineas": len(lineas),
+        "total_lineas": 0,
         "lineas_vacias": 0,
         "lineas_muy_cortas": 0,
         "errores_parsing": [],
-        "movimientos_validos": [],
+        "total_errores_parsing": 0,
+        "total_movimientos_validos": 0,
+        "movimientos_reconocidos": [],
         "separadores_detectados": defaultdict(int),
         "formatos_fecha_detectados": defaultdict(int),
         "tipos_transaccion": defaultdict(int)
     }
     
     print(f"\n📋 ANÁLISIS DETALLADO DE {filename}")
-    print(f"Total de líneas: {len(lineas)}")
+    numerador = NumeradorHuellas()
     
-    for i, linea in enumerate(lineas):
-        numero_linea = i + 1
-        linea_limpia = linea.strip()
-        
-        # Contar líneas vacías
-        if not linea_limpia:
-            analisis["lineas_vacias"] += 1
-            continue
-        
-        # Contar líneas muy cortas
-        if len(linea_limpia) < 10:
-            analisis["lineas_muy_cortas"] += 1
-            print(f"  Línea {numero_linea}: Muy corta ({len(linea_limpia)} chars): '{linea_limpia}'")
+    for lote in lector:
+        analisis["total_errores_parsing"] += len(lote.errores)
+        espacio = MAX_ERRORES_DETALLADOS - len(analisis["errores_parsing"])
+        if espacio > 0:
+            analisis["errores_parsing"].extend(lote.errores[:espacio])
+        if lote.filas.empty:
             continue
         
-        # Detectar separadores
-        if ';' in linea_limpia:
-            analisis["separadores_detectados"][';'] += 1
-        if ',' in linea_limpia:
-            analisis["separadores_detectados"][','] += 1
-        if '\t' in linea_limpia:
-            analisis["separadores_detectados"]['\t'] += 1
-        
-        # Intentar parsear el movimiento
-        try:
-            mov = MovimientoBanco(linea_limpia, numero_linea)
-            analisis["movimientos_validos"].append(mov)
-            
-            # Estadísticas de tipos de transacción
-            tipo = "CONSIGNACION" if mov.es_consignacion() else "OTRO"
-            analisis["tipos_transaccion"][tipo] += 1
-            
-        except Exception as e:
-            error_info = {
-                "linea": numero_linea,
-                "error": str(e),
-                "contenido": linea_limpia[:100] + "..." if len(linea_limpia) > 100 else linea_limpia
-            }
-            analisis["errores_parsing"].append(error_info)
-            print(f"  ❌ Línea {numero_linea}: {str(e)}")
+        # Estadísticas de tipos de transacción
+        consignaciones = int(es_consignacion(lote.filas["descripcion"]).sum())
+        analisis["tipos_transaccion"]["CONSIGNACION"] += consignaciones
+        analisis["tipos_transaccion"]["OTRO"] += len(lote.filas) - consignaciones
+        if lector.formato_fecha:
+            analisis["formatos_fecha_detectados"][lector.formato_fecha] += len(lote.filas)
+        
+        analisis["total_movimientos_validos"] += len(lote.filas)
+        # La huella numera ocurrencias por contenido (descripción incluida), así
+        # que descartar los tipos no reconocidos no cambia la de los demás
+        reconocidas = lote.filas[lote.filas["descripcion"].map(normalizar_tipo_banco).notna()]
+        analisis["movimientos_reconocidos"].extend(
+            MovimientoBanco.desde_fila(fila, numerador) for fila in reconocidas.itertuples(index=False)
+        )
+    
+    analisis["total_lineas"] = lector.total_lineas
+    analisis["lineas_vacias"] = lector.lineas_vacias
+    analisis["lineas_muy_cortas"] = lector.lineas_muy_cortas
+    for separador, cantidad in lector.separadores_detectados.items():
+        if cantidad:
+            analisis["separadores_detectados"][separador] = cantidad
     
     # Resumen del análisis
     print(f"\n📊 RESUMEN DEL ANÁLISIS:")
-    print(f"  ✅ Movimientos válidos: {len(analisis['movimientos_validos'])}")
-    print(f"  ❌ Errores de parsing: {len(analisis['errores_parsing'])}")
+    print(f"  Total de líneas: {analisis['total_lineas']} | Separador: {lector.separador!r} | Formato fecha: {lector.formato_fecha}")
+    print(f"  ✅ Movimientos válidos: {analisis['total_movimientos_validos']}")
+    print(f"  ❌ Errores de parsing: {analisis['total_errores_parsing']}")
     print(f"  📝 Líneas vacías: {analisis['lineas_vacias']}")
     print(f"  📏 Líneas muy cortas: {analisis['lineas_muy_cortas']}")
     print(f"  🔗 Separadores detectados: {dict(analisis['separadores_detectados'])}")
@@ -322,46 +354,34 @@ def analizar_archivo_detallado(decoded: str, filename: str) -> Dict:
 # ========== ENDPOINT MEJORADO DE CARGA ==========
 
 @router.post("/cargar-banco-excel")
-async def cargar_archivo_banco_mejorado(file: UploadFile = File(...)):
+@invalida("banco_movimientos")
+async def cargar_archivo_banco_mejorado(file: UploadFile = File(...), client: bigquery.Client = Depends(get_bigquery_client)):
     """VERSIÓN MEJORADA: Cargar archivo CSV del banco con análisis detallado"""
     
     if not (file.filename.endswith((".csv", ".CSV"))):
         raise HTTPException(status_code=400, detail="El archivo debe ser CSV")
 
-    # VALIDAR TAMAÑO DEL ARCHIVO
-    content = await file.read()
-    if len(content) > MAX_FILE_SIZE:
+    # VALIDAR TAMAÑO DEL ARCHIVO (sin cargarlo en memoria)
+    file.file.seek(0, os.SEEK_END)
+    tamano = file.file.tell()
+    file.file.seek(0)
+    if tamano > MAX_FILE_SIZE:
         raise HTTPException(
             status_code=413, 
             detail=f"Archivo demasiado grande. Máximo permitido: {MAX_FILE_SIZE // (1024*1024)}MB"
         )
     
-    # DECODIFICAR ARCHIVO con múltiples codificaciones
-    encodings = ["utf-8-sig", "utf-8", "latin-1", "cp1252", "iso-8859-1"]
-    decoded = None
-    encoding_usado = None
-    
-    for encoding in encodings:
-        try:
-            decoded = content.decode(encoding)
-            encoding_usado = encoding
-            print(f"✅ Archivo decodificado con: {encoding}")
-            break
-        except UnicodeDecodeError:
-            continue
-    
-    if decoded is None:
+    # DETECTAR CODIFICACIÓN (se prueban varias, leyendo por bloques)
+    encoding_usado = await asyncio.to_thread(detectar_codificacion, file.file)
+    if encoding_usado is None:
         raise HTTPException(status_code=400, detail="No se pudo decodificar el archivo con ninguna codificación")
+    print(f"✅ Archivo decodificado con: {encoding_usado}")
     
-    # ANÁLISIS DETALLADO DEL ARCHIVO
-    analisis = analizar_archivo_detallado(decoded, file.filename)
+    # ANÁLISIS DETALLADO DEL ARCHIVO (por bloques, fuera del event loop)
+    analisis = await asyncio.to_thread(analizar_archivo_detallado, file.file, file.filename, encoding_usado)
     
-    # Filtrar y normalizar movimientos válidos
-    # Solo se conservan los que tienen un tipo reconocido (consignación, nequi, etc.)
-    movimientos_normalizados = [
-        mov for mov in analisis["movimientos_validos"] 
-        if normalizar_tipo_banco(mov.descripcion) is not None
-    ]
+    # Movimientos con tipo reconocido (consignación, nequi, etc.), ya filtrados por bloque
+    movimientos_normalizados = analisis["movimientos_reconocidos"]
 
     # Mostrar resumen de las consignaciones encontradas
     print(f"\n💰 CONSIGNACIONES ENCONTRADAS: {len(movimientos_normalizados)}")
@@ -379,9 +399,9 @@ async def cargar_archivo_banco_mejorado(file: UploadFile = File(...)):
         info_debug = {
             "mensaje": "No se encontraron consignaciones válidas",
             "analisis_detallado": {
-                "total_movimientos_parseados": len(analisis["movimientos_validos"]),
+                "total_movimientos_parseados": analisis["total_movimientos_validos"],
                 "tipos_encontrados": dict(analisis["tipos_transaccion"]),
-                "errores_parsing": len(analisis["errores_parsing"]),
+                "errores_parsing": analisis["total_errores_parsing"],
                 "primeros_errores": analisis["errores_parsing"][:10],  # Mostrar primeros 10 errores
                 "encoding_usado": encoding_usado
             }
@@ -389,34 +409,16 @@ async def cargar_archivo_banco_mejorado(file: UploadFile = File(...)):
         raise HTTPException(status_code=400, detail=f"Debug info: {info_debug}")
 
     # Iniciar análisis de patrones y preparación para inserción en BD
-    client = bigquery.Client()
     
-    # Obtener lista única de fechas del archivo
-    fechas_archivo = list(set(mov.fecha.isoformat() for mov in movimientos_normalizados))
+    # Deduplicación por huella contra la BD: una consulta para todas las fechas del archivo
+    fechas_archivo = sorted({mov.fecha.isoformat() for mov in movimientos_normalizados})
     print(f"📅 Fechas en archivo: {fechas_archivo}")
     
-    # Inicializar contenedores para resultados
-    todos_movimientos_a_insertar = []
-    reporte_completo = {"fechas_procesadas": {}}
-    
-    # Procesar cada fecha por separado para mejor organización y control
-    for fecha_str in fechas_archivo:
-        print(f"\n🔍 Analizando fecha: {fecha_str}")
-        
-        # Filtrar movimientos de la fecha actual
-        movimientos_fecha = [mov for mov in movimientos_normalizados if mov.fecha.isoformat() == fecha_str]
-        
-        # Obtener patrones existentes de la BD para comparar
-        patrones_existentes = analizar_patrones_existentes(client, fecha_str)
-        
-        # Analizar patrones del archivo actual
-        patrones_nuevos = analizar_patrones_nuevos(movimientos_fecha)
-        
-        # Determinar qué insertar
-        movimientos_insertar, reporte_fecha = determinar_movimientos_a_insertar(patrones_existentes, patrones_nuevos)
-        
-        todos_movimientos_a_insertar.extend(movimientos_insertar)
-        reporte_completo["fechas_procesadas"][fecha_str] = reporte_fecha
+    conteos_bd = await client.ejecutar_async(contar_movimientos_existentes, client, fechas_archivo)
+    todos_movimientos_a_insertar, reporte_completo = determinar_movimientos_a_insertar(
+        movimientos_normalizados, conteos_bd
+    )
+    print(f"🔍 {len(todos_movimientos_a_insertar)} nuevos, {len(movimientos_normalizados) - len(todos_movimientos_a_insertar)} ya cargados")
 
     # INSERTAR EN BIGQUERY (código existente, sin cambios)
     if todos_movimientos_a_insertar:
@@ -443,44 +445,13 @@ async def cargar_archivo_banco_mejorado(file: UploadFile = File(...)):
             })
 
         
-        try:
-            table_id = "datos-clientes-441216.Conciliaciones.banco_movimientos"
-            
-            valores_sql = []
-            for reg in registros_bd:
-                descripcion_escaped = reg['descripcion'].replace("'", "''")
-                linea_escaped = reg['linea_original'].replace("'", "''")
-                
-                valores_sql.append(f"""(
-                    '{reg['id']}',
-                    DATE('{reg['fecha']}'),
-                    {reg['valor_banco']},
-                    '{reg['cuenta']}',
-                    '{reg['codigo']}',
-                    '{reg['cod_transaccion']}',
-                    '{descripcion_escaped}',
-                    '{reg['tipo']}',
-                    '{reg['estado_conciliacion']}',
-                    {reg['match_manual']},
-                    {reg['confianza_match']},
-                    '{reg['observaciones']}',
-                    TIMESTAMP('{reg['cargado_en']}'),
-                    '{linea_escaped}'
-                )""")
-            
-            query = f"""
-            INSERT INTO `{table_id}` (
-                id, fecha, valor_banco, cuenta, codigo, cod_transaccion, 
-                descripcion, tipo, estado_conciliacion, match_manual, 
-                confianza_match, observaciones, cargado_en, linea_original
-            ) VALUES {', '.join(valores_sql)}
-            """
-            
-            client.query(query).result()
-            print("✅ Inserción completada en BigQuery")
-            
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=f"Error insertando en BigQuery: {str(e)}")
+        # Un solo load job: sin costo por fila y sin streaming buffer, así la
+        # conciliación puede actualizar los movimientos de inmediato
+        table_id = "datos-clientes-441216.Conciliaciones.banco_movimientos"
+        errores_carga = await asyncio.to_thread(cargador_masivo.cargar, table_id, registros_bd)
+        if errores_carga:
+            raise HTTPException(status_code=500, detail=f"Error insertando en BigQuery: {errores_carga}")
+        print("✅ Inserción completada en BigQuery")
     
     else:
         print("ℹ️ No hay movimientos nuevos para insertar")
@@ -491,9 +462,9 @@ async def cargar_archivo_banco_mejorado(file: UploadFile = File(...)):
         "encoding_usado": encoding_usado,
         "analisis_archivo": {
             "total_lineas": analisis["total_lineas"],
-            "movimientos_parseados": len(analisis["movimientos_validos"]),
+            "movimientos_parseados": analisis["total_movimientos_validos"],
             "consignaciones_encontradas": len(movimientos_normalizados),
-            "errores_parsing": len(analisis["errores_parsing"]),
+            "errores_parsing": analisis["total_errores_parsing"],
             "tipos_transaccion": dict(analisis["tipos_transaccion"])
         },
         "movimientos_insertados": len(todos_movimientos_a_insertar),
@@ -502,7 +473,7 @@ async def cargar_archivo_banco_mejorado(file: UploadFile = File(...)):
     }
     
     # Incluir errores si son pocos para debug
-    if len(analisis["errores_parsing"]) <= 20:
+    if analisis["total_errores_parsing"] <= 20:
         resultado["errores_detalladas"] = analisis["errores_parsing"]
     
     return resultado
@@ -586,114 +557,99 @@ def normalizar_tipo_banco(descripcion: str) -> Optional[str]:
     return None
 
 
-def analizar_patrones_existentes(client: bigquery.Client, fecha: str) -> Dict[str, Dict[float, int]]:
-    """Analiza patrones existentes en BD por fecha y tipo de transacción"""
+def contar_movimientos_existentes(client: bigquery.Client, fechas: List[str]) -> Dict[ClaveContenido, int]:
+    """Cuántos movimientos hay en BD por contenido, para todas las fechas a la vez"""
     
     query = """
     SELECT 
-        descripcion,
+        cuenta,
+        codigo,
+        DATE(fecha) AS fecha,
         valor_banco,
+        cod_transaccion,
+        descripcion,
         COUNT(*) as cantidad
     FROM `datos-clientes-441216.Conciliaciones.banco_movimientos`
-    WHERE DATE(fecha) = @fecha 
-    GROUP BY descripcion, valor_banco
-    ORDER BY descripcion, valor_banco
+    WHERE DATE(fecha) IN UNNEST(@fechas)
+    GROUP BY cuenta, codigo, DATE(fecha), valor_banco, cod_transaccion, descripcion
     """
     
     job_config = bigquery.QueryJobConfig(
         query_parameters=[
-            bigquery.ScalarQueryParameter("fecha", "DATE", fecha)
+            bigquery.ArrayQueryParameter("fechas", "DATE", fechas)
         ]
     )
     
     resultados = client.query(query, job_config=job_config).result()
     
-    # Organizar por tipo de descripción
-    patrones = defaultdict(dict)
+    conteos = defaultdict(int)
     for row in resultados:
-        tipo_desc = row.descripcion.strip()
-        valor = float(row.valor_banco)
-        cantidad = int(row.cantidad)
-        patrones[tipo_desc][valor] = cantidad
-    
-    print(f"📊 Patrones existentes para {fecha}:")
-    for tipo, valores in patrones.items():
-        print(f"  {tipo}: {len(valores)} valores únicos")
-        for valor, cant in sorted(valores.items()):
-            print(f"    ${valor:,.0f} → {cant} veces")
+        if row.valor_banco is None:
+            continue
+        clave = clave_contenido(row.cuenta, row.codigo, row.fecha, row.valor_banco, row.cod_transaccion, row.descripcion)
+        conteos[clave] += int(row.cantidad)
     
-    return dict(patrones)
+    print(f"📊 Movimientos existentes para {len(fechas)} fechas: {sum(conteos.values())}")
+    return dict(conteos)
 
-def analizar_patrones_nuevos(movimientos: List[MovimientoBanco]) -> Dict[str, Dict[float, List[MovimientoBanco]]]:
-    """Analiza patrones en archivo nuevo, agrupados por tipo y valor"""
+def determinar_movimientos_a_insertar(
+    movimientos: List[MovimientoBanco],
+    conteos_bd: Dict[ClaveContenido, int]
+) -> Tuple[List[MovimientoBanco], Dict]:
+    """
+    Diferencia de conjuntos por huella en una pasada: se insertan los
+    movimientos cuya huella no está en BD. El reporte conserva el formato
+    por fecha, descripción y valor.
+    """
     
-    patrones = defaultdict(lambda: defaultdict(list))
+    huellas_bd = huellas_existentes(conteos_bd.items())
+    movimientos_a_insertar = []
+    conteos_archivo = defaultdict(int)
+    resumen = defaultdict(lambda: {"nuevos": 0, "existentes": 0, "anomalias": 0})
     
     for mov in movimientos:
-        tipo_desc = mov.descripcion.strip()
-        valor = mov.valor
-        patrones[tipo_desc][valor].append(mov)
-    
-    print(f"📥 Patrones en archivo nuevo:")
-    for tipo, valores in patrones.items():
-        print(f"  {tipo}: {len(valores)} valores únicos")
-        for valor, movs in sorted(valores.items()):
-            print(f"    ${valor:,.0f} → {len(movs)} veces")
+        clave = mov.clave_contenido()
+        conteos_archivo[clave] += 1
+        llave = (mov.fecha.isoformat(), mov.descripcion.strip(), mov.valor)
+        if mov.huella in huellas_bd:
+            resumen[llave]["existentes"] += 1
+        else:
+            resumen[llave]["nuevos"] += 1
+            movimientos_a_insertar.append(mov)
     
-    return dict(patrones)
-
-def determinar_movimientos_a_insertar(
-    patrones_existentes: Dict[str, Dict[float, int]], 
-    patrones_nuevos: Dict[str, Dict[float, List[MovimientoBanco]]]
-) -> List[MovimientoBanco]:
-    """Determina qué movimientos insertar basado en comparación de patrones"""
+    # BD con más movimientos idénticos que el archivo: se informa, no se borra nada
+    for clave, cantidad_archivo in conteos_archivo.items():
+        cantidad_bd = conteos_bd.get(clave, 0)
+        if cantidad_bd > cantidad_archivo:
+            resumen[(clave[2], clave[5], clave[3])]["anomalias"] += cantidad_bd - cantidad_archivo
     
-    movimientos_a_insertar = []
-    reporte_detallado = {
-        "nuevos_insertados": [],
-        "duplicados_skipped": [],
-        "anomalias_detectadas": []
-    }
-    
-    for tipo_desc, valores_nuevos in patrones_nuevos.items():
-        valores_existentes = patrones_existentes.get(tipo_desc, {})
-        
-        print(f"\n🔍 Analizando: {tipo_desc}")
-        
-        for valor, movimientos_valor in valores_nuevos.items():
-            cantidad_nueva = len(movimientos_valor)
-            cantidad_existente = valores_existentes.get(valor, 0)
-            
-            if cantidad_nueva > cantidad_existente:
-                cantidad_a_insertar = cantidad_nueva - cantidad_existente
-                movimientos_nuevos = movimientos_valor[-cantidad_a_insertar:]
-                movimientos_a_insertar.extend(movimientos_nuevos)
-                
-                print(f"  ✅ ${valor:,.0f}: Existían {cantidad_existente}, nuevas {cantidad_nueva}, insertar {cantidad_a_insertar}")
-                reporte_detallado["nuevos_insertados"].append({
-                    "tipo": tipo_desc,
-                    "valor": valor,
-                    "cantidad_insertada": cantidad_a_insertar
-                })
-                
-            elif cantidad_nueva == cantidad_existente:
-                print(f"  ⚠️ ${valor:,.0f}: Mismo patrón ({cantidad_existente}), SKIP duplicados")
-                reporte_detallado["duplicados_skipped"].append({
-                    "tipo": tipo_desc,
-                    "valor": valor,
-                    "cantidad_skipped": cantidad_nueva
-                })
-                
-            else:
-                print(f"  🤔 ${valor:,.0f}: ANOMALÍA - Archivo tiene {cantidad_nueva}, BD tiene {cantidad_existente}")
-                reporte_detallado["anomalias_detectadas"].append({
-                    "tipo": tipo_desc,
-                    "valor": valor,
-                    "cantidad_archivo": cantidad_nueva,
-                    "cantidad_bd": cantidad_existente
-                })
+    reporte = {"fechas_procesadas": {}}
+    for (fecha, tipo_desc, valor), conteo in resumen.items():
+        reporte_fecha = reporte["fechas_procesadas"].setdefault(fecha, {
+            "nuevos_insertados": [],
+            "duplicados_skipped": [],
+            "anomalias_detectadas": []
+        })
+        if conteo["nuevos"]:
+            reporte_fecha["nuevos_insertados"].append({
+                "tipo": tipo_desc,
+                "valor": valor,
+                "cantidad_insertada": conteo["nuevos"]
+            })
+        if conteo["existentes"]:
+            reporte_fecha["duplicados_skipped"].append({
+                "tipo": tipo_desc,
+                "valor": valor,
+                "cantidad_skipped": conteo["existentes"]
+            })
+        if conteo["anomalias"]:
+            reporte_fecha["anomalias_detectadas"].append({
+                "tipo": tipo_desc,
+                "valor": valor,
+                "cantidad_solo_en_bd": conteo["anomalias"]
+            })
     
-    return movimientos_a_insertar, reporte_detallado
+    return movimientos_a_insertar, reporte
 
 def conciliar_pago_automaticamente(
     fecha_pago: str,
@@ -704,7 +660,7 @@ def conciliar_pago_automaticamente(
     Conciliación automática with mejor manejo de errores
     """
     try:
-        client = bigquery.Client()
+        client = get_bigquery_client()
         
         # Validar parámetros
         if not all([fecha_pago, tipo_pago, id_pago]):
@@ -819,43 +775,30 @@ def conciliar_pago_automaticamente(
             
             # 🔥 SOLO CONCILIAR SI ES MATCH EXACTO (score >= 90)
             if es_match_exacto:
-                # Actualizar movimiento banco
-                query_update_banco = """
+                # Actualizar movimiento banco y pago conductor en un solo job (script)
+                query_update = """
                 UPDATE `datos-clientes-441216.Conciliaciones.banco_movimientos`
                 SET 
                     estado_conciliacion = @estado,
                     referencia_pago_asociada = @referencia,
                     fecha_conciliacion = CURRENT_DATE()
-                WHERE id = @id_banco
-                """
-                
-                client.query(
-                    query_update_banco,
-                    job_config=bigquery.QueryJobConfig(
-                        query_parameters=[
-                            bigquery.ScalarQueryParameter("estado", "STRING", "conciliado_automatico"),
-                            bigquery.ScalarQueryParameter("referencia", "STRING", referencia_pago),
-                            bigquery.ScalarQueryParameter("id_banco", "STRING", mov.id)
-                        ]
-                    )
-                ).result()
+                WHERE id = @id_banco;
 
-                # Actualizar pago conductor
-                query_update_pago = """
                 UPDATE `datos-clientes-441216.Conciliaciones.pagosconductor`
                 SET 
                     estado_conciliacion = @estado,
                     movimiento_banco_id = @id_banco,
                     fecha_conciliacion = CURRENT_DATE(),
                     confianza_conciliacion = @confianza
-                WHERE id_string = @id_pago
+                WHERE id_string = @id_pago;
                 """
                 
                 client.query(
-                    query_update_pago,
+                    query_update,
                     job_config=bigquery.QueryJobConfig(
                         query_parameters=[
                             bigquery.ScalarQueryParameter("estado", "STRING", "conciliado_automatico"),
+                            bigquery.ScalarQueryParameter("referencia", "STRING", referencia_pago),
                             bigquery.ScalarQueryParameter("id_banco", "STRING", mov.id),
                             bigquery.ScalarQueryParameter("id_pago", "STRING", id_pago),
                             bigquery.ScalarQueryParameter("confianza", "FLOAT", score_total)
@@ -871,8 +814,19 @@ def conciliar_pago_automaticamente(
         print(f"❌ Error en conciliación: {str(e)}")
         return None
 
+def _aplicar_lote_pendiente(lote: LoteConciliacionAutomatica, client) -> None:
+    """Guarda el remanente de una corrida interrumpida (se ejecuta en el pool)"""
+    try:
+        aplicadas = lote.aplicar(client)
+        logger.info(f"💾 {aplicadas} conciliaciones pendientes guardadas tras interrupción")
+    except Exception as e:
+        logger.error(f"❌ No se pudieron guardar {len(lote)} conciliaciones pendientes: {str(e)}")
+    finally:
+        if lote.total_aplicadas:
+            invalidar_tablas("pagosconductor", "banco_movimientos", fechas=lote.fechas_pago)
+
 @router.get("/conciliacion-automatica-mejorada")
-async def conciliacion_automatica_mejorada():
+async def conciliacion_automatica_mejorada(client: bigquery.Client = Depends(get_bigquery_client)):
     """
     Conciliación automática mejorada:
     - Agrupa pagos por Id_Transaccion o referencia individual (solo estado 'pendiente_conciliacion')
@@ -880,11 +834,14 @@ async def conciliacion_automatica_mejorada():
     - Si es pago agrupado (Id_Transaccion no nulo y varias referencias distintas): SIN MATCH directo
     - Si es individual (Id_Transaccion nulo o solo una referencia): busca match exacto valor y fecha
     - Si match: actualiza ambos lados, si Id_Transaccion no nulo agrega 'referencia_pago;Id_Transaccion' en banco
-    - Devuelve todos los pagos pendientes con resultado de la operación
+    - Emite un evento 'resultado' por grupo procesado; el evento final trae el
+      resumen y el resultado_id para leer los resultados por páginas
     """
     async def generar_progreso() -> AsyncGenerator[str, None]:
+        escritor = None
+        lote_conciliacion = None
+        invalidado = False
         try:
-            client = get_bigquery_client()
             # 1. Obtener pagos pendientes agrupados
             FECHA_MINIMA = "2025-06-09"
             query_pagos = f"""
@@ -914,12 +871,12 @@ async def conciliacion_automatica_mejorada():
                     bigquery.ScalarQueryParameter("fecha_minima_auto", "DATE", FECHA_MINIMA)
                 ]
             )
-            pagos_rows = list(client.query(query_pagos, job_config=job_config).result())
+            pagos_rows = await client.query_async(query_pagos, job_config=job_config)
             pagos_por_grupo = {}
             for row in pagos_rows:
                 pagos_por_grupo[row.grupo_pago] = row.pagos
 
-            yield f"data: {json_safe_dumps({'tipo': 'info', 'mensaje': f'📊 {sum(len(p) for p in pagos_por_grupo.values())} pagos en {len(pagos_por_grupo)} grupos', 'porcentaje': 20})}\n\n"
+            yield f"data: {dumps_json({'tipo': 'info', 'mensaje': f'📊 {sum(len(p) for p in pagos_por_grupo.values())} pagos en {len(pagos_por_grupo)} grupos', 'porcentaje': 20})}\n\n"
             await asyncio.sleep(0.1)
 
             # 2. Obtener movimientos bancarios pendientes CON VALIDACIÓN DE VALOR EXTRAÍDO
@@ -940,12 +897,21 @@ async def conciliacion_automatica_mejorada():
                 WHERE LOWER(estado_conciliacion) IN ('pendiente', 'pendiente_conciliacion')
                    OR estado_conciliacion IN ('PENDIENTE', 'Pendiente', 'pendiente')
             """
-            banco_rows = list(client.query(query_banco).result())
+            banco_rows = await client.query_async(query_banco)
+            lote_conciliacion = LoteConciliacionAutomatica()
+            # Índice (fecha, valor) construido una vez: cada búsqueda es O(1)
+            indice_banco = IndiceMovimientosBanco(
+                banco_rows,
+                valor_de=lambda mov: float(mov.valor_real_extraido) if mov.valor_real_extraido else float(mov.valor_banco),
+                fecha_de=lambda mov: str(mov.fecha)
+            )
 
-            yield f"data: {json_safe_dumps({'tipo': 'info', 'mensaje': f'💳 {len(banco_rows)} movimientos bancarios pendientes', 'porcentaje': 40})}\n\n"
+            yield f"data: {dumps_json({'tipo': 'info', 'mensaje': f'💳 {len(banco_rows)} movimientos bancarios pendientes', 'porcentaje': 40})}\n\n"
             await asyncio.sleep(0.1)
 
-            resultados = []
+            # Los resultados van a disco y en eventos pequeños, no a una lista en memoria
+            escritor = conjuntos_resultados.crear("conciliacion")
+            conteo_operaciones = defaultdict(int)
             procesadas = 0
             total_grupos = len(pagos_por_grupo)
 
@@ -981,76 +947,53 @@ async def conciliacion_automatica_mejorada():
                     # Caso agrupado: SIN MATCH directo
                     resultado_operacion["operacion"] = "sin_match_agrupado"
                     resultado_operacion["mensaje"] = "Pago agrupado (varias referencias), no se concilia automáticamente"
-                    yield f"data: {json_safe_dumps({'tipo': 'info', 'mensaje': f'❌ SIN MATCH AGRUPADO: {grupo}', 'porcentaje': porcentaje_actual})}\n\n"
+                    yield f"data: {dumps_json({'tipo': 'info', 'mensaje': f'❌ SIN MATCH AGRUPADO: {grupo}', 'porcentaje': porcentaje_actual})}\n\n"
                 else:
                     # Caso individual: buscar match exacto en banco usando VALOR EXTRAÍDO DEL ID
                     match = None
-                    for mov in banco_rows:
+                    # 🔥 VALIDACIÓN MEJORADA: Comparar con valor extraído del ID (búsqueda en el índice)
+                    for mov in indice_banco.candidatos(str(fecha_pago), valor_total):
                         valor_banco_real = float(mov.valor_real_extraido) if mov.valor_real_extraido else float(mov.valor_banco)
+                        # ✅ VALIDACIÓN ADICIONAL: Verificar coherencia entre valor_banco y valor extraído
+                        diferencia_valores = abs(float(mov.valor_banco) - valor_banco_real)
                         
-                        # 🔥 VALIDACIÓN MEJORADA: Comparar con valor extraído del ID
-                        if valor_banco_real == valor_total and str(mov.fecha) == str(fecha_pago):
-                            # ✅ VALIDACIÓN ADICIONAL: Verificar coherencia entre valor_banco y valor extraído
-                            diferencia_valores = abs(float(mov.valor_banco) - valor_banco_real)
-                            
-                            # Si hay diferencia significativa, loguear para diagnóstico
-                            if diferencia_valores > 1000:  # Diferencia mayor a $1,000
-                                logger.warning(f"⚠️ DISCREPANCIA en {mov.id}: valor_banco=${mov.valor_banco}, valor_extraído=${valor_banco_real}")
-                                yield f"data: {json_safe_dumps({'tipo': 'warning', 'mensaje': f'⚠️ Discrepancia detectada en {mov.id}', 'porcentaje': porcentaje_actual})}\n\n"
-                                # Continuar con la siguiente iteración si hay discrepancia grande
-                                continue
-                            
-                            match = mov
-                            break
+                        # Si hay diferencia significativa, loguear para diagnóstico
+                        if diferencia_valores > 1000:  # Diferencia mayor a $1,000
+                            logger.warning(f"⚠️ DISCREPANCIA en {mov.id}: valor_banco=${mov.valor_banco}, valor_extraído=${valor_banco_real}")
+                            yield f"data: {dumps_json({'tipo': 'warning', 'mensaje': f'⚠️ Discrepancia detectada en {mov.id}', 'porcentaje': porcentaje_actual})}\n\n"
+                            # Continuar con el siguiente candidato si hay discrepancia grande
+                            continue
+                        
+                        match = mov
+                        break
                     
                     if match:
-                        # 🔥 ACTUALIZACIÓN MEJORADA: Usar criterios específicos según el tipo de pago
-                        
+                        # Un movimiento bancario solo puede conciliarse una vez por corrida
+                        indice_banco.retirar(match)
+                        # 🔥 ACTUALIZACIÓN MEJORADA: Usar criterios específicos según el tipo de pago.
+                        # Las decisiones se acumulan y se escriben por lotes con MERGE
                         if id_transaccion is not None:
                             # ✅ PAGO CON Id_Transaccion: Actualizar SOLO por Id_Transaccion específico
-                            update_pagos_query = f"""
-                                UPDATE `datos-clientes-441216.Conciliaciones.pagosconductor`
-                                SET estado_conciliacion = 'conciliado_automatico',
-                                    fecha_conciliacion = CURRENT_DATE(),
-                                    id_banco_asociado = '{match.id}',
-                                    confianza_conciliacion = 100
-                                WHERE Id_Transaccion = {id_transaccion}
-                                  AND estado_conciliacion = 'pendiente_conciliacion'
-                            """
-                            ref_banco = f"{referencia_pago};{id_transaccion}"
-                            logger.info(f"🔗 Actualizando por Id_Transaccion: {id_transaccion}")
+                            lote_conciliacion.agregar(
+                                id_banco=match.id,
+                                referencia_banco=f"{referencia_pago};{id_transaccion}",
+                                id_transaccion=id_transaccion,
+                                fecha_pago=fecha_pago
+                            )
+                            logger.info(f"🔗 Conciliando por Id_Transaccion: {id_transaccion}")
                         else:
                             # 🔥 PAGO SIN Id_Transaccion: Usar criterios MUY ESPECÍFICOS para evitar afectar otros pagos
                             valor_pago = pagos[0]["valor_total_consignacion"] if pagos[0]["valor_total_consignacion"] else pagos[0]["valor"]
                             correo_conductor = pagos[0]["correo"]
-                            update_pagos_query = f"""
-                                UPDATE `datos-clientes-441216.Conciliaciones.pagosconductor`
-                                SET estado_conciliacion = 'conciliado_automatico',
-                                    fecha_conciliacion = CURRENT_DATE(),
-                                    id_banco_asociado = '{match.id}',
-                                    confianza_conciliacion = 100
-                                WHERE referencia_pago = '{referencia_pago}'
-                                  AND fecha_pago = '{fecha_pago}'
-                                  AND correo = '{correo_conductor}'
-                                  AND COALESCE(valor_total_consignacion, CAST(valor AS FLOAT64)) = {valor_pago}
-                                  AND Id_Transaccion IS NULL
-                                  AND estado_conciliacion = 'pendiente_conciliacion'
-                            """
-                            ref_banco = referencia_pago
-                            logger.info(f"📄 Actualizando pago individual ESPECÍFICO: {referencia_pago} | {correo_conductor} | {fecha_pago} | ${valor_pago}")
-                        
-                        client.query(update_pagos_query).result()
-                        
-                        # Actualizar banco_movimientos
-                        update_banco_query = f"""
-                            UPDATE `datos-clientes-441216.Conciliaciones.banco_movimientos`
-                            SET estado_conciliacion = 'conciliado_automatico',
-                                referencia_pago_asociada = '{ref_banco}',
-                                confianza_match = 100,
-                                conciliado_en = CURRENT_TIMESTAMP()
-                            WHERE id = '{match.id}'
-                        """
-                        client.query(update_banco_query).result()
+                            lote_conciliacion.agregar(
+                                id_banco=match.id,
+                                referencia_banco=referencia_pago,
+                                referencia_pago=referencia_pago,
+                                fecha_pago=fecha_pago,
+                                correo=correo_conductor,
+                                valor=valor_pago
+                            )
+                            logger.info(f"📄 Conciliando pago individual ESPECÍFICO: {referencia_pago} | {correo_conductor} | {fecha_pago} | ${valor_pago}")
                         resultado_operacion["operacion"] = "conciliado_automatico"
                         resultado_operacion["match"] = {
                             "id_banco": match.id,
@@ -1067,13 +1010,13 @@ async def conciliacion_automatica_mejorada():
                         valor_usado = float(match.valor_real_extraido) if match.valor_real_extraido else float(match.valor_banco)
                         logger.info(f"✅ CONCILIADO: {grupo} | Pago=${valor_total:,.0f} | Banco=${valor_usado:,.0f} | ID={match.id}")
                         
-                        yield f"data: {json_safe_dumps({'tipo': 'exito', 'mensaje': f'✅ CONCILIADO: {grupo} - Pago:${valor_total:,.0f} ↔ Banco:${valor_usado:,.0f}', 'porcentaje': porcentaje_actual})}\n\n"
+                        yield f"data: {dumps_json({'tipo': 'exito', 'mensaje': f'✅ CONCILIADO: {grupo} - Pago:${valor_total:,.0f} ↔ Banco:${valor_usado:,.0f}', 'porcentaje': porcentaje_actual})}\n\n"
                     else:
                         resultado_operacion["operacion"] = "sin_match"
                         
                         # 🔥 DIAGNÓSTICO DETALLADO: Mostrar por qué no hubo match
-                        matches_por_valor = [mov for mov in banco_rows if float(mov.valor_real_extraido or mov.valor_banco) == valor_total]
-                        matches_por_fecha = [mov for mov in banco_rows if str(mov.fecha) == str(fecha_pago)]
+                        matches_por_valor = indice_banco.cantidad_por_valor(valor_total)
+                        matches_por_fecha = indice_banco.cantidad_por_fecha(str(fecha_pago))
                         
                         if matches_por_valor and not matches_por_fecha:
                             resultado_operacion["mensaje"] = f"Valor coincide (${valor_total:,.0f}) pero no la fecha ({fecha_pago})"
@@ -1085,40 +1028,69 @@ async def conciliacion_automatica_mejorada():
                             resultado_operacion["mensaje"] = "No se encontró match exacto en banco"
                         
                         # Log para diagnóstico
-                        logger.info(f"❌ SIN MATCH: {grupo} | Pago=${valor_total:,.0f} en {fecha_pago} | Matches valor:{len(matches_por_valor)} fecha:{len(matches_por_fecha)}")
+                        logger.info(f"❌ SIN MATCH: {grupo} | Pago=${valor_total:,.0f} en {fecha_pago} | Matches valor:{matches_por_valor} fecha:{matches_por_fecha}")
                         
                         mensaje_sin_match = resultado_operacion["mensaje"]
-                        yield f"data: {json_safe_dumps({'tipo': 'info', 'mensaje': f'❌ SIN MATCH: {grupo} - {mensaje_sin_match}', 'porcentaje': porcentaje_actual})}\n\n"
+                        yield f"data: {dumps_json({'tipo': 'info', 'mensaje': f'❌ SIN MATCH: {grupo} - {mensaje_sin_match}', 'porcentaje': porcentaje_actual})}\n\n"
+
+                escritor.agregar(resultado_operacion)
+                conteo_operaciones[resultado_operacion["operacion"]] += 1
+                yield f"data: {dumps_json({'tipo': 'resultado', 'resultado': resultado_operacion, 'porcentaje': porcentaje_actual})}\n\n"
 
-                resultados.append(resultado_operacion)
+                if lote_conciliacion.pendiente_envio:
+                    cantidad_lote = len(lote_conciliacion)
+                    yield f"data: {dumps_json({'tipo': 'info', 'mensaje': f'💾 Guardando lote de {cantidad_lote} conciliaciones...', 'porcentaje': porcentaje_actual})}\n\n"
+                    await client.ejecutar_async(lote_conciliacion.aplicar, client)
 
             # Finalización
-            yield f"data: {json_safe_dumps({'tipo': 'fase', 'mensaje': '🏁 Finalizando conciliación y generando reporte...', 'porcentaje': 100})}\n\n"
+            yield f"data: {dumps_json({'tipo': 'fase', 'mensaje': '🏁 Finalizando conciliación y generando reporte...', 'porcentaje': 100})}\n\n"
+            if len(lote_conciliacion):
+                cantidad_lote = len(lote_conciliacion)
+                yield f"data: {dumps_json({'tipo': 'info', 'mensaje': f'💾 Guardando {cantidad_lote} conciliaciones restantes...', 'porcentaje': 100})}\n\n"
+                await client.ejecutar_async(lote_conciliacion.aplicar, client)
+            if lote_conciliacion.total_aplicadas:
+                invalidar_tablas("pagosconductor", "banco_movimientos", fechas=lote_conciliacion.fechas_pago)
+                invalidado = True
             await asyncio.sleep(0.1)
 
+            escritor.cerrar()
+            total_procesados = len(escritor)
+
             # Generar resumen para compatibilidad con el frontend
             resumen = {
-                "total_movimientos_banco": 0,  # Se podría calcular si es necesario
-                "total_pagos_conductores": len(resultados),
-                "conciliado_automatico": len([r for r in resultados if r.get("estado_match") == "conciliado_automatico"]),
-                "conciliado_aproximado": len([r for r in resultados if r.get("estado_match") == "conciliado_aproximado"]),
-                "sin_match": len([r for r in resultados if r.get("estado_match") == "sin_match"]),
-                "total_procesados": len(resultados)
+                "total_movimientos_banco": len(banco_rows),
+                "total_pagos_conductores": total_procesados,
+                "conciliado_automatico": conteo_operaciones["conciliado_automatico"],
+                "conciliado_aproximado": 0,  # Esta conciliación solo hace match exacto
+                "sin_match": conteo_operaciones["sin_match"] + conteo_operaciones["sin_match_agrupado"],
+                "total_procesados": total_procesados
             }
 
-            # Crear estructura compatible con el frontend
+            # Solo el resumen: los resultados se leen por páginas con resultado_id
             resultado_final = {
                 "resumen": resumen,
-                "resultados": resultados,
+                "resultado_id": escritor.id,
+                "total_resultados": total_procesados,
                 "fecha_conciliacion": datetime.now().isoformat()
             }
 
-            # Devuelve todos los pagos pendientes con resultado de la operación
-            yield f"data: {json_safe_dumps({'tipo': 'completado', 'resultado': resultado_final, 'timestamp': datetime.now().isoformat(), 'exitoso': True})}\n\n"
+            yield f"data: {dumps_json({'tipo': 'completado', 'resultado': resultado_final, 'timestamp': datetime.now().isoformat(), 'exitoso': True})}\n\n"
 
         except Exception as e:
             error_msg = f"💥 Error crítico en conciliación: {str(e)}"
-            yield f"data: {json_safe_dumps({'tipo': 'error', 'mensaje': error_msg, 'porcentaje': 0})}\n\n"
+            yield f"data: {dumps_json({'tipo': 'error', 'mensaje': error_msg, 'porcentaje': 0})}\n\n"
+        finally:
+            # Si el proceso falló o el cliente se desconectó, el conjunto se descarta
+            if escritor is not None:
+                escritor.cerrar(descartar=True)
+            # Los matches ya anunciados como conciliados se guardan aunque la corrida
+            # se corte. Se envían al pool sin esperar: tras una desconexión esta
+            # tarea está cancelada y un await no llegaría a ejecutarse.
+            if lote_conciliacion is not None and len(lote_conciliacion):
+                client.pool.submit(_aplicar_lote_pendiente, lote_conciliacion, client)
+            elif lote_conciliacion is not None and lote_conciliacion.total_aplicadas and not invalidado:
+                # Corrida cortada después de aplicar algún lote
+                invalidar_tablas("pagosconductor", "banco_movimientos", fechas=lote_conciliacion.fechas_pago)
 
     return StreamingResponse(
         generar_progreso(),
@@ -1131,12 +1103,37 @@ async def conciliacion_automatica_mejorada():
         }
     )
 
+@router.get("/conciliacion-automatica-mejorada/resultados/{resultado_id}")
+async def obtener_resultados_conciliacion_automatica(
+    resultado_id: str,
+    offset: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=1000)
+):
+    """
+    Resultados de una corrida de conciliación automática mejorada, por páginas.
+    El resultado_id llega en el evento 'completado' y vence después de un tiempo.
+    """
+    pagina = await asyncio.to_thread(conjuntos_resultados.pagina, resultado_id, offset, limit)
+    if pagina is None:
+        raise HTTPException(status_code=404, detail="Resultados no encontrados o vencidos; vuelva a ejecutar la conciliación")
+    resultados, total = pagina
+    return RespuestaJSON({
+        "resultado_id": resultado_id,
+        "resultados": resultados,
+        "paginacion": {
+            "total_registros": total,
+            "registros_por_pagina": limit,
+            "offset": offset,
+            "tiene_siguiente": offset + len(resultados) < total,
+            "tiene_anterior": offset > 0
+        }
+    })
+
 @router.get("/conciliacion-automatica-fallback")
-async def conciliacion_automatica_fallback():
+async def conciliacion_automatica_fallback(client: bigquery.Client = Depends(get_bigquery_client)):
     """
     Endpoint de conciliación automática tradicional como fallback
     """
-    client = bigquery.Client()
     # 🔥 ELIMINADO MARGEN DE ERROR - SOLO VALORES EXACTOS
     # margen_error = 100
 
@@ -1150,7 +1147,7 @@ async def conciliacion_automatica_fallback():
             WHERE estado_conciliacion = 'pendiente_conciliacion'
               AND referencia_pago IS NOT NULL
         """
-        pagos_rows = list(client.query(query_pagos).result())
+        pagos_rows = await client.query_async(query_pagos)
         
         # Agrupar por referencia_pago
         pagos_por_referencia = defaultdict(list)
@@ -1163,11 +1160,12 @@ async def conciliacion_automatica_fallback():
             FROM `datos-clientes-441216.Conciliaciones.banco_movimientos`
             WHERE estado_conciliacion = 'pendiente'
         """
-        banco_rows = list(client.query(query_banco).result())
+        banco_rows = await client.query_async(query_banco)
 
         # 3. Procesar conciliaciones
         resultados = []
         referencias_usadas = set()
+        conciliaciones = {}  # referencia_pago -> id del movimiento bancario
         resumen = {
             "total_movimientos_banco": len(banco_rows),
             "total_pagos_conductores": len(pagos_rows),
@@ -1208,31 +1206,9 @@ async def conciliacion_automatica_fallback():
                     "num_matches_posibles": 1,
                 })
 
-                # Marcar conciliado en base de datos
-                try:
-                    update_query = f"""
-                        UPDATE `datos-clientes-441216.Conciliaciones.pagosconductor`
-                        SET estado_conciliacion = 'conciliado_automatico',
-                            fecha_conciliacion = CURRENT_DATE(),
-                            id_banco_asociado = '{match.id}',
-                            confianza_conciliacion = 100
-                        WHERE referencia_pago = '{referencia}'
-                    """
-                    client.query(update_query).result()
+                # Se marca en base de datos al final, en un solo job
+                conciliaciones[referencia] = match.id
 
-                    update_mov = f"""
-                        UPDATE `datos-clientes-441216.Conciliaciones.banco_movimientos`
-                        SET estado_conciliacion = 'conciliado_automatico',
-                            referencia_pago_asociada = '{referencia}',
-                            confianza_match = 100,
-                            conciliado_en = CURRENT_TIMESTAMP()
-                        WHERE id = '{match.id}'
-                    """
-                    client.query(update_mov).result()
-                    
-                except Exception as e:
-                    print(f"Error actualizando BD para {referencia}: {str(e)}")
-                    
             else:
                 # ❌ Sin match
                 resumen["sin_match"] += 1
@@ -1253,12 +1229,50 @@ async def conciliacion_automatica_fallback():
 
             resumen["total_procesados"] += 1
 
-        return {
+        # 4. Marcar conciliados en base de datos (pagos y movimientos en un solo script)
+        if conciliaciones:
+            # Un movimiento puede haber casado con varias referencias: queda la última
+            por_movimiento = {id_banco: referencia for referencia, id_banco in conciliaciones.items()}
+            params = ParametrosConsulta()
+            pagos_param = params.structs(
+                "pagos", (("referencia", "STRING"), ("id_banco", "STRING")),
+                [{"referencia": r, "id_banco": i} for r, i in conciliaciones.items()]
+            )
+            movimientos_param = params.structs(
+                "movimientos", (("referencia", "STRING"), ("id_banco", "STRING")),
+                [{"referencia": r, "id_banco": i} for i, r in por_movimiento.items()]
+            )
+            update_query = f"""
+                UPDATE `datos-clientes-441216.Conciliaciones.pagosconductor` pc
+                SET estado_conciliacion = 'conciliado_automatico',
+                    fecha_conciliacion = CURRENT_DATE(),
+                    id_banco_asociado = s.id_banco,
+                    confianza_conciliacion = 100
+                FROM {pagos_param} s
+                WHERE pc.referencia_pago = s.referencia;
+
+                UPDATE `datos-clientes-441216.Conciliaciones.banco_movimientos` bm
+                SET estado_conciliacion = 'conciliado_automatico',
+                    referencia_pago_asociada = s.referencia,
+                    confianza_match = 100,
+                    conciliado_en = CURRENT_TIMESTAMP()
+                FROM {movimientos_param} s
+                WHERE bm.id = s.id_banco;
+            """
+            try:
+                await client.query_async(update_query, job_config=params.job_config())
+                invalidar_tablas("pagosconductor", "banco_movimientos",
+                                 fechas=[pagos_por_referencia[r][0].fecha_pago for r in conciliaciones])
+            except Exception as e:
+                print(f"Error actualizando BD para {len(conciliaciones)} referencias: {str(e)}")
+
+        # Se devuelve ya serializada: evita la copia de jsonable_encoder sobre todos los resultados
+        return RespuestaJSON({
             "resumen": resumen,
             "resultados": resultados,
             "referencias_usadas": list(referencias_usadas),
             "fecha_conciliacion": datetime.now().isoformat()
-        }
+        })
 
     except Exception as e:
         logger.error(f"Error en conciliación fallback: {str(e)}")
@@ -1372,12 +1386,11 @@ class ConciliacionManual(BaseModel):
         )
 
 @router.post("/liquidar-cliente")
-async def liquidar_entregas(cliente: str, usuario_id: str):
+@invalida("pagosconductor")
+def liquidar_entregas(cliente: str, usuario_id: str, client: bigquery.Client = Depends(get_bigquery_client)):
     """
     Actualiza estado de guías a 'liquidado' por cliente, validando integridad
     """
-    client = bigquery.Client()
-    
     try:
         # 1. Verificar que todas las entregas estén conciliadas
         query_verificacion = f"""
@@ -1420,13 +1433,7 @@ async def liquidar_entregas(cliente: str, usuario_id: str):
             
         # 2. Actualizar estado en guias_liquidacion
         # Segunda actualización: también marcar los pagos como liquidados
-        query_liquidar_pagos = f"""
-        UPDATE `{PROJECT_ID}.{DATASET_CONCILIACIONES}.pagosconductor` pc
-        SET 
-            estado = 'liquidado',
-            modificado_en = CURRENT_TIMESTAMP(),
-            modificado_por = @usuario_id
-        WHERE pc.referencia_pago IN (
+        referencias_a_liquidar = f"""
             SELECT DISTINCT pc.referencia_pago
             FROM `{PROJECT_ID}.{DATASET_CONCILIACIONES}.pagosconductor` pc
             JOIN `{PROJECT_ID}.{DATASET_CONCILIACIONES}.banco_movimientos` bm
@@ -1434,7 +1441,24 @@ async def liquidar_entregas(cliente: str, usuario_id: str):
             WHERE pc.cliente = @cliente
             AND pc.estado = 'aprobado'
             AND bm.estado_conciliacion IN ('conciliado_automatico', 'conciliado_aproximado', 'conciliado_manual')
+        """
+        # Fechas que dejan de contar como aprobadas en la tabla resumen
+        query_fechas = f"""
+        SELECT DISTINCT fecha_pago
+        FROM `{PROJECT_ID}.{DATASET_CONCILIACIONES}.pagosconductor`
+        WHERE referencia_pago IN ({referencias_a_liquidar})
+        """
+        registrar_fechas_modificadas(
+            *(fila.fecha_pago for fila in client.query(query_fechas, job_config=job_config).result())
         )
+
+        query_liquidar_pagos = f"""
+        UPDATE `{PROJECT_ID}.{DATASET_CONCILIACIONES}.pagosconductor` pc
+        SET 
+            estado = 'liquidado',
+            modificado_en = CURRENT_TIMESTAMP(),
+            modificado_por = @usuario_id
+        WHERE pc.referencia_pago IN ({referencias_a_liquidar})
         """
 
         job_config_liquidar = bigquery.QueryJobConfig(
@@ -1479,15 +1503,16 @@ async def liquidar_entregas(cliente: str, usuario_id: str):
 # ========== NUEVO ENDPOINT PARA RECHAZAR PAGOS ==========
 
 @router.post("/rechazar-pago/{referencia}")
-async def rechazar_pago(
+@invalida("pagosconductor", "banco_movimientos")
+def rechazar_pago(
     referencia: str,
     usuario_id: str,
-    motivo: str
+    motivo: str,
+    client: bigquery.Client = Depends(get_bigquery_client)
 ):
     """
     Rechaza un pago, limpia id_banco_asociado y registra novedad
     """
-    client = bigquery.Client()
     timestamp = datetime.utcnow()
     
     try:
@@ -1594,12 +1619,10 @@ async def rechazar_pago(
 # ========== NUEVO ENDPOINT DE DIAGNÓSTICO AVANZADO ==========
 
 @router.get("/diagnostico-avanzado")
-async def diagnostico_avanzado():
+def diagnostico_avanzado(client: bigquery.Client = Depends(get_bigquery_client)):
     """
     Endpoint mejorado de diagnóstico que analiza la integridad del sistema de conciliación
     """
-    client = bigquery.Client()
-    
     try:
         diagnostico = {
             "pagos": {},
@@ -1749,12 +1772,11 @@ async def diagnostico_avanzado():
 
 
 @router.post("/conciliar-manual")
-async def conciliar_pago_manual(data: ConciliacionManual):
+@invalida("pagosconductor", "banco_movimientos")
+def conciliar_pago_manual(data: ConciliacionManual, client: bigquery.Client = Depends(get_bigquery_client)):
     """
     Concilia un pago manualmente desde Cruces
     """
-    client = bigquery.Client()
-
     try:
         # Verifica que el pago exista
         query_check = """
@@ -1827,44 +1849,28 @@ async def conciliar_pago_manual(data: ConciliacionManual):
 
 
 @router.post("/exportar-tablas")
-async def exportar_tablas_csv():
+async def exportar_tablas_csv(client: bigquery.Client = Depends(get_bigquery_client)):
     """
     Endpoint dedicado para exportar todas las tablas de conciliación a archivos CSV
     """
-    client = bigquery.Client()
     import os
-    import csv
-    import io
     
-    def export_table_to_csv(query, filename):
-        """Exporta una tabla de BigQuery a archivo CSV"""
+    def export_table_to_csv(tabla_completa, filename):
+        """Exporta una tabla de BigQuery a archivo CSV, página por página"""
         try:
-            rows = list(client.query(query).result())
-            if not rows:
-                logger.warning(f"No se encontraron datos para exportar en {filename}")
-                return ""
-            
-            fieldnames = rows[0].keys()
-            output = io.StringIO()
-            writer = csv.DictWriter(output, fieldnames=fieldnames)
-            writer.writeheader()
-            
-            for row in rows:
-                writer.writerow({k: str(v) if v is not None else "" for k, v in row.items()})
-            
-            csv_content = output.getvalue()
-            
             # Crear directorio de exportaciones
             export_dir = os.path.join(os.path.dirname(__file__), "..", "..", "..", "exportaciones")
             export_dir = os.path.abspath(export_dir)
             os.makedirs(export_dir, exist_ok=True)
             
-            # Escribir archivo CSV
+            # Lectura directa de la tabla (sin SELECT *) escrita a disco a medida que llega
+            resultado = leer_tabla_paginada(client, tabla_completa)
             ruta_csv = os.path.join(export_dir, filename)
-            with open(ruta_csv, "w", encoding="utf-8", newline='') as f:
-                f.write(csv_content)
+            total = escribir_archivo(ruta_csv, resultado.columnas, resultado.filas(), "csv")
             
-            logger.info(f"✅ Tabla exportada exitosamente: {filename} ({len(rows)} registros)")
+            if not total:
+                logger.warning(f"No se encontraron datos para exportar en {filename}")
+            logger.info(f"✅ Tabla exportada exitosamente: {filename} ({total} registros)")
             return ruta_csv
             
         except Exception as e:
@@ -1879,31 +1885,34 @@ async def exportar_tablas_csv():
         # Definir tablas a exportar
         tablas_exportar = [
             {
-                "query": "SELECT * FROM `datos-clientes-441216.Conciliaciones.pagosconductor`",
+                "tabla": "datos-clientes-441216.Conciliaciones.pagosconductor",
                 "filename": "pagosconductor.csv",
                 "descripcion": "Pagos de conductores"
             },
             {
-                "query": "SELECT * FROM `datos-clientes-441216.Conciliaciones.guias_liquidacion`",
+                "tabla": "datos-clientes-441216.Conciliaciones.guias_liquidacion",
                 "filename": "guias_liquidacion.csv",
                 "descripcion": "Guías de liquidación"
             },
             {
-                "query": "SELECT * FROM `datos-clientes-441216.Conciliaciones.COD_pendientes_v1`",
+                "tabla": "datos-clientes-441216.Conciliaciones.COD_pendientes_v1",
                 "filename": "COD_pendientes_v1.csv",
                 "descripcion": "COD pendientes"
             },
             {
-                "query": "SELECT * FROM `datos-clientes-441216.Conciliaciones.banco_movimientos`",
+                "tabla": "datos-clientes-441216.Conciliaciones.banco_movimientos",
                 "filename": "banco_movimientos.csv",
                 "descripcion": "Movimientos bancarios"
             }
         ]
         
-        # Exportar cada tabla
-        for tabla in tablas_exportar:
-            logger.info(f"📄 Exportando: {tabla['descripcion']}...")
-            ruta_archivo = export_table_to_csv(tabla["query"], tabla["filename"])
+        # Exportar las tablas en paralelo, fuera del event loop
+        rutas = await asyncio.gather(*(
+            client.ejecutar_async(export_table_to_csv, tabla["tabla"], tabla["filename"])
+            for tabla in tablas_exportar
+        ))
+        for tabla, ruta_archivo in zip(tablas_exportar, rutas):
+            logger.info(f"📄 Exportado: {tabla['descripcion']}")
             
             if ruta_archivo:
                 archivos_exportados.append({
@@ -1953,9 +1962,10 @@ async def exportar_tablas_csv():
         )
 
 @router.post("/exportar-tabla-individual")
-async def exportar_tabla_individual(
+def exportar_tabla_individual(
     tabla: str = Body(..., description="Nombre de la tabla a exportar"),
-    filtros: Optional[Dict] = Body(None, description="Filtros opcionales para la consulta")
+    filtros: Optional[Dict] = Body(None, description="Filtros opcionales para la consulta"),
+    client: bigquery.Client = Depends(get_bigquery_client)
 ):
     """
     Endpoint para exportar una tabla específica con filtros opcionales
@@ -1966,8 +1976,6 @@ async def exportar_tabla_individual(
     - COD_pendientes_v1
     - banco_movimientos
     """
-    client = bigquery.Client()
-    
     # Mapeo de tablas permitidas
     tablas_permitidas = {
         "pagosconductor": {
@@ -2037,11 +2045,12 @@ async def exportar_tabla_individual(
         
         logger.info(f"🔍 Exportando tabla '{tabla}' con consulta: {query}")
         
-        # Ejecutar consulta
+        # Ejecutar consulta; las filas se leen por páginas y se escriben directo al archivo
         job_config = bigquery.QueryJobConfig(query_parameters=parametros) if parametros else None
-        rows = list(client.query(query, job_config=job_config).result())
+        filas = filas_dict(client, query, job_config)
+        primera = next(filas, None)
         
-        if not rows:
+        if primera is None:
             return {
                 "mensaje": f"No se encontraron datos para la tabla '{tabla}' con los filtros especificados",
                 "tabla": tabla,
@@ -2049,17 +2058,6 @@ async def exportar_tabla_individual(
                 "timestamp": datetime.utcnow().isoformat()
             }
         
-        # Crear archivo CSV
-        fieldnames = rows[0].keys()
-        output = io.StringIO()
-        writer = csv.DictWriter(output, fieldnames=fieldnames)
-        writer.writeheader()
-        
-        for row in rows:
-            writer.writerow({k: str(v) if v is not None else "" for k, v in row.items()})
-        
-        csv_content = output.getvalue()
-        
         # Crear directorio y archivo
         export_dir = os.path.join(os.path.dirname(__file__), "..", "..", "..", "exportaciones")
         export_dir = os.path.abspath(export_dir)
@@ -2069,10 +2067,9 @@ async def exportar_tabla_individual(
         filename = f"{tabla}_{timestamp_str}.csv"
         ruta_csv = os.path.join(export_dir, filename)
         
-        with open(ruta_csv, "w", encoding="utf-8", newline='') as f:
-            f.write(csv_content)
+        total = escribir_archivo(ruta_csv, list(primera.keys()), itertools.chain([primera], filas), "csv")
         
-        logger.info(f"✅ Tabla '{tabla}' exportada exitosamente: {filename} ({len(rows)} registros)")
+        logger.info(f"✅ Tabla '{tabla}' exportada exitosamente: {filename} ({total} registros)")
         
         return {
             "mensaje": f"Tabla '{tabla}' exportada exitosamente",
@@ -2080,7 +2077,7 @@ async def exportar_tabla_individual(
             "descripcion": tabla_info["descripcion"],
             "archivo": filename,
             "ruta": ruta_csv,
-            "registros": len(rows),
+            "registros": total,
             "filtros_aplicados": filtros or {},
             "timestamp": datetime.utcnow().isoformat()
         }
@@ -2093,12 +2090,10 @@ async def exportar_tabla_individual(
         )
 
 @router.get("/resumen-conciliacion")
-def obtener_resumen_conciliacion():
+def obtener_resumen_conciliacion(client: bigquery.Client = Depends(get_bigquery_client)):
     """
     Endpoint para obtener resumen de conciliación que requiere Cruces.tsx
     """
-    client = bigquery.Client()
-    
     try:
         # ...existing code for resumen...
         query_mov_banco = """
@@ -2199,7 +2194,8 @@ def obtener_resumen_conciliacion():
         )
         
 @router.post("/marcar-conciliado-manual")
-def marcar_conciliado_manual(data: dict):
+@invalida("pagosconductor", "banco_movimientos")
+def marcar_conciliado_manual(data: dict, client: bigquery.Client = Depends(get_bigquery_client)):
     """
     Endpoint para marcar una conciliación como manual desde Cruces.tsx
     🔥 MEJORADO: Maneja pagos agrupados con múltiples transacciones bancarias
@@ -2217,7 +2213,6 @@ def marcar_conciliado_manual(data: dict):
     if not ids_banco:
         raise HTTPException(status_code=400, detail="Al menos un id_banco es requerido")
     
-    client = bigquery.Client()
     timestamp = datetime.utcnow()
     
     try:
@@ -2296,6 +2291,7 @@ def marcar_conciliado_manual(data: dict):
             )
             
             pagos_del_grupo = list(client.query(query_verificar_grupo, job_config=job_config_grupo).result())
+            registrar_fechas_modificadas(*(pago["fecha_pago"] for pago in pagos_del_grupo))
             
             # Es un grupo si hay múltiples transacciones bancarias O múltiples pagos con la misma referencia
             es_grupo = len(transacciones_banco) > 1 or len(pagos_del_grupo) > 1
@@ -2513,12 +2509,10 @@ def marcar_conciliado_manual(data: dict):
 
 
 @router.get("/diagnostico-conciliacion")
-async def diagnostico_conciliacion():
+def diagnostico_conciliacion(client: bigquery.Client = Depends(get_bigquery_client)):
     """
     Diagnóstica por qué no se están encontrando matches en la conciliación
     """
-    client = bigquery.Client()
-    
     try:
         # 1. Analizar pagos pendientes (muestra los primeros 10)
         query_pagos_muestra = """
@@ -2647,18 +2641,17 @@ async def diagnostico_conciliacion():
         )
         
 @router.get("/obtener-movimientos-banco-disponibles")
-async def obtener_movimientos_banco_disponibles(
+def obtener_movimientos_banco_disponibles(
     valor_min: float,
     valor_max: float,
     fecha_inicio: str,
     fecha_fin: str,
-    estado: str = "pendiente"
+    estado: str = "pendiente",
+    client: bigquery.Client = Depends(get_bigquery_client)
 ):
     """
     Endpoint para obtener movimientos bancarios disponibles para conciliación manual
     """
-    client = bigquery.Client()
-    
     try:
         # Validar rangos de valor para evitar consultas demasiado amplias
         if valor_max / valor_min > 10:  # Si el rango es mayor a 10x, es demasiado amplio
@@ -2729,12 +2722,10 @@ async def obtener_movimientos_banco_disponibles(
         )
 
 @router.get("/pagos-pendientes-conciliar")
-async def obtener_pagos_pendientes_conciliar():
+def obtener_pagos_pendientes_conciliar(client: bigquery.Client = Depends(get_bigquery_client)):
     """
     Endpoint para obtener pagos pendientes de conciliar
     """
-    client = bigquery.Client()
-    
     try:
     
         query = """
@@ -2789,16 +2780,16 @@ async def obtener_pagos_pendientes_conciliar():
 
 
 @router.get("/transacciones-bancarias-disponibles")
-async def obtener_transacciones_bancarias_disponibles(
+def obtener_transacciones_bancarias_disponibles(
     referencia: str,
     fecha_pago: Optional[str] = Query(None, description="Fecha del pago en formato YYYY-MM-DD"),
-    valor: Optional[float] = Query(None, description="Valor del pago para filtrar")
+    valor: Optional[float] = Query(None, description="Valor del pago para filtrar"),
+    client: bigquery.Client = Depends(get_bigquery_client)
     ):
     """
     Endpoint para obtener transacciones bancarias disponibles para una referencia específica
     ✅ NUEVO: Si tiene Id_Transaccion, busca transacciones para todos los valores del grupo y en rango de fechas
     """
-    client = bigquery.Client()
     try:
         # Primero verificar si el pago tiene Id_Transaccion
         query_verificar_grupo = """
@@ -3178,7 +3169,8 @@ def get_nivel_match(porcentaje: float) -> str:
 
 
 @router.post("/revertir-conciliaciones-automaticas")
-async def revertir_conciliaciones_automaticas():
+@invalida("pagosconductor", "banco_movimientos")
+def revertir_conciliaciones_automaticas(client: bigquery.Client = Depends(get_bigquery_client)):
     """
     Revierte las conciliaciones automáticas realizadas el 2025-09-02.
     
@@ -3192,8 +3184,6 @@ async def revertir_conciliaciones_automaticas():
         import os
         import csv
         
-        client = get_bigquery_client()
-        
         # Fecha específica para buscar conciliaciones del 2025-09-02
         fecha_objetivo = "2025-09-02"
         usuario_id = "sistema"
@@ -3314,6 +3304,23 @@ async def revertir_conciliaciones_automaticas():
             })
             logger.info(f"✅ Exportados {len(registros_banco)} registros de banco_movimientos a: {filename_banco}")
         
+        # Fechas de pago afectadas: las de los pagos revertidos y las de los
+        # pagos asociados a los movimientos que vuelven a pendiente
+        registrar_fechas_modificadas(*(registro["fecha_pago"] for registro in registros_pagos))
+        referencias_banco = sorted({r["referencia_pago_asociada"] for r in registros_banco if r["referencia_pago_asociada"]})
+        if referencias_banco:
+            query_fechas_banco = f"""
+                SELECT DISTINCT fecha_pago
+                FROM `{PROJECT_ID}.{DATASET_CONCILIACIONES}.pagosconductor`
+                WHERE referencia_pago IN UNNEST(@referencias)
+            """
+            job_config_fechas = bigquery.QueryJobConfig(
+                query_parameters=[bigquery.ArrayQueryParameter("referencias", "STRING", referencias_banco)]
+            )
+            registrar_fechas_modificadas(
+                *(fila.fecha_pago for fila in client.query(query_fechas_banco, job_config=job_config_fechas).result())
+            )
+
         # 4. Actualizar tabla pagosconductor
         logger.info("🔄 Actualizando registros en pagosconductor...")
         query_update_pagos = f"""
@@ -3404,13 +3411,12 @@ async def revertir_conciliaciones_automaticas():
 
 
 @router.get("/consultas")
-async def consultas():
+@invalida("pagosconductor", "guias_liquidacion")
+def consultas(client: bigquery.Client = Depends(get_bigquery_client)):
     try:
         import csv
         import os
         
-        client = get_bigquery_client()
-        
         logger.info("Iniciando eliminación de registros por tracking number específico")
         
         # Lista específica de tracking numbers a eliminar
@@ -3545,6 +3551,8 @@ async def consultas():
         
         logger.info(f"📁 Archivos CSV exportados exitosamente en: {export_dir}")
         
+        registrar_fechas_modificadas(*(registro["fecha_pago"] for registro in registros_pagos))
+
         # 3. Eliminar registros de pagosconductor
         logger.info("🗑️ Eliminando registros de pagosconductor...")
         query_delete_pagos = f"""
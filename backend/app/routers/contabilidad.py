@@ -1,4 +1,4 @@
-from fastapi import APIRouter, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query
 from google.cloud import bigquery
 from google.api_core import exceptions as gcp_exceptions
 from datetime import datetime
@@ -6,6 +6,8 @@ import logging
 from typing import List, Dict, Any, Optional
 import asyncio
 import concurrent.futures
+from app.core.bigquery_client import get_bigquery_client
+from app.core.cache import cacheado
 
 # Configurar logging específico para contabilidad
 logging.basicConfig(level=logging.INFO)
@@ -17,17 +19,6 @@ router = APIRouter(prefix="/contabilidad", tags=["Contabilidad"])
 PROJECT_ID = "datos-clientes-441216"
 DATASET_CONCILIACIONES = "Conciliaciones"
 
-def get_bigquery_client() -> bigquery.Client:
-    """Obtiene cliente de BigQuery con manejo de errores"""
-    try:
-        return bigquery.Client(project=PROJECT_ID)
-    except Exception as e:
-        logger.error(f"Error inicializando cliente BigQuery: {e}")
-        raise HTTPException(
-            status_code=500, 
-            detail="Error de configuración de base de datos"
-        )
-
 async def verificar_tablas_disponibles(client: bigquery.Client) -> Dict[str, bool]:
     """Verifica qué tablas están disponibles en tu proyecto"""
     
@@ -42,8 +33,7 @@ async def verificar_tablas_disponibles(client: bigquery.Client) -> Dict[str, boo
         try:
             # Test de acceso simple
             query = f"SELECT COUNT(*) as total FROM `{tabla_id}` LIMIT 1"
-            result = client.query(query)
-            next(result.result())
+            await client.query_async(query)
             tablas_disponibles[nombre] = True
             logger.info(f"✅ Tabla disponible: {tabla_id}")
         except gcp_exceptions.NotFound:
@@ -56,12 +46,11 @@ async def verificar_tablas_disponibles(client: bigquery.Client) -> Dict[str, boo
     return tablas_disponibles
 
 @router.get("/resumen")
-async def obtener_resumen_contabilidad() -> List[Dict[str, Any]]:
+@cacheado("contabilidad_resumen", tablas=("pagosconductor", "COD_pendientes_v1"))
+async def obtener_resumen_contabilidad(client: bigquery.Client = Depends(get_bigquery_client)) -> List[Dict[str, Any]]:
     """
     Obtiene el resumen de contabilidad usando SOLO las tablas disponibles
     """
-    client = get_bigquery_client()
-
     try:
         logger.info("Iniciando consulta de resumen contabilidad")
         
@@ -173,19 +162,14 @@ async def obtener_resumen_contabilidad() -> List[Dict[str, Any]]:
 
         # PASO 4: Ejecutar consulta con timeout manual
         logger.info("Ejecutando consulta principal...")
-        query_job = client.query(query)
-        
-        # Timeout manual usando concurrent.futures
-        with concurrent.futures.ThreadPoolExecutor() as executor:
-            future = executor.submit(lambda: list(query_job.result()))
-            try:
-                rows = future.result(timeout=30)  # 30 segundos timeout
-            except concurrent.futures.TimeoutError:
-                logger.error("Query timeout después de 30 segundos")
-                raise HTTPException(
-                    status_code=504, 
-                    detail="La consulta tardó demasiado tiempo. Intente nuevamente."
-                )
+        try:
+            rows = await asyncio.wait_for(client.query_async(query), timeout=30)  # 30 segundos timeout
+        except asyncio.TimeoutError:
+            logger.error("Query timeout después de 30 segundos")
+            raise HTTPException(
+                status_code=504, 
+                detail="La consulta tardó demasiado tiempo. Intente nuevamente."
+            )
         
         # PASO 5: Procesar resultados
         agrupado = {}
@@ -225,7 +209,7 @@ async def obtener_resumen_contabilidad() -> List[Dict[str, Any]]:
             status_code=404, 
             detail="Tabla de datos no encontrada en BigQuery. Verifique la configuración."
         )
-    except concurrent.futures.TimeoutError:
+    except asyncio.TimeoutError:
         logger.error("Timeout en consulta de resumen")
         raise HTTPException(
             status_code=504, 
@@ -325,12 +309,10 @@ def obtener_prioridad_estado(estado: str) -> int:
     return 999  # Estados desconocidos al final
 
 @router.get("/resumen/cliente/{cliente}")
-async def obtener_resumen_cliente(cliente: str) -> Dict[str, Any]:
+async def obtener_resumen_cliente(cliente: str, client: bigquery.Client = Depends(get_bigquery_client)) -> Dict[str, Any]:
     """
     Obtiene el resumen detallado de un cliente específico
     """
-    client = get_bigquery_client()
-    
     try:
         cliente_upper = cliente.upper().strip()
         
@@ -366,12 +348,8 @@ async def obtener_resumen_cliente(cliente: str) -> Dict[str, Any]:
             ]
         )
         
-        query_job = client.query(query, job_config=job_config)
-        
         # Timeout manual
-        with concurrent.futures.ThreadPoolExecutor() as executor:
-            future = executor.submit(lambda: list(query_job.result()))
-            rows = future.result(timeout=15)
+        rows = await asyncio.wait_for(client.query_async(query, job_config=job_config), timeout=15)
         
         datos = []
         for row in rows:
@@ -395,11 +373,9 @@ async def obtener_resumen_cliente(cliente: str) -> Dict[str, Any]:
         )
 
 @router.get("/health")
-def health_check() -> Dict[str, str]:
+def health_check(client: bigquery.Client = Depends(get_bigquery_client)) -> Dict[str, str]:
     """Endpoint de verificación de salud"""
     try:
-        client = get_bigquery_client()
-        
         # Test simple de conectividad
         test_query = "SELECT 1 as test"
         result = client.query(test_query)
@@ -422,12 +398,10 @@ def health_check() -> Dict[str, str]:
         }
 
 @router.get("/debug-tablas")
-async def debug_tablas_disponibles() -> Dict[str, Any]:
+async def debug_tablas_disponibles(client: bigquery.Client = Depends(get_bigquery_client)) -> Dict[str, Any]:
     """
     Debug: Verifica qué tablas están disponibles en tu proyecto
     """
-    client = get_bigquery_client()
-    
     try:
         tablas_disponibles = await verificar_tablas_disponibles(client)
         
@@ -457,12 +431,10 @@ async def debug_tablas_disponibles() -> Dict[str, Any]:
         )
 
 @router.get("/test-consulta-simple")
-def test_consulta_simple() -> Dict[str, Any]:
+def test_consulta_simple(client: bigquery.Client = Depends(get_bigquery_client)) -> Dict[str, Any]:
     """
     Test: Consulta simple para verificar acceso a pagosconductor
     """
-    client = get_bigquery_client()
-    
     try:
         query = f"""
         SELECT 
@@ -493,12 +465,10 @@ def test_consulta_simple() -> Dict[str, Any]:
         )
 
 @router.get("/test-datos-muestra")
-def test_datos_muestra(limite: int = Query(5, ge=1, le=20)) -> Dict[str, Any]:
+def test_datos_muestra(limite: int = Query(5, ge=1, le=20), client: bigquery.Client = Depends(get_bigquery_client)) -> Dict[str, Any]:
     """
     Test: Muestra datos reales de la tabla para debugging
     """
-    client = get_bigquery_client()
-    
     try:
         query = f"""
         SELECT 
@@ -542,14 +512,14 @@ def test_datos_muestra(limite: int = Query(5, ge=1, le=20)) -> Dict[str, Any]:
         )
 
 @router.get("/conciliacion-mensual")
-async def conciliacion_mensual(
-    mes: str = Query(..., description="Mes en formato YYYY-MM")
+def conciliacion_mensual(
+    mes: str = Query(..., description="Mes en formato YYYY-MM"),
+    client: bigquery.Client = Depends(get_bigquery_client)
 ) -> Dict[str, Any]:
     """
     Devuelve el resumen diario de conciliación bancaria para un mes dado.
     SOLO usa datos reales de BigQuery - SIN simulaciones.
     """
-    client = get_bigquery_client()
     try:
         # Validar mes
         try:
@@ -862,12 +832,10 @@ async def conciliacion_mensual(
 
 
 @router.get("/estructura-tablas")
-async def obtener_estructura_tablas() -> Dict[str, Any]:
+def obtener_estructura_tablas(client: bigquery.Client = Depends(get_bigquery_client)) -> Dict[str, Any]:
     """
     Debug: Obtiene la estructura real de las tablas disponibles
     """
-    client = get_bigquery_client()
-    
     try:
         estructura = {}
         
@@ -1,5 +1,7 @@
-from fastapi import APIRouter, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query
 from google.cloud import bigquery
+from app.core.bigquery_client import get_bigquery_client
+from app.core.cache import cacheado, invalida
 from datetime import datetime, timedelta
 from typing import List, Dict, Optional
 from pydantic import BaseModel
@@ -39,10 +41,9 @@ def obtener_cruces_bancarios(
     estado: Optional[str] = Query(None, description="Filtrar por estado"),
     fecha_desde: Optional[str] = Query(None, description="Fecha desde (YYYY-MM-DD)"),
     fecha_hasta: Optional[str] = Query(None, description="Fecha hasta (YYYY-MM-DD)"),
-    limit: int = Query(100, description="Límite de registros")
+    limit: int = Query(100, description="Límite de registros"),
+    client: bigquery.Client = Depends(get_bigquery_client)
 ):
-    client = bigquery.Client()
-
     try:
         # Construir filtros
         where_conditions = ["1=1"]
@@ -120,14 +121,12 @@ def obtener_cruces_bancarios(
         logger.error(f"Error obteniendo cruces: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error consultando cruces: {str(e)}")
 @router.get("/estadisticas-cruces", response_model=EstadisticasCruces)
-def obtener_estadisticas_cruces():
+def obtener_estadisticas_cruces(client: bigquery.Client = Depends(get_bigquery_client)):
     """
     Obtiene estadísticas generales de cruces bancarios
     
     🎯 **BENEFICIO**: KPIs de conciliación en tiempo real
     """
-    client = bigquery.Client()
-    
     try:
         query = """
         SELECT 
@@ -162,18 +161,18 @@ def obtener_estadisticas_cruces():
         raise HTTPException(status_code=500, detail=f"Error consultando estadísticas: {str(e)}")
 
 @router.post("/aprobar-cruce/{id_banco}")
+@invalida("banco_movimientos", "pagosconductor")
 def aprobar_cruce_manual(
     id_banco: str,
     referencia_pago: Optional[str] = None,
-    observaciones: str = "Aprobado manualmente"
+    observaciones: str = "Aprobado manualmente",
+    client: bigquery.Client = Depends(get_bigquery_client)
 ):
     """
     Aprueba un cruce de forma manual
     
     🎯 **BENEFICIO**: Resolver casos complejos que requieren intervención humana
     """
-    client = bigquery.Client()
-    
     try:
         # Actualizar estado del movimiento bancario
         query_update = """
@@ -229,17 +228,17 @@ def aprobar_cruce_manual(
         raise HTTPException(status_code=500, detail=f"Error aprobando cruce: {str(e)}")
 
 @router.post("/rechazar-cruce/{id_banco}")
+@invalida("banco_movimientos", "pagosconductor")
 def rechazar_cruce(
     id_banco: str,
-    motivo: str = "Rechazado por revisión manual"
+    motivo: str = "Rechazado por revisión manual",
+    client: bigquery.Client = Depends(get_bigquery_client)
 ):
     """
     Rechaza un cruce y lo marca para revisión
     
     🎯 **BENEFICIO**: Gestión de excepciones y casos especiales
     """
-    client = bigquery.Client()
-    
     try:
         query_update = """
         UPDATE `datos-clientes-441216.Conciliaciones.banco_movimientos`
@@ -273,14 +272,12 @@ def rechazar_cruce(
         raise HTTPException(status_code=500, detail=f"Error rechazando cruce: {str(e)}")
 
 @router.get("/cruces-pendientes")
-def obtener_cruces_pendientes(limite: int = Query(50, description="Límite de registros")):
+def obtener_cruces_pendientes(limite: int = Query(50, description="Límite de registros"), client: bigquery.Client = Depends(get_bigquery_client)):
     """
     Obtiene solo los cruces que requieren atención manual
     
     🎯 **BENEFICIO**: Vista enfocada en tareas pendientes para mayor productividad
     """
-    client = bigquery.Client()
-    
     try:
         query = """
         SELECT 
@@ -333,15 +330,14 @@ def obtener_cruces_pendientes(limite: int = Query(50, description="Límite de re
 @router.get("/auditoria-conciliacion")
 def obtener_auditoria_conciliacion(
     fecha_desde: Optional[str] = Query(None, description="Fecha desde (YYYY-MM-DD)"),
-    fecha_hasta: Optional[str] = Query(None, description="Fecha hasta (YYYY-MM-DD)")
+    fecha_hasta: Optional[str] = Query(None, description="Fecha hasta (YYYY-MM-DD)"),
+    client: bigquery.Client = Depends(get_bigquery_client)
 ):
     """
     Obtiene log de auditoría de todas las acciones de conciliación
     
     🎯 **BENEFICIO**: Trazabilidad completa para cumplimiento y revisión
     """
-    client = bigquery.Client()
-    
     try:
         # Filtros de fecha
         where_conditions = ["1=1"]
@@ -399,18 +395,18 @@ def obtener_auditoria_conciliacion(
         raise HTTPException(status_code=500, detail=f"Error consultando auditoría: {str(e)}")
 
 @router.post("/ejecutar-conciliacion-lote")
+@invalida("banco_movimientos", "pagosconductor")
 def ejecutar_conciliacion_lote(
     fecha_desde: str,
     fecha_hasta: str,
-    auto_aprobar_exactos: bool = True
+    auto_aprobar_exactos: bool = True,
+    client: bigquery.Client = Depends(get_bigquery_client)
 ):
     """
     Ejecuta conciliación masiva para un rango de fechas
     
     🎯 **BENEFICIO**: Procesamiento eficiente de grandes volúmenes
     """
-    client = bigquery.Client()
-    
     try:
         # Llamar al procedimiento de conciliación automática del backend principal
         from .conciliacion import ejecutar_conciliacion_automatica
@@ -444,14 +440,13 @@ def ejecutar_conciliacion_lote(
 
 # 🔥 NUEVA FUNCIONALIDAD: Dashboard en tiempo real
 @router.get("/dashboard-tiempo-real")
-def obtener_dashboard_tiempo_real():
+@cacheado("cruces_dashboard_tiempo_real", tablas=("banco_movimientos",), ttl=60)
+def obtener_dashboard_tiempo_real(client: bigquery.Client = Depends(get_bigquery_client)):
     """
     Dashboard con métricas en tiempo real para monitoreo
     
     🎯 **BENEFICIO**: Visibilidad instantánea del estado de conciliación
     """
-    client = bigquery.Client()
-    
     try:
         # Métricas principales
         query_metricas = """
@@ -1,5 +1,9 @@
-from fastapi import APIRouter, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query
 from google.cloud import bigquery
+from app.core.bigquery_client import get_bigquery_client
+from app.core.cache import cacheado, invalida, TablaResumen, registrar_tabla_resumen, obtener_tabla_resumen
+from app.core.exportacion import generar_json, respuesta_streaming
+from app.core.resultados_arrow import lotes_dict
 from datetime import datetime, date
 from typing import Optional, List
 from pydantic import BaseModel
@@ -8,7 +12,17 @@ logging.basicConfig(level=logging.DEBUG)
 
 
 router = APIRouter(prefix="/entregas", tags=["Entregas"])
-client = bigquery.Client()
+
+# Tipos de salida de /entregas-consolidadas (el resto: fechas ISO automáticas)
+CONVERSIONES_ENTREGAS = {
+    "valor": "float0",
+    "valor_tracking": "float0",
+    "valor_banco_conciliado": "float",
+    "confianza_match": "int0",
+    "diferencia_valor": "float0",
+    "integridad_ok": "bool",
+    "listo_para_liquidar": "bool",
+}
 
 # ✅ 1. ENDPOINT PRINCIPAL QUE EL FRONTEND NECESITA
 @router.get("/entregas-consolidadas")
@@ -16,14 +30,13 @@ def obtener_entregas_consolidadas(
     cliente: Optional[str] = Query(None),
     desde: Optional[str] = Query(None),
     hasta: Optional[str] = Query(None),
-    solo_conciliadas: Optional[bool] = Query(True)
+    solo_conciliadas: Optional[bool] = Query(True),
+    client: bigquery.Client = Depends(get_bigquery_client)
 ):
     """
     🎯 ENDPOINT PRINCIPAL que coincide exactamente con lo que el frontend espera
     """
     
-    client = bigquery.Client()
-    
     try:
         # Construir filtros
         condiciones = []
@@ -133,33 +146,28 @@ END as listo_para_liquidar,                  CASE
             {filtro_conciliacion}
         )
         
+        -- Columnas con el nombre y orden de la respuesta: las filas salen tal cual
         SELECT 
             tracking,
-            referencia_pago,
-            cliente,
-            valor_consignacion,
-            valor_tracking,
             DATE(fecha_pago) as fecha,
-            correo_conductor,
-            entidad_pago,
             tipo,
-            estado_pago,
+            cliente,
+            valor_consignacion as valor,
+            COALESCE(NULLIF(valor_tracking, 0), valor_consignacion) as valor_tracking,
             estado_conciliacion,
+            referencia_pago,
+            correo_conductor,
+            entidad_pago,
+            COALESCE(DATE(fecha_conciliacion), DATE(fecha_pago)) as fecha_conciliacion,
             
-            -- Información de conciliación extendida
+            -- Información extendida de conciliación
+            NULLIF(valor_banco, 0) as valor_banco_conciliado,
             id_banco_asociado,
-            DATE(fecha_banco) as fecha_banco,
-            valor_banco as valor_banco_conciliado,
-            descripcion_banco,
-            estado_conciliacion_raw,
-            confianza_match,
             observaciones_conciliacion,
-            COALESCE(DATE(fecha_conciliacion), DATE(fecha_pago)) as fecha_conciliacion,
-            
-            -- Validaciones
+            confianza_match,
             diferencia_valor,
-            listo_para_liquidar,
             integridad_ok,
+            listo_para_liquidar,
             calidad_conciliacion
             
         FROM entregas_procesadas
@@ -170,10 +178,10 @@ END as listo_para_liquidar,                  CASE
         """
         
         job_config = bigquery.QueryJobConfig(query_parameters=parametros)
-        resultados = client.query(query, job_config=job_config).result()
+        # Conversión por columna (Arrow); las entregas se envían a medida que llegan
+        lotes = lotes_dict(client, query, job_config, conversiones=CONVERSIONES_ENTREGAS)
         
-        entregas = []
-        total_valor = 0
+        totales = {"valor": 0.0, "confianza": 0, "alertas": 0}
         clientes_agrupados = {}
         
         # Métricas de calidad
@@ -183,82 +191,60 @@ END as listo_para_liquidar,                  CASE
             'manuales': 0,
             'sin_conciliar': 0        }
         
-        for row in resultados:
-            valor_consignacion = float(row["valor_consignacion"])
-            valor_tracking = float(row["valor_tracking"]) if row["valor_tracking"] else valor_consignacion
-            diferencia_valor = float(row["diferencia_valor"]) if row["diferencia_valor"] else 0
-            
-            entrega = {
-                "tracking": row["tracking"],
-                "fecha": row["fecha"].isoformat(),
-                "tipo": row["tipo"],
-                "cliente": row["cliente"],
-                "valor": valor_consignacion,  # Este es el valor de consignación
-                "valor_tracking": valor_tracking,  # Este es el valor del tracking
-                "estado_conciliacion": row["estado_conciliacion"],
-                "referencia_pago": row["referencia_pago"],
-                "correo_conductor": row["correo_conductor"],
-                "entidad_pago": row["entidad_pago"],
-                "fecha_conciliacion": row["fecha_conciliacion"].isoformat() if row["fecha_conciliacion"] else None,
-                
-                # Información extendida de conciliación
-                "valor_banco_conciliado": float(row["valor_banco_conciliado"]) if row["valor_banco_conciliado"] else None,
-                "id_banco_asociado": row["id_banco_asociado"],
-                "observaciones_conciliacion": row["observaciones_conciliacion"],
-                "confianza_match": int(row["confianza_match"]) if row["confianza_match"] else 0,
-                "diferencia_valor": diferencia_valor,
-                "integridad_ok": bool(row["integridad_ok"]),
-                "listo_para_liquidar": bool(row["listo_para_liquidar"]),
-                "calidad_conciliacion": row["calidad_conciliacion"]
+        def recorrer_entregas():
+            for lote in lotes:
+                for entrega in lote:
+                    valor_consignacion = entrega["valor"]
+                    totales["valor"] += valor_consignacion
+                    totales["confianza"] += entrega["confianza_match"]
+                    if not entrega["integridad_ok"]:
+                        totales["alertas"] += 1
+                    
+                    # Actualizar estadísticas de calidad
+                    if entrega["estado_conciliacion"] == "Conciliado Exacto":
+                        stats_calidad['exactas'] += 1
+                    elif entrega["estado_conciliacion"] == "Conciliado Aproximado":
+                        stats_calidad['aproximadas'] += 1
+                    elif entrega["estado_conciliacion"] == "Conciliado Manual":
+                        stats_calidad['manuales'] += 1
+                    else:
+                        stats_calidad['sin_conciliar'] += 1
+                    
+                    # Agrupar por cliente
+                    cliente_key = entrega["cliente"]
+                    if cliente_key not in clientes_agrupados:
+                        clientes_agrupados[cliente_key] = {
+                            "cantidad": 0,
+                            "valor": 0
+                        }
+                    
+                    clientes_agrupados[cliente_key]["cantidad"] += 1
+                    clientes_agrupados[cliente_key]["valor"] += valor_consignacion
+                    yield entrega
+        
+        def resumen():
+            # Calcular métricas de calidad
+            total_entregas = sum(stats_calidad.values())
+            entregas_conciliadas = stats_calidad['exactas'] + stats_calidad['aproximadas'] + stats_calidad['manuales']
+            return {
+                "total_entregas": total_entregas,
+                "valor_total": totales["valor"],
+                "estadisticas": {
+                    "total_entregas": total_entregas,
+                    "valor_total": totales["valor"],
+                    "clientes": clientes_agrupados
+                },
+                "clientes_agrupados": clientes_agrupados,
+                "estadisticas_calidad": stats_calidad,
+                "calidad_datos": {
+                    "porcentaje_calidad": (entregas_conciliadas / max(total_entregas, 1)) * 100,
+                    "confianza_promedio": totales["confianza"] / max(total_entregas, 1),
+                    "alertas_criticas": totales["alertas"]
+                },
+                "timestamp": datetime.now().isoformat()
             }
-            
-            entregas.append(entrega)
-            total_valor += valor_consignacion
-            
-            # Actualizar estadísticas de calidad
-            if row["estado_conciliacion"] == "Conciliado Exacto":
-                stats_calidad['exactas'] += 1
-            elif row["estado_conciliacion"] == "Conciliado Aproximado":
-                stats_calidad['aproximadas'] += 1
-            elif row["estado_conciliacion"] == "Conciliado Manual":
-                stats_calidad['manuales'] += 1
-            else:
-                stats_calidad['sin_conciliar'] += 1
-            
-            # Agrupar por cliente
-            cliente_key = entrega["cliente"]
-            if cliente_key not in clientes_agrupados:
-                clientes_agrupados[cliente_key] = {
-                    "cantidad": 0,
-                    "valor": 0
-                }
-            
-            clientes_agrupados[cliente_key]["cantidad"] += 1
-            clientes_agrupados[cliente_key]["valor"] += valor_consignacion
         
-        # Calcular métricas de calidad
-        total_entregas = len(entregas)
-        entregas_conciliadas = stats_calidad['exactas'] + stats_calidad['aproximadas'] + stats_calidad['manuales']
-        confianza_promedio = sum(e['confianza_match'] for e in entregas) / max(total_entregas, 1)
-        
-        return {
-            "entregas": entregas,
-            "total_entregas": total_entregas,
-            "valor_total": total_valor,
-            "estadisticas": {
-                "total_entregas": total_entregas,
-                "valor_total": total_valor,
-                "clientes": clientes_agrupados
-            },
-            "clientes_agrupados": clientes_agrupados,
-            "estadisticas_calidad": stats_calidad,
-            "calidad_datos": {
-                "porcentaje_calidad": (entregas_conciliadas / max(total_entregas, 1)) * 100,
-                "confianza_promedio": confianza_promedio,
-                "alertas_criticas": len([e for e in entregas if not e['integridad_ok']])
-            },
-            "timestamp": datetime.now().isoformat()
-        }
+        return respuesta_streaming(generar_json("entregas", recorrer_entregas(), resumen), "json")
         
     except Exception as e:
         raise HTTPException(
@@ -267,16 +253,76 @@ END as listo_para_liquidar,                  CASE
         )
 
 # ✅ 2. ENDPOINT RESUMEN LIQUIDACIONES
+# Tabla resumen opcional (DASHBOARD_RESUMENES_HABILITADOS): agregados diarios por
+# cliente que se refrescan con MERGE solo para los días recientes
+RESUMEN_LIQUIDACIONES = registrar_tabla_resumen(TablaResumen(
+    nombre="resumen_liquidaciones_diario",
+    tablas_origen=("pagosconductor", "banco_movimientos"),
+    sql_crear="""
+    CREATE TABLE IF NOT EXISTS `datos-clientes-441216.Conciliaciones.resumen_liquidaciones_diario` (
+        cliente STRING,
+        fecha DATE,
+        total_entregas INT64,
+        valor_total FLOAT64,
+        entregas_conciliadas INT64,
+        actualizado_en TIMESTAMP
+    )
+    PARTITION BY fecha
+    """,
+    sql_merge="""
+    MERGE `datos-clientes-441216.Conciliaciones.resumen_liquidaciones_diario` T
+    USING (
+        SELECT 
+            COALESCE(pc.cliente, 'Sin Cliente') as cliente,
+            pc.fecha_pago as fecha,
+            COUNT(*) as total_entregas,
+            SUM(CAST(pc.valor AS FLOAT64)) as valor_total,
+            COUNT(CASE WHEN bm.estado_conciliacion IN ('conciliado_exacto', 'conciliado_aproximado', 'conciliado_manual') THEN 1 END) as entregas_conciliadas
+        FROM `datos-clientes-441216.Conciliaciones.pagosconductor` pc
+        LEFT JOIN `datos-clientes-441216.Conciliaciones.banco_movimientos` bm
+            ON bm.referencia_pago_asociada = pc.referencia_pago
+        WHERE pc.estado IN ('aprobado', 'pagado')
+        AND (pc.fecha_pago >= @desde OR pc.fecha_pago IN UNNEST(@fechas))
+        GROUP BY cliente, fecha
+    ) S
+    ON T.cliente = S.cliente AND T.fecha = S.fecha
+    WHEN MATCHED THEN UPDATE SET
+        total_entregas = S.total_entregas,
+        valor_total = S.valor_total,
+        entregas_conciliadas = S.entregas_conciliadas,
+        actualizado_en = CURRENT_TIMESTAMP()
+    WHEN NOT MATCHED BY TARGET THEN INSERT
+        (cliente, fecha, total_entregas, valor_total, entregas_conciliadas, actualizado_en)
+        VALUES (S.cliente, S.fecha, S.total_entregas, S.valor_total, S.entregas_conciliadas, CURRENT_TIMESTAMP())
+    WHEN NOT MATCHED BY SOURCE AND (T.fecha >= @desde OR T.fecha IN UNNEST(@fechas)) THEN DELETE
+    """
+))
+
 @router.get("/resumen-liquidaciones")
-def obtener_resumen_liquidaciones():
+@cacheado("entregas_resumen_liquidaciones", tablas=("pagosconductor", "banco_movimientos", "resumen_liquidaciones_diario"))
+def obtener_resumen_liquidaciones(client: bigquery.Client = Depends(get_bigquery_client)):
     """
     Resumen de liquidaciones por cliente
     """
     
-    client = bigquery.Client()
-    
     try:
-        query = """
+        if obtener_tabla_resumen(RESUMEN_LIQUIDACIONES.nombre):
+            # Lectura de la tabla resumen: unas pocas filas por cliente y día
+            query = """
+            WITH resumen_clientes AS (
+                SELECT 
+                    cliente,
+                    SUM(total_entregas) as total_entregas,
+                    SUM(valor_total) as valor_total,
+                    SUM(entregas_conciliadas) as entregas_conciliadas,
+                    SAFE_DIVIDE(SUM(valor_total), SUM(total_entregas)) as valor_promedio_entrega
+                FROM `datos-clientes-441216.Conciliaciones.resumen_liquidaciones_diario`
+                WHERE fecha >= DATE_SUB(CURRENT_DATE(), INTERVAL 60 DAY)
+                GROUP BY cliente
+            )
+            """
+        else:
+            query = """
         WITH resumen_clientes AS (
             SELECT 
                 COALESCE(pc.cliente, 'Sin Cliente') as cliente,                COUNT(*) as total_entregas,
@@ -294,7 +340,9 @@ def obtener_resumen_liquidaciones():
             
             GROUP BY pc.cliente
         )
+            """
         
+        query += """
         SELECT 
             cliente,
             total_entregas,
@@ -333,7 +381,7 @@ def obtener_resumen_liquidaciones():
 
 # ✅ 3. ENDPOINT DASHBOARD CONCILIACIÓN
 @router.get("/dashboard-conciliacion")
-def obtener_dashboard_conciliacion():
+def obtener_dashboard_conciliacion(client: bigquery.Client = Depends(get_bigquery_client)):
     query = """
     SELECT * FROM `datos-clientes-441216.Conciliaciones.view_resumen_conciliacion`
     """
@@ -343,13 +391,11 @@ def obtener_dashboard_conciliacion():
 
 # ✅ 4. ENDPOINT VALIDAR INTEGRIDAD
 @router.get("/validar-integridad-liquidacion/{cliente}")
-def validar_integridad_liquidacion(cliente: str):
+def validar_integridad_liquidacion(cliente: str, client: bigquery.Client = Depends(get_bigquery_client)):
     """
     Valida la integridad de las entregas de un cliente específico
     """
     
-    client = bigquery.Client()
-    
     try:
         query = """        WITH validacion_cliente AS (
             SELECT 
@@ -473,14 +519,13 @@ def obtener_entregas_listas_liquidar(
     cliente: Optional[str] = Query(None),
     desde: Optional[str] = Query(None),
     hasta: Optional[str] = Query(None),
-    incluir_aproximadas: Optional[bool] = Query(True)
+    incluir_aproximadas: Optional[bool] = Query(True),
+    client: bigquery.Client = Depends(get_bigquery_client)
 ):
     """
     🎯 ENDPOINT SIMPLIFICADO SOLO PARA ENTREGAS LISTAS
     """
     
-    client = bigquery.Client()
-    
     # Construir filtros
     condiciones = []
     parametros = []
@@ -631,11 +676,9 @@ def obtener_entregas_listas_liquidar(
 
 # ✅ ENDPOINTS DE DIAGNÓSTICO Y REPARACIÓN
 @router.get("/debug-relacion-tablas")
-def debug_relacion_tablas():
+def debug_relacion_tablas(client: bigquery.Client = Depends(get_bigquery_client)):
     """Debug: Verificar cómo están relacionadas las tablas"""
     
-    client = bigquery.Client()
-    
     try:
         query_banco = """
         SELECT 
@@ -683,11 +726,9 @@ def debug_relacion_tablas():
         return {"error": str(e)}
 
 @router.get("/verificar-datos-conciliados")
-def verificar_datos_conciliados():
+def verificar_datos_conciliados(client: bigquery.Client = Depends(get_bigquery_client)):
     """Verifica si hay datos conciliados en el sistema"""
     
-    client = bigquery.Client()
-    
     try:
         query = """
         WITH verificacion AS (
@@ -753,13 +794,12 @@ def verificar_datos_conciliados():
         return {"error": str(e)}
 
 @router.post("/reparar-referencias-conciliacion")
-def reparar_referencias_conciliacion():
+@invalida("banco_movimientos")
+def reparar_referencias_conciliacion(client: bigquery.Client = Depends(get_bigquery_client)):
     """
     Repara las referencias entre pagos y movimientos bancarios si están rotas
     """
     
-    client = bigquery.Client()
-    
     try:
         # 1. Verificar si hay movimientos conciliados sin referencia
         query_verificar = """
@@ -815,12 +855,10 @@ def reparar_referencias_conciliacion():
 
 # ✅ ENDPOINTS DE ASOCIACIÓN MANUAL
 @router.get("/analizar-datos-para-asociar")
-def analizar_datos_para_asociar():
+def analizar_datos_para_asociar(client: bigquery.Client = Depends(get_bigquery_client)):
     """
     Analiza los datos para identificar qué se puede asociar
     """
-    client = bigquery.Client()
-    
     try:
         # 1. Ver movimientos bancarios conciliados sin referencia
         query_banco = """
@@ -909,12 +947,11 @@ def analizar_datos_para_asociar():
         raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
 
 @router.post("/asociar-referencias-automatico")
-def asociar_referencias_automatico():
+@invalida("banco_movimientos")
+def asociar_referencias_automatico(client: bigquery.Client = Depends(get_bigquery_client)):
     """
     Asocia referencias automáticamente basado en las mejores sugerencias
     """
-    client = bigquery.Client()
-    
     try:
         # 1. Obtener sugerencias
         analisis = analizar_datos_para_asociar()
@@ -980,7 +1017,8 @@ def asociar_referencias_automatico():
         raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
 
 @router.post("/asociar-referencia-manual")
-def asociar_referencia_manual(data: dict):
+@invalida("banco_movimientos")
+def asociar_referencia_manual(data: dict, client: bigquery.Client = Depends(get_bigquery_client)):
     """
     Asocia una referencia manualmente
     """
@@ -990,8 +1028,6 @@ def asociar_referencia_manual(data: dict):
     if not id_banco or not referencia_pago:
         raise HTTPException(status_code=400, detail="id_banco y referencia_pago son requeridos")
     
-    client = bigquery.Client()
-    
     try:
         # Verificar que la referencia no esté ya usada
         query_verificar = """
@@ -1041,12 +1077,10 @@ def asociar_referencia_manual(data: dict):
         raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
 
 @router.get("/verificar-asociaciones-exitosas")
-def verificar_asociaciones_exitosas():
+def verificar_asociaciones_exitosas(client: bigquery.Client = Depends(get_bigquery_client)):
     """
     Verifica qué asociaciones se hicieron correctamente
     """
-    client = bigquery.Client()
-    
     try:
         query = """
         SELECT 
@@ -1095,8 +1129,7 @@ def verificar_asociaciones_exitosas():
         raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
 
 @router.get("/liquidacion/{cliente}")
-def obtener_liquidacion(cliente: str):
-    client = bigquery.Client()
+def obtener_liquidacion(cliente: str, client: bigquery.Client = Depends(get_bigquery_client)):
     query = """
         SELECT
           gl.tracking_number,
@@ -1122,12 +1155,10 @@ def obtener_liquidacion(cliente: str):
     return [dict(row.items()) for row in result]
 
 @router.get("/debug-entrega/{referencia}")
-def debug_entrega_especifica(referencia: str):
+def debug_entrega_especifica(referencia: str, client: bigquery.Client = Depends(get_bigquery_client)):
     """
     Debug específico para una entrega problemática
     """
-    client = bigquery.Client()
-    
     try:
         query = """
         SELECT 
@@ -1204,12 +1235,10 @@ def debug_entrega_especifica(referencia: str):
 
 
 @router.get("/debug-todos-estados")
-def debug_todos_los_estados():
+def debug_todos_los_estados(client: bigquery.Client = Depends(get_bigquery_client)):
     """
     Ver todos los estados únicos que existen en banco_movimientos
     """
-    client = bigquery.Client()
-    
     try:
         query = """
         SELECT 
@@ -1239,7 +1268,8 @@ def debug_todos_los_estados():
 async def obtener_estadisticas(
     desde: Optional[str] = Query(None),
     hasta: Optional[str] = Query(None),
-    cliente: Optional[str] = Query(None)
+    cliente: Optional[str] = Query(None),
+    client: bigquery.Client = Depends(get_bigquery_client)
 ):
     """
     Endpoint para obtener estadísticas de entregas
@@ -1278,8 +1308,7 @@ async def obtener_estadisticas(
         """
         
         job_config = bigquery.QueryJobConfig(query_parameters=parametros)
-        query_job = client.query(query, job_config=job_config)
-        results = query_job.result()
+        results = await client.query_async(query, job_config=job_config)
         
         for row in results:
             return {
@@ -1301,7 +1330,7 @@ async def obtener_estadisticas(
         )
 
 @router.get("/filtros")
-async def obtener_filtros():
+async def obtener_filtros(client: bigquery.Client = Depends(get_bigquery_client)):
     """
     Endpoint para obtener las opciones de filtros disponibles
     """
@@ -1316,8 +1345,7 @@ async def obtener_filtros():
         WHERE fecha_pago >= DATE_SUB(CURRENT_DATE(), INTERVAL 90 DAY)
         """
         
-        query_job = client.query(query)
-        results = query_job.result()
+        results = await client.query_async(query)
         
         for row in results:
             return {
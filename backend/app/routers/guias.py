@@ -5,6 +5,9 @@ from google.cloud import bigquery
 from typing import List, Dict, Any, Optional
 import os
 from app.dependencies import get_current_user
+from app.core.bigquery_client import get_bigquery_client
+from app.core.carga_masiva import cargador_masivo
+from app.core.identidades import identidades
 from datetime import datetime, date
 from uuid import uuid4
 import json
@@ -15,12 +18,8 @@ DATASET = "Conciliaciones"
 
 router = APIRouter(prefix="/guias", tags=["Guías"])
 
-def get_bigquery_client():
-    """Obtiene el cliente de BigQuery"""
-    return bigquery.Client()
-
 def consumir_bono(employee_id, valor_a_usar, usuario, referencia_uso):
-    client = bigquery.Client()
+    client = get_bigquery_client()
     # Obtiene bonos activos ordenados por antigüedad (FIFO)
     query = """
         SELECT id, saldo_disponible
@@ -62,7 +61,7 @@ def consumir_bono(employee_id, valor_a_usar, usuario, referencia_uso):
         raise Exception("Saldo de bono insuficiente para cubrir lo solicitado")
 
 def registrar_bono_excedente(employee_id, conductor_email, excedente, referencia_pago, descripcion, creado_por):
-    client = bigquery.Client()
+    client = get_bigquery_client()
     table_id = "datos-clientes-441216.Conciliaciones.conductor_bonos"
     bono = {
         "id": f"BONO_{referencia_pago}_{employee_id}_{int(datetime.now().timestamp())}",
@@ -81,13 +80,21 @@ def registrar_bono_excedente(employee_id, conductor_email, excedente, referencia
         "creado_por": creado_por,
         "modificado_por": creado_por,
     }
-    errors = client.insert_rows_json(table_id, [bono])
+    # Load job en vez de streaming: el saldo del bono se actualiza con UPDATE al usarlo
+    errors = cargador_masivo.cargar(table_id, [bono])
     if errors:
         print("❌ Error guardando bono excedente:", errors)
     else:
         print("✅ Bono excedente registrado correctamente")
 
 def obtener_employee_id_usuario(correo: str, client: bigquery.Client) -> Optional[int]:
+    """
+    Employee_id del usuario desde la caché de identidades; si el correo no
+    está cargado se busca con las estrategias de ``consultar_employee_id_usuario``.
+    """
+    return identidades.employee_id(correo, consultar=lambda: consultar_employee_id_usuario(correo, client))
+
+def consultar_employee_id_usuario(correo: str, client: bigquery.Client) -> Optional[int]:
     """
     ✅ MEJORADO: Obtiene el Employee_id con múltiples estrategias
     """
@@ -160,7 +167,7 @@ def obtener_employee_id_usuario(correo: str, client: bigquery.Client) -> Optiona
         return None
 
 @router.get("/pendientes")
-def obtener_guias_pendientes(request: Request) -> Dict:
+def obtener_guias_pendientes(request: Request, client: bigquery.Client = Depends(get_bigquery_client)) -> Dict:
     """
     ✅ VALIDADO: Endpoint para obtener guías pendientes de liquidación
     
@@ -184,9 +191,6 @@ def obtener_guias_pendientes(request: Request) -> Dict:
         return {"guias": [], "total": 0, "error": "Usuario no autenticado"}
 
     try:
-        # Conexión a BigQuery
-        client = bigquery.Client()
-
         # Obtener employee_id
         employee_id = obtener_employee_id_usuario(usuario, client)
         
@@ -391,7 +395,7 @@ def obtener_guias_pendientes(request: Request) -> Dict:
         }
 
 @router.post("/sincronizar-guias-desde-cod")
-async def sincronizar_guias_desde_cod_pendientes(
+def sincronizar_guias_desde_cod_pendientes(
     client: bigquery.Client = Depends(get_bigquery_client),
     current_user: dict = Depends(get_current_user)
 ) -> Dict[str, Any]:
@@ -509,7 +513,7 @@ async def sincronizar_guias_desde_cod_pendientes(
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/bonos-disponibles")
-async def obtener_bonos_disponibles(
+def obtener_bonos_disponibles(
     client: bigquery.Client = Depends(get_bigquery_client),
     current_user: dict = Depends(get_current_user)
 ) -> Dict[str, Any]:
@@ -518,7 +522,7 @@ async def obtener_bonos_disponibles(
     """
     try:
         user_email = current_user.get("correo") or current_user.get("sub")
-        employee_id = obtener_employee_id_usuario(user_email, client)
+        employee_id = current_user.get("employee_id") or obtener_employee_id_usuario(user_email, client)
         
         if not employee_id:
             return {
@@ -642,7 +646,8 @@ def crear_bono_conductor(
         }
         
         table_id = f"{PROJECT_ID}.{DATASET}.conductor_bonos"
-        errors = client.insert_rows_json(table_id, [bono])
+        # Load job en vez de streaming: el saldo del bono se actualiza con UPDATE al usarlo
+        errors = cargador_masivo.cargar(table_id, [bono])
         
         if errors:
             raise Exception(f"Error guardando bono: {errors}")
@@ -660,11 +665,11 @@ def crear_bono_conductor(
             "guias_aplicadas": None
         }
         
-        table_id = f"{PROJECT_ID}.{DATASET}.bono_movimientos"
-        errors = client.insert_rows_json(table_id, [movimiento])
-        
+        # Rastro de auditoría del saldo: se escribe antes de responder. Solo se
+        # inserta (nunca se actualiza), así que va por streaming sin gastar load jobs
+        errors = client.insert_rows_json(f"{PROJECT_ID}.{DATASET}.bono_movimientos", [movimiento])
         if errors:
-            raise Exception(f"Error registrando movimiento: {errors}")
+            raise Exception(f"Error registrando movimiento del bono: {errors}")
             
         return bono
         
@@ -743,11 +748,11 @@ def usar_bono(
             "guias_aplicadas": json.dumps(guias)
         }
         
-        table_id = f"{PROJECT_ID}.{DATASET}.bono_movimientos"
-        errors = client.insert_rows_json(table_id, [movimiento])
-        
+        # Rastro de auditoría del saldo: se escribe antes de responder. Solo se
+        # inserta (nunca se actualiza), así que va por streaming sin gastar load jobs
+        errors = client.insert_rows_json(f"{PROJECT_ID}.{DATASET}.bono_movimientos", [movimiento])
         if errors:
-            raise Exception(f"Error registrando movimiento: {errors}")
+            raise Exception(f"Error registrando movimiento del bono: {errors}")
             
         return {
             "mensaje": "Bono usado exitosamente",
@@ -794,7 +799,7 @@ def verificar_vencimiento_bonos(client: bigquery.Client):
         raise Exception(f"Error en verificación de vencimientos: {str(e)}")
 
 @router.post("/verificar-datos-conductor")
-async def verificar_datos_conductor(
+def verificar_datos_conductor(
     client: bigquery.Client = Depends(get_bigquery_client),
     current_user: dict = Depends(get_current_user)
 ) -> Dict[str, Any]:
@@ -803,7 +808,7 @@ async def verificar_datos_conductor(
     """
     try:
         user_email = current_user.get("correo") or current_user.get("sub")
-        employee_id = obtener_employee_id_usuario(user_email, client)
+        employee_id = current_user.get("employee_id") or obtener_employee_id_usuario(user_email, client)
         
         if not employee_id:
             return {"error": "Conductor no encontrado en ninguna tabla"}
@@ -864,7 +869,7 @@ async def verificar_datos_conductor(
 
 # ✅ MANTENER ENDPOINTS EXISTENTES PARA COMPATIBILIDAD
 @router.get("/estadisticas-liquidacion")
-async def obtener_estadisticas_liquidacion(
+def obtener_estadisticas_liquidacion(
     client: bigquery.Client = Depends(get_bigquery_client),
     current_user: dict = Depends(get_current_user)
 ) -> Dict[str, Any]:
@@ -873,7 +878,7 @@ async def obtener_estadisticas_liquidacion(
     """
     try:
         user_email = current_user.get("correo") or current_user.get("sub")
-        employee_id = obtener_employee_id_usuario(user_email, client)
+        employee_id = current_user.get("employee_id") or obtener_employee_id_usuario(user_email, client)
         
         if not employee_id:
             return {"error": "Conductor no encontrado"}
@@ -938,7 +943,7 @@ async def obtener_estadisticas_liquidacion(
         raise HTTPException(status_code=500, detail=f"Error obteniendo estadísticas: {str(e)}")
 
 @router.get("/validar-guias-estado-360")
-async def validar_guias_estado_360(
+def validar_guias_estado_360(
     request: Request,
     client: bigquery.Client = Depends(get_bigquery_client)
 ) -> Dict[str, Any]:
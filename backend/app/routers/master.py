@@ -2,6 +2,9 @@ from fastapi import APIRouter, HTTPException, Depends, Query, Request, Header
 from fastapi.responses import StreamingResponse
 from google.cloud import bigquery
 from app.dependencies import get_current_user
+from app.core.bigquery_client import get_bigquery_client
+from app.core.cache import cacheado
+from app.core.resultados_arrow import consultar_dicts
 from typing import List, Dict, Any, Optional
 from datetime import datetime, timedelta
 import logging
@@ -9,6 +12,8 @@ import csv
 import io
 import os
 import json
+import asyncio
+import time
 import concurrent.futures
 
 # Configurar logging
@@ -20,16 +25,6 @@ router = APIRouter(prefix="/master", tags=["Master"])
 PROJECT_ID = "datos-clientes-441216"
 DATASET = "Conciliaciones"
 
-try:
-    bq_client = bigquery.Client(project=PROJECT_ID)
-    logger.info(f"✅ Cliente BigQuery inicializado para proyecto: {PROJECT_ID}")
-except Exception as e:
-    logger.error(f"❌ Error inicializando BigQuery: {e}")
-    raise HTTPException(
-        status_code=500,
-        detail=f"Error inicializando conexión con BigQuery: {str(e)}"
-    )
-
 def verificar_master(
     request: Request,
     authorization: Optional[str] = Header(None),
@@ -77,13 +72,25 @@ def verificar_master(
     logger.error("❌ No se encontraron credenciales válidas")
     raise HTTPException(status_code=401, detail="Credenciales de autenticación requeridas")
 
+async def _consulta_cronometrada(bq_client, query: str):
+    """Ejecuta una consulta del dashboard y devuelve (filas, milisegundos)"""
+    inicio = time.perf_counter()
+    filas = await bq_client.query_async(query)
+    return filas, round((time.perf_counter() - inicio) * 1000, 1)
+
 @router.get("/dashboard")
-async def get_dashboard_data(current_user: dict = Depends(verificar_master)):
+@cacheado("master_dashboard", tablas=("COD_pendientes_v1",))
+async def get_dashboard_data(
+    current_user: dict = Depends(verificar_master),
+    client: bigquery.Client = Depends(get_bigquery_client)
+):
     try:
         logger.info(f"📊 Obteniendo datos del dashboard para {current_user.get('sub', 'usuario desconocido')}")
         
-        # Obtener estadísticas globales
-        logger.info("1️⃣ Ejecutando query de estadísticas globales...")
+        # Las cuatro consultas son independientes: se arman aquí y se lanzan
+        # en paralelo más abajo, así la latencia es la de la más lenta
+
+        # Estadísticas globales
         stats_query = f"""
         WITH GuiaStats AS (
             SELECT 
@@ -100,14 +107,8 @@ async def get_dashboard_data(current_user: dict = Depends(verificar_master)):
         )
         SELECT * FROM GuiaStats;
         """
-        
-        logger.info(f"Query a ejecutar: {stats_query}")
-        stats_job = bq_client.query(stats_query)
-        stats_result = next(stats_job.result())
-        logger.info("✅ Estadísticas globales obtenidas exitosamente")
 
-        # Obtener ranking de carriers        
-        logger.info("2️⃣ Ejecutando query de ranking de carriers...")
+        # Ranking de carriers
         carriers_query = f"""
         SELECT 
             carrier_id,
@@ -128,13 +129,8 @@ async def get_dashboard_data(current_user: dict = Depends(verificar_master)):
         ORDER BY total_guias DESC
         LIMIT 10
         """
-        
-        carriers_job = bq_client.query(carriers_query)
-        carriers_result = [dict(row) for row in carriers_job.result()]
-        logger.info("✅ Ranking de carriers obtenido exitosamente")
 
-        # Obtener análisis por ciudades
-        logger.info("3️⃣ Ejecutando query de análisis por ciudades...")
+        # Análisis por ciudades
         ciudades_query = f"""
         SELECT 
             Ciudad,
@@ -150,13 +146,8 @@ async def get_dashboard_data(current_user: dict = Depends(verificar_master)):
         ORDER BY total_guias DESC
         LIMIT 10
         """
-        
-        ciudades_job = bq_client.query(ciudades_query)
-        ciudades_result = [dict(row) for row in ciudades_job.result()]
-        logger.info("✅ Análisis por ciudades obtenido exitosamente")
 
-        # Obtener tendencias mensuales
-        logger.info("4️⃣ Ejecutando query de tendencias mensuales...")
+        # Tendencias mensuales
         tendencias_query = f"""
         SELECT 
             FORMAT_DATE('%Y-%m', Status_Date) as mes,
@@ -172,9 +163,32 @@ async def get_dashboard_data(current_user: dict = Depends(verificar_master)):
         ORDER BY mes DESC
         """
 
-        tendencias_job = bq_client.query(tendencias_query)
-        tendencias_result = [dict(row) for row in tendencias_job.result()]
-        logger.info("✅ Tendencias mensuales obtenidas exitosamente")
+        logger.info("🚀 Ejecutando en paralelo las 4 consultas del dashboard...")
+        inicio_total = time.perf_counter()
+        (
+            (stats_rows, ms_stats),
+            (carriers_rows, ms_carriers),
+            (ciudades_rows, ms_ciudades),
+            (tendencias_rows, ms_tendencias),
+        ) = await asyncio.gather(
+            _consulta_cronometrada(client, stats_query),
+            _consulta_cronometrada(client, carriers_query),
+            _consulta_cronometrada(client, ciudades_query),
+            _consulta_cronometrada(client, tendencias_query),
+        )
+        tiempos_ms = {
+            "stats_globales": ms_stats,
+            "ranking_carriers": ms_carriers,
+            "analisis_ciudades": ms_ciudades,
+            "tendencias_mensuales": ms_tendencias,
+            "total": round((time.perf_counter() - inicio_total) * 1000, 1),
+        }
+        logger.info(f"✅ Consultas del dashboard completadas: {tiempos_ms}")
+
+        stats_result = stats_rows[0]
+        carriers_result = [dict(row) for row in carriers_rows]
+        ciudades_result = [dict(row) for row in ciudades_rows]
+        tendencias_result = [dict(row) for row in tendencias_rows]
 
         # Calcular alertas
         alertas = []
@@ -202,7 +216,8 @@ async def get_dashboard_data(current_user: dict = Depends(verificar_master)):
             "tendencias_mensuales": tendencias_result,
             "alertas": alertas,
             "periodo_analisis": "Desde 9 de junio 2025",
-            "fecha_actualizacion": datetime.now().isoformat()
+            "fecha_actualizacion": datetime.now().isoformat(),
+            "tiempos_ms": tiempos_ms
         }
 
         logger.info("✅ Dashboard generado exitosamente")
@@ -218,11 +233,12 @@ async def get_dashboard_data(current_user: dict = Depends(verificar_master)):
 @router.get("/export/data")
 async def export_dashboard_data(
     formato: str = Query("json", regex="^(json|csv)$"),
-    current_user: dict = Depends(verificar_master)
+    current_user: dict = Depends(verificar_master),
+    bq_client: bigquery.Client = Depends(get_bigquery_client)
 ):
     try:
         # Reutilizar la función del dashboard
-        data = await get_dashboard_data(current_user)
+        data = await get_dashboard_data(current_user, bq_client)
         
         if formato == "json":
             return data
@@ -247,7 +263,8 @@ async def get_carriers_guias_entregadas(
     estado_pago: Optional[str] = Query(None, description="Filtro por estado: pendiente|pagado"),
     page: int = Query(1, ge=1, description="Número de página (inicia en 1)"),
     page_size: int = Query(100, ge=1, le=1000, description="Registros por página (máximo 1000)"),
-    current_user: dict = Depends(verificar_master)
+    current_user: dict = Depends(verificar_master),
+    bq_client: bigquery.Client = Depends(get_bigquery_client)
 ):
     """
     🚛 CARRIER MANAGEMENT: Obtiene todas las guías entregadas (estado 360) 
@@ -476,20 +493,18 @@ async def get_carriers_guias_entregadas(
             job_timeout_ms=60000  # 60 segundos en milisegundos
         )
         
-        # Usar ThreadPoolExecutor para timeout personalizado adicional
-        def ejecutar_query():
-            query_job = bq_client.query(optimized_query, job_config=job_config)
-            return query_job.result(timeout=45)  # 45 segundos timeout en result()
-        
-        with concurrent.futures.ThreadPoolExecutor() as executor:
-            future = executor.submit(ejecutar_query)
-            try:
-                results = future.result(timeout=50)  # 50 segundos timeout total
-            except concurrent.futures.TimeoutError:
-                raise HTTPException(
-                    status_code=504,
-                    detail="Consulta demoró demasiado tiempo. Intenta reducir el rango de fechas o usar más filtros."
-                )
+        # Timeout de 45s en result() y 50s total sin bloquear el event loop
+        try:
+            # Conversión por columna (Arrow): las filas llegan como dicts listos para JSON
+            results = await asyncio.wait_for(
+                bq_client.ejecutar_async(consultar_dicts, bq_client, optimized_query, job_config, None, 45),
+                timeout=50
+            )
+        except (asyncio.TimeoutError, concurrent.futures.TimeoutError):
+            raise HTTPException(
+                status_code=504,
+                detail="Consulta demoró demasiado tiempo. Intenta reducir el rango de fechas o usar más filtros."
+            )
         
         # Procesar resultados
         guias_result = []
@@ -497,7 +512,7 @@ async def get_carriers_guias_entregadas(
         resumen_data = {}
         
         for row in results:
-            row_dict = dict(row)
+            row_dict = row
             if row_dict['tipo'] == 'data':
                 # Datos de guías
                 guia_data = {k: v for k, v in row_dict.items() if k not in ['tipo', 'total_count', 'total_guias', 'valor_total', 'guias_pendientes', 'guias_pagadas', 'valor_pendiente', 'valor_pagado']}
@@ -612,7 +627,8 @@ async def export_carriers_data(
     fecha_fin: Optional[str] = Query(None),
     carrier: Optional[str] = Query(None),
     estado_pago: Optional[str] = Query(None),
-    current_user: dict = Depends(verificar_master)
+    current_user: dict = Depends(verificar_master),
+    bq_client: bigquery.Client = Depends(get_bigquery_client)
 ):
     """
     📤 EXPORTAR: Exporta datos de carriers en diferentes formatos
@@ -724,8 +740,7 @@ async def export_carriers_data(
             job_timeout_ms=120000  # 2 minutos para exportación
         )
         
-        query_job = bq_client.query(export_query, job_config=job_config)
-        results = query_job.result(timeout=90)  # 90 segundos timeout
+        results = await bq_client.query_async(export_query, job_config=job_config, timeout=90)  # 90 segundos timeout
         
         # Convertir resultados a lista de diccionarios
         guias_data = [dict(row) for row in results]
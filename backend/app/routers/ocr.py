@@ -4,10 +4,16 @@ Sin errores de sintaxis y con API key funcionando
 """
 
 from fastapi import APIRouter, UploadFile, File, HTTPException
-from fastapi.responses import JSONResponse
-from typing import Dict, List, Any, Optional, Tuple
+from fastapi.responses import JSONResponse, StreamingResponse
+from typing import AsyncGenerator, Dict, List, Any, Optional, Tuple
 from datetime import datetime
+import asyncio
+import hashlib
 import logging
+from app.core.config import OCR_LOTE_CONCURRENCIA, OCR_LOTE_MAX_ARCHIVOS
+from app.core.serializacion import dumps_json
+from app.services.cache_ocr import cache_ocr
+from app.services.ocr_motores import estado_pool
 from app.services.openai_extractor import enhanced_extractor
 
 # Configurar logging
@@ -40,6 +46,76 @@ async def extraer_pago_con_ia(file: UploadFile = File(...)):
             }
         )
 
+@router.post("/extraer-lote")
+async def extraer_lote_con_ia(files: List[UploadFile] = File(...)):
+    """
+    Extracción OCR de varios comprobantes (pagos con varios comprobante_N).
+
+    Las imágenes idénticas se procesan una sola vez y como máximo
+    OCR_LOTE_CONCURRENCIA a la vez. La respuesta es NDJSON: una línea
+    {"tipo": "resultado", "indice", "archivo", "duplicado_de", "resultado"}
+    por archivo, en el orden en que terminan, y al final una línea
+    {"tipo": "resumen", ...}.
+    """
+    if len(files) > OCR_LOTE_MAX_ARCHIVOS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Máximo {OCR_LOTE_MAX_ARCHIVOS} comprobantes por lote"
+        )
+
+    archivos = [(file.filename, await file.read()) for file in files]
+
+    # Índices de los archivos con el mismo contenido (el primero se procesa)
+    grupos: Dict[str, List[int]] = {}
+    for indice, (_, contents) in enumerate(archivos):
+        grupos.setdefault(hashlib.sha256(contents).hexdigest(), []).append(indice)
+
+    semaforo = asyncio.Semaphore(OCR_LOTE_CONCURRENCIA)
+
+    async def procesar(indices: List[int]) -> Tuple[List[int], Dict[str, Any]]:
+        async with semaforo:
+            try:
+                resultado = await enhanced_extractor.extraer_datos_contenido(archivos[indices[0]][1])
+            except Exception as e:
+                logger.error(f"❌ Error en extracción OCR de {archivos[indices[0]][0]}: {str(e)}")
+                resultado = {
+                    "error": True,
+                    "mensaje": "Error procesando comprobante de pago",
+                    "detalle": str(e)
+                }
+        return indices, resultado
+
+    async def generar_resultados() -> AsyncGenerator[str, None]:
+        inicio = datetime.now()
+        tareas = [asyncio.create_task(procesar(indices)) for indices in grupos.values()]
+        errores = 0
+        try:
+            for siguiente in asyncio.as_completed(tareas):
+                indices, resultado = await siguiente
+                errores += len(indices) if resultado.get("error") else 0
+                for indice in indices:
+                    yield dumps_json({
+                        "tipo": "resultado",
+                        "indice": indice,
+                        "archivo": archivos[indice][0],
+                        "duplicado_de": indices[0] if indice != indices[0] else None,
+                        "resultado": resultado
+                    }) + "\n"
+            yield dumps_json({
+                "tipo": "resumen",
+                "total_archivos": len(archivos),
+                "imagenes_unicas": len(grupos),
+                "errores": errores,
+                "tiempo_total": (datetime.now() - inicio).total_seconds()
+            }) + "\n"
+        finally:
+            # Si el cliente se desconecta no se siguen procesando comprobantes
+            for tarea in tareas:
+                tarea.cancel()
+
+    logger.info(f"📚 Lote OCR: {len(archivos)} archivos, {len(grupos)} imágenes distintas")
+    return StreamingResponse(generar_resultados(), media_type="application/x-ndjson")
+
 @router.get("/health")
 async def health_check():
     """
@@ -48,5 +124,7 @@ async def health_check():
     return {
         "status": "healthy",
         "engines_disponibles": enhanced_extractor.get_engines_status(),
+        "cache": cache_ocr.estadisticas(),
+        "pool_ocr": estado_pool(),
         "timestamp": datetime.now().isoformat()
     }
\ No newline at end of file
@@ -1,7 +1,8 @@
 from fastapi import APIRouter, UploadFile, Form
 from app.services.email_service import enviar_correo_pago
-from fastapi import APIRouter, HTTPException, UploadFile, Form
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, Form
 from google.cloud import bigquery
+from app.core.bigquery_client import get_bigquery_client
 from uuid import uuid4
 from typing import List
 from pydantic import BaseModel
@@ -10,7 +11,6 @@ import os
 
 
 router = APIRouter()
-client = bigquery.Client()
 
 
 class PagoCliente(BaseModel):
@@ -24,7 +24,7 @@ class PagoCliente(BaseModel):
     creado_por: str
 
 @router.post("/pago-cliente/registrar")
-def registrar_pago_cliente(pago: PagoCliente):
+def registrar_pago_cliente(pago: PagoCliente, client: bigquery.Client = Depends(get_bigquery_client)):
     try:
         id_pago = str(uuid4())
 
@@ -13,8 +13,26 @@ import json
 import traceback
 import logging
 import concurrent.futures
+import asyncio
+import aiofiles
 from pathlib import Path
 from app.dependencies import get_current_user
+from app.core.bigquery_client import get_bigquery_client
+from app.core.cache import cache_agregados, invalida, registrar_fechas_modificadas
+from app.core.config import PAGINACION_CURSOR_TTL
+from app.core.consultas import parametro_lista
+from app.core.exportacion import consultar_paginado, generar, generar_json, respuesta_streaming
+from app.core.paginacion import ConjuntoPaginado, decodificar_cursor, huella_filtros
+from app.core.secuencias import siguiente_id_transaccion
+from app.services.registro_pago_service import (
+    SQL_DATOS_TRACKINGS,
+    SQL_REGISTRAR_PAGO,
+    SQL_VERIFICAR_REFERENCIA,
+    config_datos_trackings,
+    config_registrar_pago,
+    config_verificar_referencia,
+)
+from app.utils.tiempos import TiemposEtapas
 from pydantic import BaseModel
 from .guias import obtener_employee_id_usuario
 
@@ -28,22 +46,17 @@ router = APIRouter(prefix="/pagos", tags=["Pagos"])
 PROJECT_ID = "datos-clientes-441216"
 DATASET_CONCILIACIONES = "Conciliaciones"
 COMPROBANTES_DIR = "comprobantes"
+# Resultado materializado de /pendientes-contabilidad, por filtros; se invalida con sus tablas
+CONJUNTO_PENDIENTES_CONTABILIDAD = "pendientes_contabilidad_paginado"
+cache_agregados.registrar(
+    CONJUNTO_PENDIENTES_CONTABILIDAD,
+    ("pagosconductor", "banco_movimientos", "COD_pendientes_v1", "guias_liquidacion")
+)
 MAX_FILE_SIZE = 10 * 1024 * 1024  # 10MB para comprobantes
 
 # Crear directorio de comprobantes si no existe
 os.makedirs(COMPROBANTES_DIR, exist_ok=True)
 
-def get_bigquery_client() -> bigquery.Client:
-    """Obtiene cliente de BigQuery con manejo de errores"""
-    try:
-        return bigquery.Client(project=PROJECT_ID)
-    except Exception as e:
-        
-        raise HTTPException(
-            status_code=500, 
-            detail="Error de configuración de base de datos"
-        )
-
 def validar_archivo_comprobante(archivo: UploadFile) -> None:
     """Valida que el archivo de comprobante sea válido"""
     
@@ -91,9 +104,9 @@ async def guardar_comprobante(archivo: UploadFile) -> str:
             
             raise ValueError("Archivo vacío")
         
-        # Guardar archivo
-        with open(ruta_local, "wb") as f:
-            bytes_written = f.write(content)
+        # Guardar archivo sin bloquear el event loop
+        async with aiofiles.open(ruta_local, "wb") as f:
+            await f.write(content)
        
         
         # Verificar que se guardó correctamente
@@ -128,9 +141,29 @@ async def guardar_comprobante(archivo: UploadFile) -> str:
             detail=f"Error guardando comprobante de pago: {str(e)}"
         )
 
+async def guardar_comprobantes(archivos: List[UploadFile]) -> List[str]:
+    """Guarda varios comprobantes en paralelo; si alguno falla borra los demás"""
+    resultados = await asyncio.gather(*(guardar_comprobante(a) for a in archivos), return_exceptions=True)
+    errores = [r for r in resultados if isinstance(r, BaseException)]
+    if errores:
+        eliminar_comprobantes([r for r in resultados if isinstance(r, str)])
+        raise errores[0]
+    return resultados
+
+def eliminar_comprobantes(comprobante_urls: List[str]) -> None:
+    """Borra los archivos locales de comprobantes ya guardados"""
+    for url in comprobante_urls:
+        try:
+            filepath = os.path.join(COMPROBANTES_DIR, url.split('/')[-1])
+            if os.path.exists(filepath):
+                os.remove(filepath)
+        except OSError:
+            pass
+
 
 
 @router.post("/registrar-conductor")
+@invalida("pagosconductor")
 async def registrar_pago_conductor(
     request: Request,
     correo: str = Form(..., description="Correo del conductor"),
@@ -141,18 +174,27 @@ async def registrar_pago_conductor(
     entidad: str = Form(..., description="Entidad bancaria"),
     referencia: str = Form(..., description="Referencia única del pago"),
     guias: str = Form(..., description="JSON con las guías asociadas"),
-    comprobante: UploadFile = File(None, description="Imagen/PDF del comprobante (compatibilidad)")
+    comprobante: UploadFile = File(None, description="Imagen/PDF del comprobante (compatibilidad)"),
+    client: bigquery.Client = Depends(get_bigquery_client)
 ):
     """
-    Registra un pago realizado por un conductor con validaciones robustas
+    Registra un pago realizado por un conductor con validaciones robustas.
+
+    Flujo: validaciones locales → en paralelo (referencia duplicada, datos
+    de COD_pendientes_v1, employee_id y escritura de los comprobantes) →
+    reserva del Id_Transaccion → un solo script con el INSERT y el MERGE en
+    guias_liquidacion → bono por excedente. La respuesta incluye
+    ``tiempos_ms`` con la duración de cada etapa.
     """
-    client = get_bigquery_client()
+    tiempos = TiemposEtapas()
     comprobante_urls = []
     # LOG: Mostrar los campos recibidos
     logger.info(f"Campos recibidos: correo={correo}, valor_pago_str={valor_pago_str}, fecha_pago={fecha_pago}, hora_pago={hora_pago}, tipo={tipo}, entidad={entidad}, referencia={referencia}")
     logger.info(f"Archivos recibidos: {request.headers.get('content-type')}")
+    registrar_fechas_modificadas(fecha_pago)
     # Obtener todos los archivos enviados como comprobante_0, comprobante_1, ...
-    form = await request.form()
+    with tiempos.etapa("formulario"):
+        form = await request.form()
     archivos = []
     tipos_individuales = []
     
@@ -176,14 +218,8 @@ async def registrar_pago_conductor(
         logger.info(f"   - tipo_comprobante_{idx}: {tipo_individual}")
     logger.info(f"   - Tipo principal (compatibilidad): {tipo}")
 
-    # Obtener el nuevo Id_Transaccion autoincrementable SOLO UNA VEZ POR LOTE (request)
-    # Todas las guías asociadas en este request compartirán el mismo Id_Transaccion
-    query_id = f"SELECT MAX(Id_Transaccion) as max_id FROM `{PROJECT_ID}.{DATASET_CONCILIACIONES}.pagosconductor`"
-    result_id = list(client.query(query_id).result())
-    nuevo_id_transaccion = (result_id[0].max_id or 0) + 1
-    # Este valor se asigna a todas las filas generadas en este request, sin incrementarse por cada inserción
-
     try:
+        # PASO 1: Validaciones locales (sin I/O)
         try:
             valor_pago = float(valor_pago_str.replace(',', '').replace('$', ''))
             if valor_pago <= 0:
@@ -215,33 +251,6 @@ async def registrar_pago_conductor(
                 # Ya está en formato correcto
             except ValueError:
                 raise HTTPException(status_code=400, detail="Formato de hora inválido (HH:MM o HH:MM:SS)")
-        # PASO 2: Validar referencia única
-        
-        verificacion_ref = client.query("""
-                SELECT COUNT(*) as total
-                FROM `{project}.{dataset}.pagosconductor`
-                WHERE referencia_pago = @referencia
-                AND valor_total_consignacion = @valor
-                AND fecha_pago = @fecha
-                AND hora_pago = @hora
-            """.format(project=PROJECT_ID, dataset=DATASET_CONCILIACIONES),
-                job_config=bigquery.QueryJobConfig(
-                    query_parameters=[
-                        bigquery.ScalarQueryParameter("referencia", "STRING", referencia),
-                        bigquery.ScalarQueryParameter("valor", "FLOAT64", valor_pago),
-                        bigquery.ScalarQueryParameter("fecha", "DATE", fecha_pago),
-                        bigquery.ScalarQueryParameter("hora", "TIME", hora_pago),
-                    ]
-                )
-            ).result()
-
-
-
-        if next(verificacion_ref)["total"] > 0:
-            raise HTTPException(
-                status_code=409,
-                detail="Ya existe un pago registrado con esa referencia"
-            )
 
         try:
             lista_guias = json.loads(guias)
@@ -253,7 +262,7 @@ async def registrar_pago_conductor(
         except json.JSONDecodeError:
             raise HTTPException(status_code=400, detail="Formato de guías inválido (JSON requerido)")
 
-        # PASO 5: 🔥 CORREGIDO: Obtener trackings únicos para consultar COD_pendientes_v1
+        # 🔥 CORREGIDO: Obtener trackings únicos para consultar COD_pendientes_v1
         trackings_guias = []
         for guia in lista_guias:
             tracking = str(guia.get("tracking", "")).strip()
@@ -266,72 +275,51 @@ async def registrar_pago_conductor(
         if not trackings_unicos:
             raise HTTPException(status_code=400, detail="No se encontraron trackings válidos en las guías")
 
+        for archivo in archivos:
+            validar_archivo_comprobante(archivo)
+
         logger.info(f"📊 Trackings únicos para consultar COD_pendientes_v1: {trackings_unicos}")
-        
-        trackings_str = "', '".join(trackings_unicos)
 
-        # 🔥 CORREGIDO: Usar trackings para buscar en COD_pendientes_v1
-        query_clientes = f"""
-            SELECT 
-                tracking_number,
-                Cliente as cliente, 
-                Ciudad as ciudad,
-                Departamento as departamento,
-                Valor as valor,
-                Status_Date as status_date,
-                Status_Big as status_big,
-                Carrier as carrier,
-                carrier_id,
-                Empleado as conductor_nombre_completo,
-                Employee_id as employee_id
-            FROM `{PROJECT_ID}.{DATASET_CONCILIACIONES}.COD_pendientes_v1`
-            WHERE tracking_number IN ('{trackings_str}')
-        """
+        # PASO 2: Consultas independientes y escritura de comprobantes en paralelo
+        (
+            verificacion_ref,
+            clientes_data,
+            employee_id,
+            comprobante_urls,
+        ) = await _ejecutar_en_paralelo(
+            tiempos.medir("verificar_referencia", client.query_async(
+                SQL_VERIFICAR_REFERENCIA,
+                job_config=config_verificar_referencia(referencia, valor_pago, fecha_pago, hora_pago),
+            )),
+            tiempos.medir("datos_trackings", _consultar_datos_trackings(client, trackings_unicos)),
+            tiempos.medir("employee_id", client.ejecutar_async(obtener_employee_id_usuario, correo, client)),
+            tiempos.medir("comprobantes", guardar_comprobantes(archivos)),
+            al_fallar={3: eliminar_comprobantes},
+        )
 
-        try:
-            resultado_clientes = client.query(query_clientes).result()
-            clientes_data = {
-                row["tracking_number"]: {
-                    "cliente": row["cliente"],
-                    "ciudad": row["ciudad"],
-                    "departamento": row["departamento"],
-                    "valor": row["valor"],  # 🔥 Este será el valor de COD_pendientes_v1.Valor
-                    "status_date": row["status_date"],
-                    "status_big": row["status_big"],
-                    "carrier": row["carrier"],
-                    "carrier_id": row["carrier_id"],
-                    "conductor_nombre_completo": row["conductor_nombre_completo"],
-                    "employee_id": row["employee_id"]
-                } for row in resultado_clientes
-            }
-            
-            # 🔥 NUEVO: Logging para verificar que se obtuvieron datos de BD por tracking
-            logger.info(f"📊 Trackings encontrados en COD_pendientes_v1: {len(clientes_data)}")
-            for tracking, data in clientes_data.items():
-                logger.info(f"✅ Tracking {tracking}: Cliente={data['cliente']}, Ciudad={data.get('ciudad', '')}, Valor BD={data['valor']}")
-            
-        except Exception as e:
-            logger.error(f"❌ Error consultando COD_pendientes_v1: {e}")
-            clientes_data = {}
+        if verificacion_ref[0]["total"] > 0:
+            raise HTTPException(
+                status_code=409,
+                detail="Ya existe un pago registrado con esa referencia"
+            )
 
+        # Todas las guías asociadas en este request compartirán el mismo Id_Transaccion,
+        # reservado de forma atómica: dos registros simultáneos nunca comparten ID.
+        # Se reserva después de descartar duplicados para que un 409 no consuma
+        # IDs; solo un fallo posterior (inserción) deja un hueco en la secuencia
+        nuevo_id_transaccion = await tiempos.medir(
+            "id_transaccion", client.ejecutar_async(siguiente_id_transaccion)
+        )
 
-        # PASO 6: Guardar comprobantes
-        for idx, archivo in enumerate(archivos):
-            logger.info(f"Guardando comprobante {idx+1}: {getattr(archivo, 'filename', 'sin nombre')}")
-            url = await guardar_comprobante(archivo)
-            comprobante_urls.append(url)
         # Para compatibilidad, usar el primer comprobante como comprobante_url principal
         comprobante_url = comprobante_urls[0] if comprobante_urls else None
 
-        # PASO 7: Preparar datos para inserción
-        
+        # PASO 3: Preparar datos para inserción
         creado_en = datetime.utcnow()
-        filas = []
 
         # Calcular valor_bonos y valor_total_combinado
         valor_bonos = 0.0
         referencia_bonos = None
-        valor_total_combinado = valor_pago  # Por defecto solo efectivo
 
         # Si las guías tienen campo 'bono_aplicado', sumar
         for guia in lista_guias:
@@ -345,30 +333,10 @@ async def registrar_pago_conductor(
 
         valor_total_combinado = valor_pago + valor_bonos
 
-        # 🔎 FASE 2: Establecer estado
-
-
         estado_conciliacion = "pendiente_conciliacion"
 
         filas = []
 
-        # Calcular valor_bonos y valor_total_combinado
-        valor_bonos = 0.0
-        referencia_bonos = None
-        valor_total_combinado = valor_pago  # Por defecto solo efectivo
-
-        # Si las guías tienen campo 'bono_aplicado', sumar
-        for guia in lista_guias:
-            if isinstance(guia, dict) and "bono_aplicado" in guia and guia["bono_aplicado"]:
-                try:
-                    valor_bonos += float(guia["bono_aplicado"])
-                except Exception:
-                    pass
-                if "referencia_bonos" in guia and guia["referencia_bonos"]:
-                    referencia_bonos = guia["referencia_bonos"]
-
-        valor_total_combinado = valor_pago + valor_bonos
-
         for i, guia in enumerate(lista_guias):
             referencia_value = str(guia.get("referencia", "")).strip()
             if not referencia_value:
@@ -457,231 +425,32 @@ async def registrar_pago_conductor(
 
         if not filas:
             raise HTTPException(status_code=400, detail="No se procesaron guías válidas")
-        
-        # Preparar valores para consulta SQL
-        valores_sql = []
-        for fila in filas:
-            def escape_value(value, field_type='STRING'):
-                if value is None:
-                    return 'NULL'
-                elif field_type == 'STRING':
-                    escaped = str(value).replace("'", "''")
-                    return f"'{escaped}'"
-                elif field_type in ['NUMERIC', 'FLOAT64']:
-                    return str(value)
-                elif field_type == 'DATE':
-                    return f"'{value}'"
-                elif field_type == 'TIMESTAMP':
-                    return f"TIMESTAMP('{value}')" if value else 'NULL'
-                else:
-                    return f"'{str(value)}'"
-            
-            valores_fila = f"""(
-                {escape_value(fila['referencia'])},
-                {escape_value(fila['valor'], 'NUMERIC')},
-                {escape_value(fila['fecha'], 'DATE')},
-                {escape_value(fila['entidad'])},
-                {escape_value(fila['estado'])},
-                {escape_value(fila['tipo'])},
-                {escape_value(fila['comprobante'])},
-                {escape_value(fila['novedades'])},
-                {escape_value(fila['creado_en'], 'TIMESTAMP')},
-                {escape_value(fila['creado_por'])},
-                {escape_value(fila['modificado_en'], 'TIMESTAMP')},
-                {escape_value(fila['modificado_por'])},
-                {escape_value(fila['hora_pago'])},
-                {escape_value(fila['correo'])},
-                {escape_value(fila['fecha_pago'], 'DATE')},
-                {escape_value(fila['id_string'])},
-                {escape_value(fila['referencia_pago'])},
-                {escape_value(fila['valor_total_consignacion'], 'NUMERIC')},
-                {escape_value(fila['tracking'])},
-                {escape_value(fila['cliente'])},
-                {escape_value(fila['estado_conciliacion'])}
-
-            )"""
-            valores_sql.append(valores_fila)
-        
-        # Ejecutar inserción
-        tabla = f"{PROJECT_ID}.{DATASET_CONCILIACIONES}.pagosconductor"
-        query = f"""
-        INSERT INTO `{tabla}` (
-            referencia, valor, fecha, entidad, estado, tipo, comprobante, 
-            novedades, creado_en, creado_por, modificado_en, modificado_por,
-            hora_pago, correo, fecha_pago, id_string, referencia_pago, 
-            valor_total_consignacion, tracking, cliente,
-            estado_conciliacion, Id_Transaccion
-        ) VALUES {', '.join([vs[:-1] + f", {escape_value(nuevo_id_transaccion, 'NUMERIC')})" for vs in valores_sql])}
-        """
-        
-        # Timeout para inserción
-        with concurrent.futures.ThreadPoolExecutor() as executor:
-            future = executor.submit(lambda: client.query(query).result())
-            future.result(timeout=30)
-        
 
-        
- # PASO 9: Insertar o actualizar en guias_liquidacion (MERGE/UPSERT por guía)
+        # PASO 4: INSERT en pagosconductor + MERGE en guias_liquidacion en una sola transacción
+        pago_referencia_concatenado = ', '.join(dict.fromkeys(fila['referencia'] for fila in filas))
+        await tiempos.medir("registrar", client.query_async(
+            SQL_REGISTRAR_PAGO,
+            job_config=config_registrar_pago(
+                filas, correo, employee_id, nuevo_id_transaccion, pago_referencia_concatenado
+            ),
+            timeout=30,
+        ))
+
+        # PASO 5: 🔥 FASE 1: Registrar bono por excedente si aplica (no bloquea el pago)
         try:
-            todas_referencias_pago = []
-            for fila_ref in filas:
-                ref_individual = fila_ref.get('referencia', '').strip()
-                if ref_individual and ref_individual not in todas_referencias_pago:
-                    todas_referencias_pago.append(ref_individual)
-            
-            pago_referencia_concatenado = ', '.join(todas_referencias_pago)
-            
-            for fila in filas:
-                merge_query = f"""
-                MERGE `{PROJECT_ID}.{DATASET_CONCILIACIONES}.guias_liquidacion` AS gl
-                USING (SELECT
-                        @tracking AS tracking_number,
-                        @employee_id_usuario AS employee_id,
-                        @correo AS conductor_email,
-                        @cliente AS cliente,
-                        @ciudad AS ciudad,
-                        @departamento AS departamento,
-                        @valor_guia_bd AS valor_guia,
-                        @status_date AS status_date,
-                        @status_big AS status_big,
-                        @carrier AS carrier,
-                        @carrier_id AS carrier_id,
-                        @conductor_nombre_completo AS conductor_nombre_completo,
-                        @employee_id_cod AS employee_id_cod,
-                        @fecha_pago AS fecha_entrega,
-                        @pago_referencia_concatenado AS pago_referencia,
-                        @fecha_pago AS fecha_pago,
-                        @valor AS valor_pagado,
-                        @tipo AS metodo_pago,
-                        @id_transaccion AS Id_Transaccion,
-                        CURRENT_TIMESTAMP() AS fecha_creacion,
-                        CURRENT_TIMESTAMP() AS fecha_modificacion,
-                        @correo AS creado_por,
-                        @correo AS modificado_por
-                ) AS src
-                ON gl.tracking_number = src.tracking_number
-                WHEN MATCHED THEN
-                  UPDATE SET
-                    cliente = src.cliente,
-                    ciudad = src.ciudad,
-                    departamento = src.departamento,
-                    valor_guia = src.valor_guia,
-                    status_date = src.status_date,
-                    status_big = src.status_big,
-                    carrier = src.carrier,
-                    carrier_id = src.carrier_id,
-                    conductor_nombre_completo = src.conductor_nombre_completo,
-                    employee_id = COALESCE(src.employee_id_cod, src.employee_id),
-                    pago_referencia = src.pago_referencia,
-                    fecha_pago = src.fecha_pago,
-                    valor_pagado = src.valor_pagado,
-                    metodo_pago = src.metodo_pago,
-                    estado_liquidacion = 'pagado',
-                    fecha_modificacion = CURRENT_TIMESTAMP(),
-                    modificado_por = src.modificado_por
-                WHEN NOT MATCHED THEN
-                  INSERT (
-                    tracking_number, employee_id, conductor_email, cliente, ciudad, departamento,
-                    valor_guia, status_date, status_big, carrier, carrier_id, conductor_nombre_completo,
-                    fecha_entrega, pago_referencia, fecha_pago, valor_pagado, metodo_pago, Id_Transaccion,
-                    fecha_creacion, fecha_modificacion, creado_por, modificado_por, estado_liquidacion
-                  ) VALUES (
-                    src.tracking_number, COALESCE(src.employee_id_cod, src.employee_id), src.conductor_email, 
-                    src.cliente, src.ciudad, src.departamento, src.valor_guia, src.status_date, src.status_big,
-                    src.carrier, src.carrier_id, src.conductor_nombre_completo, src.fecha_entrega,
-                    src.pago_referencia, src.fecha_pago, src.valor_pagado, src.metodo_pago, src.Id_Transaccion,
-                    src.fecha_creacion, src.fecha_modificacion, src.creado_por, src.modificado_por, 'pagado'
-                  )
-                """
-                job_config = bigquery.QueryJobConfig(
-                    query_parameters=[
-                        bigquery.ScalarQueryParameter("tracking", "STRING", fila['tracking']),
-                        bigquery.ScalarQueryParameter("employee_id_usuario", "INTEGER", obtener_employee_id_usuario(correo, client) or 0),
-                        bigquery.ScalarQueryParameter("correo", "STRING", correo),
-                        bigquery.ScalarQueryParameter("cliente", "STRING", fila['cliente']),
-                        bigquery.ScalarQueryParameter("ciudad", "STRING", fila.get('ciudad', '')),
-                        bigquery.ScalarQueryParameter("departamento", "STRING", fila.get('departamento', '')),
-                        bigquery.ScalarQueryParameter("valor_guia_bd", "FLOAT64", fila.get('valor_guia_bd', 0)),
-                        bigquery.ScalarQueryParameter("status_date", "DATE", fila.get('status_date')),
-                        bigquery.ScalarQueryParameter("status_big", "STRING", fila.get('status_big', '')),
-                        bigquery.ScalarQueryParameter("carrier", "STRING", fila.get('carrier', '')),
-                        bigquery.ScalarQueryParameter("carrier_id", "INTEGER", fila.get('carrier_id')),
-                        bigquery.ScalarQueryParameter("conductor_nombre_completo", "STRING", fila.get('conductor_nombre_completo', '')),
-                        bigquery.ScalarQueryParameter("employee_id_cod", "INTEGER", fila.get('employee_id_cod')),
-                        bigquery.ScalarQueryParameter("valor", "FLOAT64", fila['valor']),
-                        bigquery.ScalarQueryParameter("fecha_pago", "DATE", fila['fecha_pago']),
-                        bigquery.ScalarQueryParameter("pago_referencia_concatenado", "STRING", pago_referencia_concatenado),
-                        bigquery.ScalarQueryParameter("tipo", "STRING", fila['tipo']),
-                        bigquery.ScalarQueryParameter("id_transaccion", "INTEGER", nuevo_id_transaccion),
-                    ]
+            with tiempos.etapa("bono_excedente"):
+                await _registrar_bono_excedente(
+                    client, correo, employee_id, referencia, lista_guias, valor_total_combinado
                 )
-                client.query(merge_query, job_config=job_config).result()
-            
         except Exception as e:
-            
-
-
-        # 🔥 FASE 1: Registrar bono por excedente si aplica
-       # 🔥 FASE 1: Registrar bono por excedente si aplica        try:
-            # Calcular excedente con validación
-            try:
-                valor_total_guias = sum(float(g.get('valor', 0)) for g in lista_guias)
-                excedente = round(valor_total_combinado - valor_total_guias, 2)
-                
-            except Exception as e:
-                
-                return
-
-            if excedente > 0:
-                
-
-                # Obtener y validar employee_id
-                employee_id = obtener_employee_id_usuario(correo, client)
-                if not employee_id:
-                    
-                    # Enviar notificación al administrador
-                    await notificar_error_bono(correo, excedente, "No se encontró employee_id")
-                    logger.warning(f"⚠️ No se pudo obtener el Employee ID para {correo}, no se registrará bono")
-                else:
-                    timestamp_actual = datetime.now()
-                    bono_id = f"BONO_EXCEDENTE_{timestamp_actual.strftime('%Y%m%d_%H%M%S')}_{employee_id}"
-                    
-                    # Construir descripción detallada
-                    descripcion = f"Excedente generado automáticamente del pago ref: {referencia}. Valor total pagado: ${valor_total_combinado}, Valor guías: ${valor_total_guias}"
-                    
-                    insertar_bono_query = f"""
-                    INSERT INTO `{PROJECT_ID}.{DATASET_CONCILIACIONES}.conductor_bonos` (
-                        id, tipo_bono, valor_bono, saldo_disponible, descripcion,
-                        fecha_generacion, referencia_pago_origen, estado_bono, employee_id,
-                        conductor_email, fecha_creacion, fecha_modificacion, 
-                        creado_por, modificado_por
-                    ) VALUES (
-                        @id, 'excedente', @valor, @valor, @descripcion,
-                        CURRENT_DATE(), @referencia, 'activo', @employee_id,
-                        @correo, CURRENT_TIMESTAMP(), CURRENT_TIMESTAMP(),
-                        @creado_por, @modificado_por
-                    )
-                    """
-                    
-                    # Configuración mejorada de parámetros
-                    job_config = bigquery.QueryJobConfig(query_parameters=[
-                        bigquery.ScalarQueryParameter("id", "STRING", bono_id),
-                        bigquery.ScalarQueryParameter("valor", "FLOAT64", excedente),
-                        bigquery.ScalarQueryParameter("descripcion", "STRING", descripcion),
-                        bigquery.ScalarQueryParameter("referencia", "STRING", referencia),
-                        bigquery.ScalarQueryParameter("employee_id", "INTEGER", employee_id),
-                        bigquery.ScalarQueryParameter("correo", "STRING", correo),
-                        bigquery.ScalarQueryParameter("creado_por", "STRING", correo),
-                        bigquery.ScalarQueryParameter("modificado_por", "STRING", correo),
-                    ])
-                    client.query(insertar_bono_query, job_config=job_config).result()
-                    
-        except Exception as e:
-            
             # ⚠️ IMPORTANTE: NO hacer raise aquí a menos que quieras que falle todo el pago
             # Solo registrar el error pero continuar con el flujo
+            logger.error(f"❌ Error registrando bono de excedente: {e}")
             logger.warning("⚠️ Continuando sin registrar bono de excedente")
 
+        resumen_tiempos = tiempos.resumen()
+        logger.info(f"⏱️ Registro de pago {referencia} (Id_Transaccion {nuevo_id_transaccion}): {resumen_tiempos}")
+
         # ✅ RESPUESTA EXITOSA - Esta debe estar FUERA del try/except del bono
         return {
             "mensaje": "✅ Pago híbrido registrado correctamente",
@@ -692,23 +461,19 @@ async def registrar_pago_conductor(
             "referencia_pago": referencia,
             "referencia_bonos": referencia_bonos,
             "comprobante_url": comprobante_url,
-            "tipo_pago": "híbrido" if valor_bonos > 0 else "efectivo"
+            "tipo_pago": "híbrido" if valor_bonos > 0 else "efectivo",
+            "tiempos_ms": resumen_tiempos,
         }
 
     except HTTPException:
+        eliminar_comprobantes(comprobante_urls)
         raise
     except Exception as e:
+        logger.error(f"❌ Error registrando pago {referencia}: {e}")
+        logger.error(traceback.format_exc())
 
-        
-        # Limpiar comprobante si hay error
-        if comprobante_url:
-            try:
-                filename = comprobante_url.split('/')[-1]
-                filepath = os.path.join(COMPROBANTES_DIR, filename)
-                if os.path.exists(filepath):
-                    os.remove(filepath)
-            except:
-                pass
+        # Limpiar comprobantes si hay error
+        eliminar_comprobantes(comprobante_urls)
         
         raise HTTPException(
             status_code=500, 
@@ -716,10 +481,106 @@ async def registrar_pago_conductor(
         )
 
 
+async def _ejecutar_en_paralelo(*tareas, al_fallar: Optional[Dict[int, Any]] = None) -> list:
+    """
+    ``asyncio.gather`` que espera a todas las tareas aunque alguna falle y,
+    si hubo error, entrega los resultados exitosos a ``al_fallar[indice]``
+    (por ejemplo para borrar archivos ya guardados) antes de relanzar.
+    """
+    resultados = await asyncio.gather(*tareas, return_exceptions=True)
+    errores = [r for r in resultados if isinstance(r, BaseException)]
+    if errores:
+        for indice, limpiar in (al_fallar or {}).items():
+            if not isinstance(resultados[indice], BaseException):
+                limpiar(resultados[indice])
+        raise errores[0]
+    return resultados
+
+
+async def _consultar_datos_trackings(client, trackings: List[str]) -> Dict[str, Dict[str, Any]]:
+    """Datos de COD_pendientes_v1 por tracking (vacío si la consulta falla)"""
+    try:
+        resultado_clientes = await client.query_async(
+            SQL_DATOS_TRACKINGS, job_config=config_datos_trackings(trackings)
+        )
+    except Exception as e:
+        logger.error(f"❌ Error consultando COD_pendientes_v1: {e}")
+        return {}
+
+    clientes_data = {
+        row["tracking_number"]: {
+            "cliente": row["cliente"],
+            "ciudad": row["ciudad"],
+            "departamento": row["departamento"],
+            "valor": row["valor"],  # 🔥 Este será el valor de COD_pendientes_v1.Valor
+            "status_date": row["status_date"],
+            "status_big": row["status_big"],
+            "carrier": row["carrier"],
+            "carrier_id": row["carrier_id"],
+            "conductor_nombre_completo": row["conductor_nombre_completo"],
+            "employee_id": row["employee_id"]
+        } for row in resultado_clientes
+    }
+
+    # 🔥 NUEVO: Logging para verificar que se obtuvieron datos de BD por tracking
+    logger.info(f"📊 Trackings encontrados en COD_pendientes_v1: {len(clientes_data)}")
+    for tracking, data in clientes_data.items():
+        logger.info(f"✅ Tracking {tracking}: Cliente={data['cliente']}, Ciudad={data.get('ciudad', '')}, Valor BD={data['valor']}")
+    return clientes_data
+
+
+async def _registrar_bono_excedente(client, correo: str, employee_id: Optional[int], referencia: str,
+                                    lista_guias: List[dict], valor_total_combinado: float) -> None:
+    """Crea un bono por la diferencia entre lo pagado y el valor de las guías"""
+    valor_total_guias = sum(float(g.get('valor', 0)) for g in lista_guias)
+    excedente = round(valor_total_combinado - valor_total_guias, 2)
+    if excedente <= 0:
+        return
+
+    if not employee_id:
+        # Enviar notificación al administrador
+        await notificar_error_bono(client, correo, excedente, "No se encontró employee_id")
+        logger.warning(f"⚠️ No se pudo obtener el Employee ID para {correo}, no se registrará bono")
+        return
+
+    timestamp_actual = datetime.now()
+    bono_id = f"BONO_EXCEDENTE_{timestamp_actual.strftime('%Y%m%d_%H%M%S')}_{employee_id}"
+
+    # Construir descripción detallada
+    descripcion = f"Excedente generado automáticamente del pago ref: {referencia}. Valor total pagado: ${valor_total_combinado}, Valor guías: ${valor_total_guias}"
+
+    insertar_bono_query = f"""
+    INSERT INTO `{PROJECT_ID}.{DATASET_CONCILIACIONES}.conductor_bonos` (
+        id, tipo_bono, valor_bono, saldo_disponible, descripcion,
+        fecha_generacion, referencia_pago_origen, estado_bono, employee_id,
+        conductor_email, fecha_creacion, fecha_modificacion, 
+        creado_por, modificado_por
+    ) VALUES (
+        @id, 'excedente', @valor, @valor, @descripcion,
+        CURRENT_DATE(), @referencia, 'activo', @employee_id,
+        @correo, CURRENT_TIMESTAMP(), CURRENT_TIMESTAMP(),
+        @creado_por, @modificado_por
+    )
+    """
+
+    job_config = bigquery.QueryJobConfig(query_parameters=[
+        bigquery.ScalarQueryParameter("id", "STRING", bono_id),
+        bigquery.ScalarQueryParameter("valor", "FLOAT64", excedente),
+        bigquery.ScalarQueryParameter("descripcion", "STRING", descripcion),
+        bigquery.ScalarQueryParameter("referencia", "STRING", referencia),
+        bigquery.ScalarQueryParameter("employee_id", "INTEGER", employee_id),
+        bigquery.ScalarQueryParameter("correo", "STRING", correo),
+        bigquery.ScalarQueryParameter("creado_por", "STRING", correo),
+        bigquery.ScalarQueryParameter("modificado_por", "STRING", correo),
+    ])
+    await client.query_async(insertar_bono_query, job_config=job_config)
+    logger.info(f"🎁 Bono por excedente {bono_id} registrado: ${excedente}")
+
+
 # 🔥 NUEVA RUTA: Consultar bonos disponibles por conductor
 
 @router.get("/bonos-disponibles")
-async def obtener_bonos_disponibles(
+def obtener_bonos_disponibles(
     client: bigquery.Client = Depends(get_bigquery_client),
     current_user: dict = Depends(get_current_user)
 ) -> Dict[str, Any]:
@@ -854,7 +715,7 @@ async def aplicar_bonos_conductor(
             ]
         )
 
-        bono_result = client.query(query_bono, job_config=job_config).result()
+        bono_result = await client.query_async(query_bono, job_config=job_config)
         bono = next(iter(bono_result), None)
 
         if not bono:
@@ -895,8 +756,7 @@ async def aplicar_bonos_conductor(
             ]
         )
 
-        update_job = client.query(update_query, job_config=job_config)
-        update_job.result()  # Esperar actualización
+        await client.query_async(update_query, job_config=job_config)  # Esperar actualización
 
         # Registrar uso del bono
         movimiento = {
@@ -911,12 +771,13 @@ async def aplicar_bonos_conductor(
             "guias_aplicadas": json.dumps(guias)
         }
 
-        table_id = f"{PROJECT_ID}.{DATASET_CONCILIACIONES}.bono_movimientos"
-        errors = client.insert_rows_json(table_id, [movimiento])
-
-        if errors:
-            
-            raise Exception("Error registrando movimiento del bono")
+        # Rastro de auditoría del saldo: se escribe antes de responder. Solo se
+        # inserta (nunca se actualiza), así que va por streaming sin gastar load jobs
+        errores_carga = await client.ejecutar_async(
+            client.insert_rows_json, f"{PROJECT_ID}.{DATASET_CONCILIACIONES}.bono_movimientos", [movimiento]
+        )
+        if errores_carga:
+            raise HTTPException(status_code=500, detail=f"Error registrando movimiento del bono: {errores_carga}")
 
         return {
             "mensaje": "Bono aplicado exitosamente",
@@ -941,6 +802,7 @@ def obtener_detalles_pago(
     hora_pago: str = Query(None, description="Filtrar por hora de pago (opcional)"),
     valor: float = Query(None, description="Filtrar por valor del pago (opcional)"),
     estado_conciliacion: str = Query(None, description="Filtrar por estado de conciliación (opcional)"),
+    client: bigquery.Client = Depends(get_bigquery_client),
 ):
     """
     Obtiene apariciones ÚNICAS del campo tracking para un pago seleccionado.
@@ -949,8 +811,6 @@ def obtener_detalles_pago(
     - Solo trae valor_guia de la tabla guias_liquidacion (sin COD_pendientes_v1)
     """
     try:
-        client = get_bigquery_client()
-        
         condiciones = []
         query_params = []
         
@@ -1090,13 +950,13 @@ def obtener_detalles_guias(
     referencia_pago: Optional[str] = Query(None, description="Referencia de pago (opcional)"),
     id_transaccion: Optional[int] = Query(None, description="Id_Transaccion para pagos agrupados (opcional)"),
     fecha_pago: Optional[str] = Query(None, description="Filtrar por fecha de pago (YYYY-MM-DD, opcional)"),  # 🔥 NUEVO
-    valor_pagado: Optional[float] = Query(None, description="Filtrar por valor pagado (opcional)")              # 🔥 NUEVO
+    valor_pagado: Optional[float] = Query(None, description="Filtrar por valor pagado (opcional)"),              # 🔥 NUEVO
+    client: bigquery.Client = Depends(get_bigquery_client)
 ):
     """
     Obtiene todas las guías asociadas a una referencia de pago o Id_Transaccion, con filtros opcionales.
     """
     try:
-        client = get_bigquery_client()
         condiciones = []
         query_params = []
 
@@ -1185,14 +1045,13 @@ def obtener_detalles_pago_cruces(
     correo: str = Query(None, description="Filtrar por correo del conductor (opcional)"),
     valor: float = Query(None, description="Filtrar por valor del pago (opcional)"),
     fecha_pago: str = Query(None, description="Filtrar por fecha de pago (YYYY-MM-DD, opcional)"),
-    estado_conciliacion: str = Query(None, description="Filtrar por estado de conciliación (opcional)")
+    estado_conciliacion: str = Query(None, description="Filtrar por estado de conciliación (opcional)"),
+    client: bigquery.Client = Depends(get_bigquery_client)
 ):
     """
     Obtiene los datos generales de un pago y los trackings asociados.
     """
     try:
-        client = get_bigquery_client()
-        
         # Consulta para obtener los datos generales del pago (solo una fila)
         query_pago = """
         SELECT 
@@ -1326,7 +1185,8 @@ def obtener_detalles_pago_cruces(
 @router.get("/imagenes-transaccion/{id_transaccion}")
 def obtener_imagenes_por_transaccion(
     id_transaccion: str,
-    current_user: dict = Depends(get_current_user)
+    current_user: dict = Depends(get_current_user),
+    client: bigquery.Client = Depends(get_bigquery_client)
 ):
     """
     Obtiene todas las imágenes de comprobantes asociadas a un Id_Transaccion específico.
@@ -1334,8 +1194,6 @@ def obtener_imagenes_por_transaccion(
     Si hay múltiples imágenes con el mismo Id_Transaccion, devuelve todas.
     """
     try:
-        client = get_bigquery_client()
-        
         # Primero verificar si el id_transaccion es válido (numérico)
         try:
             id_transaccion_num = int(id_transaccion)
@@ -1419,7 +1277,8 @@ def obtener_imagenes_por_referencia(
     correo: Optional[str] = Query(None, description="Filtrar por correo del conductor (opcional)"),
     valor: Optional[float] = Query(None, description="Filtrar por valor del pago (opcional)"),
     fecha_pago: Optional[str] = Query(None, description="Filtrar por fecha de pago (YYYY-MM-DD, opcional)"),
-    id_transaccion: Optional[int] = Query(None, description="Filtrar por Id_Transaccion (opcional)")
+    id_transaccion: Optional[int] = Query(None, description="Filtrar por Id_Transaccion (opcional)"),
+    client: bigquery.Client = Depends(get_bigquery_client)
 ):
     """
     Obtiene todas las imágenes relacionadas con una referencia de pago específica.
@@ -1430,8 +1289,6 @@ def obtener_imagenes_por_referencia(
     ✅ CORREGIDO: Elimina duplicados de URLs de imágenes
     """
     try:
-        client = get_bigquery_client()
-        
         # 🔥 LÓGICA MEJORADA: Buscar por Id_Transaccion primero
         condiciones = []
         parametros = []
@@ -1549,26 +1406,246 @@ def obtener_imagenes_por_referencia(
             detail=f"Error interno del servidor: {str(e)}"
         )
 
+def _materializar_pendientes_contabilidad(client, where_clause: str, parametros: list) -> ConjuntoPaginado:
+    """
+    Ejecuta una sola vez la consulta agrupada de pendientes de contabilidad
+    (sin LIMIT/OFFSET) y devuelve el conjunto ordenado por
+    (fecha_pago, creado_en, grupo) descendente para paginar por cursor.
+    """
+    # ⭐ CONSULTA PRINCIPAL CORREGIDA - SIN DUPLICADOS CON MOVIMIENTOS BANCARIOS INDIVIDUALES
+    main_query = f"""
+        WITH movimientos_relacionados AS (
+            -- Pre-calcular todos los movimientos bancarios relacionados por Id_Transaccion
+            SELECT DISTINCT
+                pc.Id_Transaccion,
+                pc.id_banco_asociado,
+                bm.id as banco_id,
+                bm.valor_banco,
+                bm.fecha as fecha_banco,
+                bm.descripcion
+            FROM `{PROJECT_ID}.{DATASET_CONCILIACIONES}.pagosconductor` pc
+            INNER JOIN `{PROJECT_ID}.{DATASET_CONCILIACIONES}.banco_movimientos` bm 
+                ON pc.id_banco_asociado = bm.id
+            WHERE pc.Id_Transaccion IS NOT NULL
+            AND pc.id_banco_asociado IS NOT NULL
+        ),
+        transacciones_banco_ids AS (
+            -- Agrupar todos los IDs de banco por Id_Transaccion
+            SELECT 
+                Id_Transaccion,
+                STRING_AGG(DISTINCT CAST(id_banco_asociado AS STRING), ', ') as todos_ids_banco,
+                STRING_AGG(DISTINCT 
+                    CONCAT('ID:', CAST(banco_id AS STRING), '|Valor:', CAST(valor_banco AS STRING), '|Fecha:', CAST(fecha_banco AS STRING))
+                    , ' || '
+                ) as movimientos_detalle,
+                SUM(DISTINCT valor_banco) as total_movimientos
+            FROM movimientos_relacionados
+            GROUP BY Id_Transaccion
+        )
+        SELECT 
+            CASE 
+                WHEN pc.Id_Transaccion IS NOT NULL THEN CAST(pc.Id_Transaccion AS STRING)
+                ELSE CONCAT(pc.referencia_pago, '|', pc.correo, '|', CAST(pc.fecha_pago AS STRING))
+            END as grupo_id,
+
+            -- 🔥 REFERENCIAS AGRUPADAS - CORREGIDO: usar 'referencia' para Id_Transaccion
+            CASE 
+                WHEN pc.Id_Transaccion IS NOT NULL AND COUNT(DISTINCT pc.referencia) > 1 THEN 
+                    STRING_AGG(DISTINCT pc.referencia, ', ')
+                WHEN pc.Id_Transaccion IS NOT NULL THEN 
+                    MAX(pc.referencia)
+                ELSE MAX(pc.referencia_pago)
+            END as referencia_pago_display,
+
+            -- Principal: usar referencia_pago para operaciones, pero referencia para display cuando hay Id_Transaccion
+            CASE 
+                WHEN pc.Id_Transaccion IS NOT NULL THEN MAX(pc.referencia)
+                ELSE MAX(pc.referencia_pago)
+            END as referencia_pago_principal,
+
+            -- Contar referencias correctas según el caso
+            CASE 
+                WHEN pc.Id_Transaccion IS NOT NULL THEN COUNT(DISTINCT pc.referencia)
+                ELSE COUNT(DISTINCT pc.referencia_pago)
+            END as num_referencias,
+
+            MAX(pc.correo) as correo_conductor,
+            MAX(pc.fecha_pago) as fecha,
+            MAX(FORMAT_TIMESTAMP('%Y-%m-%d', pc.creado_en, 'America/Bogota')) AS creado_en,
+            COALESCE(MAX(pc.valor_total_consignacion), SUM(pc.valor)) AS valor,
+            MAX(pc.hora_pago) AS hora_pago,
+            MAX(pc.entidad) AS entidad,
+            MAX(pc.tipo) AS tipo,
+            MAX(pc.comprobante) AS imagen,
+            COUNT(DISTINCT pc.tracking) AS num_guias,
+            STRING_AGG(DISTINCT SAFE_CAST(pc.tracking AS STRING), ', ' LIMIT 5) AS trackings_preview,
+            MAX(pc.estado_conciliacion) as estado_conciliacion,
+            MAX(pc.novedades) as novedades,
+            MAX(pc.creado_en) as fecha_creacion,
+            MAX(pc.modificado_en) as fecha_modificacion,
+            MAX(COALESCE(cod.Carrier, gl.carrier, 'N/A')) as carrier,
+            MAX(pc.Id_Transaccion) AS Id_Transaccion,
+
+            -- 🔥 CAMPOS DE BANCO ASOCIADO - TODOS LOS IDs usando CTE
+            COALESCE(
+                MAX(tbi.todos_ids_banco), 
+                STRING_AGG(DISTINCT CAST(pc.id_banco_asociado AS STRING), ', ')
+            ) AS ids_banco_asociado,
+
+            COALESCE(
+                COUNT(DISTINCT CASE WHEN tbi.Id_Transaccion IS NOT NULL THEN tbi.Id_Transaccion END),
+                COUNT(DISTINCT pc.id_banco_asociado)
+            ) AS num_movimientos_banco,
+
+            -- 🔥 MOVIMIENTOS BANCARIOS INDIVIDUALES desde CTE
+            COALESCE(
+                MAX(tbi.movimientos_detalle),
+                STRING_AGG(DISTINCT 
+                    CASE 
+                        WHEN bm.valor_banco IS NOT NULL THEN 
+                            CONCAT('ID:', CAST(bm.id AS STRING), '|Valor:', CAST(bm.valor_banco AS STRING), '|Fecha:', CAST(bm.fecha AS STRING))
+                        ELSE NULL 
+                    END, ' || '
+                )
+            ) AS movimientos_bancarios_detalle,
+
+            -- 🔥 SUMA TOTAL DE MOVIMIENTOS BANCARIOS
+            COALESCE(MAX(tbi.total_movimientos), SUM(DISTINCT bm.valor_banco)) AS total_valor_movimientos_banco,
+
+            -- 🔥 REFERENCIA_PAGO ORIGINAL DE LA TABLA
+            MAX(pc.referencia_pago) AS referencia_pago_original,  -- 🔥 CAMPO ADICIONAL SOLICITADO
+
+            -- 🔥 INDICADOR DE AGRUPACIÓN - Usar la lógica correcta
+            CASE 
+                WHEN pc.Id_Transaccion IS NOT NULL AND COUNT(DISTINCT pc.referencia) > 1 
+                THEN true 
+                ELSE false 
+            END as es_grupo_transaccion
+
+            FROM `{PROJECT_ID}.{DATASET_CONCILIACIONES}.pagosconductor` pc
+            LEFT JOIN `{PROJECT_ID}.{DATASET_CONCILIACIONES}.COD_pendientes_v1` cod 
+                ON pc.tracking = cod.tracking_number
+            LEFT JOIN `{PROJECT_ID}.{DATASET_CONCILIACIONES}.guias_liquidacion` gl 
+                ON pc.tracking = gl.tracking_number
+            LEFT JOIN `{PROJECT_ID}.{DATASET_CONCILIACIONES}.banco_movimientos` bm 
+                ON pc.id_banco_asociado = bm.id
+            LEFT JOIN transacciones_banco_ids tbi
+                ON pc.Id_Transaccion = tbi.Id_Transaccion
+            {where_clause}
+            GROUP BY grupo_id, pc.Id_Transaccion
+    """
+
+    job_config = bigquery.QueryJobConfig(query_parameters=parametros)
+    main_result = client.query(main_query, job_config=job_config).result(timeout=60)
+
+    filas = []
+    for row in main_result:
+        trackings_preview = row.get("trackings_preview", "")
+        if trackings_preview:
+            trackings_list = trackings_preview.split(", ")
+            if len(trackings_list) > 3:
+                trackings_preview = ", ".join(trackings_list[:3]) + f" (+{len(trackings_list) - 3} más)"
+
+        # 🔥 FORMATEAR REFERENCIA DISPLAY
+        referencia_display = row.get("referencia_pago_display", "")
+        num_referencias = row.get("num_referencias", 1)
+        es_grupo = row.get("es_grupo_transaccion", False)
+
+        if es_grupo and num_referencias > 1:
+            referencia_display = f"🔗 {referencia_display}"  # Emoji para indicar agrupación
+
+        # 🔥 PROCESAR MOVIMIENTOS BANCARIOS INDIVIDUALES
+        movimientos_bancarios = []
+        movimientos_detalle = row.get("movimientos_bancarios_detalle", "")
+
+        if movimientos_detalle:
+            # Dividir por el separador ' || ' y procesar cada movimiento
+            movimientos_raw = movimientos_detalle.split(" || ")
+            for mov in movimientos_raw:
+                if mov and mov.strip():
+                    try:
+                        # Parsear formato: ID:123|Valor:1000|Fecha:2025-01-01
+                        parts = mov.split("|")
+                        mov_dict = {}
+                        for part in parts:
+                            if ":" in part:
+                                key, value = part.split(":", 1)
+                                if key == "ID":
+                                    mov_dict["id"] = int(value) if value.isdigit() else value
+                                elif key == "Valor":
+                                    mov_dict["valor"] = float(value) if value.replace(".", "").replace("-", "").isdigit() else value
+                                elif key == "Fecha":
+                                    mov_dict["fecha"] = value
+                        if mov_dict:
+                            movimientos_bancarios.append(mov_dict)
+                    except (ValueError, IndexError):
+                        # Si hay error en el parsing, guardar como string
+                        movimientos_bancarios.append({"raw": mov})
+
+        # Llave de orden y de cursor: (fecha_pago, creado_en, grupo) descendente
+        llave = (
+            str(row.get("fecha") or ""),
+            row.get("fecha_creacion").isoformat() if row.get("fecha_creacion") else "",
+            str(row.get("grupo_id") or "")
+        )
+        filas.append((llave, {
+            "referencia_pago": referencia_display,  # 🔥 PRINCIPAL CAMBIO
+            "referencia_pago_principal": row.get("referencia_pago_principal", ""),
+            "referencia_pago_original": str(row.get("referencia_pago_original", "")),  # 🔥 CAMPO ADICIONAL SOLICITADO
+            "num_referencias": num_referencias,
+            "es_grupo_transaccion": es_grupo,
+            "valor": float(row.get("valor", 0)) if row.get("valor") else 0.0,
+            "fecha": str(row.get("fecha", "")),
+            "creado_en": str(row.get("creado_en", "")),
+            "hora_pago": str(row.get("hora_pago", "")),
+            "entidad": str(row.get("entidad", "")),
+            "estado_conciliacion": str(row.get("estado_conciliacion", "")),
+            "tipo": str(row.get("tipo", "")),
+            "imagen": str(row.get("imagen", "")),
+            "novedades": str(row.get("novedades", "")),
+            "num_guias": int(row.get("num_guias", 0)),
+            "trackings_preview": trackings_preview,
+            "correo_conductor": str(row.get("correo_conductor", "")),
+            "fecha_creacion": row.get("fecha_creacion").isoformat() if row.get("fecha_creacion") else None,
+            "fecha_modificacion": row.get("fecha_modificacion").isoformat() if row.get("fecha_modificacion") else None,
+            "carrier": str(row.get("carrier", "N/A")),
+            "Id_Transaccion": row.get("Id_Transaccion", None),
+            # 🔥 CAMPOS NUEVOS DE MOVIMIENTOS BANCARIOS
+            "ids_banco_asociado": row.get("ids_banco_asociado", None),
+            "num_movimientos_banco": int(row.get("num_movimientos_banco", 0)),
+            "movimientos_bancarios": movimientos_bancarios,
+            "total_valor_movimientos_banco": float(row.get("total_valor_movimientos_banco", 0)) if row.get("total_valor_movimientos_banco") else 0.0,
+            # 🔥 CAMPOS LEGACY PARA COMPATIBILIDAD
+            "id_banco_asociado": row.get("ids_banco_asociado", "").split(", ")[0] if row.get("ids_banco_asociado") else None,
+            "valor_banco_asociado": movimientos_bancarios[0].get("valor") if movimientos_bancarios else None,
+            "fecha_movimiento_banco": movimientos_bancarios[0].get("fecha") if movimientos_bancarios else None
+        }))
+
+    return ConjuntoPaginado(filas)
+
+
 @router.get("/pendientes-contabilidad")
 def obtener_pagos_pendientes_contabilidad(
     limit: int = Query(20, ge=1, le=10000, description="Número de registros por página (máximo 10000 para carga completa)"),
-    offset: int = Query(0, ge=0, description="Número de registros a omitir"),
+    offset: int = Query(0, ge=0, description="Número de registros a omitir (se ignora si viene cursor)"),
+    cursor: Optional[str] = Query(None, description="Cursor de la página siguiente (paginacion.cursor_siguiente)"),
     referencia: Optional[str] = Query(None, description="Filtrar por referencia de pago"),
     carrier: Optional[str] = Query(None, description="Filtar por carrier"),
     valor: Optional[float] = Query(None, ge=0, description="Filtrar por valor del pago"),
     estado: Optional[List[str]] = Query(None, description="Filtrar por uno o varios estados de conciliación"),
     fecha_desde: Optional[str] = Query(None, description="Fecha desde (YYYY-MM-DD)"),
     fecha_hasta: Optional[str] = Query(None, description="Fecha hasta (YYYY-MM-DD)"),
-    id_transaccion: Optional[int] = Query(None, ge=1, description="Filtrar por Id_Transaccion exacto")  # 🔥 NUEVO
+    id_transaccion: Optional[int] = Query(None, ge=1, description="Filtrar por Id_Transaccion exacto"),  # 🔥 NUEVO
+    client: bigquery.Client = Depends(get_bigquery_client)
 ):
     """
     Obtiene pagos pendientes de contabilidad con paginación y filtros avanzados
     ✅ ACTUALIZADO: Agrupa por Id_Transaccion cuando existe, o por referencia individual
     ✅ NUEVO: Filtro por Id_Transaccion exacto
+    ✅ Paginación por cursor: la primera página materializa el resultado
+    filtrado y agrupado; las siguientes se leen de él sin volver a consultar
     """
     try:
-        client = get_bigquery_client()
-
         FECHA_MINIMA = "2025-06-09"
         logger.info(f"🗓️ [DIAGNÓSTICO PAGOS] Filtro automático aplicado: >= {FECHA_MINIMA}")
 
@@ -1607,20 +1684,9 @@ def obtener_pagos_pendientes_contabilidad(
 
         if estado:
             estados_limpios = [e.strip() for e in estado if e and e.strip()]
-            if len(estados_limpios) == 1:
-                condiciones.append("pc.estado_conciliacion = @estado_filtro")
-                parametros.append(
-                    bigquery.ScalarQueryParameter("estado_filtro", "STRING", estados_limpios[0])
-                )
-            elif len(estados_limpios) > 1:
-                in_params = []
-                for idx, est in enumerate(estados_limpios):
-                    param_name = f"estado_filtro_{idx}"
-                    in_params.append(f"@{param_name}")
-                    parametros.append(
-                        bigquery.ScalarQueryParameter(param_name, "STRING", est)
-                    )
-                condiciones.append(f"pc.estado_conciliacion IN ({', '.join(in_params)})")
+            if estados_limpios:
+                condiciones.append("pc.estado_conciliacion IN UNNEST(@estado_filtro)")
+                parametros.append(parametro_lista("estado_filtro", estados_limpios, "STRING"))
         elif not any([
             referencia and referencia.strip(),
             carrier and carrier.strip(),
@@ -1652,259 +1718,48 @@ def obtener_pagos_pendientes_contabilidad(
 
         where_clause = "WHERE " + " AND ".join(condiciones)
 
-        # ⭐ NUEVA CONSULTA: Agrupa por Id_Transaccion cuando existe
-        count_query = f"""
-            SELECT COUNT(*) as total
-            FROM (
-                SELECT 
-                    CASE 
-                        WHEN pc.Id_Transaccion IS NOT NULL THEN CAST(pc.Id_Transaccion AS STRING)
-                        ELSE pc.referencia_pago
-                    END as grupo_pago
-                FROM (
-                    SELECT DISTINCT
-                        pc.Id_Transaccion,
-                        pc.referencia_pago,
-                        pc.referencia,
-                        pc.tracking
-                    FROM `{PROJECT_ID}.{DATASET_CONCILIACIONES}.pagosconductor` pc
-                    LEFT JOIN `{PROJECT_ID}.{DATASET_CONCILIACIONES}.COD_pendientes_v1` cod 
-                        ON pc.tracking = cod.tracking_number
-                    LEFT JOIN `{PROJECT_ID}.{DATASET_CONCILIACIONES}.guias_liquidacion` gl 
-                        ON pc.tracking = gl.tracking_number
-                    {where_clause}
-                ) pc
-                GROUP BY grupo_pago
-            )
-        """
-
-
-        # ⭐ CONSULTA PRINCIPAL CORREGIDA - SIN DUPLICADOS CON MOVIMIENTOS BANCARIOS INDIVIDUALES
-        main_query = f"""
-            WITH movimientos_relacionados AS (
-                -- Pre-calcular todos los movimientos bancarios relacionados por Id_Transaccion
-                SELECT DISTINCT
-                    pc.Id_Transaccion,
-                    pc.id_banco_asociado,
-                    bm.id as banco_id,
-                    bm.valor_banco,
-                    bm.fecha as fecha_banco,
-                    bm.descripcion
-                FROM `{PROJECT_ID}.{DATASET_CONCILIACIONES}.pagosconductor` pc
-                INNER JOIN `{PROJECT_ID}.{DATASET_CONCILIACIONES}.banco_movimientos` bm 
-                    ON pc.id_banco_asociado = bm.id
-                WHERE pc.Id_Transaccion IS NOT NULL
-                AND pc.id_banco_asociado IS NOT NULL
-            ),
-            transacciones_banco_ids AS (
-                -- Agrupar todos los IDs de banco por Id_Transaccion
-                SELECT 
-                    Id_Transaccion,
-                    STRING_AGG(DISTINCT CAST(id_banco_asociado AS STRING), ', ') as todos_ids_banco,
-                    STRING_AGG(DISTINCT 
-                        CONCAT('ID:', CAST(banco_id AS STRING), '|Valor:', CAST(valor_banco AS STRING), '|Fecha:', CAST(fecha_banco AS STRING))
-                        , ' || '
-                    ) as movimientos_detalle,
-                    SUM(DISTINCT valor_banco) as total_movimientos
-                FROM movimientos_relacionados
-                GROUP BY Id_Transaccion
-            )
-            SELECT 
-                CASE 
-                    WHEN pc.Id_Transaccion IS NOT NULL THEN CAST(pc.Id_Transaccion AS STRING)
-                    ELSE CONCAT(pc.referencia_pago, '|', pc.correo, '|', CAST(pc.fecha_pago AS STRING))
-                END as grupo_id,
-                
-                -- 🔥 REFERENCIAS AGRUPADAS - CORREGIDO: usar 'referencia' para Id_Transaccion
-                CASE 
-                    WHEN pc.Id_Transaccion IS NOT NULL AND COUNT(DISTINCT pc.referencia) > 1 THEN 
-                        STRING_AGG(DISTINCT pc.referencia, ', ')
-                    WHEN pc.Id_Transaccion IS NOT NULL THEN 
-                        MAX(pc.referencia)
-                    ELSE MAX(pc.referencia_pago)
-                END as referencia_pago_display,
-                
-                -- Principal: usar referencia_pago para operaciones, pero referencia para display cuando hay Id_Transaccion
-                CASE 
-                    WHEN pc.Id_Transaccion IS NOT NULL THEN MAX(pc.referencia)
-                    ELSE MAX(pc.referencia_pago)
-                END as referencia_pago_principal,
-                
-                -- Contar referencias correctas según el caso
-                CASE 
-                    WHEN pc.Id_Transaccion IS NOT NULL THEN COUNT(DISTINCT pc.referencia)
-                    ELSE COUNT(DISTINCT pc.referencia_pago)
-                END as num_referencias,
-                
-                MAX(pc.correo) as correo_conductor,
-                MAX(pc.fecha_pago) as fecha,
-                MAX(FORMAT_TIMESTAMP('%Y-%m-%d', pc.creado_en, 'America/Bogota')) AS creado_en,
-                COALESCE(MAX(pc.valor_total_consignacion), SUM(pc.valor)) AS valor,
-                MAX(pc.hora_pago) AS hora_pago,
-                MAX(pc.entidad) AS entidad,
-                MAX(pc.tipo) AS tipo,
-                MAX(pc.comprobante) AS imagen,
-                COUNT(DISTINCT pc.tracking) AS num_guias,
-                STRING_AGG(DISTINCT SAFE_CAST(pc.tracking AS STRING), ', ' LIMIT 5) AS trackings_preview,
-                MAX(pc.estado_conciliacion) as estado_conciliacion,
-                MAX(pc.novedades) as novedades,
-                MAX(pc.creado_en) as fecha_creacion,
-                MAX(pc.modificado_en) as fecha_modificacion,
-                MAX(COALESCE(cod.Carrier, gl.carrier, 'N/A')) as carrier,
-                MAX(pc.Id_Transaccion) AS Id_Transaccion,
-                
-                -- 🔥 CAMPOS DE BANCO ASOCIADO - TODOS LOS IDs usando CTE
-                COALESCE(
-                    MAX(tbi.todos_ids_banco), 
-                    STRING_AGG(DISTINCT CAST(pc.id_banco_asociado AS STRING), ', ')
-                ) AS ids_banco_asociado,
-                
-                COALESCE(
-                    COUNT(DISTINCT CASE WHEN tbi.Id_Transaccion IS NOT NULL THEN tbi.Id_Transaccion END),
-                    COUNT(DISTINCT pc.id_banco_asociado)
-                ) AS num_movimientos_banco,
-                
-                -- 🔥 MOVIMIENTOS BANCARIOS INDIVIDUALES desde CTE
-                COALESCE(
-                    MAX(tbi.movimientos_detalle),
-                    STRING_AGG(DISTINCT 
-                        CASE 
-                            WHEN bm.valor_banco IS NOT NULL THEN 
-                                CONCAT('ID:', CAST(bm.id AS STRING), '|Valor:', CAST(bm.valor_banco AS STRING), '|Fecha:', CAST(bm.fecha AS STRING))
-                            ELSE NULL 
-                        END, ' || '
-                    )
-                ) AS movimientos_bancarios_detalle,
-                
-                -- 🔥 SUMA TOTAL DE MOVIMIENTOS BANCARIOS
-                COALESCE(MAX(tbi.total_movimientos), SUM(DISTINCT bm.valor_banco)) AS total_valor_movimientos_banco,
-
-                -- 🔥 REFERENCIA_PAGO ORIGINAL DE LA TABLA
-                MAX(pc.referencia_pago) AS referencia_pago_original,  -- 🔥 CAMPO ADICIONAL SOLICITADO
-                
-                -- 🔥 INDICADOR DE AGRUPACIÓN - Usar la lógica correcta
-                CASE 
-                    WHEN pc.Id_Transaccion IS NOT NULL AND COUNT(DISTINCT pc.referencia) > 1 
-                    THEN true 
-                    ELSE false 
-                END as es_grupo_transaccion
-                
-                FROM `{PROJECT_ID}.{DATASET_CONCILIACIONES}.pagosconductor` pc
-                LEFT JOIN `{PROJECT_ID}.{DATASET_CONCILIACIONES}.COD_pendientes_v1` cod 
-                    ON pc.tracking = cod.tracking_number
-                LEFT JOIN `{PROJECT_ID}.{DATASET_CONCILIACIONES}.guias_liquidacion` gl 
-                    ON pc.tracking = gl.tracking_number
-                LEFT JOIN `{PROJECT_ID}.{DATASET_CONCILIACIONES}.banco_movimientos` bm 
-                    ON pc.id_banco_asociado = bm.id
-                LEFT JOIN transacciones_banco_ids tbi
-                    ON pc.Id_Transaccion = tbi.Id_Transaccion
-                {where_clause}
-                GROUP BY grupo_id, pc.Id_Transaccion
-                ORDER BY MAX(pc.fecha_pago) DESC, MAX(pc.creado_en) DESC
-                LIMIT {limit}
-                OFFSET {offset}
-        """
-
-
-        job_config = bigquery.QueryJobConfig(query_parameters=parametros)
-
-        with concurrent.futures.ThreadPoolExecutor() as executor:
-            future_count = executor.submit(lambda: client.query(count_query, job_config=job_config).result())
-            future_main = executor.submit(lambda: client.query(main_query, job_config=job_config).result())
-
-            count_result = future_count.result(timeout=30)
-            main_result = future_main.result(timeout=30)
-
-        total_registros = next(count_result)["total"]
+        filtros = {
+            "referencia": referencia,
+            "carrier": carrier,
+            "valor": valor,
+            "estado": estado,
+            "fecha_desde": fecha_desde,
+            "fecha_hasta": fecha_hasta,
+            "id_transaccion": id_transaccion
+        }
+        huella = huella_filtros(filtros)
+        llave_cursor = None
+        if cursor:
+            try:
+                llave_cursor = decodificar_cursor(cursor, huella)
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=str(e))
+
+        encontrado, conjunto = cache_agregados.obtener(CONJUNTO_PENDIENTES_CONTABILIDAD, filtros)
+        if not encontrado:
+            generacion = cache_agregados.generacion(CONJUNTO_PENDIENTES_CONTABILIDAD)
+            conjunto = _materializar_pendientes_contabilidad(client, where_clause, parametros)
+            cache_agregados.guardar(CONJUNTO_PENDIENTES_CONTABILIDAD, filtros, conjunto,
+                                    PAGINACION_CURSOR_TTL, generacion)
+            logger.info(f"📦 Pendientes de contabilidad materializados: {len(conjunto)} grupos")
+
+        inicio = conjunto.posicion_despues_de(llave_cursor) if llave_cursor is not None else offset
+        pagos, cursor_siguiente = conjunto.pagina(inicio, limit, huella)
+
+        total_registros = len(conjunto)
         total_paginas = (total_registros + limit - 1) // limit
-        pagina_actual = (offset // limit) + 1
-
-        pagos = []
-        for row in main_result:
-            trackings_preview = row.get("trackings_preview", "")
-            if trackings_preview:
-                trackings_list = trackings_preview.split(", ")
-                if len(trackings_list) > 3:
-                    trackings_preview = ", ".join(trackings_list[:3]) + f" (+{len(trackings_list) - 3} más)"
-
-            # 🔥 FORMATEAR REFERENCIA DISPLAY
-            referencia_display = row.get("referencia_pago_display", "")
-            num_referencias = row.get("num_referencias", 1)
-            es_grupo = row.get("es_grupo_transaccion", False)
-            
-            if es_grupo and num_referencias > 1:
-                referencia_display = f"🔗 {referencia_display}"  # Emoji para indicar agrupación
-
-            # 🔥 PROCESAR MOVIMIENTOS BANCARIOS INDIVIDUALES
-            movimientos_bancarios = []
-            movimientos_detalle = row.get("movimientos_bancarios_detalle", "")
-            
-            if movimientos_detalle:
-                # Dividir por el separador ' || ' y procesar cada movimiento
-                movimientos_raw = movimientos_detalle.split(" || ")
-                for mov in movimientos_raw:
-                    if mov and mov.strip():
-                        try:
-                            # Parsear formato: ID:123|Valor:1000|Fecha:2025-01-01
-                            parts = mov.split("|")
-                            mov_dict = {}
-                            for part in parts:
-                                if ":" in part:
-                                    key, value = part.split(":", 1)
-                                    if key == "ID":
-                                        mov_dict["id"] = int(value) if value.isdigit() else value
-                                    elif key == "Valor":
-                                        mov_dict["valor"] = float(value) if value.replace(".", "").replace("-", "").isdigit() else value
-                                    elif key == "Fecha":
-                                        mov_dict["fecha"] = value
-                            if mov_dict:
-                                movimientos_bancarios.append(mov_dict)
-                        except (ValueError, IndexError):
-                            # Si hay error en el parsing, guardar como string
-                            movimientos_bancarios.append({"raw": mov})
-
-            pagos.append({
-                "referencia_pago": referencia_display,  # 🔥 PRINCIPAL CAMBIO
-                "referencia_pago_principal": row.get("referencia_pago_principal", ""),
-                "referencia_pago_original": str(row.get("referencia_pago_original", "")),  # 🔥 CAMPO ADICIONAL SOLICITADO
-                "num_referencias": num_referencias,
-                "es_grupo_transaccion": es_grupo,
-                "valor": float(row.get("valor", 0)) if row.get("valor") else 0.0,
-                "fecha": str(row.get("fecha", "")),
-                "creado_en": str(row.get("creado_en", "")),
-                "hora_pago": str(row.get("hora_pago", "")),
-                "entidad": str(row.get("entidad", "")),
-                "estado_conciliacion": str(row.get("estado_conciliacion", "")),
-                "tipo": str(row.get("tipo", "")),
-                "imagen": str(row.get("imagen", "")),
-                "novedades": str(row.get("novedades", "")),
-                "num_guias": int(row.get("num_guias", 0)),
-                "trackings_preview": trackings_preview,
-                "correo_conductor": str(row.get("correo_conductor", "")),
-                "fecha_creacion": row.get("fecha_creacion").isoformat() if row.get("fecha_creacion") else None,
-                "fecha_modificacion": row.get("fecha_modificacion").isoformat() if row.get("fecha_modificacion") else None,
-                "carrier": str(row.get("carrier", "N/A")),
-                "Id_Transaccion": row.get("Id_Transaccion", None),
-                # 🔥 CAMPOS NUEVOS DE MOVIMIENTOS BANCARIOS
-                "ids_banco_asociado": row.get("ids_banco_asociado", None),
-                "num_movimientos_banco": int(row.get("num_movimientos_banco", 0)),
-                "movimientos_bancarios": movimientos_bancarios,
-                "total_valor_movimientos_banco": float(row.get("total_valor_movimientos_banco", 0)) if row.get("total_valor_movimientos_banco") else 0.0,
-                # 🔥 CAMPOS LEGACY PARA COMPATIBILIDAD
-                "id_banco_asociado": row.get("ids_banco_asociado", "").split(", ")[0] if row.get("ids_banco_asociado") else None,
-                "valor_banco_asociado": movimientos_bancarios[0].get("valor") if movimientos_bancarios else None,
-                "fecha_movimiento_banco": movimientos_bancarios[0].get("fecha") if movimientos_bancarios else None
-            })
+        pagina_actual = (inicio // limit) + 1
 
         paginacion_info = {
             "total_registros": total_registros,
             "total_paginas": total_paginas,
             "pagina_actual": pagina_actual,
             "registros_por_pagina": limit,
-            "tiene_siguiente": pagina_actual < total_paginas,
-            "tiene_anterior": pagina_actual > 1,
-            "desde_registro": offset + 1 if pagos else 0,
-            "hasta_registro": offset + len(pagos)
+            "tiene_siguiente": cursor_siguiente is not None,
+            "tiene_anterior": inicio > 0,
+            "desde_registro": inicio + 1 if pagos else 0,
+            "hasta_registro": inicio + len(pagos),
+            "cursor_siguiente": cursor_siguiente
         }
 
         return {
@@ -1957,9 +1812,10 @@ def obtener_pagos_pendientes_contabilidad(
 
 # 🔥 NUEVO ENDPOINT: Verificación de referencias Nequi
 @router.post("/verificar-referencia-nequi")
-async def verificar_referencia_nequi(
+def verificar_referencia_nequi(
     referencia: str = Form(..., description="Referencia extraída del comprobante"),
-    tipo: str = Form(..., description="Tipo de pago detectado por OCR")
+    tipo: str = Form(..., description="Tipo de pago detectado por OCR"),
+    client: bigquery.Client = Depends(get_bigquery_client)
 ):
     """
     Verifica si una referencia de pago Nequi ya existe en la base de datos.
@@ -1971,8 +1827,6 @@ async def verificar_referencia_nequi(
     - referencia_existente: dict - Datos del pago existente si se encuentra
     """
     try:
-        client = get_bigquery_client()
-        
         # Validar que el tipo sea Nequi
         if not tipo or tipo.strip().lower() != 'nequi':
             return {
@@ -2110,15 +1964,13 @@ async def verificar_referencia_nequi(
 # Reportes ---
 
 @router.get("/historial-2")
-def obtener_historial_pagos_simplificado():
+def obtener_historial_pagos_simplificado(client: bigquery.Client = Depends(get_bigquery_client)):
     """
     Endpoint que trae todos los pagos de la tabla pagosconductor con campos específicos:
     - referencia, referencia_pago, valor, valor_total_consignacion, fecha, estado_conciliacion, tipo, 
     - cantidad de tracking por referencia, tracking, comprobante, cliente, Id_Transaccion
     """
     try:
-        client = get_bigquery_client()
-        
         logger.info("📊 Iniciando consulta para historial-2 con campos extendidos")
         
         query = f"""
@@ -2215,13 +2067,13 @@ def obtener_detalles_pago_reportes(
     carrier: str = FastAPIQuery(None, description="Carrier"),
     fecha: str = FastAPIQuery(None, description="Fecha (YYYY-MM-DD)"),
     tipo: str = FastAPIQuery(None, description="Tipo de pago"),
-    estado: str = FastAPIQuery(None, description="Estado de conciliación")
+    estado: str = FastAPIQuery(None, description="Estado de conciliación"),
+    client: bigquery.Client = Depends(get_bigquery_client)
 ):
     """
     Obtiene los detalles de un pago específico incluyendo todas las guías asociadas
     """
     try:
-        client = get_bigquery_client()
         # Validar si el parámetro id_transaccion viene como string 'null' y convertirlo a None
         id_transaccion_final = id_transaccion
         if isinstance(id_transaccion_final, str) and id_transaccion_final.lower() == "null":
@@ -2368,15 +2220,14 @@ def obtener_pagos_pendientes_contabilidad_2(
     id_transaccion: Optional[str] = Query(None, description="Filtrar por ID de transacción"),
     estado: Optional[List[str]] = Query(None, description="Filtrar por uno o varios estados de conciliación"),
     fecha_desde: Optional[str] = Query(None, description="Fecha desde (YYYY-MM-DD)"),
-    fecha_hasta: Optional[str] = Query(None, description="Fecha hasta (YYYY-MM-DD)")
+    fecha_hasta: Optional[str] = Query(None, description="Fecha hasta (YYYY-MM-DD)"),
+    client: bigquery.Client = Depends(get_bigquery_client)
 ):
     """
     Obtiene pagos pendientes de contabilidad con paginación y filtros avanzados
     ✅ VALIDADO: Incluye filtro automático desde el 9 de junio de 2025
     """
     try:
-        client = get_bigquery_client()
-
         FECHA_MINIMA = "2025-06-09"
         logger.info(f"🗓️ [DIAGNÓSTICO PAGOS] Filtro automático aplicado: >= {FECHA_MINIMA}")
 
@@ -2396,20 +2247,9 @@ def obtener_pagos_pendientes_contabilidad_2(
 
         if estado:
             estados_limpios = [e.strip().lower() for e in estado if e and e.strip()]
-            if len(estados_limpios) == 1:
-                condiciones.append("LOWER(estado_conciliacion) = @estado_filtro")
-                parametros.append(
-                    bigquery.ScalarQueryParameter("estado_filtro", "STRING", estados_limpios[0])
-                )
-            elif len(estados_limpios) > 1:
-                in_params = []
-                for idx, est in enumerate(estados_limpios):
-                    param_name = f"estado_filtro_{idx}"
-                    in_params.append(f"@{param_name}")
-                    parametros.append(
-                        bigquery.ScalarQueryParameter(param_name, "STRING", est)
-                    )
-                condiciones.append(f"LOWER(estado_conciliacion) IN ({', '.join(in_params)})")
+            if estados_limpios:
+                condiciones.append("LOWER(estado_conciliacion) IN UNNEST(@estado_filtro)")
+                parametros.append(parametro_lista("estado_filtro", estados_limpios, "STRING"))
         elif not (referencia and referencia.strip()):
             condiciones.append("estado_conciliacion = 'pendiente_conciliacion'")
 
@@ -2624,14 +2464,13 @@ def obtener_estadisticas_pendientes_contabilidad(
     carrier: Optional[str] = Query(None, description="Filtrar por carrier"),
     cliente: Optional[str] = Query(None, description="Filtrar por cliente"),
     tipo: Optional[str] = Query(None, description="Filtrar por tipo"),
-    id_transaccion: Optional[str] = Query(None, description="Filtrar por ID de transacción")
+    id_transaccion: Optional[str] = Query(None, description="Filtrar por ID de transacción"),
+    client: bigquery.Client = Depends(get_bigquery_client)
 ):
     """
     Obtiene estadísticas globales de pagos pendientes de contabilidad sin paginación
     """
     try:
-        client = get_bigquery_client()
-
         FECHA_MINIMA = "2025-06-09"
         logger.info(f"🗓️ [ESTADÍSTICAS] Filtro automático aplicado: >= {FECHA_MINIMA}")
 
@@ -2704,14 +2543,8 @@ def obtener_estadisticas_pendientes_contabilidad(
                 pass  # En estadísticas, ignoramos el error silenciosamente
 
         if estado and len(estado) > 0:
-            placeholders = []
-            for i, e in enumerate(estado):
-                param_name = f"estado_{i}"
-                placeholders.append(f"@{param_name}")
-                parametros.append(
-                    bigquery.ScalarQueryParameter(param_name, "STRING", e.strip().lower())
-                )
-            condiciones.append(f"LOWER(pc.estado_conciliacion) IN ({', '.join(placeholders)})")
+            condiciones.append("LOWER(pc.estado_conciliacion) IN UNNEST(@estado)")
+            parametros.append(parametro_lista("estado", [e.strip().lower() for e in estado], "STRING"))
 
         condiciones_sql = " AND ".join(condiciones)
 
@@ -2767,7 +2600,8 @@ def obtener_estadisticas_pendientes_contabilidad(
 
 
 @router.post("/aprobar-pago")
-def aprobar_pago(payload: dict):
+@invalida("pagosconductor")
+def aprobar_pago(payload: dict, client: bigquery.Client = Depends(get_bigquery_client)):
     """
     Aprueba un pago cambiando su estado a conciliado_manual
     """
@@ -2781,8 +2615,6 @@ def aprobar_pago(payload: dict):
         )
 
     try:
-        client = get_bigquery_client()
-        
         # Verificar que el pago existe y está en estado pendiente
         verificacion_query = """
         SELECT COUNT(*) as total, MAX(estado_conciliacion) as estado_actual
@@ -2876,7 +2708,8 @@ def aprobar_pago(payload: dict):
 
 
 @router.post("/rechazar-pago")
-def rechazar_pago(payload: dict):
+@invalida("pagosconductor")
+def rechazar_pago(payload: dict, client: bigquery.Client = Depends(get_bigquery_client)):
     """
     Rechaza un pago cambiando su estado a rechazado y agregando la novedad
     """
@@ -2898,7 +2731,6 @@ def rechazar_pago(payload: dict):
         )
 
     try:
-        client = get_bigquery_client()
         # Si se envía id_transaccion, priorizarlo
         if id_transaccion is not None:
             # Validar que todos los pagos del grupo puedan ser rechazados
@@ -3085,7 +2917,7 @@ def rechazar_pago(payload: dict):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error interno del servidor: {str(e)}")
 
-async def notificar_error_bono(correo: str, excedente: float, razon: str):
+async def notificar_error_bono(client, correo: str, excedente: float, razon: str):
     """
     Notifica a los administradores cuando hay un error al registrar un bono por excedente
     """
@@ -3099,7 +2931,6 @@ async def notificar_error_bono(correo: str, excedente: float, razon: str):
         }
         
         # Registrar en tabla de errores
-        client = bigquery.Client()
         table_id = f"{PROJECT_ID}.{DATASET_CONCILIACIONES}.errores_bonos"
         
         query = f"""
@@ -3116,28 +2947,27 @@ async def notificar_error_bono(correo: str, excedente: float, razon: str):
             bigquery.ScalarQueryParameter("razon", "STRING", razon),
         ])
         
-        client.query(query, job_config=job_config).result()
+        await client.query_async(query, job_config=job_config)
         
         
     except Exception as e:
         logger.error(f"❌ Error al notificar error de bono: {e}")
 
 @router.get("/historial")
-async def obtener_historial_pagos(
+def obtener_historial_pagos(
     limite: int = Query(50, description="Número máximo de registros a devolver (0 = todos)"),
     offset: int = Query(0, description="Número de registros a omitir"),
     fecha_inicio: Optional[str] = Query(None, description="Fecha de inicio (YYYY-MM-DD)"),
     fecha_fin: Optional[str] = Query(None, description="Fecha de fin (YYYY-MM-DD)"),
     estado: Optional[str] = Query(None, description="Estado del pago"),
-    conductor: Optional[str] = Query(None, description="Email del conductor")
+    conductor: Optional[str] = Query(None, description="Email del conductor"),
+    client: bigquery.Client = Depends(get_bigquery_client)
 ):
     """
     Obtiene el historial de pagos con filtros opcionales
     limite = 0 devuelve TODOS los registros sin límite
     """
     try:
-        client = get_bigquery_client()
-        
         # Construir la consulta base simplificada
         query = f"""
         SELECT 
@@ -3270,6 +3100,53 @@ async def obtener_historial_pagos(
             detail=f"Error interno del servidor: {str(e)}"
         )
 
+COLUMNAS_EXPORTACION_PAGOS = (
+    "referencia_pago", "referencia_pago_principal", "num_referencias", "es_grupo_transaccion",
+    "valor", "fecha", "creado_en", "hora_pago", "entidad", "estado_conciliacion", "tipo",
+    "imagen", "novedades", "num_guias", "trackings_completos", "correo_conductor",
+    "fecha_creacion", "fecha_modificacion", "carrier", "Id_Transaccion",
+    "id_banco_asociado", "valor_banco_asociado", "fecha_movimiento_banco", "descripcion_banco",
+)
+
+
+def _formatear_pago_exportacion(row) -> Dict[str, Any]:
+    """Fila de /exportar-pendientes-contabilidad con el formato de la consulta principal"""
+    # 🔥 FORMATEAR REFERENCIA DISPLAY IGUAL QUE EN LA CONSULTA PRINCIPAL
+    referencia_display = row.get("referencia_pago_display", "")
+    num_referencias = row.get("num_referencias", 1)
+    es_grupo = row.get("es_grupo_transaccion", False)
+
+    if es_grupo and num_referencias > 1:
+        referencia_display = f"🔗 {referencia_display}"  # Emoji para indicar agrupación
+
+    return {
+        "referencia_pago": referencia_display,
+        "referencia_pago_principal": row.get("referencia_pago_principal", ""),
+        "num_referencias": num_referencias,
+        "es_grupo_transaccion": es_grupo,
+        "valor": float(row.get("valor", 0)) if row.get("valor") else 0.0,
+        "fecha": str(row.get("fecha", "")),
+        "creado_en": str(row.get("creado_en", "")),
+        "hora_pago": str(row.get("hora_pago", "")),
+        "entidad": str(row.get("entidad", "")),
+        "estado_conciliacion": str(row.get("estado_conciliacion", "")),
+        "tipo": str(row.get("tipo", "")),
+        "imagen": str(row.get("imagen", "")),
+        "novedades": str(row.get("novedades", "")),
+        "num_guias": int(row.get("num_guias", 0)),
+        "trackings_completos": str(row.get("trackings_completos", "")),
+        "correo_conductor": str(row.get("correo_conductor", "")),
+        "fecha_creacion": row.get("fecha_creacion").isoformat() if row.get("fecha_creacion") else None,
+        "fecha_modificacion": row.get("fecha_modificacion").isoformat() if row.get("fecha_modificacion") else None,
+        "carrier": str(row.get("carrier", "N/A")),
+        "Id_Transaccion": row.get("Id_Transaccion", None),
+        # 🔥 AGREGADO: Campos de banco en la respuesta
+        "id_banco_asociado": row.get("id_banco_asociado", None),
+        "valor_banco_asociado": float(row.get("valor_banco_asociado", 0)) if row.get("valor_banco_asociado") else None,
+        "fecha_movimiento_banco": str(row.get("fecha_movimiento_banco", "")) if row.get("fecha_movimiento_banco") else None,
+        "descripcion_banco": str(row.get("descripcion_banco", "")) if row.get("descripcion_banco") else None
+    }
+
 @router.get("/exportar-pendientes-contabilidad")
 def exportar_todos_pagos_pendientes_contabilidad(
     referencia: Optional[str] = Query(None, description="Filtrar por referencia de pago"),
@@ -3278,17 +3155,19 @@ def exportar_todos_pagos_pendientes_contabilidad(
     estado: Optional[List[str]] = Query(None, description="Filtrar por uno o varios estados de conciliación"),
     fecha_desde: Optional[str] = Query(None, description="Fecha desde (YYYY-MM-DD)"),
     fecha_hasta: Optional[str] = Query(None, description="Fecha hasta (YYYY-MM-DD)"),
-    id_transaccion: Optional[int] = Query(None, ge=1, description="Filtrar por Id_Transaccion exacto")
+    id_transaccion: Optional[int] = Query(None, ge=1, description="Filtrar por Id_Transaccion exacto"),
+    formato: str = Query("json", regex="^(json|csv|xlsx)$", description="json (por defecto), csv o xlsx"),
+    client: bigquery.Client = Depends(get_bigquery_client)
 ):
     """
     Exporta TODOS los pagos pendientes de contabilidad que coincidan con los filtros (sin paginación)
     ✅ ACTUALIZADO: Usa exactamente los mismos filtros que obtener_pagos_pendientes_contabilidad
     ✅ NUEVO: Agrupa por Id_Transaccion cuando existe, o por referencia individual
     ✅ INCLUYE: Todas las columnas de banco asociado (id_banco_asociado, valor_banco_asociado, etc.)
+    ✅ STREAMING: las filas se leen por páginas y se escriben a medida que
+    llegan (JSON con la misma forma de siempre, o archivo CSV/XLSX)
     """
     try:
-        client = get_bigquery_client()
-
         FECHA_MINIMA = "2025-06-09"
         logger.info(f"🗓️ [DIAGNÓSTICO EXPORTAR] Filtro automático aplicado: >= {FECHA_MINIMA}")
 
@@ -3330,20 +3209,9 @@ def exportar_todos_pagos_pendientes_contabilidad(
         # 🔥 LÓGICA EXACTA DE ESTADOS
         if estado:
             estados_limpios = [e.strip() for e in estado if e and e.strip()]
-            if len(estados_limpios) == 1:
-                condiciones.append("pc.estado_conciliacion = @estado_filtro")
-                parametros.append(
-                    bigquery.ScalarQueryParameter("estado_filtro", "STRING", estados_limpios[0])
-                )
-            elif len(estados_limpios) > 1:
-                in_params = []
-                for idx, est in enumerate(estados_limpios):
-                    param_name = f"estado_filtro_{idx}"
-                    in_params.append(f"@{param_name}")
-                    parametros.append(
-                        bigquery.ScalarQueryParameter(param_name, "STRING", est)
-                    )
-                condiciones.append(f"pc.estado_conciliacion IN ({', '.join(in_params)})")
+            if estados_limpios:
+                condiciones.append("pc.estado_conciliacion IN UNNEST(@estado_filtro)")
+                parametros.append(parametro_lista("estado_filtro", estados_limpios, "STRING"))
         elif not any([
             referencia and referencia.strip(),
             carrier and carrier.strip(),
@@ -3446,54 +3314,22 @@ def exportar_todos_pagos_pendientes_contabilidad(
         
         job_config = bigquery.QueryJobConfig(query_parameters=parametros)
         
-        # Ejecutar consulta con timeout extendido para exportación
-        with concurrent.futures.ThreadPoolExecutor() as executor:
-            future_export = executor.submit(lambda: client.query(export_query, job_config=job_config).result())
-            export_result = future_export.result(timeout=120)  # 2 minutos para exportación completa
-        
-        # Procesar todos los resultados
-        pagos_exportar = []
-        for row in export_result:
-            # 🔥 FORMATEAR REFERENCIA DISPLAY IGUAL QUE EN LA CONSULTA PRINCIPAL
-            referencia_display = row.get("referencia_pago_display", "")
-            num_referencias = row.get("num_referencias", 1)
-            es_grupo = row.get("es_grupo_transaccion", False)
-            
-            if es_grupo and num_referencias > 1:
-                referencia_display = f"🔗 {referencia_display}"  # Emoji para indicar agrupación
+        # La consulta termina aquí (timeout extendido para exportación); las filas se descargan al responder
+        resultado = consultar_paginado(
+            client, export_query, job_config,
+            timeout=120,
+            transformar=_formatear_pago_exportacion,
+            columnas=COLUMNAS_EXPORTACION_PAGOS
+        )
+        logger.info(f"📊 [EXPORTAR] Total registros a exportar: {resultado.total} ({formato})")
+
+        if formato != "json":
+            nombre = f"pagos-pendientes-contabilidad-{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+            return respuesta_streaming(generar(formato, resultado.columnas, resultado.filas()), formato, nombre)
 
-            pago = {
-                "referencia_pago": referencia_display,
-                "referencia_pago_principal": row.get("referencia_pago_principal", ""),
-                "num_referencias": num_referencias,
-                "es_grupo_transaccion": es_grupo,
-                "valor": float(row.get("valor", 0)) if row.get("valor") else 0.0,
-                "fecha": str(row.get("fecha", "")),
-                "creado_en": str(row.get("creado_en", "")),
-                "hora_pago": str(row.get("hora_pago", "")),
-                "entidad": str(row.get("entidad", "")),
-                "estado_conciliacion": str(row.get("estado_conciliacion", "")),
-                "tipo": str(row.get("tipo", "")),
-                "imagen": str(row.get("imagen", "")),
-                "novedades": str(row.get("novedades", "")),
-                "num_guias": int(row.get("num_guias", 0)),
-                "trackings_completos": str(row.get("trackings_completos", "")),
-                "correo_conductor": str(row.get("correo_conductor", "")),
-                "fecha_creacion": row.get("fecha_creacion").isoformat() if row.get("fecha_creacion") else None,
-                "fecha_modificacion": row.get("fecha_modificacion").isoformat() if row.get("fecha_modificacion") else None,
-                "carrier": str(row.get("carrier", "N/A")),
-                "Id_Transaccion": row.get("Id_Transaccion", None),
-                # 🔥 AGREGADO: Campos de banco en la respuesta
-                "id_banco_asociado": row.get("id_banco_asociado", None),
-                "valor_banco_asociado": float(row.get("valor_banco_asociado", 0)) if row.get("valor_banco_asociado") else None,
-                "fecha_movimiento_banco": str(row.get("fecha_movimiento_banco", "")) if row.get("fecha_movimiento_banco") else None,
-                "descripcion_banco": str(row.get("descripcion_banco", "")) if row.get("descripcion_banco") else None
-            }
-            pagos_exportar.append(pago)
-        
         # Información de la exportación
         info_exportacion = {
-            "total_registros_exportados": len(pagos_exportar),
+            "total_registros_exportados": resultado.total,
             "filtros_aplicados": {
                 "referencia": referencia,
                 "carrier": carrier,
@@ -3506,13 +3342,10 @@ def exportar_todos_pagos_pendientes_contabilidad(
             "fecha_exportacion": datetime.now().isoformat()
         }
         
-        logger.info(f"📊 [EXPORTAR] Total registros exportados: {len(pagos_exportar)}")
-        
-        return {
-            "pagos": pagos_exportar,
-            "info_exportacion": info_exportacion,
-            "status": "success"
-        }
+        return respuesta_streaming(
+            generar_json("pagos", resultado.filas(), {"info_exportacion": info_exportacion, "status": "success"}),
+            "json"
+        )
         
     except HTTPException:
         raise
@@ -3525,13 +3358,11 @@ def exportar_todos_pagos_pendientes_contabilidad(
 
 # Endpoint para debugging - verificar referencias
 @router.get("/debug/verificar-referencia/{referencia}")
-def debug_verificar_referencia(referencia: str):
+def debug_verificar_referencia(referencia: str, client: bigquery.Client = Depends(get_bigquery_client)):
     """
     Endpoint de debugging para verificar si una referencia existe y en qué estados
     """
     try:
-        client = get_bigquery_client()
-        
         # Buscar la referencia en todos los estados
         query = f"""
         SELECT 
@@ -3591,14 +3422,13 @@ def obtener_estadisticas_pendientes_contabilidad(
     carrier: Optional[str] = Query(None, description="Filtrar por carrier"),
     cliente: Optional[str] = Query(None, description="Filtrar por cliente"),
     tipo: Optional[str] = Query(None, description="Filtrar por tipo"),
-    id_transaccion: Optional[str] = Query(None, description="Filtrar por ID de transacción")
+    id_transaccion: Optional[str] = Query(None, description="Filtrar por ID de transacción"),
+    client: bigquery.Client = Depends(get_bigquery_client)
 ):
     """
     Obtiene estadísticas globales de pagos pendientes de contabilidad sin paginación
     """
     try:
-        client = get_bigquery_client()
-
         FECHA_MINIMA = "2025-06-09"
         logger.info(f"🗓️ [ESTADÍSTICAS] Filtro automático aplicado: >= {FECHA_MINIMA}")
 
@@ -3671,14 +3501,8 @@ def obtener_estadisticas_pendientes_contabilidad(
                 pass  # En estadísticas, ignoramos el error silenciosamente
 
         if estado and len(estado) > 0:
-            placeholders = []
-            for i, e in enumerate(estado):
-                param_name = f"estado_{i}"
-                placeholders.append(f"@{param_name}")
-                parametros.append(
-                    bigquery.ScalarQueryParameter(param_name, "STRING", e.strip().lower())
-                )
-            condiciones.append(f"LOWER(pc.estado_conciliacion) IN ({', '.join(placeholders)})")
+            condiciones.append("LOWER(pc.estado_conciliacion) IN UNNEST(@estado)")
+            parametros.append(parametro_lista("estado", [e.strip().lower() for e in estado], "STRING"))
 
         condiciones_sql = " AND ".join(condiciones)
 
@@ -3735,23 +3559,19 @@ def obtener_estadisticas_pendientes_contabilidad(
 @router.get("/valores-tn-reales")
 def obtener_valores_tn_reales(
     trackings: str = Query(..., description="Lista de trackings separados por coma"),
-    estado_conciliacion: str = Query(..., description="Estado de conciliación del pago")
+    estado_conciliacion: str = Query(..., description="Estado de conciliación del pago"),
+    client: bigquery.Client = Depends(get_bigquery_client)
 ):
     """
     Obtiene los valores reales de TN desde COD_pendientes o guias_liquidacion según el estado
     """
     try:
-        client = get_bigquery_client()
-        
         # Convertir string de trackings a lista
         lista_trackings = [t.strip() for t in trackings.split(',') if t.strip()]
         
         if not lista_trackings:
             raise HTTPException(status_code=400, detail="No se proporcionaron trackings válidos")
         
-        # Crear placeholder para IN clause
-        trackings_placeholder = "', '".join(lista_trackings)
-        
         valores_tn = {}
         
         if estado_conciliacion == 'pendiente_conciliacion':
@@ -3763,7 +3583,7 @@ def obtener_valores_tn_reales(
                 Cliente as cliente,
                 Carrier as carrier
             FROM `{PROJECT_ID}.{DATASET_CONCILIACIONES}.COD_pendientes_v1`
-            WHERE tracking_number IN ('{trackings_placeholder}')
+            WHERE tracking_number IN UNNEST(@trackings)
             """
             
             logger.info(f"🔍 Buscando valores TN en COD_pendientes_v1 para trackings: {lista_trackings}")
@@ -3777,12 +3597,14 @@ def obtener_valores_tn_reales(
                 cliente,
                 carrier
             FROM `{PROJECT_ID}.{DATASET_CONCILIACIONES}.guias_liquidacion`
-            WHERE tracking_number IN ('{trackings_placeholder}')
+            WHERE tracking_number IN UNNEST(@trackings)
             """
             
             logger.info(f"🔍 Buscando valores TN en guias_liquidacion para trackings: {lista_trackings}")
         
-        results = client.query(query).result()
+        results = client.query(query, job_config=bigquery.QueryJobConfig(
+            query_parameters=[parametro_lista("trackings", lista_trackings, "STRING")]
+        )).result()
         
         # Procesar resultados
         for row in results:
@@ -3799,8 +3621,6 @@ def obtener_valores_tn_reales(
         if trackings_no_encontrados:
             logger.info(f"🔄 Buscando trackings faltantes en tabla alternativa: {trackings_no_encontrados}")
             
-            trackings_fallback_placeholder = "', '".join(trackings_no_encontrados)
-            
             if estado_conciliacion == 'pendiente_conciliacion':
                 # Buscar en guias_liquidacion como fallback
                 query_fallback = f"""
@@ -3810,7 +3630,7 @@ def obtener_valores_tn_reales(
                     cliente,
                     carrier
                 FROM `{PROJECT_ID}.{DATASET_CONCILIACIONES}.guias_liquidacion`
-                WHERE tracking_number IN ('{trackings_fallback_placeholder}')
+                WHERE tracking_number IN UNNEST(@trackings)
                 """
                 fuente_fallback = "guias_liquidacion"
             else:
@@ -3822,11 +3642,13 @@ def obtener_valores_tn_reales(
                     Cliente as cliente,
                     Carrier as carrier
                 FROM `{PROJECT_ID}.{DATASET_CONCILIACIONES}.COD_pendientes_v1`
-                WHERE tracking_number IN ('{trackings_fallback_placeholder}')
+                WHERE tracking_number IN UNNEST(@trackings)
                 """
                 fuente_fallback = "COD_pendientes_v1"
             
-            results_fallback = client.query(query_fallback).result()
+            results_fallback = client.query(query_fallback, job_config=bigquery.QueryJobConfig(
+                query_parameters=[parametro_lista("trackings", trackings_no_encontrados, "STRING")]
+            )).result()
             
             for row in results_fallback:
                 if row.tracking not in valores_tn:  # Solo agregar si no existe
@@ -3869,13 +3691,11 @@ def obtener_valores_tn_reales(
 
 # Endpoint para debugging - verificar datos de banco
 @router.get("/debug/verificar-banco")
-def debug_verificar_banco():
+def debug_verificar_banco(client: bigquery.Client = Depends(get_bigquery_client)):
     """
     Endpoint de debugging para verificar los datos de banco asociado
     """
     try:
-        client = get_bigquery_client()
-        
         # Verificar registros con id_banco_asociado
         query_pagos_con_banco = f"""
         SELECT 
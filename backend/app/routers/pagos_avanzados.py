@@ -1,12 +1,12 @@
 from fastapi import APIRouter, HTTPException, Depends
 from google.cloud import bigquery
+from app.core.bigquery_client import get_bigquery_client
 from typing import List, Dict, Any
 from pydantic import BaseModel
 import json
 from datetime import datetime, date
 
 router = APIRouter(prefix="/pagos-avanzados")
-client = bigquery.Client()
 
 class GuiaSeleccionada(BaseModel):
     tracking: str
@@ -20,8 +20,9 @@ class ValidacionPago(BaseModel):
 
 
 @router.post("/validar-pago")
-async def validar_pago_con_bonos(
+def validar_pago_con_bonos(
     validacion: ValidacionPago,
+    client: bigquery.Client = Depends(get_bigquery_client),
 ) -> Dict[str, Any]:
     """
     Valida si el pago es posible con efectivo + bonos disponibles
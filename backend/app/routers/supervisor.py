@@ -1,6 +1,9 @@
 from fastapi import APIRouter, HTTPException, Depends, Query, logger
 from google.cloud import bigquery
 from app.dependencies import get_current_user
+from app.core.bigquery_client import get_bigquery_client
+from app.core.consultas import ParametrosConsulta, parametro_lista
+from app.core.identidades import identidades
 from typing import List, Dict, Any, Optional
 from datetime import datetime
 
@@ -10,14 +13,19 @@ PROJECT_ID = "datos-clientes-441216"
 DATASET = "Conciliaciones"
 DATASET_CONCILIACIONES = DATASET  # Añadido para evitar error de variable no definida
 
-bq_client = bigquery.Client()
-
 def verificar_supervisor(current_user: dict = Depends(get_current_user)):
     if current_user["rol"] not in ["admin", "supervisor", "master"]:
         raise HTTPException(status_code=403, detail="No autorizado")
     return current_user
 
 def obtener_carrier_id_supervisor(correo: str, client: bigquery.Client) -> List[int]:
+    """
+    IDs de carriers que puede supervisar un usuario, desde la caché de
+    identidades; si el correo no está cargado se consultan las tablas.
+    """
+    return identidades.carrier_ids(correo, consultar=lambda: consultar_carrier_id_supervisor(correo, client))
+
+def consultar_carrier_id_supervisor(correo: str, client: bigquery.Client) -> List[int]:
     """
     Obtiene los IDs de carriers que puede supervisar un usuario
     FUNCIÓN FALTANTE - FIX CRÍTICO
@@ -89,82 +97,29 @@ def obtener_carrier_id_supervisor(correo: str, client: bigquery.Client) -> List[
         return []
 
 
-def obtener_carrier_info_supervisor(correo: str, client: bigquery.Client) -> List[Dict[str, Any]]:
+def obtener_carrier_info_supervisor(correo: str, client: bigquery.Client,
+                                    carrier_ids: Optional[List[int]] = None) -> List[Dict[str, Any]]:
     """
     Obtiene información completa de los carriers que puede supervisar un usuario
+    (``carrier_ids`` ya resueltos, p. ej. desde el token, evitan la búsqueda)
     """
     try:
-        # INTENTO 1: Buscar si empresa_carrier contiene IDs numéricos
-        query_admin_numeric = """
-        SELECT DISTINCT
-            SAFE_CAST(SPLIT(empresa_carrier, ',')[OFFSET(0)] AS INT64) as carrier_id
-        FROM `datos-clientes-441216.Conciliaciones.usuarios`
-        WHERE correo = @correo
-        AND empresa_carrier IS NOT NULL
-        AND empresa_carrier != ''
-        AND REGEXP_CONTAINS(empresa_carrier, r'^[0-9,\s]+$')
-        """
-        
-        job_config = bigquery.QueryJobConfig(
-            query_parameters=[
-                bigquery.ScalarQueryParameter("correo", "STRING", correo)
-            ]
-        )
-        
-        result = client.query(query_admin_numeric, job_config=job_config).result()
-        rows = list(result)
-        
-        carrier_ids = []
-        if rows:
-            carrier_ids = [row.carrier_id for row in rows if row.carrier_id is not None]
-        
-        # INTENTO 2: Si no encontró IDs numéricos, buscar por nombre de empresa
-        if not carrier_ids:
-            query_admin_by_name = """
-            SELECT DISTINCT cod.carrier_id
-            FROM `datos-clientes-441216.Conciliaciones.usuarios` u
-            JOIN `datos-clientes-441216.Conciliaciones.COD_pendientes_v1` cod
-                ON UPPER(TRIM(u.empresa_carrier)) = UPPER(TRIM(cod.Carrier))
-            WHERE u.correo = @correo
-            AND u.empresa_carrier IS NOT NULL
-            AND u.empresa_carrier != ''
-            """
-            
-            result_by_name = client.query(query_admin_by_name, job_config=job_config).result()
-            rows_by_name = list(result_by_name)
-            
-            if rows_by_name:
-                carrier_ids = [row.carrier_id for row in rows_by_name if row.carrier_id is not None]
-        
-        # Si no está en usuarios, buscar en usuarios_BIG
-        if not carrier_ids:
-            query_big = """
-            SELECT DISTINCT Carrier_id
-            FROM `datos-clientes-441216.Conciliaciones.usuarios_BIG`
-            WHERE LOWER(Employee_Mail) = LOWER(@correo)
-            """
-            
-            result_big = client.query(query_big, job_config=job_config).result()
-            rows_big = list(result_big)
-            
-            if rows_big:
-                carrier_ids = [row.Carrier_id for row in rows_big if row.Carrier_id]
+        carrier_ids = carrier_ids or obtener_carrier_id_supervisor(correo, client)
         
         if not carrier_ids:
             print(f"⚠️ No se encontraron carriers para supervisor {correo}")
             return []
         
         # Obtener nombres de los carriers
-        carrier_ids_str = ','.join(map(str, carrier_ids))
-        query_nombres = f"""
+        query_nombres = """
         SELECT DISTINCT 
             carrier_id,
             Carrier as nombre
         FROM `datos-clientes-441216.Conciliaciones.COD_pendientes_v1`
-        WHERE carrier_id IN ({carrier_ids_str})
+        WHERE carrier_id IN UNNEST(@carrier_ids)
         """
         
-        result_nombres = client.query(query_nombres).result()
+        result_nombres = client.query(query_nombres, job_config=bigquery.QueryJobConfig(query_parameters=[parametro_lista("carrier_ids", carrier_ids)])).result()
         carriers_info = []
         
         for row in result_nombres:
@@ -181,15 +136,16 @@ def obtener_carrier_info_supervisor(correo: str, client: bigquery.Client) -> Lis
         return []
 
 @router.get("/dashboard")
-async def get_dashboard_supervisor(current_user = Depends(verificar_supervisor)):
+async def get_dashboard_supervisor(current_user = Depends(verificar_supervisor), client: bigquery.Client = Depends(get_bigquery_client)):
     """
     Dashboard del supervisor con estadísticas REALES de su(s) carrier(s)
     """
     try:
-        client = bigquery.Client()
         # CAMBIO: Obtener correo correctamente desde el JWT
         user_email = current_user.get("correo") or current_user.get("sub")
-        carriers_info = obtener_carrier_info_supervisor(user_email, client)
+        carriers_info = await client.ejecutar_async(
+            obtener_carrier_info_supervisor, user_email, client, current_user.get("carrier_ids")
+        )
         
         if not carriers_info:
             return {
@@ -200,7 +156,8 @@ async def get_dashboard_supervisor(current_user = Depends(verificar_supervisor))
             }
         
         carrier_ids = [c["id"] for c in carriers_info]
-        carrier_ids_str = ','.join(map(str, carrier_ids))        # Estadísticas REALES del carrier usando criterios actualizados
+        carrier_config = bigquery.QueryJobConfig(query_parameters=[parametro_lista("carrier_ids", carrier_ids)])
+        # Estadísticas REALES del carrier usando criterios actualizados
         query_stats = f"""
         WITH fecha_limite AS (
             SELECT DATE('2025-06-09') as fecha_inicio  -- ✅ FECHA FIJA desde el 9 de junio de 2025
@@ -239,7 +196,7 @@ async def get_dashboard_supervisor(current_user = Depends(verificar_supervisor))
             LEFT JOIN `datos-clientes-441216.Conciliaciones.pagosconductor` pc
                 ON pc.tracking = cod.tracking_number
             CROSS JOIN fecha_limite fl
-            WHERE cod.carrier_id IN ({carrier_ids_str})
+            WHERE cod.carrier_id IN UNNEST(@carrier_ids)
                 AND cod.Valor > 0
                 AND DATE(cod.Status_Date) >= fl.fecha_inicio
         ),
@@ -247,7 +204,7 @@ async def get_dashboard_supervisor(current_user = Depends(verificar_supervisor))
             SELECT 
                 COUNT(DISTINCT Employee_id) as total_conductores_registrados
             FROM `datos-clientes-441216.Conciliaciones.usuarios_BIG`
-            WHERE Carrier_id IN ({carrier_ids_str})
+            WHERE Carrier_id IN UNNEST(@carrier_ids)
         )
         SELECT 
             gs.*,
@@ -256,8 +213,8 @@ async def get_dashboard_supervisor(current_user = Depends(verificar_supervisor))
         FROM guias_stats gs, conductores_stats cs, fecha_limite fl
         """
         
-        result_stats = client.query(query_stats).result()
-        stats_row = list(result_stats)[0]        # Top 5 conductores con más actividad reciente (ACTUALIZADO)
+        result_stats = await client.query_async(query_stats, job_config=carrier_config)
+        stats_row = result_stats[0]        # Top 5 conductores con más actividad reciente (ACTUALIZADO)
         query_conductores = f"""
         WITH fecha_limite AS (
             SELECT DATE('2025-06-09') as fecha_inicio  -- ✅ FECHA FIJA desde el 9 de junio de 2025
@@ -298,14 +255,14 @@ async def get_dashboard_supervisor(current_user = Depends(verificar_supervisor))
         LEFT JOIN `datos-clientes-441216.Conciliaciones.pagosconductor` pc
             ON pc.tracking = cp.tracking_number
         CROSS JOIN fecha_limite fl
-        WHERE ub.Carrier_id IN ({carrier_ids_str})
+        WHERE ub.Carrier_id IN UNNEST(@carrier_ids)
             AND cp.Status_Date >= fl.fecha_inicio
         GROUP BY ub.Employee_Name, ub.Employee_Mail, ub.Employee_Phone
         HAVING COUNT(cp.tracking_number) > 0
         ORDER BY guias_totales DESC, ultima_actividad DESC
         LIMIT 8        """
         
-        result_conductores = client.query(query_conductores).result()
+        result_conductores = await client.query_async(query_conductores, job_config=carrier_config)
         conductores = []
         
         for row in result_conductores:
@@ -410,7 +367,8 @@ async def get_guias_pendientes_supervisor(
     ciudad: Optional[str] = Query(None),
     fecha: Optional[str] = Query(None),  # formato YYYY-MM-DD
     estado_liquidacion: Optional[str] = Query(None, description="pendiente, pagado"),
-    current_user = Depends(verificar_supervisor)
+    current_user = Depends(verificar_supervisor),
+    client: bigquery.Client = Depends(get_bigquery_client)
 ):
     """
     Lista las guías pendientes de los carriers supervisados
@@ -419,21 +377,19 @@ async def get_guias_pendientes_supervisor(
     - pagado: Guías con pago registrado en pagosconductor
     """
     try:
-        client = bigquery.Client()
         user_email = current_user.get("correo") or current_user.get("sub")
-        carrier_ids = obtener_carrier_id_supervisor(user_email, client)
+        carrier_ids = current_user.get("carrier_ids") or await client.ejecutar_async(obtener_carrier_id_supervisor, user_email, client)
         
         if not carrier_ids:
             return {"guias": [], "total": 0, "mensaje": "No hay carriers asignados"}
 
-        carrier_ids_str = ','.join(map(str, carrier_ids))
         where_conditions = [
-            f"cp.carrier_id IN ({carrier_ids_str})",
+            "cp.carrier_id IN UNNEST(@carrier_ids)",
             "cp.Valor > 0",
             "cp.Status_Big = '360 - Entregado al cliente'"
         ]
 
-        query_params = []        # Filtro por estado de liquidación (basado en pagosconductor existente)
+        query_params = [parametro_lista("carrier_ids", carrier_ids)]        # Filtro por estado de liquidación (basado en pagosconductor existente)
         if estado_liquidacion:
             if estado_liquidacion.lower() == "pendiente":
                 # Guías sin pago registrado
@@ -501,7 +457,7 @@ async def get_guias_pendientes_supervisor(
         ])
 
         job_config = bigquery.QueryJobConfig(query_parameters=query_params)
-        result = client.query(query, job_config=job_config).result()
+        result = await client.query_async(query, job_config=job_config)
 
         guias = []
         for row in result:
@@ -533,7 +489,7 @@ async def get_guias_pendientes_supervisor(
         """
 
         count_config = bigquery.QueryJobConfig(query_parameters=query_params[:-2])
-        total = list(client.query(count_query, job_config=count_config).result())[0].total
+        total = (await client.query_async(count_query, job_config=count_config))[0].total
 
         return {
             "guias": guias,
@@ -549,21 +505,18 @@ async def get_guias_pendientes_supervisor(
 
 
 @router.get("/conductores")
-async def get_conductores_supervisor(current_user = Depends(verificar_supervisor)):
+async def get_conductores_supervisor(current_user = Depends(verificar_supervisor), client: bigquery.Client = Depends(get_bigquery_client)):
     """
     Lista todos los conductores de los carriers del supervisor desde 2025-06-09
     """
     try:
-        client = bigquery.Client()
         user_email = current_user.get("correo") or current_user.get("sub")
-        carrier_ids = obtener_carrier_id_supervisor(user_email, client)
+        carrier_ids = current_user.get("carrier_ids") or await client.ejecutar_async(obtener_carrier_id_supervisor, user_email, client)
         
         if not carrier_ids:
             return []
         
-        carrier_ids_str = ','.join(map(str, carrier_ids))
-        
-        query = f"""
+        query = """
         WITH conductores_actividad AS (
             SELECT 
                 ub.Employee_id,
@@ -586,7 +539,7 @@ async def get_conductores_supervisor(current_user = Depends(verificar_supervisor
             LEFT JOIN `datos-clientes-441216.Conciliaciones.COD_pendientes_v1` cp 
                 ON ub.Employee_id = cp.Employee_id
                 AND cp.Status_Date >= '2025-06-09'  # Filtro por fecha
-            WHERE ub.Carrier_id IN ({carrier_ids_str})
+            WHERE ub.Carrier_id IN UNNEST(@carrier_ids)
             GROUP BY ub.Employee_id, ub.Employee_Name, ub.Employee_Mail, 
                      ub.Employee_Phone, ub.Carrier_Name, ub.Created
         )
@@ -601,7 +554,7 @@ async def get_conductores_supervisor(current_user = Depends(verificar_supervisor
         ORDER BY ultima_actividad DESC NULLS LAST
         """
         
-        result = client.query(query).result()
+        result = await client.query_async(query, job_config=bigquery.QueryJobConfig(query_parameters=[parametro_lista("carrier_ids", carrier_ids)]))
         
         conductores = []
         for row in result:
@@ -626,13 +579,12 @@ async def get_conductores_supervisor(current_user = Depends(verificar_supervisor
         raise HTTPException(status_code=500, detail=f"Error interno: {str(e)}")
 
 @router.get("/resumen-carrier")
-async def get_resumen_carrier(current_user = Depends(verificar_supervisor)):
+async def get_resumen_carrier(current_user = Depends(verificar_supervisor), client: bigquery.Client = Depends(get_bigquery_client)):
     """
     Resumen ejecutivo del/los carrier(s) del supervisor
     """
     try:
-        client = bigquery.Client()
-        carrier_ids = obtener_carrier_id_supervisor(current_user["correo"], client)
+        carrier_ids = current_user.get("carrier_ids") or await client.ejecutar_async(obtener_carrier_id_supervisor, current_user["correo"], client)
         
         if not carrier_ids:
             return {"mensaje": "No hay carriers asignados", "carriers": []}
@@ -660,7 +612,7 @@ async def get_resumen_carrier(current_user = Depends(verificar_supervisor)):
             GROUP BY c.Carrier
             """
             
-            result = client.query(query).result()
+            result = await client.query_async(query)
             rows = list(result)
             
             if rows:
@@ -690,27 +642,26 @@ async def get_guias_entregadas_supervisor(
     limit: int = Query(100),
     offset: int = Query(0),
     conductor: Optional[str] = Query(None),
-    current_user = Depends(verificar_supervisor)
+    current_user = Depends(verificar_supervisor),
+    client: bigquery.Client = Depends(get_bigquery_client)
 ):
     """
     Lista las guías en estado 360 (entregadas) de los carriers supervisados
     """
     try:
-        client = bigquery.Client()
         user_email = current_user.get("correo") or current_user.get("sub")
-        carrier_ids = obtener_carrier_id_supervisor(user_email, client)
+        carrier_ids = current_user.get("carrier_ids") or await client.ejecutar_async(obtener_carrier_id_supervisor, user_email, client)
         
         if not carrier_ids:
             return {"guias": [], "total": 0}
 
-        carrier_ids_str = ','.join(map(str, carrier_ids))
         where_conditions = [
-            f"cp.carrier_id IN ({carrier_ids_str})",
+            "cp.carrier_id IN UNNEST(@carrier_ids)",
             "cp.Valor > 0",
             "(cp.Status_Big LIKE '%360%' OR cp.Status_Big LIKE '%Entregado%')"
         ]
         
-        query_params = []
+        query_params = [parametro_lista("carrier_ids", carrier_ids)]
 
         if conductor:
             where_conditions.append("LOWER(ub.Employee_Name) LIKE LOWER(@conductor) ")
@@ -746,7 +697,7 @@ async def get_guias_entregadas_supervisor(
         ]
 
         job_config = bigquery.QueryJobConfig(query_parameters=query_params)
-        result = client.query(query, job_config=job_config).result()
+        result = await client.query_async(query, job_config=job_config)
         
         guias = [{
             "tracking_number": row.tracking_number,
@@ -774,21 +725,18 @@ async def get_guias_entregadas_supervisor(
         raise HTTPException(status_code=500, detail="Error interno")
 
 @router.get("/pagos-conductor")
-async def obtener_pagos_conductor(current_user = Depends(verificar_supervisor)):
+async def obtener_pagos_conductor(current_user = Depends(verificar_supervisor), client: bigquery.Client = Depends(get_bigquery_client)):
     """
     Obtiene la lista de pagos filtrados por carrier y fecha
     """
     try:
-        client = bigquery.Client()
         user_email = current_user.get("correo") or current_user.get("sub")
         
         # Obtener carriers del supervisor
-        carrier_ids = obtener_carrier_id_supervisor(user_email, client)
+        carrier_ids = current_user.get("carrier_ids") or await client.ejecutar_async(obtener_carrier_id_supervisor, user_email, client)
         if not carrier_ids:
             return []
             
-        carrier_ids_str = ','.join(map(str, carrier_ids))
-        
         query = f"""
         WITH pagos_filtrados AS (
             SELECT 
@@ -800,7 +748,7 @@ async def obtener_pagos_conductor(current_user = Depends(verificar_supervisor)):
             FROM `{PROJECT_ID}.{DATASET_CONCILIACIONES}.pagosconductor` pc
             INNER JOIN `{PROJECT_ID}.{DATASET_CONCILIACIONES}.COD_pendientes_v1` cp 
                 ON pc.tracking = cp.tracking_number
-            WHERE cp.carrier_id IN ({carrier_ids_str})
+            WHERE cp.carrier_id IN UNNEST(@carrier_ids)
                 AND pc.fecha_pago >= '2025-06-09'
                 AND cp.Status_Big LIKE '%360%'
         )
@@ -813,7 +761,7 @@ async def obtener_pagos_conductor(current_user = Depends(verificar_supervisor)):
         ORDER BY pf.fecha_pago DESC, pf.creado_en DESC
         """
         
-        resultados = client.query(query).result()
+        resultados = await client.query_async(query, job_config=bigquery.QueryJobConfig(query_parameters=[parametro_lista("carrier_ids", carrier_ids)]))
           # Agrupar pagos por referencia
         pagos_agrupados = {}
         for row in resultados:
@@ -856,15 +804,15 @@ async def obtener_pagos_conductor(current_user = Depends(verificar_supervisor)):
 async def cambiar_estado_conductor(
     conductor_id: str, 
     nuevo_estado: dict,
-    current_user = Depends(verificar_supervisor)
+    current_user = Depends(verificar_supervisor),
+    client: bigquery.Client = Depends(get_bigquery_client)
 ):
     """
     Cambia el estado de un conductor (activo/inactivo/suspendido)
     """
     try:
-        client = bigquery.Client()
         user_email = current_user.get("correo") or current_user.get("sub")
-        carrier_ids = obtener_carrier_id_supervisor(user_email, client)
+        carrier_ids = current_user.get("carrier_ids") or await client.ejecutar_async(obtener_carrier_id_supervisor, user_email, client)
         
         if not carrier_ids:
             raise HTTPException(status_code=403, detail="No autorizado para gestionar conductores")
@@ -874,17 +822,16 @@ async def cambiar_estado_conductor(
             raise HTTPException(status_code=400, detail="Estado inválido")
         
         # Verificar que el conductor pertenece a uno de los carriers del supervisor
-        carrier_ids_str = ','.join(map(str, carrier_ids))
-        
+        params = ParametrosConsulta()
         verify_query = f"""
         SELECT Employee_id 
         FROM `datos-clientes-441216.Conciliaciones.usuarios_BIG`
-        WHERE Employee_id = '{conductor_id}' 
-        AND Carrier_id IN ({carrier_ids_str})
+        WHERE CAST(Employee_id AS STRING) = {params.escalar("conductor_id", conductor_id, "STRING")}
+        AND Carrier_id IN {params.lista("carrier_ids", carrier_ids)}
         """
         
-        verify_result = client.query(verify_query).result()
-        if not list(verify_result):
+        verify_result = await client.query_async(verify_query, job_config=params.job_config())
+        if not verify_result:
             raise HTTPException(status_code=404, detail="Conductor no encontrado o no autorizado")
         
         # En este caso, como no tenemos una tabla específica para estados de conductores,
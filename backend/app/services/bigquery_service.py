@@ -1,13 +1,14 @@
 import os
 from google.cloud import bigquery
 from app.core.config import GOOGLE_CREDENTIALS_PATH
+from app.core.bigquery_client import get_bigquery_client
 
 os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = GOOGLE_CREDENTIALS_PATH
 
 
 def obtener_pagos_pendientes():
     """Obtiene los pagos pendientes para conductores"""
-    client = bigquery.Client()
+    client = get_bigquery_client()
     
     query = """
         SELECT 
@@ -33,7 +34,7 @@ AND (Status_Big IS NULL OR Status_Big NOT LIKE '%PAGADO%')
 
 def obtener_roles():
     """Obtiene los roles disponibles"""
-    client = bigquery.Client()
+    client = get_bigquery_client()
     
     query = """
         SELECT id_rol, nombre_rol, descripcion
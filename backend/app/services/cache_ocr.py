@@ -0,0 +1,294 @@
+"""
+Caché de resultados OCR por contenido de la imagen (SQLite en disco).
+
+Los conductores suben el mismo comprobante varias veces (reintentos,
+registros fallidos, varias guías con un solo pago) y cada subida repetía la
+extracción completa, incluida la llamada paga a GPT-4o. Aquí el resultado
+fusionado se guarda con dos llaves:
+
+- ``sha256`` de los bytes: la misma imagen exacta.
+- Hash perceptual (dHash de 16x16 = 256 bits): la misma imagen recomprimida
+  o reenviada por WhatsApp. Un candidato con distancia de Hamming
+  ``<= OCR_CACHE_DISTANCIA_MAXIMA`` y la misma proporción de aspecto se
+  filtra además comparando miniaturas por bloques (descarta imágenes con
+  regiones claramente distintas). Con ``0`` solo se usan
+  coincidencias exactas.
+
+Un acierto perceptual es solo una sugerencia: un dígito distinto en la
+referencia apenas cambia la miniatura, así que antes de devolverlo se lee el
+texto de la imagen nueva con el OCR local y ``confirma_acierto`` exige que la
+referencia y el valor guardados aparezcan en él. Si no, se repite la
+extracción completa.
+
+::
+
+    acierto = await cache_ocr.buscar(contents, variante)
+    if acierto and acierto["cache"]["tipo"] == "exacto":
+        return acierto
+    if acierto and confirma_acierto(acierto, texto_ocr_local):
+        return acierto
+    ...
+    await cache_ocr.guardar(contents, variante, respuesta_final)
+
+Al superar ``OCR_CACHE_MAX_ENTRADAS`` se descartan las menos usadas
+recientemente (LRU). Los hashes perceptuales viven también en memoria para
+comparar sin consultar la base.
+"""
+
+import asyncio
+import hashlib
+import io
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+from app.core.config import OCR_CACHE_DISTANCIA_MAXIMA, OCR_CACHE_MAX_ENTRADAS, OCR_CACHE_RUTA
+from app.core.serializacion import codificar_json
+
+logger = logging.getLogger(__name__)
+
+LADO_HASH = 16
+# Diferencia máxima de proporción (ancho/alto) para aceptar una coincidencia perceptual
+TOLERANCIA_PROPORCION = 0.02
+# Miniatura en grises para confirmar coincidencias perceptuales
+ANCHO_MINIATURA = 256
+LADO_BLOQUE = 8
+# Diferencia media máxima (niveles de gris) en cualquier bloque de la miniatura
+UMBRAL_BLOQUE = 12
+# Campos del resultado guardado que deben leerse en la imagen nueva
+CAMPOS_CONFIRMACION = ("referencia", "valor")
+
+
+def huella_perceptual(contents: bytes) -> Tuple[int, float, bytes]:
+    """dHash de ``LADO_HASH``² bits, proporción ancho/alto y miniatura PNG en grises"""
+    imagen = Image.open(io.BytesIO(contents))
+    proporcion = imagen.width / imagen.height if imagen.height else 0.0
+    # En JPEG decodifica directamente a una resolución cercana a la miniatura
+    imagen.draft("L", (ANCHO_MINIATURA, max(1, round(ANCHO_MINIATURA / (proporcion or 1)))))
+    gris = imagen.convert("L")
+    miniatura = gris.resize((ANCHO_MINIATURA, max(1, round(ANCHO_MINIATURA / (proporcion or 1)))), Image.BILINEAR)
+    pixeles = np.asarray(miniatura.resize((LADO_HASH + 1, LADO_HASH), Image.BILINEAR), dtype=np.int16)
+    valor = 0
+    for bit in (pixeles[:, :-1] > pixeles[:, 1:]).ravel():
+        valor = (valor << 1) | int(bit)
+    salida = io.BytesIO()
+    miniatura.save(salida, format="PNG", optimize=True)
+    return valor, proporcion, salida.getvalue()
+
+
+def misma_imagen(miniatura_a: bytes, miniatura_b: bytes) -> bool:
+    """Ninguna región difiere más que el ruido de recompresión"""
+    a = Image.open(io.BytesIO(miniatura_a))
+    b = Image.open(io.BytesIO(miniatura_b))
+    if a.size != b.size:
+        b = b.resize(a.size, Image.BILINEAR)
+    diferencia = np.abs(np.asarray(a, dtype=np.int16) - np.asarray(b, dtype=np.int16))
+    alto = diferencia.shape[0] // LADO_BLOQUE * LADO_BLOQUE
+    ancho = diferencia.shape[1] // LADO_BLOQUE * LADO_BLOQUE
+    if not alto or not ancho:
+        return False
+    bloques = diferencia[:alto, :ancho].reshape(alto // LADO_BLOQUE, LADO_BLOQUE, ancho // LADO_BLOQUE, LADO_BLOQUE)
+    return float(bloques.mean(axis=(1, 3)).max()) <= UMBRAL_BLOQUE
+
+
+def _alfanumerico(texto: Any) -> str:
+    return re.sub(r"[^0-9a-z]", "", str(texto).lower())
+
+
+def _montos(texto: str) -> set:
+    """Montos del texto como enteros en texto: ``$ 150.000,00`` -> ``150000``"""
+    montos = set()
+    for numero in re.findall(r"\d[\d.,]*\d|\d", texto):
+        numero = re.sub(r"[.,]\d{2}$", "", numero)
+        montos.add(re.sub(r"\D", "", numero).lstrip("0") or "0")
+    return montos
+
+
+def confirma_acierto(resultado: Dict[str, Any], texto: str) -> bool:
+    """La referencia y el valor del resultado guardado aparecen en ``texto`` (OCR de la imagen nueva)"""
+    datos = resultado.get("datos_extraidos") or {}
+    campos = {campo: datos.get(campo) for campo in CAMPOS_CONFIRMACION if datos.get(campo) not in (None, "", "null")}
+    if not campos or not texto:
+        return False
+    if "referencia" in campos:
+        if _alfanumerico(campos["referencia"]) not in {_alfanumerico(token) for token in texto.split()}:
+            return False
+    if "valor" in campos:
+        valor = re.sub(r"\D", "", str(campos["valor"]).split(".")[0]).lstrip("0") or "0"
+        if valor not in _montos(texto):
+            return False
+    return True
+
+
+class CacheOCR:
+    """Resultados OCR por imagen con LRU acotado; seguro entre hilos"""
+
+    def __init__(self, ruta: str = OCR_CACHE_RUTA, max_entradas: int = OCR_CACHE_MAX_ENTRADAS,
+                 distancia_maxima: int = OCR_CACHE_DISTANCIA_MAXIMA):
+        self._ruta = ruta
+        self._max_entradas = max_entradas
+        self._distancia_maxima = distancia_maxima
+        self._conexion: Optional[sqlite3.Connection] = None
+        self._perceptuales: Dict[str, List[Tuple[int, float, str]]] = {}
+        self._lock = threading.Lock()
+        self._aciertos_exactos = 0
+        self._aciertos_perceptuales = 0
+        self._fallos = 0
+
+    # ------------------------------------------------------------------
+    # Base de datos
+    # ------------------------------------------------------------------
+    def _bd(self) -> sqlite3.Connection:
+        if self._conexion is None:
+            directorio = os.path.dirname(self._ruta)
+            if directorio:
+                os.makedirs(directorio, exist_ok=True)
+            conexion = sqlite3.connect(self._ruta, check_same_thread=False)
+            conexion.execute("PRAGMA journal_mode=WAL")
+            conexion.execute("""
+                CREATE TABLE IF NOT EXISTS resultados (
+                    sha TEXT NOT NULL,
+                    variante TEXT NOT NULL,
+                    phash TEXT NOT NULL,
+                    proporcion REAL NOT NULL,
+                    miniatura BLOB,
+                    resultado BLOB NOT NULL,
+                    creado REAL NOT NULL,
+                    usado REAL NOT NULL,
+                    PRIMARY KEY (sha, variante)
+                )
+            """)
+            conexion.execute("CREATE INDEX IF NOT EXISTS idx_resultados_usado ON resultados (usado)")
+            self._conexion = conexion
+            self._cargar_perceptuales()
+        return self._conexion
+
+    def _cargar_perceptuales(self) -> None:
+        self._perceptuales = {}
+        for sha, variante, phash, proporcion in self._conexion.execute(
+            "SELECT sha, variante, phash, proporcion FROM resultados"
+        ):
+            if phash != "0":
+                self._perceptuales.setdefault(variante, []).append((int(phash, 16), proporcion, sha))
+
+    def _similar(self, variante: str, phash: int, proporcion: float, miniatura: bytes) -> Optional[Tuple[str, int]]:
+        """Imagen guardada más cercana por hash que además coincide por bloques"""
+        candidatos = []
+        for otro, otra_proporcion, sha in self._perceptuales.get(variante, ()):
+            if abs(otra_proporcion - proporcion) > TOLERANCIA_PROPORCION * max(proporcion, 1e-9):
+                continue
+            distancia = (otro ^ phash).bit_count()
+            if distancia <= self._distancia_maxima:
+                candidatos.append((distancia, sha))
+        for distancia, sha in sorted(candidatos):
+            fila = self._conexion.execute(
+                "SELECT miniatura FROM resultados WHERE sha = ? AND variante = ?", (sha, variante)
+            ).fetchone()
+            if fila and fila[0] and misma_imagen(miniatura, fila[0]):
+                return sha, distancia
+        return None
+
+    # ------------------------------------------------------------------
+    # Operaciones (bloqueantes; usar las versiones async desde handlers)
+    # ------------------------------------------------------------------
+    def buscar_sync(self, contents: bytes, variante: str) -> Optional[Dict[str, Any]]:
+        sha = hashlib.sha256(contents).hexdigest()
+        with self._lock:
+            bd = self._bd()
+            fila = bd.execute(
+                "SELECT resultado FROM resultados WHERE sha = ? AND variante = ?", (sha, variante)
+            ).fetchone()
+            tipo, distancia = "exacto", 0
+            if fila is None and self._distancia_maxima > 0:
+                try:
+                    similar = self._similar(variante, *huella_perceptual(contents))
+                except Exception as e:
+                    logger.warning(f"⚠️ No se pudo calcular hash perceptual: {e}")
+                    similar = None
+                if similar:
+                    sha, distancia = similar
+                    tipo = "perceptual"
+                    fila = bd.execute(
+                        "SELECT resultado FROM resultados WHERE sha = ? AND variante = ?", (sha, variante)
+                    ).fetchone()
+            if fila is None:
+                self._fallos += 1
+                return None
+            bd.execute("UPDATE resultados SET usado = ? WHERE sha = ? AND variante = ?", (time.time(), sha, variante))
+            bd.commit()
+            if tipo == "exacto":
+                self._aciertos_exactos += 1
+            else:
+                self._aciertos_perceptuales += 1
+
+        resultado = json.loads(fila[0])
+        resultado["cache"] = {"acierto": True, "tipo": tipo, "distancia": distancia}
+        logger.info(f"♻️ Caché OCR: acierto {tipo} (distancia {distancia})")
+        return resultado
+
+    def guardar_sync(self, contents: bytes, variante: str, resultado: Dict[str, Any]) -> None:
+        sha = hashlib.sha256(contents).hexdigest()
+        try:
+            phash, proporcion, miniatura = huella_perceptual(contents)
+        except Exception:
+            phash, proporcion, miniatura = 0, 0.0, None  # Solo servirá para coincidencias exactas
+        ahora = time.time()
+        with self._lock:
+            bd = self._bd()
+            bd.execute(
+                "INSERT OR REPLACE INTO resultados VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (sha, variante, format(phash, "x"), proporcion, miniatura, codificar_json(resultado), ahora, ahora),
+            )
+            total = bd.execute("SELECT COUNT(*) FROM resultados").fetchone()[0]
+            if total > self._max_entradas:
+                # Se libera un 10% de margen para no depurar en cada inserción
+                sobrantes = total - int(self._max_entradas * 0.9)
+                bd.execute(
+                    "DELETE FROM resultados WHERE rowid IN (SELECT rowid FROM resultados ORDER BY usado LIMIT ?)",
+                    (sobrantes,),
+                )
+                bd.commit()
+                self._cargar_perceptuales()
+                logger.info(f"🧹 Caché OCR: {sobrantes} resultados descartados (LRU)")
+            else:
+                bd.commit()
+                if phash:
+                    self._perceptuales.setdefault(variante, []).append((phash, proporcion, sha))
+
+    async def buscar(self, contents: bytes, variante: str) -> Optional[Dict[str, Any]]:
+        try:
+            return await asyncio.to_thread(self.buscar_sync, contents, variante)
+        except Exception as e:
+            logger.warning(f"⚠️ Error consultando caché OCR: {e}")
+            return None
+
+    async def guardar(self, contents: bytes, variante: str, resultado: Dict[str, Any]) -> None:
+        try:
+            await asyncio.to_thread(self.guardar_sync, contents, variante, resultado)
+        except Exception as e:
+            logger.warning(f"⚠️ Error guardando en caché OCR: {e}")
+
+    def estadisticas(self) -> Dict[str, Any]:
+        with self._lock:
+            aciertos = self._aciertos_exactos + self._aciertos_perceptuales
+            consultas = aciertos + self._fallos
+            entradas = self._conexion.execute("SELECT COUNT(*) FROM resultados").fetchone()[0] if self._conexion else 0
+            return {
+                "entradas": entradas,
+                "max_entradas": self._max_entradas,
+                "aciertos_exactos": self._aciertos_exactos,
+                "aciertos_perceptuales": self._aciertos_perceptuales,
+                "fallos": self._fallos,
+                "tasa_aciertos": round(aciertos / consultas, 4) if consultas else 0.0,
+            }
+
+
+cache_ocr = CacheOCR()
@@ -0,0 +1,127 @@
+"""
+Escritura por lotes de la conciliación automática.
+
+En lugar de dos ``UPDATE`` por cada match (uno en ``pagosconductor`` y otro
+en ``banco_movimientos``), las decisiones se acumulan en memoria y se aplican
+con un ``MERGE`` por tabla destino, usando las decisiones como parámetro
+``ARRAY<STRUCT>`` (``UNNEST``). Ambos ``MERGE`` van en un mismo script, así
+que cada lote es un solo job de BigQuery.
+"""
+
+import logging
+import time
+from datetime import date
+from typing import Any, Dict, List, Optional
+
+from google.cloud import bigquery
+
+from app.core.config import BIGQUERY_PROJECT_ID
+from app.core.consultas import arreglo_structs
+
+logger = logging.getLogger(__name__)
+
+TABLA_PAGOS = f"{BIGQUERY_PROJECT_ID}.Conciliaciones.pagosconductor"
+TABLA_BANCO = f"{BIGQUERY_PROJECT_ID}.Conciliaciones.banco_movimientos"
+
+# Decisiones por job; mantiene el tamaño de los parámetros acotado
+TAMANO_LOTE_CONCILIACION = 500
+
+CAMPOS_DECISION = (
+    ("id_banco", "STRING"), ("referencia_banco", "STRING"), ("id_transaccion", "INT64"),
+    ("referencia_pago", "STRING"), ("fecha_pago", "DATE"), ("correo", "STRING"),
+    ("valor", "FLOAT64"),
+)
+
+SQL_MERGE_CONCILIACION_AUTOMATICA = f"""
+MERGE `{TABLA_PAGOS}` T
+USING UNNEST(@pagos) S
+ON T.estado_conciliacion = 'pendiente_conciliacion'
+   AND (
+        (S.id_transaccion IS NOT NULL AND T.Id_Transaccion = S.id_transaccion)
+        OR (
+            S.id_transaccion IS NULL
+            AND T.Id_Transaccion IS NULL
+            AND T.referencia_pago = S.referencia_pago
+            AND T.fecha_pago = S.fecha_pago
+            AND T.correo = S.correo
+            AND COALESCE(T.valor_total_consignacion, CAST(T.valor AS FLOAT64)) = S.valor
+        )
+   )
+WHEN MATCHED THEN UPDATE SET
+    estado_conciliacion = 'conciliado_automatico',
+    fecha_conciliacion = CURRENT_DATE(),
+    id_banco_asociado = S.id_banco,
+    confianza_conciliacion = 100;
+
+MERGE `{TABLA_BANCO}` T
+USING UNNEST(@pagos) S
+ON T.id = S.id_banco
+WHEN MATCHED THEN UPDATE SET
+    estado_conciliacion = 'conciliado_automatico',
+    referencia_pago_asociada = S.referencia_banco,
+    confianza_match = 100,
+    conciliado_en = CURRENT_TIMESTAMP();
+"""
+
+
+class LoteConciliacionAutomatica:
+    """
+    Acumula los matches de una corrida de conciliación automática y los
+    escribe por lotes. ``pendiente_envio`` indica cuándo conviene llamar a
+    ``aplicar`` (cada ``tamano`` decisiones); al final de la corrida se llama
+    una vez más para el remanente.
+    """
+
+    def __init__(self, tamano: int = TAMANO_LOTE_CONCILIACION):
+        self.tamano = tamano
+        self._decisiones: List[Dict[str, Any]] = []
+        self.total_aplicadas = 0
+        self.jobs = 0
+        # Fechas de pago ya escritas, para refrescar las tablas resumen
+        self.fechas_pago: set = set()
+
+    def __len__(self) -> int:
+        return len(self._decisiones)
+
+    @property
+    def pendiente_envio(self) -> bool:
+        return len(self._decisiones) >= self.tamano
+
+    def agregar(self, id_banco: str, referencia_banco: str, id_transaccion: Optional[int] = None,
+                referencia_pago: Optional[str] = None, fecha_pago: Optional[date] = None,
+                correo: Optional[str] = None, valor: Optional[float] = None) -> None:
+        """
+        Con ``id_transaccion`` se concilian todos los pagos de esa transacción;
+        sin él, el pago individual que coincide en referencia, fecha, correo y valor.
+        ``fecha_pago`` se pasa siempre: con ella se invalidan los resúmenes del día.
+        """
+        self._decisiones.append({
+            "id_banco": id_banco,
+            "referencia_banco": referencia_banco,
+            "id_transaccion": id_transaccion,
+            "referencia_pago": referencia_pago,
+            "fecha_pago": fecha_pago,
+            "correo": correo,
+            "valor": float(valor) if valor is not None else None,
+        })
+
+    def aplicar(self, client) -> int:
+        """Escribe las decisiones acumuladas (bloqueante). Devuelve cuántas se aplicaron."""
+        if not self._decisiones:
+            return 0
+        decisiones, self._decisiones = self._decisiones, []
+        inicio = time.perf_counter()
+        try:
+            client.query(
+                SQL_MERGE_CONCILIACION_AUTOMATICA,
+                job_config=bigquery.QueryJobConfig(query_parameters=[arreglo_structs("pagos", CAMPOS_DECISION, decisiones)])
+            ).result()
+        except Exception:
+            # Se conservan para que el llamador pueda reintentar
+            self._decisiones = decisiones + self._decisiones
+            raise
+        self.total_aplicadas += len(decisiones)
+        self.jobs += 1
+        self.fechas_pago.update(d["fecha_pago"] for d in decisiones if d["fecha_pago"] is not None)
+        logger.info(f"💾 Lote de conciliación aplicado: {len(decisiones)} matches en {time.perf_counter() - inicio:.2f}s")
+        return len(decisiones)
@@ -0,0 +1,150 @@
+"""
+Motores OCR de CPU (EasyOCR y Tesseract) en un pool de procesos dedicado.
+
+``reader.readtext`` y ``pytesseract`` bloquean varios segundos de CPU; desde
+un handler ``async`` congelaban el event loop durante todo el OCR. Aquí se
+ejecutan en procesos aparte, así que el loop sigue atendiendo peticiones y
+los motores corren en paralelo con la llamada a OpenAI::
+
+    texto = await ejecutar_en_pool(texto_easyocr, contents)
+
+Carga perezosa: ni Torch ni los modelos de EasyOCR se importan en el
+proceso de la API. El pool (``OCR_PROCESOS`` procesos, independiente de los
+workers de uvicorn) se crea con el primer OCR y cada proceso carga un solo
+``easyocr.Reader`` la primera vez que lo necesita; desde ahí queda caliente
+y lo comparten todas las peticiones que atiende. Los procesos se crean con
+``spawn`` (Torch no tolera bien ``fork``) y este módulo no importa nada de
+``app`` a nivel de módulo para que arranquen livianos.
+
+Si un proceso muere (OOM, segfault de Torch) el pool queda roto y rechaza
+todo lo que se le envía: ``ejecutar_en_pool`` lo descarta, crea uno nuevo y
+reintenta la tarea una vez.
+"""
+
+import asyncio
+import io
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+CONFIG_TESSERACT = "--oem 3 --psm 6 -l spa"
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_procesos = 0
+_pool_lock = threading.Lock()
+
+
+def pool_ocr() -> ProcessPoolExecutor:
+    """Pool compartido, creado en el primer uso"""
+    global _pool, _pool_procesos
+    with _pool_lock:
+        if _pool is None:
+            # Import local: los procesos trabajadores no necesitan cargar la configuración
+            from app.core.config import OCR_HILOS_POR_PROCESO, OCR_PROCESOS
+            # Sin límite, cada proceso usaría todos los núcleos y competirían entre sí
+            hilos = OCR_HILOS_POR_PROCESO or max(1, (os.cpu_count() or 1) // OCR_PROCESOS)
+            _pool = ProcessPoolExecutor(
+                max_workers=OCR_PROCESOS,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_iniciar_proceso,
+                initargs=(hilos,),
+            )
+            _pool_procesos = OCR_PROCESOS
+            logger.info(f"🧵 Pool OCR iniciado con {OCR_PROCESOS} procesos de {hilos} hilos")
+        return _pool
+
+
+def _descartar_pool(roto: ProcessPoolExecutor) -> None:
+    """Saca de servicio un pool roto; el siguiente uso crea otro"""
+    global _pool, _pool_procesos
+    with _pool_lock:
+        if _pool is not roto:
+            return  # Otra tarea ya lo reemplazó
+        _pool = None
+        _pool_procesos = 0
+    roto.shutdown(wait=False, cancel_futures=True)
+    logger.warning("⚠️ Pool OCR roto (murió un proceso); se creará uno nuevo")
+
+
+async def ejecutar_en_pool(func: Callable[..., Any], *args) -> Any:
+    """
+    Ejecuta ``func`` en el pool OCR. Si la tarea se cancela antes de que un
+    proceso la tome, no llega a ejecutarse; si ya está corriendo, termina y
+    su resultado se descarta. Con el pool roto se reintenta una vez en un
+    pool nuevo.
+    """
+    loop = asyncio.get_running_loop()
+    for intento in range(2):
+        pool = pool_ocr()
+        try:
+            return await loop.run_in_executor(pool, func, *args)
+        except BrokenProcessPool:
+            _descartar_pool(pool)
+            if intento:
+                raise
+
+
+def estado_pool() -> Dict[str, Any]:
+    with _pool_lock:
+        return {"iniciado": _pool is not None, "procesos": _pool_procesos}
+
+
+def cerrar_pool_ocr() -> None:
+    global _pool, _pool_procesos
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+            _pool_procesos = 0
+
+
+# ----------------------------------------------------------------------
+# Funciones que corren dentro de los procesos trabajadores
+# ----------------------------------------------------------------------
+_reader = None
+_reader_lock = threading.Lock()
+
+
+def _iniciar_proceso(hilos: int) -> None:
+    os.environ["OMP_NUM_THREADS"] = str(hilos)
+    try:
+        import torch
+    except ImportError:
+        return
+    torch.set_num_threads(hilos)
+
+
+def modelo_easyocr():
+    """``easyocr.Reader`` del proceso, cargado una sola vez en el primer uso"""
+    global _reader
+    if _reader is None:
+        with _reader_lock:
+            if _reader is None:
+                import easyocr
+                logger.info("📦 Cargando modelos de EasyOCR...")
+                _reader = easyocr.Reader(["es"], gpu=False)
+    return _reader
+
+
+def texto_easyocr(imagen: Any, parrafos: bool = True, separador: str = "\n") -> str:
+    """Texto de una imagen (bytes o arreglo NumPy)"""
+    resultados = modelo_easyocr().readtext(imagen, detail=0, paragraph=parrafos)
+    return separador.join(resultados)
+
+
+def texto_tesseract(imagen: Any, config: str = CONFIG_TESSERACT) -> str:
+    """Texto de una imagen (bytes o arreglo NumPy en BGR/grises)"""
+    import pytesseract
+    from PIL import Image
+
+    if isinstance(imagen, bytes):
+        imagen = Image.open(io.BytesIO(imagen))
+    elif imagen.ndim == 3:
+        imagen = Image.fromarray(imagen[..., ::-1])  # BGR (OpenCV) -> RGB
+    return pytesseract.image_to_string(imagen, config=config)
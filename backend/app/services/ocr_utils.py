@@ -1,7 +1,5 @@
-import easyocr
-
-reader = easyocr.Reader(["es"])
+from app.services.ocr_motores import modelo_easyocr
 
 def leer_texto_ocr(imagen_path: str) -> str:
-    resultados = reader.readtext(imagen_path, detail=0, paragraph=True)
+    resultados = modelo_easyocr().readtext(imagen_path, detail=0, paragraph=True)
     return " ".join(resultados)
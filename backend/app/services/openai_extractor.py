@@ -1,20 +1,22 @@
 import os
+import asyncio
 import json
-import io
 import re
 import traceback
 import logging
 from typing import Dict, Any, Optional, List, Tuple
 from dotenv import load_dotenv
-from openai import OpenAI
+from openai import AsyncOpenAI
 from fastapi import UploadFile
-from PIL import Image, ImageEnhance, ImageFilter
 import cv2
 import numpy as np
-import pytesseract
-import easyocr
 from datetime import datetime
 
+from app.core.config import OCR_CONFIANZA_SALIDA_TEMPRANA, OCR_SALIDA_TEMPRANA
+from app.services.cache_ocr import cache_ocr, confirma_acierto
+from app.services.ocr_motores import ejecutar_en_pool, texto_easyocr, texto_tesseract
+from app.services.preprocesamiento_imagen import ImagenPreparada, preparar_imagen
+
 # Importar el validador IA
 try:
     from app.services.ai.ai_ocr_validator import validar_comprobante_ia
@@ -38,10 +40,12 @@ logger = logging.getLogger(__name__)
 
 # Cargar variables de entorno
 load_dotenv()
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+
+# EasyOCR/Torch se cargan bajo demanda en el pool OCR (ver ocr_motores)
 
-# Inicializar OCR engines
-reader = easyocr.Reader(['es'], gpu=False)
+# Campos que debe traer un resultado para cortar antes a los demás engines
+CAMPOS_SALIDA_TEMPRANA = ("valor", "fecha", "referencia", "tipo")
 
 class EnhancedOCRExtractor:
     """
@@ -75,22 +79,41 @@ class EnhancedOCRExtractor:
         Returns:
             Dict con datos extraídos, validación IA y metadata completa
         """
+        contents = await file.read()
+        return await self.extraer_datos_contenido(contents, usar_validacion_ia, engines_preferidos)
+
+    async def extraer_datos_contenido(
+        self,
+        contents: bytes,
+        usar_validacion_ia: bool = True,
+        engines_preferidos: List[str] = None
+    ) -> Dict[str, Any]:
+        """Extracción inteligente sobre los bytes de la imagen (ver extraer_datos_pago_inteligente)"""
         inicio_proceso = datetime.now()
         resultado_validacion = None
-        contents = None
 
         try:
-            # 1. Preparar imagen
-            contents = await file.read()
-            imagen_metadata = await self._analizar_calidad_imagen(contents, file)
-            
-            # 2. Preprocesar imagen si es necesario
-            imagen_mejorada = self._mejorar_imagen_si_necesario(contents, imagen_metadata)
+            # 1. Una imagen ya procesada se responde desde la caché
+            engines_a_usar = engines_preferidos or ["openai", "easyocr"]
+            variante_cache = f"ia={int(usar_validacion_ia)};engines={','.join(engines_a_usar)}"
+            en_cache = await cache_ocr.buscar(contents, variante_cache)
+            if en_cache and en_cache["cache"]["tipo"] == "exacto":
+                return en_cache
+
+            # 2. Decodificar una vez, medir calidad y mejorar si es necesario
+            imagen = await asyncio.to_thread(preparar_imagen, contents)
+            imagen_metadata = imagen.metadata
+
+            # Un acierto perceptual puede ser otro comprobante casi idéntico: solo
+            # se devuelve si el OCR local de esta imagen lee la misma referencia y valor
+            if en_cache:
+                if await self._confirmar_acierto_perceptual(imagen, en_cache):
+                    return en_cache
+                logger.info("♻️ Caché OCR: acierto perceptual descartado, el texto no coincide")
             
             # 3. Extracción con múltiples engines
-            engines_a_usar = engines_preferidos or ["openai", "easyocr"]
             resultados_engines = await self._extraer_con_multiples_engines(
-                imagen_mejorada, 
+                imagen, 
                 engines_a_usar, 
                 imagen_metadata
             )
@@ -118,10 +141,11 @@ class EnhancedOCRExtractor:
                 } if resultados_engines else {},
                 "validacion_ia": self._formatear_validacion_ia(resultado_validacion) if resultado_validacion else None,
                 "imagen_metadata": imagen_metadata,
-                "imagen_mejorada": imagen_mejorada != contents,
+                "imagen_mejorada": imagen.mejorada,
                 "estadisticas": {
                     "tiempo_total": tiempo_total,
                     "engines_utilizados": list(resultados_engines.keys()) if resultados_engines else [],
+                    "engines_cancelados": [e for e in engines_a_usar if e not in resultados_engines],
                     "engine_ganador": self._determinar_engine_ganador(resultados_engines),
                     "calidad_imagen": imagen_metadata.get("calidad_score", 0),
                 },
@@ -132,6 +156,15 @@ class EnhancedOCRExtractor:
             logger.info(f"✅ Extracción completada - Tiempo: {tiempo_total:.2f}s, "
                        f"Engine ganador: {respuesta_final['estadisticas']['engine_ganador']}, "
                        f"Tipo: {datos_finales.get('tipo_comprobante', 'no_determinado')}")
+
+            # Solo se guarda un resultado confiable: si un engine falló (cuota,
+            # timeout) o la validación IA no corrió, el próximo envío debe repetir
+            # la extracción en vez de recibir el resultado degradado
+            sin_errores = not any("error" in resultado for resultado in resultados_engines.values())
+            concluyente = any(self._resultado_concluyente(resultado) for resultado in resultados_engines.values())
+            validacion_completa = not usar_validacion_ia or resultado_validacion is not None
+            if datos_finales and validacion_completa and (sin_errores or concluyente):
+                await cache_ocr.guardar(contents, variante_cache, respuesta_final)
             
             return respuesta_final
             
@@ -143,7 +176,7 @@ class EnhancedOCRExtractor:
             fallback_data = None
             if contents:
                 try:
-                    fallback_data = await self._extraer_fallback(file)
+                    fallback_data = await self._extraer_fallback(contents)
                 except Exception as fallback_error:
                     logger.error(f"Error en extracción fallback: {str(fallback_error)}")
             
@@ -155,163 +188,69 @@ class EnhancedOCRExtractor:
                 "fallback_data": fallback_data
             }
     
-    async def _analizar_calidad_imagen(self, contents: bytes, file: UploadFile) -> Dict[str, Any]:
-        """Analiza la calidad de la imagen para optimizar el OCR"""
-        try:
-            # Información básica del archivo
-            image = Image.open(io.BytesIO(contents))
-            width, height = image.size
-            
-            # Convertir a numpy para análisis avanzado
-            image_cv = cv2.imdecode(np.frombuffer(contents, np.uint8), cv2.IMREAD_COLOR)
-            
-            # Calcular métricas de calidad
-            calidad_score = 100
-            problemas = []
-            
-            # 1. Resolución
-            pixels_total = width * height
-            if pixels_total < 100000:  # Menos de 100K pixels
-                calidad_score -= 30
-                problemas.append("Resolución muy baja")
-            elif pixels_total < 500000:  # Menos de 500K pixels
-                calidad_score -= 15
-                problemas.append("Resolución baja")
-            
-            # 2. Tamaño de archivo (indica compresión)
-            file_size = len(contents)
-            if file_size < 50000:  # Menos de 50KB
-                calidad_score -= 20
-                problemas.append("Imagen muy comprimida")
-            
-            # 3. Análisis de contraste y claridad
-            if image_cv is not None:
-                gray = cv2.cvtColor(image_cv, cv2.COLOR_BGR2GRAY)
-                
-                # Contraste (desviación estándar)
-                contraste = np.std(gray)
-                if contraste < 30:
-                    calidad_score -= 25
-                    problemas.append("Contraste muy bajo")
-                elif contraste < 50:
-                    calidad_score -= 10
-                    problemas.append("Contraste bajo")
-                
-                # Claridad (varianza del Laplaciano)
-                claridad = cv2.Laplacian(gray, cv2.CV_64F).var()
-                if claridad < 100:
-                    calidad_score -= 25
-                    problemas.append("Imagen borrosa")
-                elif claridad < 200:
-                    calidad_score -= 10
-                    problemas.append("Imagen algo borrosa")
-            
-            # 4. Formato de archivo
-            formato = image.format.lower() if image.format else "unknown"
-            if formato == "jpeg" and file_size < 100000:
-                calidad_score -= 10
-                problemas.append("JPEG muy comprimido")
-            
-            calidad_score = max(0, calidad_score)
-            
-            return {
-                "width": width,
-                "height": height,
-                "file_size": file_size,
-                "format": formato,
-                "calidad_score": calidad_score,
-                "problemas_calidad": problemas,
-                "contraste": contraste if 'contraste' in locals() else None,
-                "claridad": claridad if 'claridad' in locals() else None,
-                "necesita_mejora": calidad_score < 70
-            }
-            
-        except Exception as e:
-            logger.error(f"Error analizando calidad de imagen: {e}")
-            return {
-                "width": 0,
-                "height": 0,
-                "file_size": len(contents),
-                "format": "unknown",
-                "calidad_score": 50,
-                "problemas_calidad": ["Error analizando imagen"],
-                "necesita_mejora": True
-            }
-    
-    def _mejorar_imagen_si_necesario(self, contents: bytes, metadata: Dict[str, Any]) -> bytes:
-        """Mejora la imagen si la calidad es baja"""
-        if not metadata.get("necesita_mejora", False):
-            return contents
-        
-        try:
-            logger.info("🔧 Mejorando calidad de imagen...")
-            
-            image = Image.open(io.BytesIO(contents))
-            
-            # Convertir a escala de grises si ayuda
-            if image.mode != 'L':
-                image = image.convert('L')
-            
-            # Mejorar contraste
-            enhancer = ImageEnhance.Contrast(image)
-            image = enhancer.enhance(1.5)
-            
-            # Mejorar nitidez
-            enhancer = ImageEnhance.Sharpness(image)
-            image = enhancer.enhance(1.3)
-            
-            # Aplicar filtro de desenfoque para reducir ruido
-            image = image.filter(ImageFilter.MedianFilter(size=3))
-            
-            # Guardar imagen mejorada
-            output = io.BytesIO()
-            image.save(output, format='PNG', optimize=True)
-            output.seek(0)
-            
-            logger.info("✅ Imagen mejorada exitosamente")
-            return output.read()
-            
-        except Exception as e:
-            logger.error(f"Error mejorando imagen: {e}")
-            return contents
-    
     async def _extraer_con_multiples_engines(
         self, 
-        contents: bytes, 
+        imagen: ImagenPreparada, 
         engines: List[str],
         metadata: Dict[str, Any]
     ) -> Dict[str, Dict[str, Any]]:
-        """Extrae datos usando múltiples engines de OCR"""
-        resultados = {}
-        
+        """
+        Ejecuta los engines en paralelo (OpenAI async, EasyOCR/Tesseract en el
+        pool de procesos). Con OCR_SALIDA_TEMPRANA, en cuanto un engine entrega
+        un resultado concluyente se cancelan los que siguen corriendo.
+        """
+        # OpenAI recibe la imagen redimensionada; los engines locales, el buffer decodificado
+        matriz = imagen.matriz if imagen.matriz is not None else imagen.bytes_vision
+        extractores = {
+            "openai": lambda: self._extraer_con_openai(imagen.bytes_vision, imagen.tipo_vision),
+            "easyocr": lambda: self._extraer_con_easyocr(matriz),
+            "tesseract": lambda: self._extraer_con_tesseract(matriz),
+        }
+        tareas = {}
         for engine in engines:
-            try:
-                logger.info(f"🔍 Ejecutando OCR con {engine}...")
-                
-                if engine == "openai":
-                    resultado = await self._extraer_con_openai(contents)
-                elif engine == "easyocr":
-                    resultado = await self._extraer_con_easyocr(contents)
-                elif engine == "tesseract":
-                    resultado = await self._extraer_con_tesseract(contents)
-                else:
-                    logger.warning(f"Engine desconocido: {engine}")
-                    continue
-                
-                resultados[engine] = resultado
-                logger.info(f"✅ {engine} completado")
-                
-            except Exception as e:
-                logger.error(f"❌ Error con {engine}: {e}")
-                resultados[engine] = {
-                    "error": str(e),
-                    "datos": {},
-                    "confianza": 0
-                }
-        
+            if engine not in extractores:
+                logger.warning(f"Engine desconocido: {engine}")
+                continue
+            logger.info(f"🔍 Ejecutando OCR con {engine}...")
+            tareas[asyncio.create_task(extractores[engine]())] = engine
+
+        resultados = {}
+        pendientes = set(tareas)
+        while pendientes:
+            terminadas, pendientes = await asyncio.wait(pendientes, return_when=asyncio.FIRST_COMPLETED)
+            concluyente = False
+            for tarea in terminadas:
+                engine = tareas[tarea]
+                try:
+                    resultados[engine] = tarea.result()
+                    logger.info(f"✅ {engine} completado")
+                except Exception as e:
+                    logger.error(f"❌ Error con {engine}: {e}")
+                    resultados[engine] = {
+                        "error": str(e),
+                        "datos": {},
+                        "confianza": 0
+                    }
+                concluyente = concluyente or self._resultado_concluyente(resultados[engine])
+
+            if pendientes and concluyente and OCR_SALIDA_TEMPRANA:
+                for tarea in pendientes:
+                    tarea.cancel()
+                logger.info(f"⚡ Salida temprana: cancelados {sorted(tareas[t] for t in pendientes)}")
+                break
+
         return resultados
+
+    def _resultado_concluyente(self, resultado: Dict[str, Any]) -> bool:
+        """Resultado sin error, con confianza alta y los campos clave válidos"""
+        if "error" in resultado or resultado.get("confianza", 0) < OCR_CONFIANZA_SALIDA_TEMPRANA:
+            return False
+        datos = self._validar_datos_sin_errores(resultado.get("datos") or {})
+        if any(datos.get(campo) in (None, "", "null") for campo in CAMPOS_SALIDA_TEMPRANA):
+            return False
+        return str(datos["valor"]).isdigit()
     
-    async def _extraer_con_openai(self, contents: bytes) -> Dict[str, Any]:
+    async def _extraer_con_openai(self, contents: bytes, tipo_contenido: str = "image/jpeg") -> Dict[str, Any]:
         """Extracción usando OpenAI GPT-4o Vision API con reglas mejoradas"""
         try:
             # Convertir imagen a base64
@@ -393,7 +332,7 @@ class EnhancedOCRExtractor:
                     5. Campos no encontrados = null (sin comillas)
                     """
 
-            response = client.chat.completions.create(
+            response = await client.chat.completions.create(
                 model="gpt-4o",  # Usar GPT-4o (la versión más actual)
                 messages=[
                     {
@@ -403,7 +342,7 @@ class EnhancedOCRExtractor:
                             {
                                 "type": "image_url",
                                 "image_url": {
-                                    "url": f"data:image/jpeg;base64,{image_base64}",
+                                    "url": f"data:{tipo_contenido};base64,{image_base64}",
                                     "detail": "high"
                                 }
                             }
@@ -452,12 +391,21 @@ class EnhancedOCRExtractor:
                 "confianza": 0
             }
     
-    async def _extraer_con_easyocr(self, contents: bytes) -> Dict[str, Any]:
+    async def _confirmar_acierto_perceptual(self, imagen: ImagenPreparada, en_cache: Dict[str, Any]) -> bool:
+        """Lee la imagen nueva con EasyOCR y compara referencia y valor con el resultado guardado"""
+        matriz = imagen.matriz if imagen.matriz is not None else imagen.bytes_vision
+        try:
+            texto = await ejecutar_en_pool(texto_easyocr, matriz)
+        except Exception as e:
+            logger.warning(f"⚠️ No se pudo confirmar el acierto perceptual: {e}")
+            return False
+        return confirma_acierto(en_cache, texto)
+
+    async def _extraer_con_easyocr(self, contents: Any) -> Dict[str, Any]:
         """Extracción usando EasyOCR"""
         try:
-            # EasyOCR con configuración optimizada
-            resultados = reader.readtext(contents, detail=0, paragraph=True)
-            texto_completo = "\n".join(resultados)
+            # EasyOCR en el pool de procesos (no bloquea el event loop)
+            texto_completo = await ejecutar_en_pool(texto_easyocr, contents)
             
             # Extraer datos usando regex y patrones mejorados
             datos_extraidos = self._extraer_datos_con_patrones_mejorados(texto_completo)
@@ -477,15 +425,11 @@ class EnhancedOCRExtractor:
                 "confianza": 0
             }
     
-    async def _extraer_con_tesseract(self, contents: bytes) -> Dict[str, Any]:
+    async def _extraer_con_tesseract(self, contents: Any) -> Dict[str, Any]:
         """Extracción usando Tesseract (backup)"""
         try:
-            # Convertir a imagen PIL
-            image = Image.open(io.BytesIO(contents))
-            
-            # Tesseract con configuración para español
-            config = '--oem 3 --psm 6 -l spa'
-            texto_completo = pytesseract.image_to_string(image, config=config)
+            # Tesseract (configuración para español) en el pool de procesos
+            texto_completo = await ejecutar_en_pool(texto_tesseract, contents)
             
             # Extraer datos usando patrones mejorados
             datos_extraidos = self._extraer_datos_con_patrones_mejorados(texto_completo)
@@ -756,12 +700,9 @@ class EnhancedOCRExtractor:
             logger.error(f"Error formateando validación IA: {e}")
             return None
 
-    async def _extraer_fallback(self, file: UploadFile) -> Optional[Dict[str, Any]]:
+    async def _extraer_fallback(self, contents: bytes) -> Optional[Dict[str, Any]]:
         """Extracción de emergencia usando solo EasyOCR"""
         try:
-            # Leer el archivo
-            contents = await file.read()
-            
             # Convertir el contenido del archivo a una imagen numpy
             nparr = np.frombuffer(contents, np.uint8)
             if len(nparr) == 0:
@@ -775,12 +716,8 @@ class EnhancedOCRExtractor:
             # Convertir a escala de grises
             gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
             
-            # Usar EasyOCR para extraer texto
-            reader = easyocr.Reader(['es'], gpu=False)
-            result = reader.readtext(gray)
-            
-            # Extraer texto completo
-            texto_completo = " ".join([text[1] for text in result])
+            # Usar EasyOCR (modelo compartido del pool OCR) para extraer texto
+            texto_completo = await ejecutar_en_pool(texto_easyocr, gray, False, " ")
             
             # Usar patrones para extraer datos básicos
             datos = self._extraer_datos_con_patrones_mejorados(texto_completo)
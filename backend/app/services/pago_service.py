@@ -4,7 +4,6 @@ from app.core.config import GOOGLE_CREDENTIALS_PATH
 import os
 
 os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = GOOGLE_CREDENTIALS_PATH
-client = bigquery.Client()
 
 def agrupar_guias_por_referencia_y_fecha(guias: List[dict]) -> dict:
     agrupadas = {}
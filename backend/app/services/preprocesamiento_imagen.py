@@ -0,0 +1,203 @@
+"""
+Preprocesamiento de comprobantes: una sola decodificación por imagen.
+
+Antes la imagen se decodificaba tres veces (PIL y ``cv2.imdecode`` para
+medir calidad, PIL otra vez para mejorarla), se recodificaba a PNG y a
+OpenAI se enviaba la resolución completa etiquetada siempre como JPEG.
+Aquí se decodifica una vez a un arreglo NumPy y todo sale de ese buffer::
+
+    imagen = await asyncio.to_thread(preparar_imagen, contents)
+    imagen.metadata      # métricas de calidad (mismas llaves que antes)
+    imagen.matriz        # arreglo para EasyOCR/Tesseract (mejorado si hacía falta)
+    imagen.bytes_vision  # JPEG/WebP redimensionado para el modelo de visión
+    imagen.tipo_vision   # "image/jpeg" o "image/webp"
+
+- Las métricas (contraste y nitidez) se calculan sobre una copia reducida
+  a ``LADO_METRICAS`` px; la nitidez (varianza del Laplaciano) sube un poco
+  al reducir, los umbrales siguen siendo los mismos.
+- La mejora (contraste 1.5, nitidez 1.3, mediana 3x3, en grises) se aplica
+  sobre el mismo buffer con OpenCV, sin pasar por PNG.
+- Para visión la imagen se reduce a lo que usa el modelo con
+  ``detail: high`` (cabe en 2048x2048 y el lado corto no pasa de 768 px):
+  lo que sobra de ahí solo agrega bytes a la subida.
+"""
+
+import io
+import logging
+from typing import Any, Dict, Optional
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from app.core.config import OCR_VISION_CALIDAD, OCR_VISION_FORMATO
+
+logger = logging.getLogger(__name__)
+
+LADO_METRICAS = 1024
+VISION_LADO_MAXIMO = 2048
+VISION_LADO_CORTO = 768
+
+# Núcleo de suavizado de PIL (ImageFilter.SMOOTH), base del realce de nitidez
+_NUCLEO_SUAVIZADO = np.array([[1, 1, 1], [1, 5, 1], [1, 1, 1]], dtype=np.float32) / 13
+
+_TIPOS_VISION = {"jpeg": ("image/jpeg", ".jpg", cv2.IMWRITE_JPEG_QUALITY),
+                 "webp": ("image/webp", ".webp", cv2.IMWRITE_WEBP_QUALITY)}
+
+
+class ImagenPreparada:
+    """Resultado del preprocesamiento de un comprobante"""
+
+    __slots__ = ("matriz", "metadata", "mejorada", "bytes_vision", "tipo_vision")
+
+    def __init__(self, matriz: Optional[np.ndarray], metadata: Dict[str, Any], mejorada: bool,
+                 bytes_vision: bytes, tipo_vision: str):
+        self.matriz = matriz
+        self.metadata = metadata
+        self.mejorada = mejorada
+        self.bytes_vision = bytes_vision
+        self.tipo_vision = tipo_vision
+
+
+def _decodificar(contents: bytes) -> Optional[np.ndarray]:
+    matriz = cv2.imdecode(np.frombuffer(contents, np.uint8), cv2.IMREAD_COLOR)
+    if matriz is not None:
+        return matriz
+    # Formatos que OpenCV no lee (p. ej. GIF): se decodifica con PIL
+    try:
+        imagen = Image.open(io.BytesIO(contents)).convert("RGB")
+    except Exception:
+        return None
+    return cv2.cvtColor(np.asarray(imagen), cv2.COLOR_RGB2BGR)
+
+
+def _formato(contents: bytes) -> str:
+    """Formato según la cabecera del archivo (no decodifica la imagen)"""
+    try:
+        formato = Image.open(io.BytesIO(contents)).format
+    except Exception:
+        return "unknown"
+    return formato.lower() if formato else "unknown"
+
+
+def _reducir(matriz: np.ndarray, lado_maximo: int) -> np.ndarray:
+    alto, ancho = matriz.shape[:2]
+    escala = lado_maximo / max(alto, ancho)
+    if escala >= 1:
+        return matriz
+    return cv2.resize(matriz, (max(1, round(ancho * escala)), max(1, round(alto * escala))), interpolation=cv2.INTER_AREA)
+
+
+def _metricas_calidad(gris: np.ndarray, contents: bytes, formato: str) -> Dict[str, Any]:
+    alto, ancho = gris.shape[:2]
+    file_size = len(contents)
+    calidad_score = 100
+    problemas = []
+
+    # 1. Resolución (de la imagen original)
+    pixels_total = ancho * alto
+    if pixels_total < 100000:
+        calidad_score -= 30
+        problemas.append("Resolución muy baja")
+    elif pixels_total < 500000:
+        calidad_score -= 15
+        problemas.append("Resolución baja")
+
+    # 2. Tamaño de archivo (indica compresión)
+    if file_size < 50000:
+        calidad_score -= 20
+        problemas.append("Imagen muy comprimida")
+
+    # 3. Contraste y claridad sobre la copia reducida
+    reducida = _reducir(gris, LADO_METRICAS)
+    contraste = float(np.std(reducida))
+    if contraste < 30:
+        calidad_score -= 25
+        problemas.append("Contraste muy bajo")
+    elif contraste < 50:
+        calidad_score -= 10
+        problemas.append("Contraste bajo")
+
+    claridad = float(cv2.Laplacian(reducida, cv2.CV_64F).var())
+    if claridad < 100:
+        calidad_score -= 25
+        problemas.append("Imagen borrosa")
+    elif claridad < 200:
+        calidad_score -= 10
+        problemas.append("Imagen algo borrosa")
+
+    # 4. Formato de archivo
+    if formato == "jpeg" and file_size < 100000:
+        calidad_score -= 10
+        problemas.append("JPEG muy comprimido")
+
+    calidad_score = max(0, calidad_score)
+    return {
+        "width": ancho,
+        "height": alto,
+        "file_size": file_size,
+        "format": formato,
+        "calidad_score": calidad_score,
+        "problemas_calidad": problemas,
+        "contraste": contraste,
+        "claridad": claridad,
+        "necesita_mejora": calidad_score < 70,
+    }
+
+
+def mejorar_en_sitio(gris: np.ndarray) -> np.ndarray:
+    """Contraste 1.5, nitidez 1.3 y mediana 3x3 (equivalentes a los de PIL) sobre ``gris``"""
+    media = float(gris.mean())
+    cv2.addWeighted(gris, 1.5, gris, 0, -0.5 * media, dst=gris)
+    suavizada = cv2.filter2D(gris, -1, _NUCLEO_SUAVIZADO)
+    cv2.addWeighted(gris, 1.3, suavizada, -0.3, 0, dst=gris)
+    cv2.medianBlur(gris, 3, dst=gris)
+    return gris
+
+
+def _imagen_vision(matriz: np.ndarray) -> bytes:
+    alto, ancho = matriz.shape[:2]
+    escala = min(1.0, VISION_LADO_MAXIMO / max(alto, ancho), VISION_LADO_CORTO / min(alto, ancho))
+    if escala < 1:
+        matriz = cv2.resize(matriz, (max(1, round(ancho * escala)), max(1, round(alto * escala))), interpolation=cv2.INTER_AREA)
+    _, extension, parametro = _TIPOS_VISION[OCR_VISION_FORMATO]
+    ok, codificada = cv2.imencode(extension, matriz, [parametro, OCR_VISION_CALIDAD])
+    if not ok:
+        raise ValueError("No se pudo codificar la imagen para visión")
+    return codificada.tobytes()
+
+
+def _sin_decodificar(contents: bytes, formato: str) -> ImagenPreparada:
+    logger.error("Error analizando calidad de imagen: no se pudo decodificar")
+    metadata = {
+        "width": 0,
+        "height": 0,
+        "file_size": len(contents),
+        "format": formato,
+        "calidad_score": 50,
+        "problemas_calidad": ["Error analizando imagen"],
+        "necesita_mejora": True,
+    }
+    tipo = f"image/{formato}" if formato in ("png", "webp", "gif") else "image/jpeg"
+    return ImagenPreparada(None, metadata, False, contents, tipo)
+
+
+def preparar_imagen(contents: bytes) -> ImagenPreparada:
+    """Decodifica una vez, mide calidad, mejora si hace falta y arma la imagen para visión"""
+    formato = _formato(contents)
+    color = _decodificar(contents)
+    if color is None:
+        return _sin_decodificar(contents, formato)
+
+    gris = cv2.cvtColor(color, cv2.COLOR_BGR2GRAY)
+    metadata = _metricas_calidad(gris, contents, formato)
+
+    if metadata["necesita_mejora"]:
+        logger.info("🔧 Mejorando calidad de imagen...")
+        matriz = mejorar_en_sitio(gris)
+        del color
+    else:
+        matriz = color
+
+    return ImagenPreparada(matriz, metadata, metadata["necesita_mejora"], _imagen_vision(matriz),
+                           _TIPOS_VISION[OCR_VISION_FORMATO][0])
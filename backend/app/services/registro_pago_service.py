@@ -0,0 +1,183 @@
+"""
+Consultas del registro de pagos de conductores (``/pagos/registrar-conductor``).
+
+El endpoint hacía sus consultas una tras otra: ``MAX(Id_Transaccion)``,
+verificación de referencia duplicada, datos de ``COD_pendientes_v1``, un
+``INSERT`` con todas las filas y luego un ``MERGE`` por guía en
+``guias_liquidacion``. Ahora las dos lecturas independientes se lanzan en
+paralelo (``query_async``) y todas las escrituras van en un solo script con
+transacción: o queda registrado el pago completo o no queda nada.
+"""
+
+from typing import Any, Dict, List, Optional
+
+from google.cloud import bigquery
+
+from app.core.config import BIGQUERY_PROJECT_ID
+from app.core.consultas import arreglo_structs, parametro_lista
+
+TABLA_PAGOS = f"{BIGQUERY_PROJECT_ID}.Conciliaciones.pagosconductor"
+TABLA_GUIAS_LIQUIDACION = f"{BIGQUERY_PROJECT_ID}.Conciliaciones.guias_liquidacion"
+TABLA_COD_PENDIENTES = f"{BIGQUERY_PROJECT_ID}.Conciliaciones.COD_pendientes_v1"
+
+SQL_VERIFICAR_REFERENCIA = f"""
+SELECT COUNT(*) AS total
+FROM `{TABLA_PAGOS}`
+WHERE referencia_pago = @referencia
+AND valor_total_consignacion = @valor
+AND fecha_pago = @fecha
+AND hora_pago = @hora
+"""
+
+SQL_DATOS_TRACKINGS = f"""
+SELECT
+    tracking_number,
+    Cliente AS cliente,
+    Ciudad AS ciudad,
+    Departamento AS departamento,
+    Valor AS valor,
+    Status_Date AS status_date,
+    Status_Big AS status_big,
+    Carrier AS carrier,
+    carrier_id,
+    Empleado AS conductor_nombre_completo,
+    Employee_id AS employee_id
+FROM `{TABLA_COD_PENDIENTES}`
+WHERE tracking_number IN UNNEST(@trackings)
+"""
+
+SQL_REGISTRAR_PAGO = f"""
+BEGIN TRANSACTION;
+
+INSERT INTO `{TABLA_PAGOS}` (
+    referencia, valor, fecha, entidad, estado, tipo, comprobante,
+    novedades, creado_en, creado_por, modificado_en, modificado_por,
+    hora_pago, correo, fecha_pago, id_string, referencia_pago,
+    valor_total_consignacion, tracking, cliente,
+    estado_conciliacion, Id_Transaccion
+)
+SELECT
+    referencia, valor, fecha, entidad, estado, tipo, comprobante,
+    novedades, creado_en, creado_por, modificado_en, modificado_por,
+    hora_pago, correo, fecha_pago, id_string, referencia_pago,
+    valor_total_consignacion, tracking, cliente,
+    estado_conciliacion, Id_Transaccion
+FROM UNNEST(@pagos);
+
+MERGE `{TABLA_GUIAS_LIQUIDACION}` AS gl
+USING (
+    SELECT
+        g.tracking AS tracking_number,
+        @employee_id_usuario AS employee_id,
+        @correo AS conductor_email,
+        g.cliente,
+        g.ciudad,
+        g.departamento,
+        g.valor_guia_bd AS valor_guia,
+        g.status_date,
+        g.status_big,
+        g.carrier,
+        g.carrier_id,
+        g.conductor_nombre_completo,
+        g.employee_id_cod,
+        g.fecha_pago AS fecha_entrega,
+        @pago_referencia_concatenado AS pago_referencia,
+        g.fecha_pago,
+        g.valor AS valor_pagado,
+        g.tipo AS metodo_pago,
+        @id_transaccion AS Id_Transaccion,
+        CURRENT_TIMESTAMP() AS fecha_creacion,
+        CURRENT_TIMESTAMP() AS fecha_modificacion,
+        @correo AS creado_por,
+        @correo AS modificado_por
+    FROM UNNEST(@guias) AS g
+) AS src
+ON gl.tracking_number = src.tracking_number
+WHEN MATCHED THEN
+  UPDATE SET
+    cliente = src.cliente,
+    ciudad = src.ciudad,
+    departamento = src.departamento,
+    valor_guia = src.valor_guia,
+    status_date = src.status_date,
+    status_big = src.status_big,
+    carrier = src.carrier,
+    carrier_id = src.carrier_id,
+    conductor_nombre_completo = src.conductor_nombre_completo,
+    employee_id = COALESCE(src.employee_id_cod, src.employee_id),
+    pago_referencia = src.pago_referencia,
+    fecha_pago = src.fecha_pago,
+    valor_pagado = src.valor_pagado,
+    metodo_pago = src.metodo_pago,
+    estado_liquidacion = 'pagado',
+    fecha_modificacion = CURRENT_TIMESTAMP(),
+    modificado_por = src.modificado_por
+WHEN NOT MATCHED THEN
+  INSERT (
+    tracking_number, employee_id, conductor_email, cliente, ciudad, departamento,
+    valor_guia, status_date, status_big, carrier, carrier_id, conductor_nombre_completo,
+    fecha_entrega, pago_referencia, fecha_pago, valor_pagado, metodo_pago, Id_Transaccion,
+    fecha_creacion, fecha_modificacion, creado_por, modificado_por, estado_liquidacion
+  ) VALUES (
+    src.tracking_number, COALESCE(src.employee_id_cod, src.employee_id), src.conductor_email,
+    src.cliente, src.ciudad, src.departamento, src.valor_guia, src.status_date, src.status_big,
+    src.carrier, src.carrier_id, src.conductor_nombre_completo, src.fecha_entrega,
+    src.pago_referencia, src.fecha_pago, src.valor_pagado, src.metodo_pago, src.Id_Transaccion,
+    src.fecha_creacion, src.fecha_modificacion, src.creado_por, src.modificado_por, 'pagado'
+  );
+
+COMMIT TRANSACTION;
+"""
+
+# (campo, tipo) de cada fila de pagosconductor, en el orden del INSERT
+CAMPOS_PAGO = (
+    ("referencia", "STRING"), ("valor", "NUMERIC"), ("fecha", "DATE"),
+    ("entidad", "STRING"), ("estado", "STRING"), ("tipo", "STRING"),
+    ("comprobante", "STRING"), ("novedades", "STRING"), ("creado_en", "TIMESTAMP"),
+    ("creado_por", "STRING"), ("modificado_en", "TIMESTAMP"), ("modificado_por", "STRING"),
+    ("hora_pago", "TIME"), ("correo", "STRING"), ("fecha_pago", "DATE"),
+    ("id_string", "STRING"), ("referencia_pago", "STRING"), ("valor_total_consignacion", "NUMERIC"),
+    ("tracking", "STRING"), ("cliente", "STRING"), ("estado_conciliacion", "STRING"),
+    ("Id_Transaccion", "INT64"),
+)
+
+CAMPOS_GUIA = (
+    ("tracking", "STRING"), ("cliente", "STRING"), ("ciudad", "STRING"),
+    ("departamento", "STRING"), ("valor_guia_bd", "FLOAT64"), ("status_date", "DATE"),
+    ("status_big", "STRING"), ("carrier", "STRING"), ("carrier_id", "INT64"),
+    ("conductor_nombre_completo", "STRING"), ("employee_id_cod", "INT64"),
+    ("fecha_pago", "DATE"), ("valor", "FLOAT64"), ("tipo", "STRING"),
+)
+
+
+def config_verificar_referencia(referencia: str, valor: float, fecha: str, hora: str) -> bigquery.QueryJobConfig:
+    return bigquery.QueryJobConfig(query_parameters=[
+        bigquery.ScalarQueryParameter("referencia", "STRING", referencia),
+        bigquery.ScalarQueryParameter("valor", "FLOAT64", valor),
+        bigquery.ScalarQueryParameter("fecha", "DATE", fecha),
+        bigquery.ScalarQueryParameter("hora", "TIME", hora),
+    ])
+
+
+def config_datos_trackings(trackings: List[str]) -> bigquery.QueryJobConfig:
+    return bigquery.QueryJobConfig(query_parameters=[
+        parametro_lista("trackings", trackings, "STRING"),
+    ])
+
+
+def config_registrar_pago(filas: List[Dict[str, Any]], correo: str, employee_id_usuario: Optional[int],
+                          id_transaccion: int, pago_referencia_concatenado: str) -> bigquery.QueryJobConfig:
+    """
+    Parámetros del script de registro. En ``guias_liquidacion`` queda una
+    fila por tracking: si el lote repite un tracking gana la última, como
+    cuando se hacía un ``MERGE`` por guía en orden.
+    """
+    guias = list({fila["tracking"]: fila for fila in filas}.values())
+    return bigquery.QueryJobConfig(query_parameters=[
+        arreglo_structs("pagos", CAMPOS_PAGO, filas),
+        arreglo_structs("guias", CAMPOS_GUIA, guias),
+        bigquery.ScalarQueryParameter("employee_id_usuario", "INT64", employee_id_usuario or 0),
+        bigquery.ScalarQueryParameter("correo", "STRING", correo),
+        bigquery.ScalarQueryParameter("pago_referencia_concatenado", "STRING", pago_referencia_concatenado),
+        bigquery.ScalarQueryParameter("id_transaccion", "INT64", id_transaccion),
+    ])
@@ -0,0 +1,332 @@
+"""
+Lectura por lotes de extractos bancarios CSV.
+
+El archivo se recorre en bloques de líneas sin decodificarlo completo en
+memoria. El separador y el formato de fecha se detectan una sola vez por
+archivo, y fechas y valores se convierten por columna con pandas. Cada
+bloque produce un ``LoteBanco`` con las filas válidas (DataFrame) y los
+errores de las filas descartadas; no hay log por fila.
+"""
+
+import codecs
+import hashlib
+import io
+from collections import Counter
+from datetime import datetime
+from itertools import islice
+from typing import BinaryIO, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+import numpy as np
+import pandas as pd
+
+CODIFICACIONES = ["utf-8-sig", "utf-8", "latin-1", "cp1252", "iso-8859-1"]
+SEPARADORES = [";", ",", "\t"]
+FORMATOS_FECHA = [
+    "%Y%m%d",        # 20250527
+    "%d/%m/%Y",      # 27/05/2025
+    "%d-%m-%Y",      # 27-05-2025
+    "%Y-%m-%d",      # 2025-05-27
+    "%d/%m/%y",      # 27/05/25
+    "%d-%m-%y",      # 27-05-25
+]
+COLUMNAS_BANCO = [
+    "cuenta", "codigo", "campo_vacio_1", "fecha_raw", "campo_vacio_2",
+    "valor_raw", "cod_transaccion", "descripcion", "flag",
+]
+TERMINOS_CONSIGNACION = ["CONSIGNACION", "TRANSFERENCIA DESDE NEQUI", "TRANSFERENCIA CTA SUC VIRTUAL"]
+
+CAMPOS_MINIMOS = 6
+LONGITUD_MINIMA_LINEA = 10
+VALOR_MAXIMO = 1000000000  # mil millones
+TAMANO_LOTE_LINEAS = 50000
+TAMANO_BLOQUE_BYTES = 1024 * 1024
+MAX_ERRORES_DETALLADOS = 100
+
+
+class LoteBanco:
+    """Resultado de un bloque de líneas: filas válidas y errores"""
+
+    __slots__ = ("filas", "errores")
+
+    def __init__(self, filas: pd.DataFrame, errores: List[Dict]):
+        self.filas = filas
+        self.errores = errores
+
+
+def detectar_codificacion(archivo: BinaryIO) -> Optional[str]:
+    """
+    Prueba las codificaciones en orden decodificando el archivo por bloques
+    (sin cargarlo completo). Deja el archivo al inicio.
+    """
+    for codificacion in CODIFICACIONES:
+        decodificador = codecs.getincrementaldecoder(codificacion)()
+        archivo.seek(0)
+        try:
+            while True:
+                bloque = archivo.read(TAMANO_BLOQUE_BYTES)
+                if not bloque:
+                    decodificador.decode(b"", final=True)
+                    break
+                decodificador.decode(bloque)
+        except UnicodeDecodeError:
+            continue
+        finally:
+            archivo.seek(0)
+        return codificacion
+    return None
+
+
+def detectar_separador(linea: str) -> Optional[str]:
+    """Mismo criterio que MovimientoBanco: ';' antes que ',' antes que tabulador"""
+    for separador in SEPARADORES:
+        if separador in linea:
+            return separador
+    return None
+
+
+def detectar_formato_fecha(valores: pd.Series) -> Optional[str]:
+    """Formato que reconoce más fechas de una muestra (en empate, el primero de la lista)"""
+    muestra = [v for v in valores.head(200) if v]
+    mejor, aciertos_mejor = None, 0
+    for formato in FORMATOS_FECHA:
+        aciertos = 0
+        for valor in muestra:
+            try:
+                datetime.strptime(valor, formato)
+                aciertos += 1
+            except ValueError:
+                pass
+        if aciertos > aciertos_mejor:
+            mejor, aciertos_mejor = formato, aciertos
+    return mejor
+
+
+def convertir_fechas(valores: pd.Series, formato: Optional[str]) -> pd.Series:
+    """
+    Convierte la columna con el formato detectado; las fechas que no encajan
+    se reintentan con los demás formatos, también por columna.
+    """
+    fechas = pd.Series(pd.NaT, index=valores.index, dtype="datetime64[ns]")
+    formatos = ([formato] if formato else []) + [f for f in FORMATOS_FECHA if f != formato]
+    for fmt in formatos:
+        faltantes = fechas.isna() & (valores != "")
+        if not faltantes.any():
+            break
+        fechas.loc[faltantes] = pd.to_datetime(valores[faltantes], format=fmt, errors="coerce")
+    return fechas
+
+
+def convertir_valores(valores: pd.Series) -> pd.Series:
+    """
+    Versión por columna de ``MovimientoBanco._procesar_valor``: quita símbolos
+    y resuelve separadores de miles/decimales (1.234.567,89 / 1,234,567.89 /
+    1234,56). Devuelve NaN donde el valor no es numérico.
+    """
+    limpio = valores
+    for simbolo in ("$", "€", "USD", "COP", " ", "\t"):
+        limpio = limpio.str.replace(simbolo, "", regex=False)
+
+    pos_coma = limpio.str.rfind(",")
+    pos_punto = limpio.str.rfind(".")
+    tiene_coma = pos_coma >= 0
+    tiene_punto = pos_punto >= 0
+
+    europeo = tiene_coma & tiene_punto & (pos_coma > pos_punto)
+    americano = tiene_coma & tiene_punto & ~europeo
+    solo_coma = tiene_coma & ~tiene_punto
+    # Largo del segundo tramo (entre la primera y la segunda coma), solo en
+    # las filas con coma: sin comas en la columna, ``split().str[1]`` deja
+    # una serie float y ``.str`` falla
+    segundo_tramo = limpio.where(solo_coma, "").str.extract(r"^[^,]*,([^,]*)", expand=False)
+    coma_decimal = solo_coma & segundo_tramo.str.len().isin([2, 3])
+
+    normalizado = limpio.copy()
+    normalizado[europeo] = limpio[europeo].str.replace(".", "", regex=False).str.replace(",", ".", regex=False)
+    normalizado[americano | (solo_coma & ~coma_decimal)] = limpio[americano | (solo_coma & ~coma_decimal)].str.replace(",", "", regex=False)
+    normalizado[coma_decimal] = limpio[coma_decimal].str.replace(",", ".", regex=False)
+    return pd.to_numeric(normalizado, errors="coerce")
+
+
+def es_consignacion(descripciones: pd.Series) -> pd.Series:
+    """Versión por columna de ``MovimientoBanco.es_consignacion``"""
+    return descripciones.str.upper().str.contains("|".join(TERMINOS_CONSIGNACION), regex=True)
+
+
+class LectorBancoCSV:
+    """
+    Recorre un extracto bancario por bloques de ``tamano_lote`` líneas.
+    Acumula contadores del archivo completo (líneas vacías, cortas,
+    separadores) para el reporte de ``analizar_archivo_detallado``.
+    """
+
+    def __init__(self, archivo: BinaryIO, codificacion: str, tamano_lote: int = TAMANO_LOTE_LINEAS):
+        self.archivo = archivo
+        self.codificacion = codificacion
+        self.tamano_lote = tamano_lote
+        self.separador: Optional[str] = None
+        self.formato_fecha: Optional[str] = None
+        self.total_lineas = 0
+        self.lineas_vacias = 0
+        self.lineas_muy_cortas = 0
+        self.separadores_detectados: Dict[str, int] = {s: 0 for s in SEPARADORES}
+
+    def __iter__(self) -> Iterator[LoteBanco]:
+        texto = io.TextIOWrapper(self.archivo, encoding=self.codificacion, newline="")
+        try:
+            while True:
+                bloque = list(islice(texto, self.tamano_lote))
+                if not bloque:
+                    break
+                inicio = self.total_lineas + 1
+                self.total_lineas += len(bloque)
+                lote = self._procesar_bloque(bloque, inicio)
+                if lote is not None:
+                    yield lote
+        finally:
+            # El archivo pertenece al llamador (UploadFile); no cerrarlo con el wrapper
+            texto.detach()
+
+    def _procesar_bloque(self, bloque: List[str], inicio: int) -> Optional[LoteBanco]:
+        lineas = pd.Series(bloque, dtype=object).str.strip()
+        lineas.index = pd.RangeIndex(inicio, inicio + len(bloque))
+
+        vacias = lineas == ""
+        cortas = ~vacias & (lineas.str.len() < LONGITUD_MINIMA_LINEA)
+        self.lineas_vacias += int(vacias.sum())
+        self.lineas_muy_cortas += int(cortas.sum())
+        lineas = lineas[~vacias & ~cortas]
+        if lineas.empty:
+            return None
+
+        for separador in SEPARADORES:
+            self.separadores_detectados[separador] += int(lineas.str.contains(separador, regex=False).sum())
+
+        if self.separador is None:
+            self.separador = detectar_separador(lineas.iloc[0])
+        if self.separador is None:
+            errores = [{"linea": int(n), "error": f"Línea {n}: No se detectó separador válido", "contenido": _muestra(l)}
+                       for n, l in lineas.items()]
+            return LoteBanco(_filas_vacias(), errores)
+
+        campos = lineas.str.split(self.separador, expand=True)
+        cantidad_campos = campos.notna().sum(axis=1)
+        campos = campos.reindex(columns=range(len(COLUMNAS_BANCO))).fillna("")
+        campos.columns = COLUMNAS_BANCO
+        for columna in COLUMNAS_BANCO:
+            campos[columna] = campos[columna].str.strip()
+
+        if self.formato_fecha is None:
+            self.formato_fecha = detectar_formato_fecha(campos["fecha_raw"][cantidad_campos >= CAMPOS_MINIMOS])
+        fechas = convertir_fechas(campos["fecha_raw"], self.formato_fecha)
+        # Los extractos repiten mucho los mismos montos: se convierte cada valor distinto una vez
+        unicos = pd.Series(pd.unique(campos["valor_raw"]), dtype=object)
+        valores = campos["valor_raw"].map(pd.Series(convertir_valores(unicos).to_numpy(), index=unicos))
+
+        # Primer error por fila, en el mismo orden de validación que MovimientoBanco.
+        # Los mensajes solo se arman para las filas descartadas
+        condiciones = [
+            cantidad_campos < CAMPOS_MINIMOS,
+            campos["fecha_raw"] == "",
+            fechas.isna(),
+            campos["valor_raw"] == "",
+            valores.isna(),
+            valores == 0,
+            valores.abs() > VALOR_MAXIMO,
+        ]
+        codigo_error = np.select([c.to_numpy(dtype=bool) for c in condiciones],
+                                 list(range(1, len(condiciones) + 1)), default=0)
+        pendiente = pd.Series(codigo_error == 0, index=lineas.index)
+
+        errores = []
+        descartadas = ~pendiente
+        for numero, codigo, linea, n_campos, fecha_raw, valor_raw, valor in zip(
+            lineas.index[descartadas], codigo_error[descartadas.to_numpy()], lineas[descartadas],
+            cantidad_campos[descartadas], campos["fecha_raw"][descartadas],
+            campos["valor_raw"][descartadas], valores[descartadas]
+        ):
+            errores.append({
+                "linea": int(numero),
+                "error": _mensaje_error(int(numero), int(codigo), n_campos, fecha_raw, valor_raw, valor),
+                "contenido": _muestra(linea)
+            })
+
+        filas = campos[pendiente].copy()
+        filas["numero_linea"] = filas.index
+        filas["linea_original"] = lineas[pendiente]
+        # Un solo objeto date por fecha distinta (en lugar de uno por fila)
+        fechas_validas = fechas[pendiente]
+        unicas = {ts: ts.date() for ts in fechas_validas.unique()}
+        filas["fecha"] = fechas_validas.map(unicas).astype(object)
+        filas["valor"] = valores[pendiente].astype(float)
+        return LoteBanco(filas, errores)
+
+
+# ======================================================================
+# Huellas de contenido (IDs deterministas)
+# ======================================================================
+ClaveContenido = Tuple[str, str, str, float, str, str]
+
+
+def clave_contenido(cuenta: str, codigo: str, fecha, valor: float,
+                    cod_transaccion: str, descripcion: str) -> ClaveContenido:
+    """Campos que identifican un movimiento, normalizados igual en archivo y en BD"""
+    return (
+        (cuenta or "").strip(),
+        (codigo or "").strip(),
+        fecha.isoformat() if hasattr(fecha, "isoformat") else str(fecha),
+        float(valor),
+        (cod_transaccion or "").strip(),
+        (descripcion or "").strip(),
+    )
+
+
+def huella_movimiento(clave: ClaveContenido, ocurrencia: int) -> int:
+    """
+    Huella estable del movimiento. ``ocurrencia`` (1, 2, ...) distingue
+    movimientos idénticos del mismo día: volver a cargar el mismo extracto
+    produce las mismas huellas. Es numérica para que los IDs sigan el
+    patrón ``BANCO_<fecha>_<valor>_<número>``.
+    """
+    contenido = "|".join([*clave[:3], repr(clave[3]), *clave[4:], str(ocurrencia)])
+    return int(hashlib.sha256(contenido.encode("utf-8")).hexdigest()[:15], 16)
+
+
+class NumeradorHuellas:
+    """Asigna huellas en orden de aparición, numerando las ocurrencias de cada contenido"""
+
+    def __init__(self):
+        self._ocurrencias: Counter = Counter()
+
+    def siguiente(self, clave: ClaveContenido) -> int:
+        self._ocurrencias[clave] += 1
+        return huella_movimiento(clave, self._ocurrencias[clave])
+
+
+def huellas_existentes(conteos: Iterable[Tuple[ClaveContenido, int]]) -> Set[int]:
+    """Huellas de los movimientos ya cargados, a partir de (contenido, cantidad)"""
+    return {
+        huella_movimiento(clave, ocurrencia)
+        for clave, cantidad in conteos
+        for ocurrencia in range(1, cantidad + 1)
+    }
+
+
+def _mensaje_error(numero: int, codigo: int, n_campos: int, fecha_raw: str, valor_raw: str, valor: float) -> str:
+    mensajes = {
+        1: f"Formato inválido - se esperaban al menos {CAMPOS_MINIMOS} campos, se encontraron {n_campos}",
+        2: "Fecha vacía",
+        3: f"Formato de fecha no reconocido: '{fecha_raw}'",
+        4: "Valor vacío",
+        5: f"Formato de valor inválido '{valor_raw}'",
+        6: "Valor cero no permitido",
+        7: f"Valor sospechosamente alto: {valor}",
+    }
+    return f"Línea {numero}: {mensajes[codigo]}"
+
+
+def _muestra(linea: str) -> str:
+    return linea[:100] + "..." if len(linea) > 100 else linea
+
+
+def _filas_vacias() -> pd.DataFrame:
+    return pd.DataFrame(columns=COLUMNAS_BANCO + ["numero_linea", "linea_original", "fecha", "valor"])
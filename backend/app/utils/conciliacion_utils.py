@@ -1,5 +1,6 @@
+from collections import Counter, defaultdict
 from datetime import datetime, date
-from typing import Optional, Tuple, Dict, Any
+from typing import Optional, Tuple, Dict, Any, Callable, Hashable, Iterable, List
 
 def calcular_diferencia_valor(valor_pago: float, valor_banco: float) -> Tuple[float, float]:
     """
@@ -103,3 +104,69 @@ def validar_conciliacion_lista(pago: Dict[str, Any], banco: Dict[str, Any]) -> b
         return False
         
     return True
+
+class IndiceMovimientosBanco:
+    """
+    Índice hash de movimientos bancarios pendientes para la conciliación
+    automática. Se construye una vez por corrida:
+
+    - índice principal (fecha, valor) -> movimientos, en el orden original
+    - conteos secundarios por valor y por fecha para el diagnóstico de los
+      pagos sin match
+
+    Los movimientos conciliados se retiran con ``retirar`` para que un mismo
+    movimiento no se asigne a dos pagos en la misma corrida.
+    """
+
+    def __init__(
+        self,
+        movimientos: Iterable[Any],
+        valor_de: Callable[[Any], float],
+        fecha_de: Callable[[Any], Hashable]
+    ):
+        self._valor_de = valor_de
+        self._fecha_de = fecha_de
+        self._por_clave: Dict[Tuple[Hashable, float], List[Any]] = defaultdict(list)
+        self._conteo_valor: Counter = Counter()
+        self._conteo_fecha: Counter = Counter()
+        self._total = 0
+        for mov in movimientos:
+            fecha, valor = fecha_de(mov), valor_de(mov)
+            self._por_clave[(fecha, valor)].append(mov)
+            self._conteo_valor[valor] += 1
+            self._conteo_fecha[fecha] += 1
+            self._total += 1
+
+    def __len__(self) -> int:
+        return self._total
+
+    def candidatos(self, fecha: Hashable, valor: float) -> List[Any]:
+        """Movimientos con la misma fecha y valor exacto (copia, se puede retirar mientras se recorre)"""
+        return list(self._por_clave.get((fecha, valor), ()))
+
+    def retirar(self, mov: Any) -> None:
+        fecha, valor = self._fecha_de(mov), self._valor_de(mov)
+        lista = self._por_clave.get((fecha, valor))
+        if not lista:
+            return
+        for i, existente in enumerate(lista):
+            if existente is mov:
+                del lista[i]
+                break
+        else:
+            return
+        if not lista:
+            del self._por_clave[(fecha, valor)]
+        self._conteo_valor[valor] -= 1
+        if self._conteo_valor[valor] <= 0:
+            del self._conteo_valor[valor]
+        self._conteo_fecha[fecha] -= 1
+        if self._conteo_fecha[fecha] <= 0:
+            del self._conteo_fecha[fecha]
+        self._total -= 1
+
+    def cantidad_por_valor(self, valor: float) -> int:
+        return self._conteo_valor.get(valor, 0)
+
+    def cantidad_por_fecha(self, fecha: Hashable) -> int:
+        return self._conteo_fecha.get(fecha, 0)
@@ -0,0 +1,51 @@
+"""
+Medición de tiempos por etapa para endpoints con varias fases de I/O.
+
+    tiempos = TiemposEtapas()
+    with tiempos.etapa("validacion"):
+        ...
+    duplicado, guias = await asyncio.gather(
+        tiempos.medir("verificar_duplicado", client.query_async(sql_dup)),
+        tiempos.medir("consultar_guias", client.query_async(sql_guias)),
+    )
+    respuesta["tiempos_ms"] = tiempos.resumen()
+
+Las etapas que corren en paralelo se miden cada una por separado; ``total``
+es el tiempo de pared desde que se creó el medidor.
+"""
+
+import time
+from contextlib import contextmanager
+from typing import Awaitable, Dict, TypeVar
+
+T = TypeVar("T")
+
+
+class TiemposEtapas:
+    def __init__(self):
+        self._inicio = time.perf_counter()
+        self._etapas: Dict[str, float] = {}
+
+    def _registrar(self, nombre: str, inicio: float) -> None:
+        self._etapas[nombre] = self._etapas.get(nombre, 0.0) + time.perf_counter() - inicio
+
+    @contextmanager
+    def etapa(self, nombre: str):
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._registrar(nombre, inicio)
+
+    async def medir(self, nombre: str, awaitable: Awaitable[T]) -> T:
+        inicio = time.perf_counter()
+        try:
+            return await awaitable
+        finally:
+            self._registrar(nombre, inicio)
+
+    def resumen(self) -> Dict[str, float]:
+        """Milisegundos por etapa más el total de pared"""
+        resumen = {nombre: round(segundos * 1000, 1) for nombre, segundos in self._etapas.items()}
+        resumen["total"] = round((time.perf_counter() - self._inicio) * 1000, 1)
+        return resumen
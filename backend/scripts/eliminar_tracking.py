@@ -12,6 +12,7 @@ backend_dir = Path(__file__).parent.parent  # backend/
 sys.path.insert(0, str(backend_dir))
 
 from app.core.config import GOOGLE_CREDENTIALS_PATH
+from app.core.consultas import parametro_lista
 
 # Cargar variables desde .env
 load_dotenv()
@@ -80,7 +81,9 @@ def leer_trackings_excel(archivo_excel, columna='TRACKING/ GUIA', hoja=0):
 
 def ejecutar_deletes_bigquery(trackings):
     """
-    Ejecuta los DELETE en BigQuery para cada tracking usando las credenciales apropiadas
+    Ejecuta un DELETE por tabla para todos los trackings a la vez, usando las
+    credenciales apropiadas. Los trackings van como parámetro ARRAY<STRING>
+    (``IN UNNEST(@trackings)``), así la consulta no crece con la lista.
     
     Args:
         trackings: Lista de trackings a eliminar
@@ -92,56 +95,54 @@ def ejecutar_deletes_bigquery(trackings):
         exitosos = 0
         errores = 0
         
-        for i, tracking in enumerate(trackings, 1):
-            print(f"\n🔄 Procesando tracking {i}/{len(trackings)}: {tracking}")
-            
-            # Definir las consultas DELETE con sus respectivos proyectos y clientes
-            consultas_config = [
-                {
-                    "query": f"DELETE FROM `descarga-masters.Conciliacion.transferidos` WHERE tracking_number IN ('{tracking}')",
-                    "tabla": "descarga-masters.Conciliacion.transferidos",
-                    "project_id": "descarga-masters"
-                },
-                {
-                    "query": f"DELETE FROM `datos-clientes-441216.Conciliaciones.guias_liquidacion` WHERE tracking_number = '{tracking}'",
-                    "tabla": "datos-clientes-441216.Conciliaciones.guias_liquidacion",
-                    "project_id": "datos-clientes-441216"
-                },
-                {
-                    "query": f"DELETE FROM `datos-clientes-441216.Conciliaciones.pagosconductor` WHERE tracking = '{tracking}'",
-                    "tabla": "datos-clientes-441216.Conciliaciones.pagosconductor", 
-                    "project_id": "datos-clientes-441216"
-                }
-            ]
-            
-            tracking_exitoso = True
-            
-            # Ejecutar cada DELETE con el cliente apropiado
-            for config in consultas_config:
-                try:
-                    # Crear cliente específico para este proyecto
-                    client = crear_cliente_bigquery(config["project_id"])
-                    
-                    job = client.query(config["query"])
-                    result = job.result()
-                    
-                    # Obtener número de filas eliminadas
-                    rows_deleted = job.num_dml_affected_rows or 0
-                    print(f"  ✅ {config['tabla']}: {rows_deleted} filas eliminadas")
-                    
-                except Exception as e:
-                    print(f"  ❌ Error en {config['tabla']}: {e}")
-                    tracking_exitoso = False
-                    errores += 1
-            
-            if tracking_exitoso:
+        # Definir las consultas DELETE con sus respectivos proyectos
+        consultas_config = [
+            {
+                "query": "DELETE FROM `descarga-masters.Conciliacion.transferidos` WHERE tracking_number IN UNNEST(@trackings)",
+                "tabla": "descarga-masters.Conciliacion.transferidos",
+                "project_id": "descarga-masters"
+            },
+            {
+                "query": "DELETE FROM `datos-clientes-441216.Conciliaciones.guias_liquidacion` WHERE tracking_number IN UNNEST(@trackings)",
+                "tabla": "datos-clientes-441216.Conciliaciones.guias_liquidacion",
+                "project_id": "datos-clientes-441216"
+            },
+            {
+                "query": "DELETE FROM `datos-clientes-441216.Conciliaciones.pagosconductor` WHERE tracking IN UNNEST(@trackings)",
+                "tabla": "datos-clientes-441216.Conciliaciones.pagosconductor", 
+                "project_id": "datos-clientes-441216"
+            }
+        ]
+        
+        job_config = bigquery.QueryJobConfig(
+            query_parameters=[parametro_lista("trackings", trackings, "STRING")]
+        )
+        
+        print(f"\n🔄 Eliminando {len(trackings)} trackings...")
+        
+        # Ejecutar cada DELETE con el cliente apropiado
+        for config in consultas_config:
+            try:
+                # Crear cliente específico para este proyecto
+                client = crear_cliente_bigquery(config["project_id"])
+                
+                job = client.query(config["query"], job_config=job_config)
+                job.result()
+                
+                # Obtener número de filas eliminadas
+                rows_deleted = job.num_dml_affected_rows or 0
+                print(f"  ✅ {config['tabla']}: {rows_deleted} filas eliminadas")
                 exitosos += 1
+                
+            except Exception as e:
+                print(f"  ❌ Error en {config['tabla']}: {e}")
+                errores += 1
         
         # Resumen final
         print(f"\n📊 RESUMEN:")
-        print(f"✅ Trackings procesados exitosamente: {exitosos}")
-        print(f"❌ Trackings con errores: {errores}")
-        print(f"📈 Total procesados: {len(trackings)}")
+        print(f"✅ Tablas procesadas exitosamente: {exitosos}")
+        print(f"❌ Tablas con errores: {errores}")
+        print(f"📈 Total trackings: {len(trackings)}")
         
     except Exception as e:
         print(f"❌ Error al ejecutar consultas en BigQuery: {e}")
@@ -0,0 +1,39 @@
+"""
+Pruebas de la lectura por lotes de extractos bancarios (app/utils/banco_csv.py).
+
+Se ejecutan desde backend/::
+
+    python -m pytest -q tests
+"""
+
+import io
+from datetime import date
+
+import pandas as pd
+
+from app.utils.banco_csv import LectorBancoCSV, convertir_valores
+
+
+def test_convertir_valores_bloque_sin_comas():
+    # Ningún valor con coma: antes ``split(",").str[1]`` dejaba una serie float y ``.str`` fallaba
+    valores = convertir_valores(pd.Series(["150000", "250000.00"]))
+    assert valores.tolist() == [150000.0, 250000.0]
+
+
+def test_convertir_valores_formatos_mixtos():
+    valores = convertir_valores(pd.Series(["1.234.567,89", "1,234,567.89", "1234,56", "$ 5000", "abc"]))
+    assert valores.iloc[:4].tolist() == [1234567.89, 1234567.89, 1234.56, 5000.0]
+    assert pd.isna(valores.iloc[4])
+
+
+def test_lector_bloque_con_valores_sin_comas():
+    contenido = (
+        "123456;001;;20250527;;150000.00;4521;CONSIGNACION CORRESPONSAL CB;0\n"
+        "123456;001;;20250527;;250000;4521;TRANSFERENCIA DESDE NEQUI;0\n"
+    )
+    lotes = list(LectorBancoCSV(io.BytesIO(contenido.encode("utf-8")), "utf-8"))
+
+    assert len(lotes) == 1
+    assert lotes[0].errores == []
+    assert lotes[0].filas["valor"].tolist() == [150000.0, 250000.0]
+    assert lotes[0].filas["fecha"].tolist() == [date(2025, 5, 27), date(2025, 5, 27)]
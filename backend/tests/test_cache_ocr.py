@@ -0,0 +1,69 @@
+"""
+Pruebas de la caché OCR (app/services/cache_ocr.py).
+
+Se ejecutan desde backend/::
+
+    python -m pytest -q tests
+"""
+
+import io
+
+import pytest
+
+pytest.importorskip("PIL")
+from PIL import Image, ImageDraw, ImageFont
+
+from app.services.cache_ocr import CacheOCR, confirma_acierto
+
+
+def _comprobante(referencia: str, valor: str = "$ 150.000") -> bytes:
+    """Comprobante de 1080x2400 con texto de 26px, como una captura de Nequi"""
+    imagen = Image.new("RGB", (1080, 2400), "white")
+    dibujo = ImageDraw.Draw(imagen)
+    fuente = ImageFont.load_default(size=26)
+    for y, linea in enumerate(["Envío realizado", "Para: JUAN PEREZ", f"Valor {valor}",
+                               "Fecha 27 de mayo de 2025", f"Referencia {referencia}"]):
+        dibujo.text((80, 400 + y * 60), linea, fill="black", font=fuente)
+    salida = io.BytesIO()
+    imagen.save(salida, format="JPEG", quality=90)
+    return salida.getvalue()
+
+
+def _texto(referencia: str, valor: str = "$ 150.000") -> str:
+    return f"Envío realizado\nPara: JUAN PEREZ\nValor {valor}\nFecha 27 de mayo de 2025\nReferencia {referencia}"
+
+
+RESULTADO = {"datos_extraidos": {"valor": "150000", "referencia": "M12345678", "fecha": "2025-05-27"}}
+
+
+def test_comprobante_casi_identico_no_se_fusiona(tmp_path):
+    cache = CacheOCR(ruta=str(tmp_path / "ocr.sqlite3"), distancia_maxima=4)
+    cache.guardar_sync(_comprobante("M12345678"), "v", RESULTADO)
+
+    acierto = cache.buscar_sync(_comprobante("M12345679"), "v")
+
+    # La miniatura no distingue un dígito (distancia 0): el acierto es solo
+    # perceptual y el texto de la imagen nueva lo descarta
+    assert acierto["cache"]["tipo"] == "perceptual"
+    assert not confirma_acierto(acierto, _texto("M12345679"))
+
+
+def test_acierto_exacto(tmp_path):
+    cache = CacheOCR(ruta=str(tmp_path / "ocr.sqlite3"), distancia_maxima=4)
+    contenido = _comprobante("M12345678")
+    cache.guardar_sync(contenido, "v", RESULTADO)
+
+    acierto = cache.buscar_sync(contenido, "v")
+    assert acierto["cache"]["tipo"] == "exacto"
+    assert acierto["datos_extraidos"]["referencia"] == "M12345678"
+
+
+def test_confirma_acierto():
+    assert confirma_acierto(RESULTADO, _texto("M12345678"))
+    assert confirma_acierto(RESULTADO, _texto("M12345678", "$150.000,00"))
+    assert not confirma_acierto(RESULTADO, _texto("M12345679"))
+    assert not confirma_acierto(RESULTADO, _texto("M1234567"))
+    assert not confirma_acierto(RESULTADO, _texto("M12345678", "$ 15.000"))
+    assert not confirma_acierto(RESULTADO, _texto("M12345678", "$ 1.500.000"))
+    assert not confirma_acierto(RESULTADO, "")
+    assert not confirma_acierto({"datos_extraidos": {}}, _texto("M12345678"))
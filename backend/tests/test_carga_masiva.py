@@ -0,0 +1,69 @@
+"""
+Pruebas de la serialización de load jobs (app/core/carga_masiva.py).
+
+Se ejecutan desde backend/::
+
+    python -m pytest -q tests
+"""
+
+import io
+from datetime import date, datetime, timezone
+from decimal import Decimal
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("pyarrow")
+import pyarrow.parquet as pq
+
+from app.core.carga_masiva import filas_a_ndjson, filas_a_parquet
+
+
+def _campo(nombre: str, tipo: str, modo: str = "NULLABLE"):
+    # Misma forma que google.cloud.bigquery.SchemaField (name, field_type, mode)
+    return SimpleNamespace(name=nombre, field_type=tipo, mode=modo)
+
+
+ESQUEMA = [
+    _campo("id", "STRING"),
+    _campo("fecha", "DATE"),
+    _campo("valor_banco", "FLOAT"),
+    _campo("match_manual", "BOOLEAN"),
+    _campo("confianza_match", "INTEGER"),
+    _campo("cargado_en", "TIMESTAMP"),
+    _campo("saldo", "NUMERIC"),
+    _campo("linea_original", "STRING"),
+]
+
+
+def test_parquet_tipado_con_el_esquema_de_la_tabla():
+    filas = [
+        {"id": "a", "fecha": "2025-05-27", "valor_banco": 150000, "match_manual": False,
+         "confianza_match": 0, "cargado_en": "2025-05-27T07:07:24.500000", "saldo": 1.5, "linea_original": 5},
+        {"id": "b", "fecha": None, "valor_banco": 1.5, "match_manual": True,
+         "confianza_match": 3, "cargado_en": None, "saldo": None, "linea_original": None},
+    ]
+    tabla = pq.read_table(io.BytesIO(filas_a_parquet(filas, ESQUEMA)))
+
+    assert [str(t) for t in tabla.schema.types] == [
+        "string", "date32[day]", "double", "bool", "int64", "timestamp[us, tz=UTC]", "decimal128(38, 9)", "string",
+    ]
+    primera, segunda = tabla.to_pylist()
+    assert primera["fecha"] == date(2025, 5, 27)
+    assert primera["valor_banco"] == 150000.0
+    # Texto ISO sin zona se interpreta como UTC, igual que en NDJSON
+    assert primera["cargado_en"] == datetime(2025, 5, 27, 7, 7, 24, 500000, tzinfo=timezone.utc)
+    assert primera["saldo"] == Decimal("1.5")
+    assert primera["linea_original"] == "5"
+    assert segunda["fecha"] is None and segunda["cargado_en"] is None
+
+
+def test_parquet_rechaza_columnas_fuera_del_esquema():
+    # El cargador vuelve a NDJSON y BigQuery reporta el error como antes
+    with pytest.raises(ValueError):
+        filas_a_parquet([{"id": "a", "desconocida": 1}], ESQUEMA)
+
+
+def test_ndjson():
+    contenido = filas_a_ndjson([{"fecha": date(2025, 5, 27), "valor": Decimal("1.5"), "texto": "Débito"}])
+    assert contenido == '{"fecha": "2025-05-27", "valor": 1.5, "texto": "Débito"}\n'.encode("utf-8")
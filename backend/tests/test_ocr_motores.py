@@ -0,0 +1,42 @@
+"""
+Pruebas del pool de procesos OCR (app/services/ocr_motores.py).
+
+Se ejecutan desde backend/::
+
+    python -m pytest -q tests
+"""
+
+import asyncio
+import os
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+
+from app.services import ocr_motores
+from app.services.ocr_motores import cerrar_pool_ocr, ejecutar_en_pool, pool_ocr
+
+
+@pytest.fixture(autouse=True)
+def pool_limpio():
+    cerrar_pool_ocr()
+    yield
+    cerrar_pool_ocr()
+
+
+def test_pool_roto_se_reemplaza_y_reintenta():
+    # Un proceso muere fuera de ejecutar_en_pool: el pool compartido queda roto
+    roto = pool_ocr()
+    with pytest.raises(BrokenProcessPool):
+        roto.submit(os._exit, 1).result()
+
+    pid = asyncio.run(ejecutar_en_pool(os.getpid))
+
+    assert pid != os.getpid()
+    assert ocr_motores._pool is not roto
+
+
+def test_tarea_que_rompe_el_pool_no_lo_deja_inutilizable():
+    with pytest.raises(BrokenProcessPool):
+        asyncio.run(ejecutar_en_pool(os._exit, 1))
+
+    assert asyncio.run(ejecutar_en_pool(os.getpid)) != os.getpid()